@@ -9,6 +9,14 @@ from app.api.auth import auth_bp
 from app.api.prediction import prediction_bp
 from app.utils.log import get_logger
 from app.utils.gpu_utils import setup_gpu
+from app.utils.upload import init_upload_handling
+from app.services.persistence import init_persistence
+from app.services.prediction_cache import init_prediction_cache
+from app.services.image_cache import init_image_cache
+from app.services.near_duplicates import init_near_duplicates
+from app.services.retention import init_retention_policy
+from app.services.image_gc import init_image_gc
+from app.services.data_deletion import init_deletion_jobs
 from app.db import init_mongo_collections
 
 # Initialize logger
@@ -33,9 +41,33 @@ def create_app(config_name='development'):
     # Initialize extensions
     init_extensions(app)
     
+    # Stream multipart uploads through spooled temporary files
+    init_upload_handling(app)
+    
     # Initialize MongoDB collections
     with app.app_context():
         init_mongo_collections()
+    
+    # Start background writers for prediction images and history
+    init_persistence(app)
+    
+    # Cache prediction results for re-submitted images
+    init_prediction_cache(app)
+    
+    # Keep hot images in memory
+    init_image_cache(app)
+    
+    # Index perceptual hashes to detect re-shot photos
+    init_near_duplicates(app)
+    
+    # Decide which prediction images are stored
+    init_retention_policy(app)
+    
+    # Expire images and delete images no prediction references
+    init_image_gc(app)
+    
+    # Background deletion of users' history and accounts
+    init_deletion_jobs(app)
         
     # Check Gemini AI connection status
     try:
@@ -5,6 +5,7 @@ This module provides endpoints for user authentication and profile management:
 - /register: Register a new user
 - /login: Authenticate a user and receive a JWT token
 - /profile: Get or update user profile information
+- /account: Delete the user's account, predictions and images
 
 All endpoints are prefixed with /api/auth
 
@@ -14,9 +15,10 @@ Authentication flow:
 3. User includes the JWT token in the Authorization header for protected endpoints
 """
 
-from flask import request, jsonify
+from flask import request, jsonify, url_for
 from app.api.auth import auth_bp
 from app.api.auth.services import AuthService
+from app.services.data_deletion import get_deletion_jobs
 from app.utils.log import get_logger
 from functools import wraps
 
@@ -145,3 +147,30 @@ def update_profile():
         return jsonify({'message': message}), 200
     else:
         return jsonify({'message': message}), 400
+
+
+@auth_bp.route('/account', methods=['DELETE'])
+@token_required
+def delete_account():
+    """
+    Delete the user's account together with all predictions and images
+    
+    The deletion runs as a background job; its progress is available at
+    the returned status_url.
+    """
+    user_id = request.user_id
+    
+    try:
+        job = get_deletion_jobs().submit(user_id, delete_account=True)
+    except Exception as e:
+        logger.error(f"Error deleting account: {str(e)}")
+        return jsonify({'message': 'Failed to delete account'}), 500
+    
+    if not job:
+        return jsonify({'message': 'Failed to delete account'}), 500
+    
+    job['status_url'] = url_for('prediction.get_deletion_job', job_id=job['job_id'])
+    return jsonify({
+        'message': 'Account deletion started',
+        'data': job
+    }), 202
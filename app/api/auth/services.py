@@ -53,7 +53,7 @@ class AuthService:
                 return None, "Invalid username or password"
             
             # Generate token
-            token = AuthService.generate_token(user['user_id'])
+            token = AuthService.generate_token(user['user_id'], user.get('tier'))
             
             logger.info(f"User logged in successfully: {username}")
             return {
@@ -69,9 +69,9 @@ class AuthService:
             return None, f"Login error: {str(e)}"
     
     @staticmethod
-    def generate_token(user_id):
+    def generate_token(user_id, tier=None):
         """
-        Generate JWT token
+        Generate JWT token, carrying the user's account tier when set
         """
         secret_key = os.getenv('SECRET_KEY', 'default_secret_key')
         payload = {
@@ -79,6 +79,8 @@ class AuthService:
             'iat': datetime.datetime.utcnow(),
             'sub': user_id
         }
+        if tier:
+            payload['tier'] = tier
         return jwt.encode(payload, secret_key, algorithm='HS256')
     
     @staticmethod
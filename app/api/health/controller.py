@@ -4,6 +4,7 @@
 from flask import Blueprint, jsonify
 from app.extensions import mongo, fs
 from app.services.advice_service import AdviceService
+from app.utils.metrics import metrics
 
 health_bp = Blueprint("health", __name__, url_prefix="/api")
 
@@ -45,3 +46,14 @@ def health_check():
     }
     
     return jsonify(status)
+
+@health_bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    In-process metrics for this worker (counters, gauges and timing summaries)
+    ---
+    responses:
+        200:
+            description: Current metric values
+    """
+    return jsonify(metrics.snapshot())
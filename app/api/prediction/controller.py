@@ -1,12 +1,23 @@
-from flask import request, jsonify, current_app, g
+import base64
+import json
+from flask import request, jsonify, current_app, g, url_for
+from werkzeug.wsgi import wrap_file
+from PIL import Image
 from app.api.prediction import prediction_bp
 from app.api.prediction.services import PredictionService
+from app.api.prediction.models import HISTORY_FIELDS
 from app.utils.generators import generate_uuid, get_current_timestamp
 from app.utils.log import get_logger
 from app.utils.storage import ImageStorage
+from app.utils.pagination import decode_cursor
+from app.db.indexes import HISTORY_SORT_FIELDS
 from app.utils.gpu_utils import get_device_info
 from app.core.models.model_loader import ModelLoader
+from app.core.models.fusion import FUSION_METHODS
 from app.middleware.auth import token_required
+from app.services.persistence import get_persistence_queue
+from app.services.retention import get_retention_policy
+from app.services.data_deletion import get_deletion_jobs
 
 logger = get_logger(__name__)
 
@@ -16,41 +27,126 @@ def predict():
     """
     Predict plant disease from uploaded image and save to history
     Requires authentication
+    
+    Form parameters:
+    - file: Image file, or raw uint8 RGB bytes when input_format is 'tensor'.
+      Repeat the field to send several photos of the same plant (image format only)
+    - fusion: How scores of multiple photos are combined: 'mean' (default) or 'max'
+    - save_image: Whether to store the image (default: true). The image retention
+      policy decides whether the original, a thumbnail or nothing is stored
+    - flag: Set to 'true' to flag the prediction for review (retained by the policy)
+    - input_format: 'image' (default) or 'tensor'
+    - shape: Declared tensor shape, e.g. '224,224,3' (tensor only, must match /model-info)
+    - checksum: Hex SHA-256 of the raw tensor bytes (tensor only)
     """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
-    file = request.files['file']
+    files = request.files.getlist('file')
+    file = files[0]
     # Get user_id from authentication token
     user_id = g.user_id
     save_image = request.form.get('save_image', 'true').lower() == 'true'
+    flagged = request.form.get('flag', 'false').lower() == 'true'
+    input_format = request.form.get('input_format', 'image').lower()
+    fusion = request.form.get('fusion', 'mean').lower()
+    max_images = current_app.config.get('MAX_IMAGES_PER_PREDICTION', 8)
     
-    if file.filename == '':
+    if any(f.filename == '' for f in files):
         return jsonify({'error': 'No selected file'}), 400
     
+    if input_format not in PredictionService.INPUT_FORMATS:
+        return jsonify({'error': f"Unsupported input_format '{input_format}'"}), 400
+    
+    if len(files) > max_images:
+        return jsonify({'error': f'Too many images. Maximum is {max_images} per prediction'}), 400
+    
+    if len(files) > 1 and input_format != 'image':
+        return jsonify({'error': 'Multiple files are only supported with input_format image'}), 400
+    
+    if fusion not in FUSION_METHODS:
+        return jsonify({'error': f"Unsupported fusion '{fusion}'. Expected one of {list(FUSION_METHODS)}"}), 400
+    
     try:
         # Generate unique ID for this prediction
         prediction_id = generate_uuid()
         timestamp = get_current_timestamp()
         
         # Process prediction
-        result = PredictionService.predict_disease(file, user_id)
+        if input_format == 'tensor':
+            # Client already resized to model resolution: skip decode and resize
+            try:
+                pixels = PredictionService.decode_tensor_upload(
+                    file, request.form.get('shape'), request.form.get('checksum')
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            result = PredictionService.predict_disease_from_pixels(pixels, user_id)
+            image_sources = [Image.fromarray(pixels)]
+        elif len(files) > 1:
+            # Several photos of one plant: one batch, one fused diagnosis
+            result = PredictionService.predict_disease_multi(files, user_id, fusion)
+            image_sources = files
+        else:
+            result = PredictionService.predict_disease(file, user_id)
+            image_sources = [file]
         
         # Add metadata to result
         result['prediction_id'] = prediction_id
         result['timestamp'] = timestamp
         result['user_id'] = user_id
+        result['input_format'] = input_format
+        
+        # Later re-shots of this photo are matched against it
+        PredictionService.record_perceptual_hash(result)
+        
+        # With write-behind persistence, images and history are written by
+        # background workers and the response does not wait for MongoDB
+        persistence_queue = get_persistence_queue()
+        prepared_images = []
         
-        # Save image if requested
+        # The retention policy decides what is kept of requested images
+        retention_policy = get_retention_policy()
         if save_image:
-            # Create a copy of the file since we've already read it for prediction
-            file.seek(0)
-            image_path = ImageStorage.save_prediction_image(file, prediction_id, user_id)
-            if image_path:
-                result['image_path'] = image_path
+            retention = retention_policy.decide(result, getattr(g, 'user_tier', None), flagged)
+        else:
+            retention = {'store': 'none', 'rule': 'request'}
+        result['retention'] = retention
+        if flagged:
+            result['flagged'] = True
+        
+        # Save image(s) if requested
+        if retention['store'] != 'none':
+            image_paths = []
+            for image_source in image_sources:
+                if persistence_queue:
+                    prepared = ImageStorage.prepare_prediction_image(image_source, prediction_id, user_id,
+                                                                     retention['store'])
+                    image_path = prepared['ref'] if prepared else None
+                    if prepared:
+                        prepared_images.append(prepared)
+                else:
+                    image_path = ImageStorage.save_prediction_image(image_source, prediction_id, user_id,
+                                                                    retention['store'])
+                if image_path:
+                    image_paths.append(image_path)
+            
+            if image_paths:
+                result['image_path'] = image_paths[0]
+                if len(image_sources) > 1:
+                    result['image_paths'] = image_paths
+                
+                # Images of some tiers expire and are removed by the image GC
+                expires_at = retention_policy.expires_at(getattr(g, 'user_tier', None))
+                if expires_at:
+                    result['image_expires_at'] = expires_at
                 
         # Save prediction to history
-        PredictionService.save_prediction_history(result)
+        if persistence_queue:
+            PredictionService.queue_prediction_history(result, prepared_images)
+        else:
+            PredictionService.save_prediction_history(result)
         
         return jsonify(result), 200
     except Exception as e:
@@ -69,6 +165,21 @@ def get_classes():
         logger.error(f"Error retrieving classes: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@prediction_bp.route('/model-info', methods=['GET'])
+def get_model_info():
+    """
+    Get model metadata such as the expected input shape
+    
+    Clients that preprocess on-device should read input_shape from here
+    instead of hard-coding it.
+    """
+    try:
+        model_info = PredictionService.get_model_info()
+        return jsonify(model_info), 200
+    except Exception as e:
+        logger.error(f"Error retrieving model info: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @prediction_bp.route('/history', methods=['GET'])
 @token_required
 def get_prediction_history():
@@ -77,7 +188,11 @@ def get_prediction_history():
     
     Optional query parameters:
     - limit: Maximum number of records to return (default 20)
-    - offset: Number of records to skip for pagination (default 0)
+    - cursor: next_cursor of the previous page; omit for the first page
+    - offset: Number of records to skip (default 0). Deprecated, kept for
+      backward compatibility; ignored when cursor is given
+    - fields: Comma separated fields of each record, from HISTORY_FIELDS
+      (default: the summary fields). The detail endpoint returns every field
     """
     # Get user_id from authentication token
     user_id = g.user_id
@@ -86,28 +201,77 @@ def get_prediction_history():
         # Get pagination parameters
         limit = int(request.args.get('limit', 20))
         offset = int(request.args.get('offset', 0))
+        cursor = request.args.get('cursor')
         
         # Validate parameters
         if limit < 1 or limit > 100:
             limit = 20
-        if offset < 0:
+        if offset < 0 or cursor:
             offset = 0
+        
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor, 'timestamp', 'desc')
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        try:
+            fields = _requested_fields()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
             
         # Get prediction history
-        history = PredictionService.get_user_prediction_history(user_id, limit, offset)
+        history, next_cursor = PredictionService.get_user_prediction_page(user_id, limit, offset, after=after,
+                                                                          fields=fields)
+        _add_image_urls(history)
         
         return jsonify({
             'user_id': user_id,
             'predictions': history,
             'count': len(history),
             'limit': limit,
-            'offset': offset
+            'offset': offset,
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
         logger.error(f"Error retrieving prediction history: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@prediction_bp.route('/history', methods=['DELETE'])
+@token_required
+def delete_prediction_history():
+    """
+    Delete all predictions and stored images of the authenticated user
+    
+    The deletion runs as a background job; poll the returned status_url
+    for its progress.
+    """
+    try:
+        job = get_deletion_jobs().submit(g.user_id)
+        if not job:
+            return jsonify({'error': 'Failed to start deletion'}), 500
+        job['status_url'] = url_for('prediction.get_deletion_job', job_id=job['job_id'])
+        return jsonify(job), 202
+    except Exception as e:
+        logger.error(f"Error deleting prediction history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@prediction_bp.route('/history/deletions/<job_id>', methods=['GET'])
+@token_required
+def get_deletion_job(job_id):
+    """
+    Get the progress of a history or account deletion of the authenticated user
+    
+    Path parameters:
+    - job_id: ID returned when the deletion was requested
+    """
+    job = get_deletion_jobs().get_job(job_id)
+    if not job or job['user_id'] != g.user_id:
+        return jsonify({'error': 'Deletion job not found'}), 404
+    return jsonify(job), 200
+
 @prediction_bp.route('/history/<prediction_id>', methods=['GET'])
 @token_required
 def get_prediction_detail(prediction_id):
@@ -118,7 +282,8 @@ def get_prediction_detail(prediction_id):
     - prediction_id: ID of the prediction to retrieve
     
     Query parameters:
-    - include_image: Set to 'true' to include base64 encoded image data (default: false)
+    - include_image: Set to 'true' to include base64 encoded image data (default: false).
+      Deprecated: the response carries image_url, which streams the image instead
     """
     include_image = request.args.get('include_image', 'false').lower() == 'true'
     
@@ -126,11 +291,15 @@ def get_prediction_detail(prediction_id):
         prediction = PredictionService.get_prediction_details(prediction_id)
         
         if prediction:
-            # Add image data if requested and available
+            # Clients should fetch the image from the streaming endpoint
+            _add_image_urls([prediction])
+            
+            # Add image data if requested and available (deprecated, use image_url)
             if include_image and 'image_path' in prediction and prediction['image_path']:
-                image_data = ImageStorage.get_image_as_base64(prediction['image_path'])
-                if image_data:
-                    prediction['image_data'] = image_data
+                image = ImageStorage.read_image(prediction['image_path'])
+                if image and image['data']:
+                    prediction['image_data'] = base64.b64encode(image['data']).decode('utf-8')
+                    prediction['image_content_type'] = image['content_type']
                     
             return jsonify(prediction), 200
         else:
@@ -140,6 +309,177 @@ def get_prediction_detail(prediction_id):
         logger.error(f"Error retrieving prediction details: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _requested_fields():
+    """
+    Read the fields query parameter of history list views
+    
+    Returns:
+        list: Fields to return, or None for the summary fields
+        
+    Raises:
+        ValueError: If a field is not in HISTORY_FIELDS
+    """
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    invalid = [field for field in fields if field not in HISTORY_FIELDS]
+    if invalid or not fields:
+        raise ValueError(f'Invalid fields: {", ".join(invalid)}. Supported fields: {", ".join(HISTORY_FIELDS)}')
+    return fields
+
+def _add_image_urls(predictions):
+    """
+    Add image_url and thumbnail_url to predictions that have a stored image
+    
+    Args:
+        predictions: List of prediction dicts, updated in place
+    """
+    # Smallest configured derivative, derivatives are listed largest first
+    derivative_names = ImageStorage.get_derivative_names()
+    thumbnail_size = derivative_names[-1] if derivative_names else None
+    
+    for prediction in predictions:
+        if not prediction.get('image_path') or not prediction.get('prediction_id'):
+            continue
+        prediction['image_url'] = url_for('prediction.get_prediction_image', prediction_id=prediction['prediction_id'])
+        if thumbnail_size:
+            prediction['thumbnail_url'] = url_for('prediction.get_prediction_image',
+                                                  prediction_id=prediction['prediction_id'], size=thumbnail_size)
+        else:
+            prediction['thumbnail_url'] = prediction['image_url']
+
+@prediction_bp.route('/history/<prediction_id>/image', methods=['GET'])
+@token_required
+def get_prediction_image(prediction_id):
+    """
+    Stream the image stored for a prediction
+    
+    Path parameters:
+    - prediction_id: ID of the prediction
+    
+    Query parameters:
+    - size: 'original' (default) or a configured derivative such as 'thumb' or 'medium'.
+      Images stored before derivatives existed are served at their original size
+    
+    Supports conditional requests (If-None-Match / If-Modified-Since, answered
+    with 304) and byte ranges (Range, answered with 206). Only the owner of the
+    prediction can fetch its image.
+    """
+    size = request.args.get('size', 'original')
+    sizes = ['original'] + ImageStorage.get_derivative_names()
+    if size not in sizes:
+        return jsonify({'error': f'Invalid size. Supported sizes: {", ".join(sizes)}'}), 400
+    
+    try:
+        prediction = PredictionService.get_prediction_details(prediction_id)
+        
+        if not prediction or prediction.get('user_id') != g.user_id or not prediction.get('image_path'):
+            return jsonify({'error': 'Image not found'}), 404
+        
+        image = ImageStorage.open_image(prediction['image_path'], variant=None if size == 'original' else size)
+        if not image:
+            return jsonify({'error': 'Image not found'}), 404
+        
+        # Stream the stored chunks straight to the client
+        response = current_app.response_class(
+            wrap_file(request.environ, image['stream'], buffer_size=ImageStorage.CHUNK_SIZE),
+            mimetype=image['content_type'],
+            direct_passthrough=True
+        )
+        response.content_length = image['length']
+        response.set_etag(image['etag'])
+        response.last_modified = image['last_modified']
+        response.cache_control.private = True
+        response.cache_control.max_age = current_app.config.get('IMAGE_CACHE_MAX_AGE', 86400)
+        
+        return response.make_conditional(request, accept_ranges=True, complete_length=image['length'])
+        
+    except Exception as e:
+        logger.error(f"Error streaming prediction image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@prediction_bp.route('/history/images', methods=['POST'])
+@token_required
+def get_prediction_images():
+    """
+    Get the images of several predictions in one multipart response
+    
+    Request body (JSON):
+    - prediction_ids: List of prediction IDs (at most PREDICTION_IMAGES_MAX_BATCH)
+    - size: A configured derivative; defaults to the smallest derivative
+    
+    The response is multipart/mixed. The first part is a JSON manifest listing
+    the images in order and the prediction IDs without a stored image; each
+    following part is one image, identified by its Content-ID. All predictions
+    must belong to the authenticated user. The response is built in memory, so
+    originals (up to MAX_CONTENT_LENGTH each) are only served one at a time by
+    /history/<prediction_id>/image.
+    """
+    data = request.get_json(silent=True) or {}
+    prediction_ids = data.get('prediction_ids')
+    if not isinstance(prediction_ids, list) or not prediction_ids or \
+            not all(isinstance(prediction_id, str) for prediction_id in prediction_ids):
+        return jsonify({'error': 'prediction_ids must be a non-empty list of IDs'}), 400
+    
+    # Keep the request order, without duplicates
+    prediction_ids = list(dict.fromkeys(prediction_ids))
+    max_batch = current_app.config.get('PREDICTION_IMAGES_MAX_BATCH', 50)
+    if len(prediction_ids) > max_batch:
+        return jsonify({'error': f'At most {max_batch} prediction_ids can be requested at once'}), 400
+    
+    derivative_names = ImageStorage.get_derivative_names()
+    if not derivative_names:
+        return jsonify({'error': 'No image derivatives are configured'}), 400
+    size = data.get('size') or derivative_names[-1]
+    if size not in derivative_names:
+        return jsonify({'error': f'Invalid size. Supported sizes: {", ".join(derivative_names)}'}), 400
+    
+    try:
+        result = PredictionService.get_prediction_images(g.user_id, prediction_ids, variant=size)
+    except PermissionError:
+        return jsonify({'error': 'Access denied'}), 403
+    except Exception as e:
+        logger.error(f"Error retrieving prediction images: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    return _multipart_response(result['images'], result['missing'])
+
+def _multipart_response(images, missing):
+    """
+    Build a multipart/mixed response of a JSON manifest followed by the images
+    
+    Args:
+        images: List of dicts with prediction_id, content_type and data
+        missing: Prediction IDs without a stored image
+        
+    Returns:
+        Response: The multipart response
+    """
+    boundary = generate_uuid().replace('-', '')
+    manifest = json.dumps({
+        'images': [{'prediction_id': image['prediction_id'], 'content_type': image['content_type'],
+                    'length': len(image['data'])} for image in images],
+        'missing': missing
+    }).encode('utf-8')
+    
+    parts = [(b'Content-Type: application/json\r\n'
+              b'Content-Length: ' + str(len(manifest)).encode() + b'\r\n\r\n', manifest)]
+    for image in images:
+        headers = (f"Content-Type: {image['content_type']}\r\n"
+                   f"Content-Length: {len(image['data'])}\r\n"
+                   f"Content-ID: <{image['prediction_id']}>\r\n\r\n")
+        parts.append((headers.encode('utf-8'), image['data']))
+    
+    delimiter = b'--' + boundary.encode() + b'\r\n'
+    body = b''.join(delimiter + headers + data + b'\r\n' for headers, data in parts)
+    body += b'--' + boundary.encode() + b'--\r\n'
+    
+    response = current_app.response_class(body, mimetype=f'multipart/mixed; boundary={boundary}')
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
 @prediction_bp.route('/my-predictions', methods=['GET'])
 @token_required
 def get_all_user_predictions():
@@ -148,26 +488,49 @@ def get_all_user_predictions():
     
     Optional query parameters:
     - limit: Maximum number of records to return (default 100)
-    - offset: Number of records to skip for pagination (default 0)
-    - sort_by: Field to sort by (default 'timestamp')
+    - cursor: next_cursor of the previous page; omit for the first page. Only
+      valid with the sort_by and sort_order it was returned for
+    - offset: Number of records to skip (default 0). Deprecated, kept for
+      backward compatibility; ignored when cursor is given
+    - sort_by: Field to sort by: 'timestamp' (default), 'confidence' or 'class_name'
     - sort_order: Sort order ('asc' or 'desc', default 'desc')
     - plant_type: Filter by plant type
     - condition: Filter by plant condition (e.g., 'healthy', 'late_blight')
+    - fields: Comma separated fields of each record, from HISTORY_FIELDS
+      (default: the summary fields). The detail endpoint returns every field
     """
     user_id = g.user_id
     
     try:
         # Get pagination and filter parameters
         limit = min(int(request.args.get('limit', 100)), 500)
+        if limit < 1:
+            limit = 100
         offset = int(request.args.get('offset', 0))
         sort_by = request.args.get('sort_by', 'timestamp')
         sort_order = request.args.get('sort_order', 'desc').lower()
         plant_type = request.args.get('plant_type', None)
         condition = request.args.get('condition', None)
+        cursor = request.args.get('cursor')
         
         # Validate sort order
         if sort_order not in ['asc', 'desc']:
             sort_order = 'desc'
+        if sort_by not in HISTORY_SORT_FIELDS:
+            return jsonify({'error': f'Invalid sort_by. Supported fields: {", ".join(HISTORY_SORT_FIELDS)}'}), 400
+        
+        after = None
+        if cursor:
+            offset = 0
+            try:
+                after = decode_cursor(cursor, sort_by, sort_order)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        try:
+            fields = _requested_fields()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Prepare filters
         filters = {'user_id': user_id}
@@ -177,13 +540,16 @@ def get_all_user_predictions():
             filters['condition'] = condition
             
         # Get predictions with filters
-        predictions = PredictionService.get_filtered_predictions(
+        predictions, next_cursor = PredictionService.get_filtered_prediction_page(
             filters=filters,
             sort_by=sort_by,
             sort_order=sort_order,
             limit=limit,
-            offset=offset
+            offset=offset,
+            after=after,
+            fields=fields
         )
+        _add_image_urls(predictions)
         
         # Get total count of user's predictions
         total_count = PredictionService.count_user_predictions(user_id)
@@ -194,7 +560,8 @@ def get_all_user_predictions():
             'count': len(predictions),
             'total': total_count,
             'limit': limit,
-            'offset': offset
+            'offset': offset,
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
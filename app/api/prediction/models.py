@@ -1,12 +1,24 @@
 from datetime import datetime
 from app.extensions import mongo
 from app.utils.log import get_logger
+from app.db.indexes import HISTORY_SORT_FIELDS
+from app.utils.pagination import keyset_filter
+from app.utils.serialization import documents_to_json, to_json_compatible
 import os
-from bson import json_util
-import json
 
 logger = get_logger(__name__)
 
+# Fields of history list views when the client does not choose
+HISTORY_SUMMARY_FIELDS = ('prediction_id', 'class_name', 'display_name', 'confidence', 'timestamp',
+                          'plant_type', 'condition', 'image_path')
+
+# Fields clients can request in history list views; the detail view returns every field
+HISTORY_FIELDS = HISTORY_SUMMARY_FIELDS + (
+    'class_id', 'advice', 'input_format', 'image_paths', 'image_expires_at', 'storage_type', 'retention',
+    'flagged', 'near_duplicate', 'tta', 'cache', 'fusion', 'image_count', 'per_image', 'timings_ms',
+    'created_at'
+)
+
 class PredictionHistory:
     """
     Model for storing prediction history in MongoDB
@@ -32,26 +44,8 @@ class PredictionHistory:
             str: The prediction_id of the saved prediction
         """
         try:
-            # Ensure required fields are present
-            required_fields = ['prediction_id', 'class_name', 'confidence', 'timestamp']
-            for field in required_fields:
-                if field not in prediction_data:
-                    logger.error(f"Missing required field '{field}' in prediction data")
-                    return None
-            
-            # Set default user_id if not provided
-            if 'user_id' not in prediction_data or not prediction_data['user_id']:
-                prediction_data['user_id'] = 'anonymous'
-                
-            # Add created_at timestamp
-            prediction_data['created_at'] = datetime.utcnow()
-            
-            # Check if image_path is a GridFS ID (not a file path)
-            if 'image_path' in prediction_data and prediction_data['image_path']:
-                if '/' not in prediction_data['image_path']:
-                    prediction_data['storage_type'] = 'gridfs'
-                else:
-                    prediction_data['storage_type'] = 'filesystem'
+            if not PredictionHistory.prepare_prediction(prediction_data):
+                return None
                     
             # Insert into MongoDB
             mongo.db.prediction_history.insert_one(prediction_data)
@@ -64,14 +58,123 @@ class PredictionHistory:
             return None
     
     @staticmethod
-    def get_user_predictions(user_id, limit=20, offset=0):
+    def prepare_prediction(prediction_data):
         """
-        Get prediction history for a specific user
+        Validate a prediction and fill in derived fields, in place
+        
+        Args:
+            prediction_data (dict): Prediction data (see save_prediction)
+            
+        Returns:
+            bool: True if the prediction is valid and ready to insert
+        """
+        # Ensure required fields are present
+        required_fields = ['prediction_id', 'class_name', 'confidence', 'timestamp']
+        for field in required_fields:
+            if field not in prediction_data:
+                logger.error(f"Missing required field '{field}' in prediction data")
+                return False
+        
+        # Set default user_id if not provided
+        if 'user_id' not in prediction_data or not prediction_data['user_id']:
+            prediction_data['user_id'] = 'anonymous'
+            
+        # Add created_at timestamp
+        prediction_data['created_at'] = datetime.utcnow()
+        
+        # Record where the image lives: a legacy file path, a prefixed
+        # object store reference ("disk:...", "s3:...") or a GridFS ID
+        if 'image_path' in prediction_data and prediction_data['image_path']:
+            image_path = prediction_data['image_path']
+            if '/' in image_path:
+                prediction_data['storage_type'] = 'filesystem'
+            elif ':' in image_path:
+                prediction_data['storage_type'] = image_path.split(':', 1)[0]
+            else:
+                prediction_data['storage_type'] = 'gridfs'
+        
+        return True
+    
+    @staticmethod
+    def save_predictions(predictions):
+        """
+        Insert several already prepared predictions with a single insert_many
+        
+        Args:
+            predictions (list): Prediction documents that passed prepare_prediction
+            
+        Returns:
+            int: Number of predictions inserted
+        """
+        if not predictions:
+            return 0
+        
+        result = mongo.db.prediction_history.insert_many(predictions, ordered=False)
+        logger.info(f"Saved {len(result.inserted_ids)} predictions in bulk")
+        return len(result.inserted_ids)
+    
+    @staticmethod
+    def history_query(filters, sort_by='timestamp', sort_order='desc', after=None):
+        """
+        Build the query and sort of a page of prediction history
+        
+        Every page is read in (sort_by, prediction_id) order; prediction_id
+        breaks ties so keyset pages never overlap. With filters on user_id,
+        plant_type and condition only, the history sort indexes of
+        app.db.indexes return the page without an in-memory sort.
+        
+        Args:
+            filters (dict): Equality filters, including user_id
+            sort_by (str): Field to sort by, one of HISTORY_SORT_FIELDS
+            sort_order (str): Sort order ('asc' or 'desc')
+            after (tuple): (sort_by value, prediction_id) of the last record of
+                           the previous page, or None for the first page
+            
+        Returns:
+            tuple: (query, sort) for prediction_history.find
+        """
+        sort_direction = -1 if sort_order == 'desc' else 1
+        
+        query = filters
+        if after is not None:
+            query = {'$and': [filters, keyset_filter(sort_by, sort_direction, *after)]}
+        return query, [(sort_by, sort_direction), ('prediction_id', sort_direction)]
+    
+    @staticmethod
+    def history_projection(fields=None, sort_by='timestamp'):
+        """
+        Build the projection of a page of prediction history
+        
+        prediction_id and the sort field are always included, they make up
+        the page's next cursor. Fields outside HISTORY_FIELDS are ignored.
+        
+        Args:
+            fields (list): Fields to return, from HISTORY_FIELDS; None for HISTORY_SUMMARY_FIELDS
+            sort_by (str): Field the page is sorted by
+            
+        Returns:
+            dict: Projection for prediction_history.find
+        """
+        projection = {'_id': 0, 'prediction_id': 1, sort_by: 1}
+        for field in HISTORY_SUMMARY_FIELDS if fields is None else fields:
+            if field in HISTORY_FIELDS:
+                projection[field] = 1
+        return projection
+    
+    @staticmethod
+    def get_user_predictions(user_id, limit=20, offset=0, after=None, fields=None):
+        """
+        Get prediction history for a specific user, newest first
         
         Args:
             user_id (str): User ID
             limit (int): Maximum number of results to return
-            offset (int): Number of results to skip (for pagination)
+            offset (int): Number of results to skip (for pagination, kept for
+                          backward compatibility)
+            after (tuple): (timestamp, prediction_id) of the last record of the
+                           previous page; the page starts after it (keyset pagination)
+            fields (list): Fields to return, from HISTORY_FIELDS; None for the
+                           HISTORY_SUMMARY_FIELDS
             
         Returns:
             list: List of prediction records
@@ -80,13 +183,13 @@ class PredictionHistory:
             if not user_id:
                 logger.error("No user_id provided for prediction history query")
                 return []
-                
-            cursor = mongo.db.prediction_history.find(
-                {'user_id': user_id}
-            ).sort('timestamp', -1).skip(offset).limit(limit)
             
-            # Convert MongoDB cursor to list and handle ObjectId serialization
-            predictions = json.loads(json_util.dumps(list(cursor)))
+            query, sort = PredictionHistory.history_query({'user_id': user_id}, after=after)
+            projection = PredictionHistory.history_projection(fields)
+            cursor = mongo.db.prediction_history.find(query, projection).sort(sort).skip(offset).limit(limit)
+            
+            # Convert ObjectIds and datetimes while reading the cursor
+            predictions = documents_to_json(cursor)
             
             logger.info(f"Retrieved {len(predictions)} predictions for user {user_id}")
             return predictions
@@ -111,7 +214,7 @@ class PredictionHistory:
             
             if prediction:
                 # Convert MongoDB document to JSON-serializable dict
-                prediction = json.loads(json_util.dumps(prediction))
+                prediction = to_json_compatible(prediction)
                 logger.info(f"Retrieved prediction {prediction_id}")
                 return prediction
             else:
@@ -123,31 +226,58 @@ class PredictionHistory:
             return None
             
     @staticmethod
-    def get_filtered_predictions(filters, sort_by='timestamp', sort_order='desc', limit=100, offset=0):
+    def get_image_paths(prediction_ids):
+        """
+        Get the owner and image references of several predictions with one query
+        
+        Args:
+            prediction_ids (list): Prediction IDs
+            
+        Returns:
+            list: Records with prediction_id, user_id and image_path
+        """
+        try:
+            return list(mongo.db.prediction_history.find(
+                {'prediction_id': {'$in': list(prediction_ids)}},
+                {'_id': 0, 'prediction_id': 1, 'user_id': 1, 'image_path': 1}
+            ))
+        except Exception as e:
+            logger.error(f"Error retrieving prediction images: {str(e)}")
+            return []
+            
+    @staticmethod
+    def get_filtered_predictions(filters, sort_by='timestamp', sort_order='desc', limit=100, offset=0, after=None,
+                                 fields=None):
         """
         Get prediction history with filters
         
         Args:
             filters (dict): Dictionary of filters to apply (e.g., {'user_id': '123', 'plant_type': 'Tomato'})
-            sort_by (str): Field to sort by
+            sort_by (str): Field to sort by, one of HISTORY_SORT_FIELDS
             sort_order (str): Sort order ('asc' or 'desc')
             limit (int): Maximum number of results to return
-            offset (int): Number of results to skip (for pagination)
+            offset (int): Number of results to skip (for pagination, kept for
+                          backward compatibility)
+            after (tuple): (sort_by value, prediction_id) of the last record of
+                           the previous page; the page starts after it (keyset pagination)
+            fields (list): Fields to return, from HISTORY_FIELDS; None for the
+                           HISTORY_SUMMARY_FIELDS
             
         Returns:
             list: List of filtered prediction records
         """
         try:
-            # Determine sort direction
-            sort_direction = -1 if sort_order == 'desc' else 1
+            # Other fields have no index and would be sorted in memory
+            if sort_by not in HISTORY_SORT_FIELDS:
+                logger.error(f"Unsupported sort field for prediction history: {sort_by}")
+                return []
             
-            # Execute query
-            cursor = mongo.db.prediction_history.find(
-                filters
-            ).sort(sort_by, sort_direction).skip(offset).limit(limit)
+            query, sort = PredictionHistory.history_query(filters, sort_by, sort_order, after)
+            projection = PredictionHistory.history_projection(fields, sort_by)
+            cursor = mongo.db.prediction_history.find(query, projection).sort(sort).skip(offset).limit(limit)
             
-            # Convert MongoDB cursor to list and handle ObjectId serialization
-            predictions = json.loads(json_util.dumps(list(cursor)))
+            # Convert ObjectIds and datetimes while reading the cursor
+            predictions = documents_to_json(cursor)
             
             logger.info(f"Retrieved {len(predictions)} filtered predictions")
             return predictions
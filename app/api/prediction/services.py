@@ -3,14 +3,53 @@ import numpy as np
 from PIL import Image
 import io
 import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
 from app.core.models.model_loader import ModelLoader
+from app.core.models.fusion import fuse_scores
+from app.core.models.tta import build_tta_batch, average_tta_scores
+from app.utils.metrics import metrics
+from app.services.persistence import get_persistence_queue
+from app.services.prediction_cache import get_prediction_cache
+from app.services.near_duplicates import get_near_duplicate_config
+from app.utils.cache import make_cache_key
+from app.utils.pagination import encode_cursor
 from app.utils.log import get_logger
-from app.utils.image import prep_image
+from app.utils.image import prep_image, normalize_image, decode_tensor, perceptual_hash
+from app.utils.upload import hash_stream
+from app.utils.storage import ImageStorage
 from app.api.prediction.models import PredictionHistory
 
 # Initialize logger
 logger = get_logger(__name__)
 
+def _elapsed_ms(start):
+    """Milliseconds elapsed since a time.perf_counter() start value"""
+    return round((time.perf_counter() - start) * 1000.0, 3)
+
+def _tta_trigger_ratio():
+    """Fraction of single-image predictions that triggered test-time augmentation"""
+    total = metrics.get_counter('prediction.single_image')
+    return metrics.get_counter('prediction.tta_triggered') / total if total else 0.0
+
+metrics.register_gauge('prediction.tta_trigger_ratio', _tta_trigger_ratio)
+
+# Shared pool reading the images of bulk image requests, created on first use
+_image_fetch_pool = None
+_image_fetch_pool_lock = threading.Lock()
+
+def _get_image_fetch_pool():
+    """Return the thread pool that reads images for bulk image requests"""
+    global _image_fetch_pool
+    with _image_fetch_pool_lock:
+        if _image_fetch_pool is None:
+            workers = current_app.config.get('IMAGE_FETCH_WORKERS', 8)
+            _image_fetch_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='image-fetch')
+        return _image_fetch_pool
+
 class PredictionService:
     # Initialize model loader as a singleton
     _model_loader = None
@@ -25,6 +64,9 @@ class PredictionService:
     
     # Using the prep_image utility function instead of a static method
     
+    # Input formats accepted by the /predict endpoint
+    INPUT_FORMATS = ('image', 'tensor')
+    
     @classmethod
     def predict_disease(cls, image_file, user_id=None):
         """
@@ -38,23 +80,141 @@ class PredictionService:
             dict: Prediction result including disease information
         """
         try:
-            # Preprocess image using util function
-            preprocessed_image = prep_image(image_file)
-            
             # Get model loader
             model_loader = cls._get_model_loader()
             
-            # Make prediction
-            prediction = model_loader.predict(preprocessed_image)
+            def compute():
+                # Preprocess image to the size the model expects
+                start = time.perf_counter()
+                preprocessed_image = prep_image(image_file, target_size=model_loader.get_input_size())
+                timings = {'preprocess_ms': _elapsed_ms(start)}
+                
+                return cls._predict_preprocessed(preprocessed_image, user_id, timings)
             
-            # Add additional information about the disease
-            cls._add_disease_information(prediction)
+            return cls._predict_cached(compute, user_id, lambda: hash_stream(image_file), input_format='image')
+        except Exception as e:
+            logger.error(f"Disease prediction error: {str(e)}")
+            return {
+                "error": str(e),
+                "class_name": "Unknown",
+                "confidence": 0.0
+            }
+    
+    @classmethod
+    def predict_disease_multi(cls, image_files, user_id=None, fusion='mean'):
+        """
+        Predict a single diagnosis from several photos of the same plant
+        
+        All images are preprocessed and run through the model as one batch,
+        then their class scores are fused. Disease information (including the
+        advice lookup) is added once for the fused result.
+        
+        Args:
+            image_files: List of uploaded image files
+            user_id: Optional user ID to associate with this prediction
+            fusion: Score fusion method ('mean' of log-probs or 'max')
             
-            # Ensure user_id is set to something if provided
-            if user_id:
-                prediction['user_id'] = user_id
+        Returns:
+            dict: Fused prediction result with per-image scores
+        """
+        try:
+            def hash_content():
+                # Image order matters for the per-image scores
+                return hashlib.sha256(
+                    ''.join(hash_stream(image_file) for image_file in image_files).encode('utf-8')
+                ).hexdigest()
+            
+            return cls._predict_cached(
+                lambda: cls._predict_fused(image_files, fusion), user_id, hash_content,
+                input_format='image', image_count=len(image_files), fusion=fusion
+            )
+        except Exception as e:
+            logger.error(f"Multi-image disease prediction error: {str(e)}")
+            return {
+                "error": str(e),
+                "class_name": "Unknown",
+                "confidence": 0.0
+            }
+    
+    @classmethod
+    def _predict_fused(cls, image_files, fusion):
+        """Preprocess several images as one batch and fuse their scores"""
+        # Get model loader
+        model_loader = cls._get_model_loader()
+        target_size = model_loader.get_input_size()
+        
+        # Preprocess every image into a single batch
+        start = time.perf_counter()
+        batch = np.concatenate(
+            [prep_image(image_file, target_size=target_size) for image_file in image_files],
+            axis=0
+        )
+        timings = {'preprocess_ms': _elapsed_ms(start)}
+        
+        # One forward pass for all images
+        start = time.perf_counter()
+        scores = model_loader.predict_scores(batch)
+        timings['inference_ms'] = _elapsed_ms(start)
+        metrics.observe('prediction.inference_ms', timings['inference_ms'])
+        
+        # Fuse the per-image scores into one diagnosis
+        prediction = model_loader.format_prediction(fuse_scores(scores, fusion))
+        prediction['fusion'] = fusion
+        prediction['image_count'] = len(image_files)
+        prediction['per_image'] = [model_loader.format_prediction(row) for row in scores]
+        
+        # Add additional information about the disease
+        start = time.perf_counter()
+        cls._add_disease_information(prediction)
+        timings['advice_ms'] = _elapsed_ms(start)
+        
+        prediction['timings_ms'] = timings
+        return prediction
+    
+    @classmethod
+    def decode_tensor_upload(cls, tensor_file, shape, checksum):
+        """
+        Validate and decode a client-side preprocessed tensor upload
+        
+        Args:
+            tensor_file: Uploaded file containing raw uint8 RGB bytes
+            shape: Declared shape of the tensor (e.g. "224,224,3")
+            checksum: Hex encoded SHA-256 digest of the raw bytes
             
-            return prediction
+        Returns:
+            numpy.ndarray: uint8 pixel array at model resolution
+            
+        Raises:
+            ValueError: If the upload does not match the model input shape or checksum
+        """
+        model_loader = cls._get_model_loader()
+        return decode_tensor(tensor_file, shape, checksum, expected_shape=model_loader.get_input_shape())
+    
+    @classmethod
+    def predict_disease_from_pixels(cls, pixels, user_id=None):
+        """
+        Predict plant disease from pixels that are already at model resolution
+        
+        Skips decoding and resizing entirely.
+        
+        Args:
+            pixels: uint8 array of shape (height, width, 3)
+            user_id: Optional user ID to associate with this prediction
+            
+        Returns:
+            dict: Prediction result including disease information
+        """
+        try:
+            def compute():
+                start = time.perf_counter()
+                preprocessed_image = normalize_image(pixels)
+                timings = {'preprocess_ms': _elapsed_ms(start)}
+                
+                return cls._predict_preprocessed(preprocessed_image, user_id, timings)
+            
+            return cls._predict_cached(
+                compute, user_id, lambda: hashlib.sha256(pixels.tobytes()).hexdigest(), input_format='tensor'
+            )
         except Exception as e:
             logger.error(f"Disease prediction error: {str(e)}")
             return {
@@ -63,6 +223,209 @@ class PredictionService:
                 "confidence": 0.0
             }
     
+    @classmethod
+    def _predict_cached(cls, compute, user_id, hash_content, **key_parts):
+        """
+        Run a prediction through the prediction cache when it is enabled
+        
+        On a hit, decoding, inference and the advice lookup are all skipped.
+        
+        Args:
+            compute: Callable running the prediction
+            user_id: Optional user ID to associate with this prediction
+            hash_content: Callable returning the SHA-256 of the uploaded bytes
+            **key_parts: Other request inputs the result depends on (input format, fusion)
+            
+        Returns:
+            dict: Prediction result, with a 'cache' entry when the cache is enabled
+        """
+        prediction_cache = get_prediction_cache()
+        
+        if prediction_cache is None:
+            prediction = compute()
+        else:
+            start = time.perf_counter()
+            key = cls._cache_key(hash_content(), **key_parts)
+            prediction, source = prediction_cache.get_or_compute(key, compute)
+            if source != 'computed':
+                prediction['timings_ms'] = {'cache_ms': _elapsed_ms(start)}
+            prediction['cache'] = {'hit': source != 'computed', 'source': source}
+        
+        if user_id:
+            prediction['user_id'] = user_id
+            if 'near_duplicate' not in prediction:
+                cls._flag_near_duplicate(prediction, user_id)
+        return prediction
+    
+    @classmethod
+    def _find_near_duplicate(cls, user_id, hash_value):
+        """Return the user's earlier prediction whose image is a near-duplicate, if any"""
+        config = get_near_duplicate_config()
+        if config['index'] is None or not user_id:
+            return None, config
+        return config['index'].find(user_id, hash_value, config['max_distance']), config
+    
+    @classmethod
+    def _flag_near_duplicate(cls, prediction, user_id):
+        """Mark a prediction whose image is close to one the user submitted recently"""
+        if 'perceptual_hash' not in prediction or 'error' in prediction:
+            return
+        match, _ = cls._find_near_duplicate(user_id, int(prediction['perceptual_hash'], 16))
+        if match:
+            prediction['near_duplicate'] = {
+                'prediction_id': match['prediction_id'],
+                'distance': match['distance'],
+                'reused': False
+            }
+            metrics.increment('near_duplicate.flagged')
+    
+    @classmethod
+    def record_perceptual_hash(cls, prediction):
+        """
+        Add a finished prediction to its user's near-duplicate index
+        
+        Args:
+            prediction (dict): Prediction with prediction_id, user_id and perceptual_hash
+        """
+        index = get_near_duplicate_config()['index']
+        if index is None or 'perceptual_hash' not in prediction or 'error' in prediction:
+            return
+        index.add(
+            prediction['user_id'],
+            int(prediction['perceptual_hash'], 16),
+            prediction['prediction_id'],
+            prediction['class_id'],
+            prediction['confidence']
+        )
+    
+    @classmethod
+    def _cache_key(cls, content_hash, **key_parts):
+        """
+        Build the prediction cache key for uploaded content
+        
+        The key covers everything the result depends on: the uploaded bytes,
+        the model build and the preprocessing (input shape and TTA settings).
+        """
+        model_loader = cls._get_model_loader()
+        return make_cache_key(dict(
+            key_parts,
+            content=content_hash,
+            model_version=model_loader.get_model_version(),
+            input_shape=list(model_loader.get_input_shape()),
+            tta=cls._get_tta_config()
+        ))
+    
+    @classmethod
+    def _predict_preprocessed(cls, preprocessed_image, user_id=None, timings=None):
+        """
+        Run inference on a preprocessed batch of one and enrich the result
+        
+        When test-time augmentation is enabled and the confidence is below the
+        configured threshold, augmented views are scored in one extra batch and
+        the averaged scores replace the original ones.
+        
+        A perceptual hash of the input is added to the result. With
+        NEAR_DUPLICATE_ACTION 'reuse', inference is skipped when the user
+        recently submitted a near-identical photo and that result is reused.
+        """
+        timings = dict(timings or {})
+        
+        # Get model loader
+        model_loader = cls._get_model_loader()
+        
+        # Hash the already downscaled input for near-duplicate detection
+        hash_value = perceptual_hash(preprocessed_image)
+        
+        match, near_duplicate_config = cls._find_near_duplicate(user_id, hash_value)
+        if match and near_duplicate_config['action'] == 'reuse':
+            prediction = model_loader.format_class(match['class_id'], match['confidence'])
+            prediction['near_duplicate'] = {
+                'prediction_id': match['prediction_id'],
+                'distance': match['distance'],
+                'reused': True
+            }
+            metrics.increment('near_duplicate.reused')
+            
+            start = time.perf_counter()
+            cls._add_disease_information(prediction)
+            timings['advice_ms'] = _elapsed_ms(start)
+            
+            prediction['perceptual_hash'] = f"{hash_value:016x}"
+            prediction['user_id'] = user_id
+            prediction['timings_ms'] = timings
+            return prediction
+        
+        # Make prediction
+        start = time.perf_counter()
+        scores = model_loader.predict_scores(preprocessed_image)[0]
+        timings['inference_ms'] = _elapsed_ms(start)
+        prediction = model_loader.format_prediction(scores)
+        
+        metrics.increment('prediction.single_image')
+        metrics.observe('prediction.inference_ms', timings['inference_ms'])
+        
+        tta_config = cls._get_tta_config()
+        if (tta_config['enabled'] and tta_config['max_views'] > 1
+                and prediction['confidence'] < tta_config['threshold']):
+            start = time.perf_counter()
+            tta_batch, views = build_tta_batch(
+                preprocessed_image[0],
+                max_views=tta_config['max_views'],
+                crop_fraction=tta_config['crop_fraction']
+            )
+            augmented_scores = model_loader.predict_scores(tta_batch)
+            initial_confidence = prediction['confidence']
+            prediction = model_loader.format_prediction(average_tta_scores(scores, augmented_scores))
+            timings['tta_ms'] = _elapsed_ms(start)
+            
+            prediction['tta'] = {
+                'applied': True,
+                'views': ['original'] + views,
+                'initial_confidence': initial_confidence
+            }
+            metrics.increment('prediction.tta_triggered')
+            metrics.observe('prediction.tta_ms', timings['tta_ms'])
+        
+        # Add additional information about the disease
+        start = time.perf_counter()
+        cls._add_disease_information(prediction)
+        timings['advice_ms'] = _elapsed_ms(start)
+        
+        # Ensure user_id is set to something if provided
+        if user_id:
+            prediction['user_id'] = user_id
+        
+        prediction['perceptual_hash'] = f"{hash_value:016x}"
+        prediction['timings_ms'] = timings
+        return prediction
+    
+    @staticmethod
+    def _get_tta_config():
+        """Read test-time augmentation settings from the app config"""
+        config = current_app.config if has_app_context() else {}
+        return {
+            'enabled': bool(config.get('TTA_ENABLED', False)),
+            'threshold': float(config.get('TTA_CONFIDENCE_THRESHOLD', 0.6)),
+            'max_views': int(config.get('TTA_MAX_VIEWS', 6)),
+            'crop_fraction': float(config.get('TTA_CROP_FRACTION', 0.875))
+        }
+    
+    @classmethod
+    def get_model_info(cls):
+        """
+        Get model metadata, including the input shape clients should resize to
+        
+        Returns:
+            dict: Model metadata and accepted /predict input formats
+        """
+        model_loader = cls._get_model_loader()
+        info = model_loader.get_model_metadata()
+        info['input_formats'] = {
+            'image': 'Encoded image file (JPEG/PNG); resized on the server unless already at input_shape',
+            'tensor': 'Raw uint8 RGB bytes of exactly input_shape, row-major, with "shape" and SHA-256 "checksum" form fields'
+        }
+        return info
+    
     @classmethod
     def _add_disease_information(cls, prediction):
         """
@@ -235,6 +598,31 @@ Early blight is caused by the fungus Alternaria solani and typically appears fir
             logger.error(f"Error saving prediction history: {str(e)}")
             return None
     
+    @classmethod
+    def queue_prediction_history(cls, prediction_data, prepared_images=None):
+        """
+        Queue a prediction and its images for write-behind persistence
+        
+        Args:
+            prediction_data (dict): Prediction data including metadata
+            prepared_images (list): Images from ImageStorage.prepare_prediction_image
+            
+        Returns:
+            str: ID of the queued prediction or None if it is invalid
+        """
+        try:
+            # Copy so the background insert never mutates the response body
+            document = dict(prediction_data)
+            if not PredictionHistory.prepare_prediction(document):
+                logger.error("Failed to queue prediction history")
+                return None
+            
+            get_persistence_queue().submit(document, prepared_images)
+            return document['prediction_id']
+        except Exception as e:
+            logger.error(f"Error queueing prediction history: {str(e)}")
+            return None
+    
     @classmethod
     def get_user_prediction_history(cls, user_id, limit=20, offset=0):
         """
@@ -254,6 +642,72 @@ Early blight is caused by the fungus Alternaria solani and typically appears fir
             logger.error(f"Error retrieving prediction history: {str(e)}")
             return []
     
+    @classmethod
+    def get_user_prediction_page(cls, user_id, limit=20, offset=0, after=None, fields=None):
+        """
+        Get one page of a user's prediction history, newest first
+        
+        Args:
+            user_id (str): User ID
+            limit (int): Maximum number of results to return
+            offset (int): Number of results to skip (backward compatible paging)
+            after (tuple): Key decoded from the previous page's next_cursor
+            fields (list): Fields to return, None for the summary fields
+            
+        Returns:
+            tuple: (list of prediction history records, next_cursor or None on the last page)
+        """
+        try:
+            # One extra record tells whether another page follows
+            predictions = PredictionHistory.get_user_predictions(user_id, limit + 1, offset, after=after,
+                                                                 fields=fields)
+            return cls._paginate(predictions, limit, 'timestamp', 'desc')
+        except Exception as e:
+            logger.error(f"Error retrieving prediction history: {str(e)}")
+            return [], None
+    
+    @classmethod
+    def get_filtered_prediction_page(cls, filters=None, sort_by='timestamp', sort_order='desc', limit=100,
+                                     offset=0, after=None, fields=None):
+        """
+        Get one page of prediction history with filters
+        
+        Args:
+            filters (dict): Dictionary of filters to apply
+            sort_by (str): Field to sort by
+            sort_order (str): Sort order ('asc' or 'desc')
+            limit (int): Maximum number of results to return
+            offset (int): Number of results to skip (backward compatible paging)
+            after (tuple): Key decoded from the previous page's next_cursor
+            fields (list): Fields to return, None for the summary fields
+            
+        Returns:
+            tuple: (list of prediction history records, next_cursor or None on the last page)
+        """
+        try:
+            predictions = PredictionHistory.get_filtered_predictions(
+                filters=filters or {},
+                sort_by=sort_by,
+                sort_order=sort_order,
+                limit=limit + 1,
+                offset=offset,
+                after=after,
+                fields=fields
+            )
+            return cls._paginate(predictions, limit, sort_by, sort_order)
+        except Exception as e:
+            logger.error(f"Error retrieving filtered predictions: {str(e)}")
+            return [], None
+    
+    @staticmethod
+    def _paginate(predictions, limit, sort_by, sort_order):
+        """Trim a page fetched with one extra record and build the cursor of the next page"""
+        if len(predictions) <= limit:
+            return predictions, None
+        predictions = predictions[:limit]
+        last = predictions[-1]
+        return predictions, encode_cursor(sort_by, sort_order, last.get(sort_by), last['prediction_id'])
+    
     @classmethod
     def get_prediction_details(cls, prediction_id):
         """
@@ -271,6 +725,55 @@ Early blight is caused by the fungus Alternaria solani and typically appears fir
             logger.error(f"Error retrieving prediction details: {str(e)}")
             return None
             
+    @classmethod
+    def get_prediction_images(cls, user_id, prediction_ids, variant=None):
+        """
+        Read the images of several predictions of one user in parallel
+        
+        The image references of all predictions are resolved with one query,
+        then the images are read from storage by a shared thread pool.
+        
+        Args:
+            user_id (str): ID of the user the predictions must belong to
+            prediction_ids (list): Prediction IDs, without duplicates
+            variant (str): Name of a derivative (e.g. 'thumb'), None for the original
+            
+        Returns:
+            dict: 'images' (list of dicts with prediction_id, content_type and
+                  data, in request order) and 'missing' (prediction IDs without
+                  a stored image)
+            
+        Raises:
+            PermissionError: If a prediction belongs to another user
+        """
+        records = PredictionHistory.get_image_paths(prediction_ids)
+        if any(record.get('user_id') != user_id for record in records):
+            raise PermissionError('Predictions belong to another user')
+        
+        image_paths = {record['prediction_id']: record['image_path']
+                       for record in records if record.get('image_path')}
+        app = current_app._get_current_object()
+        
+        def fetch(image_path):
+            with app.app_context():
+                return ImageStorage.read_image(image_path, variant)
+        
+        wanted = [prediction_id for prediction_id in prediction_ids if prediction_id in image_paths]
+        start = time.perf_counter()
+        results = _get_image_fetch_pool().map(fetch, [image_paths[prediction_id] for prediction_id in wanted])
+        
+        images = []
+        for prediction_id, image in zip(wanted, results):
+            if image is not None:
+                images.append({'prediction_id': prediction_id, **image})
+        found = {image['prediction_id'] for image in images}
+        
+        metrics.observe('prediction.bulk_images_ms', _elapsed_ms(start))
+        return {
+            'images': images,
+            'missing': [prediction_id for prediction_id in prediction_ids if prediction_id not in found]
+        }
+    
     @classmethod
     def get_filtered_predictions(cls, filters=None, sort_by='timestamp', sort_order='desc', limit=100, offset=0):
         """
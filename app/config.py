@@ -5,6 +5,7 @@ class Config:
     DEBUG = False
     TESTING = False
     MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/plant_disease')
+    INDEX_BUILD_BACKGROUND = os.getenv('INDEX_BUILD_BACKGROUND', 'true').lower() == 'true'  # false builds MongoDB indexes before startup completes
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt_secret_key')
     
     # Gemini API configuration
@@ -13,12 +14,92 @@ class Config:
     GENAI_LOCATION = os.getenv('GENAI_LOCATION', 'global')
     GENAI_MODEL_NAME = os.getenv('GENAI_MODEL_NAME', 'gemini-2.0-flash')
 
+    # Upload configuration
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # Reject larger request bodies with 413
+    UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', 512 * 1024))  # Uploads above this size are spooled to disk
+    IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 86400))  # Cache-Control max-age for streamed images (seconds)
+    IMAGE_MEMORY_CACHE_SIZE = int(os.getenv('IMAGE_MEMORY_CACHE_SIZE', 64 * 1024 * 1024))  # Bytes of hot images kept in each worker's memory (0 = disabled)
+    IMAGE_MEMORY_CACHE_MAX_ITEM = int(os.getenv('IMAGE_MEMORY_CACHE_MAX_ITEM', 2 * 1024 * 1024))  # Larger images are always streamed from storage
+    IMAGE_DERIVATIVES = os.getenv('IMAGE_DERIVATIVES', 'thumb:128,medium:512')  # Resized copies stored with each image (name:max side[:quality])
+    IMAGE_DERIVATIVE_FORMAT = os.getenv('IMAGE_DERIVATIVE_FORMAT', 'JPEG')  # JPEG, WEBP or AVIF
+    IMAGE_DERIVATIVE_QUALITY = int(os.getenv('IMAGE_DERIVATIVE_QUALITY', 80))  # Encoder quality for derivatives without their own
+    IMAGE_STORAGE_FORMAT = os.getenv('IMAGE_STORAGE_FORMAT', 'JPEG')  # Format of the stored original: JPEG, WEBP or AVIF
+    IMAGE_STORAGE_QUALITY = int(os.getenv('IMAGE_STORAGE_QUALITY', 85))  # Encoder quality of the stored original
+    IMAGE_STORAGE_MAX_DIMENSION = int(os.getenv('IMAGE_STORAGE_MAX_DIMENSION', 0))  # Longest side of the stored original (0 = no cap)
+    IMAGE_RETENTION_RULES = os.getenv('IMAGE_RETENTION_RULES', '')  # JSON list of retention rules, first match wins
+    IMAGE_RETENTION_DEFAULT = os.getenv('IMAGE_RETENTION_DEFAULT', 'original')  # original, thumbnail or none when no rule matches
+    IMAGE_EXPIRY_DAYS = os.getenv('IMAGE_EXPIRY_DAYS', '')  # Days images are kept per user tier, e.g. default:90,pro:365 (0 = forever)
+    IMAGE_GC_INTERVAL = int(os.getenv('IMAGE_GC_INTERVAL', 0))  # Seconds between image expiry/orphan GC runs (0 = disabled)
+    IMAGE_GC_BATCH_SIZE = int(os.getenv('IMAGE_GC_BATCH_SIZE', 500))  # Documents scanned per GC query
+    IMAGE_GC_GRACE_SECONDS = int(os.getenv('IMAGE_GC_GRACE_SECONDS', 3600))  # Images stored or referenced more recently are never collected
+    IMAGE_GC_MAX_DELETES_PER_SECOND = int(os.getenv('IMAGE_GC_MAX_DELETES_PER_SECOND', 200))  # GC delete rate limit (0 = unlimited)
+    IMAGE_STORAGE_BACKEND = os.getenv('IMAGE_STORAGE_BACKEND', 'gridfs')  # gridfs, disk or s3 (new images only)
+    IMAGE_STORAGE_CHUNK_SIZE = int(os.getenv('IMAGE_STORAGE_CHUNK_SIZE', 255 * 1024))  # GridFS chunk size of new files (bytes)
+    IMAGE_STORAGE_DISK_PATH = os.getenv('IMAGE_STORAGE_DISK_PATH', '')  # Root of the disk backend (default: uploads/objects)
+    IMAGE_STORAGE_S3_BUCKET = os.getenv('IMAGE_STORAGE_S3_BUCKET', '')  # Bucket of the s3 backend
+    IMAGE_STORAGE_S3_PREFIX = os.getenv('IMAGE_STORAGE_S3_PREFIX', 'images/')  # Key prefix of the s3 backend
+    IMAGE_STORAGE_S3_ENDPOINT_URL = os.getenv('IMAGE_STORAGE_S3_ENDPOINT_URL', '')  # S3-compatible endpoint (e.g. MinIO), empty for AWS
+    IMAGE_ARCHIVE_BACKEND = os.getenv('IMAGE_ARCHIVE_BACKEND', 'disk')  # disk or s3, where pack files of archived images are kept
+    IMAGE_ARCHIVE_PATH = os.getenv('IMAGE_ARCHIVE_PATH', '')  # Pack directory of the disk archive (default: uploads/archive)
+    IMAGE_ARCHIVE_S3_BUCKET = os.getenv('IMAGE_ARCHIVE_S3_BUCKET', '')  # Bucket of the s3 archive
+    IMAGE_ARCHIVE_S3_PREFIX = os.getenv('IMAGE_ARCHIVE_S3_PREFIX', 'archive/')  # Key prefix of the s3 archive
+    IMAGE_ARCHIVE_AFTER_DAYS = int(os.getenv('IMAGE_ARCHIVE_AFTER_DAYS', 90))  # Age at which scripts/archive_images.py archives images
+    IMAGE_ARCHIVE_PACK_SIZE = int(os.getenv('IMAGE_ARCHIVE_PACK_SIZE', 256 * 1024 * 1024))  # Bytes per pack file
+    MAX_IMAGES_PER_PREDICTION = int(os.getenv('MAX_IMAGES_PER_PREDICTION', 8))  # Photos accepted by a multi-image /predict
+    PREDICTION_IMAGES_MAX_BATCH = int(os.getenv('PREDICTION_IMAGES_MAX_BATCH', 50))  # Predictions per bulk image request
+    IMAGE_FETCH_WORKERS = int(os.getenv('IMAGE_FETCH_WORKERS', 8))  # Threads reading images of bulk image requests
+    
+    # Test-time augmentation for low-confidence predictions
+    TTA_ENABLED = os.getenv('TTA_ENABLED', 'false').lower() == 'true'
+    TTA_CONFIDENCE_THRESHOLD = float(os.getenv('TTA_CONFIDENCE_THRESHOLD', 0.6))  # Only predictions below this confidence are augmented
+    TTA_MAX_VIEWS = int(os.getenv('TTA_MAX_VIEWS', 6))  # Views per augmented prediction, including the original
+    TTA_CROP_FRACTION = float(os.getenv('TTA_CROP_FRACTION', 0.875))
+    
+    # Prediction result cache keyed by image content, model version and preprocessing
+    PREDICTION_CACHE_ENABLED = os.getenv('PREDICTION_CACHE_ENABLED', 'true').lower() == 'true'
+    PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', 1024))  # Results kept in each worker's memory
+    PREDICTION_CACHE_TTL = int(os.getenv('PREDICTION_CACHE_TTL', 7 * 24 * 3600))  # Seconds before a cached result expires
+    
+    # Near-duplicate detection of re-shot photos (perceptual hash)
+    NEAR_DUPLICATE_ACTION = os.getenv('NEAR_DUPLICATE_ACTION', 'flag').lower()  # off, flag or reuse (skip inference)
+    NEAR_DUPLICATE_DISTANCE = int(os.getenv('NEAR_DUPLICATE_DISTANCE', 8))  # Maximum differing bits of the 64-bit hash
+    NEAR_DUPLICATE_MAX_HASHES = int(os.getenv('NEAR_DUPLICATE_MAX_HASHES', 50000))  # Recent hashes kept per user
+    NEAR_DUPLICATE_MAX_USERS = int(os.getenv('NEAR_DUPLICATE_MAX_USERS', 1000))  # Users indexed per worker
+    
+    # Write-behind persistence of prediction images and history
+    PERSISTENCE_WRITE_BEHIND = os.getenv('PERSISTENCE_WRITE_BEHIND', 'false').lower() == 'true'  # true responds before MongoDB writes
+    PERSISTENCE_QUEUE_SIZE = int(os.getenv('PERSISTENCE_QUEUE_SIZE', 1000))  # Pending predictions before requests write synchronously
+    PERSISTENCE_WORKERS = int(os.getenv('PERSISTENCE_WORKERS', 2))
+    PERSISTENCE_BATCH_SIZE = int(os.getenv('PERSISTENCE_BATCH_SIZE', 50))
+    PERSISTENCE_ENQUEUE_TIMEOUT = float(os.getenv('PERSISTENCE_ENQUEUE_TIMEOUT', 0.05))  # Seconds to wait for queue space
+    PERSISTENCE_RETRIES = int(os.getenv('PERSISTENCE_RETRIES', 3))  # Retries of a failed batch before it is dead-lettered
+    PERSISTENCE_RETRY_DELAY = float(os.getenv('PERSISTENCE_RETRY_DELAY', 0.5))  # Seconds before the first retry, doubled after
+    
+    # Background deletion of a user's history and account
+    DELETION_JOBS_BACKGROUND = os.getenv('DELETION_JOBS_BACKGROUND', 'true').lower() == 'true'  # false runs deletions inside the request
+    DELETION_BATCH_SIZE = int(os.getenv('DELETION_BATCH_SIZE', 500))  # Predictions deleted per batch
+    DELETION_LEASE_SECONDS = int(os.getenv('DELETION_LEASE_SECONDS', 300))  # Seconds before a stalled job is resumed by another worker
+    DELETION_POLL_INTERVAL = int(os.getenv('DELETION_POLL_INTERVAL', 60))  # Seconds between checks for unfinished jobs
+
 class DevelopmentConfig(Config):
     DEBUG = True
     MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/plant_disease_dev')
 
 class TestingConfig(Config):
     TESTING = True
+    # Tests expect every /predict to run inference
+    PREDICTION_CACHE_ENABLED = False
+    # Tests expect every prediction image to be stored in full
+    IMAGE_RETENTION_RULES = ''
+    IMAGE_RETENTION_DEFAULT = 'original'
+    IMAGE_EXPIRY_DAYS = ''
+    IMAGE_GC_INTERVAL = 0
+    # Tests read images straight from storage
+    IMAGE_MEMORY_CACHE_SIZE = 0
+    # Tests check the result of a deletion right after requesting it
+    DELETION_JOBS_BACKGROUND = False
+    # Tests query right after startup and check the query plans
+    INDEX_BUILD_BACKGROUND = False
     MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/plant_disease_test')
 
 class ProductionConfig(Config):
@@ -0,0 +1,40 @@
+"""
+Score fusion for multi-image predictions.
+
+Several photos of the same plant are run through the model as one batch
+and their per-class scores are combined into a single diagnosis.
+"""
+import numpy as np
+
+# Supported fusion methods
+FUSION_METHODS = ('mean', 'max')
+
+# Floor applied to probabilities before taking logs
+_LOG_EPSILON = 1e-7
+
+def fuse_scores(scores, method='mean'):
+    """
+    Fuse per-image class scores into a single score vector
+
+    Args:
+        scores: Array of shape (num_images, num_classes) with per-image class probabilities
+        method: 'mean' averages log-probabilities (a normalized geometric mean),
+                'max' takes the highest score each class reached in any image
+
+    Returns:
+        numpy.ndarray: Fused scores of shape (num_classes,)
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.ndim != 2 or scores.shape[0] == 0:
+        raise ValueError(f"Expected scores of shape (num_images, num_classes), got {scores.shape}")
+
+    if method == 'mean':
+        mean_log = np.log(np.clip(scores, _LOG_EPSILON, 1.0)).mean(axis=0)
+        # Renormalize so the fused vector is a distribution again
+        fused = np.exp(mean_log - mean_log.max())
+        return fused / fused.sum()
+
+    if method == 'max':
+        return scores.max(axis=0)
+
+    raise ValueError(f"Unknown fusion method '{method}'. Expected one of {FUSION_METHODS}")
@@ -2,6 +2,7 @@ import tensorflow as tf
 import numpy as np
 import os
 import json
+import hashlib
 from app.utils.log import get_logger
 from app.core.resources import ResourceManager
 from app.core.models.inference import InferenceModel
@@ -10,11 +11,15 @@ from app.utils.gpu_utils import get_device_info
 # Get logger for this module
 logger = get_logger(__name__)
 
+# Input shape (height, width, channels) used when the model does not report one
+DEFAULT_INPUT_SHAPE = (224, 224, 3)
+
 class ModelLoader:
     def __init__(self):
         self.model = InferenceModel()
         self.class_names = []
         self.device_info = None
+        self.model_version = None
         
     def load_model(self, model_path=None):
         """Load the saved ML model for inference"""
@@ -34,6 +39,9 @@ class ModelLoader:
             # Try to load class names
             self._load_class_names()
             
+            # Identify this model build, e.g. for cache keys
+            self.model_version = self._fingerprint_model(model_path)
+            
             # Get and store device information
             self.device_info = get_device_info()
             logger.info(f"Model using GPU: {self.device_info['using_gpu']}, Number of GPUs: {self.device_info['num_gpus']}")
@@ -74,27 +82,105 @@ class ModelLoader:
             self.device_info = get_device_info()
         return self.device_info
     
-    def predict(self, preprocessed_image):
-        """Make a prediction using the loaded model"""
+    def _fingerprint_model(self, model_path):
+        """Derive a short version string from the model file and its class names"""
+        try:
+            stat = os.stat(model_path)
+            source = f"{os.path.basename(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{json.dumps(self.class_names)}"
+            return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+        except OSError as e:
+            logger.error(f"Error fingerprinting model: {str(e)}")
+            return None
+    
+    def get_model_version(self):
+        """Return the version of the loaded model ('unversioned' if unknown)"""
+        return self.model_version or 'unversioned'
+    
+    def get_input_shape(self):
+        """Return the (height, width, channels) input shape expected by the model"""
+        keras_model = getattr(self.model, 'model', None)
+        input_shape = getattr(keras_model, 'input_shape', None)
+        
+        # Keras reports (batch, height, width, channels) with a None batch dimension
+        if isinstance(input_shape, tuple) and len(input_shape) == 4 and all(input_shape[1:]):
+            return tuple(int(dim) for dim in input_shape[1:])
+        
+        return DEFAULT_INPUT_SHAPE
+    
+    def get_input_size(self):
+        """Return the (height, width) the input image must be resized to"""
+        height, width, _ = self.get_input_shape()
+        return (height, width)
+    
+    def get_model_metadata(self):
+        """Return metadata clients need to prepare input for the model"""
+        height, width, channels = self.get_input_shape()
+        return {
+            "input_shape": [height, width, channels],
+            "input_dtype": "uint8",
+            "color_order": "RGB",
+            "normalization": "divide_by_255",
+            "num_classes": len(self.get_class_names()),
+            "model_version": self.get_model_version(),
+            "model_loaded": getattr(self.model, 'model', None) is not None
+        }
+    
+    def predict_scores(self, preprocessed_batch):
+        """
+        Run the model on a batch of preprocessed images
+        
+        Args:
+            preprocessed_batch: float32 array of shape (batch, height, width, channels)
+            
+        Returns:
+            numpy.ndarray: Class scores of shape (batch, num_classes)
+        """
         if self.model is None:
             raise ValueError("Model not loaded. Call load_model() first.")
         
         # Get raw predictions from the inference model
         with tf.device('/GPU:0' if self.device_info and self.device_info['using_gpu'] else '/CPU:0'):
-            predictions = self.model.predict(preprocessed_image)
+            predictions = self.model.predict(preprocessed_batch)
+        
+        return np.asarray(predictions)
+    
+    def format_prediction(self, scores):
+        """
+        Turn a single score vector into a prediction result
         
-        # Process predictions
-        predicted_class = np.argmax(predictions, axis=1)[0]
-        confidence = float(predictions[0][predicted_class])
+        Args:
+            scores: Class scores of shape (num_classes,)
+            
+        Returns:
+            dict: class_id, class_name and confidence of the top class
+        """
+        predicted_class = int(np.argmax(scores))
+        return self.format_class(predicted_class, float(scores[predicted_class]))
+    
+    def format_class(self, class_id, confidence):
+        """
+        Build a prediction result for a known class
         
+        Args:
+            class_id: Index of the predicted class
+            confidence: Confidence of the predicted class
+            
+        Returns:
+            dict: class_id, class_name and confidence
+        """
         # Map to class name if available
-        if len(self.class_names) > predicted_class:
-            class_name = self.class_names[predicted_class]
+        if len(self.class_names) > class_id:
+            class_name = self.class_names[class_id]
         else:
-            class_name = f"class_{predicted_class}"
+            class_name = f"class_{class_id}"
             
         return {
-            "class_id": int(predicted_class),
+            "class_id": class_id,
             "class_name": class_name,
             "confidence": confidence
         }
+    
+    def predict(self, preprocessed_image):
+        """Make a prediction using the loaded model"""
+        predictions = self.predict_scores(preprocessed_image)
+        return self.format_prediction(predictions[0])
@@ -0,0 +1,78 @@
+"""
+Test-time augmentation (TTA) for low-confidence predictions.
+
+Augmented views are generated from the already decoded and normalized
+input array: flips are NumPy views and crops are views resampled back to
+the model resolution with nearest-neighbour indexing, so no image is
+decoded or resized again.
+"""
+import numpy as np
+
+# Views in the order they are added to the TTA batch
+VIEW_ORDER = ('original', 'hflip', 'vflip', 'center_crop',
+              'top_left_crop', 'top_right_crop', 'bottom_left_crop', 'bottom_right_crop')
+
+def _crop_origins(height, width, crop_height, crop_width):
+    """Return the (top, left) origin of each crop view"""
+    bottom = height - crop_height
+    right = width - crop_width
+    return {
+        'center_crop': (bottom // 2, right // 2),
+        'top_left_crop': (0, 0),
+        'top_right_crop': (0, right),
+        'bottom_left_crop': (bottom, 0),
+        'bottom_right_crop': (bottom, right),
+    }
+
+def build_tta_batch(image, max_views=6, crop_fraction=0.875):
+    """
+    Build a batch of augmented views of one preprocessed image
+
+    The original view is not included since its scores are already known
+    from the first inference pass.
+
+    Args:
+        image: Normalized array of shape (height, width, channels)
+        max_views: Maximum number of views including the original (bounds the extra cost)
+        crop_fraction: Side length of crops relative to the image
+
+    Returns:
+        tuple: (batch array of shape (views, height, width, channels), list of view names)
+    """
+    height, width = image.shape[:2]
+    names = list(VIEW_ORDER[1:max(1, min(max_views, len(VIEW_ORDER)))])
+
+    crop_height = max(1, int(round(height * crop_fraction)))
+    crop_width = max(1, int(round(width * crop_fraction)))
+    origins = _crop_origins(height, width, crop_height, crop_width)
+
+    # Nearest-neighbour sample positions that stretch a crop back to full size
+    rows = (np.arange(height) * crop_height // height).astype(np.intp)
+    cols = (np.arange(width) * crop_width // width).astype(np.intp)
+
+    batch = np.empty((len(names),) + image.shape, dtype=image.dtype)
+    for index, name in enumerate(names):
+        if name == 'hflip':
+            batch[index] = image[:, ::-1]
+        elif name == 'vflip':
+            batch[index] = image[::-1, :]
+        else:
+            top, left = origins[name]
+            crop = image[top:top + crop_height, left:left + crop_width]
+            batch[index] = crop[rows[:, None], cols]
+
+    return batch, names
+
+def average_tta_scores(original_scores, augmented_scores):
+    """
+    Average class scores over the original and augmented views
+
+    Args:
+        original_scores: Scores of the original view, shape (num_classes,)
+        augmented_scores: Scores of the augmented views, shape (views, num_classes)
+
+    Returns:
+        numpy.ndarray: Averaged scores of shape (num_classes,)
+    """
+    all_scores = np.vstack([np.asarray(original_scores)[None, :], np.asarray(augmented_scores)])
+    return all_scores.mean(axis=0)
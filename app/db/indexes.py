@@ -0,0 +1,153 @@
+"""
+Declarative registry of the MongoDB indexes of each collection.
+
+Every index is declared here next to the query it serves, and
+init_mongo_collections builds the whole registry at startup. Prediction
+history is only ever read per user: the history pages query
+{user_id[, plant_type][, condition]} sorted by (sort field, prediction_id),
+so each sortable field gets a (user_id, field, prediction_id) index that
+returns a user's documents already in sort order. Sorting by any other
+field would make MongoDB sort the whole history in memory, so sort_by is
+restricted to HISTORY_SORT_FIELDS.
+
+Builds run on a background thread (INDEX_BUILD_BACKGROUND) so a deploy
+adding an index over a large collection does not hold up startup; queries
+keep working with the existing indexes until the build finishes.
+"""
+import threading
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import ConnectionFailure, OperationFailure
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Fields the prediction history can be sorted by, each backed by an index below
+HISTORY_SORT_FIELDS = ('timestamp', 'confidence', 'class_name')
+
+
+def _history_sort_index(field):
+    """Index returning a user's predictions in (field, prediction_id) order, either direction"""
+    return IndexModel([('user_id', ASCENDING), (field, DESCENDING), ('prediction_id', DESCENDING)],
+                      background=True)
+
+
+INDEXES = {
+    'auth': [
+        IndexModel('user_id', unique=True, background=True),
+        IndexModel('email', unique=True, background=True),
+        IndexModel('username', unique=True, background=True),
+    ],
+    'profile': [
+        IndexModel('user_id', unique=True, background=True),
+    ],
+    'prediction_history': [
+        IndexModel('prediction_id', unique=True, background=True),
+        # History pages, filtered by plant_type/condition, in keyset order;
+        # the user_id prefix also serves per-user counts and deletions
+        *[_history_sort_index(field) for field in HISTORY_SORT_FIELDS],
+        # Image GC: set-difference of stored images against referencing predictions, and expiry
+        IndexModel('image_path', sparse=True, background=True),
+        IndexModel('image_paths', sparse=True, background=True),
+        IndexModel('image_expires_at', sparse=True, background=True),
+    ],
+    'prediction_cache': [
+        # Cached prediction results expire at their expires_at time
+        IndexModel('expires_at', expireAfterSeconds=0, background=True),
+    ],
+    'fs.files': [
+        # Look up image derivatives (thumbnails) by their original
+        IndexModel([('parent_id', ASCENDING), ('variant', ASCENDING)], sparse=True, background=True),
+        # Content-addressed images, one file per distinct image
+        IndexModel('content_hash', unique=True, partialFilterExpression={'content_hash': {'$exists': True}},
+                   background=True),
+        # Deletion jobs: images uploaded by a user, walked in _id order
+        IndexModel([('user_id', ASCENDING), ('_id', ASCENDING)], sparse=True, background=True),
+    ],
+    'deletion_jobs': [
+        IndexModel([('user_id', ASCENDING), ('status', ASCENDING)], background=True),
+        IndexModel('status', background=True),
+    ],
+    'image_objects': [
+        # Images kept in the disk and s3 storage backends
+        IndexModel('prediction_id', background=True),
+        IndexModel('user_id', background=True),
+    ],
+    'persistence_dead_letters': [
+        # Images of dead-lettered predictions count as referenced; deletion jobs remove a user's letters
+        IndexModel('history.image_path', sparse=True, background=True),
+        IndexModel('history.image_paths', sparse=True, background=True),
+        IndexModel('history.user_id', background=True),
+    ],
+    'image_archive': [
+        # Images moved from GridFS to archive pack files
+        IndexModel('prediction_id', background=True),
+        IndexModel('user_id', background=True),
+    ],
+}
+
+# Indexes made redundant by the registry, dropped once it is built
+OBSOLETE_INDEXES = {
+    # Prefix of every history sort index
+    'prediction_history': ['user_id_1', 'timestamp_1'],
+}
+
+
+def build_indexes(database):
+    """
+    Create every registered index and drop the obsolete ones
+
+    Existing indexes are left as they are, so this is cheap once the
+    registry is built. A failing index is logged and does not stop the
+    others; losing the connection stops the build.
+
+    Args:
+        database: pymongo Database
+
+    Returns:
+        int: Number of indexes that could not be created
+    """
+    failed = 0
+    for name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                database[name].create_indexes([index])
+            except ConnectionFailure as e:
+                # Every other index would wait for the same server selection timeout
+                logger.error(f"Error building MongoDB indexes: {str(e)}")
+                return sum(len(models) for models in INDEXES.values())
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error creating index {index.document['name']} on {name}: {str(e)}")
+
+    # Only drop the indexes a registry index replaces once it exists
+    if not failed:
+        for name, index_names in OBSOLETE_INDEXES.items():
+            for index_name in index_names:
+                try:
+                    database[name].drop_index(index_name)
+                    logger.info(f"Dropped obsolete index {index_name} on {name}")
+                except OperationFailure:
+                    pass  # Already dropped
+                except Exception as e:
+                    logger.error(f"Error dropping index {index_name} on {name}: {str(e)}")
+
+    if failed:
+        logger.warning(f"{failed} MongoDB indexes could not be created")
+    else:
+        logger.info("MongoDB indexes are up to date")
+    return failed
+
+
+def start_index_build(database):
+    """
+    Build the registry on a daemon thread
+
+    Args:
+        database: pymongo Database
+
+    Returns:
+        threading.Thread: The started thread
+    """
+    thread = threading.Thread(target=build_indexes, args=(database,), name='index-build', daemon=True)
+    thread.start()
+    return thread
@@ -1,4 +1,6 @@
+from flask import current_app
 from app.extensions import mongo, bcrypt
+from app.db.indexes import build_indexes, start_index_build
 from app.utils.log import get_logger
 import uuid
 from datetime import datetime
@@ -11,18 +13,11 @@ def init_mongo_collections():
     Initialize MongoDB collections with indexes
     """
     try:
-        # Create indexes for auth collection
-        mongo.db.auth.create_index('user_id', unique=True)
-        mongo.db.auth.create_index('email', unique=True)
-        mongo.db.auth.create_index('username', unique=True)
-        
-        # Create indexes for profile collection
-        mongo.db.profile.create_index('user_id', unique=True)
-        
-        # Create indexes for prediction_history collection
-        mongo.db.prediction_history.create_index('prediction_id', unique=True)
-        mongo.db.prediction_history.create_index('user_id')  # Non-unique index for faster queries
-        mongo.db.prediction_history.create_index('timestamp')  # For sorting by date
+        # Indexes are declared in app.db.indexes
+        if current_app.config.get('INDEX_BUILD_BACKGROUND', True):
+            start_index_build(mongo.db)
+        else:
+            build_indexes(mongo.db)
         
         # Create demo user if in development mode
         if os.getenv('FLASK_ENV') == 'development':
@@ -38,6 +38,7 @@ def token_required(f):
             secret_key = os.getenv('SECRET_KEY', 'default_secret_key')
             payload = jwt.decode(token, secret_key, algorithms=['HS256'])
             g.user_id = payload['sub']  # Store user_id in Flask's g object
+            g.user_tier = payload.get('tier')  # Account tier, used by the image retention policy
             
         except jwt.ExpiredSignatureError:
             logger.warning("Token expired")
@@ -0,0 +1,505 @@
+"""
+Background deletion of a user's prediction history and account.
+
+Deleting a heavy user's history one ImageStorage.delete_image call at a
+time costs several round-trips per image. A deletion job instead works in
+batches of predictions, found through the prediction_history user_id index:
+
+1. the batch's image references are saved on the job document, then the
+   predictions are deleted with one delete_many;
+2. the references are released in bulk. GridFS files whose last references
+   belonged to the batch are deleted with one delete_many, their
+   derivatives with another, and their chunks with delete_many on
+   files_id $in. Files shared with predictions of later batches (a user's
+   images are deduplicated by content) only lose the batch's references;
+3. progress counters are updated on the job document.
+
+Once the history is gone, together with predictions the write-behind queue
+saved as dead letters, images the user uploaded that no prediction
+references any more are swept from fs.files and image_objects, and for
+account deletions the auth and profile documents are removed.
+
+Jobs live in the deletion_jobs collection and run on a background thread.
+A worker claims a job with a lease it renews after every batch, so a job
+interrupted by a restart is resumed by the next worker once the lease
+expires. The references of a batch interrupted between steps 1 and 3 are
+not released again on resume, so shared images can never lose a reference
+twice; images left over that way are deleted by the final sweep or by the
+orphan garbage collector (app/services/image_gc.py).
+"""
+import atexit
+import queue
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import ReturnDocument, UpdateOne
+from app.extensions import mongo
+from app.services.image_cache import get_image_cache
+from app.services.persistence import DEAD_LETTER_COLLECTION, dead_letter_refs
+from app.utils.generators import generate_uuid
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the runner is stored
+EXTENSION_KEY = 'deletion_jobs'
+
+# Job states; pending and running jobs are picked up by the background thread
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+UNFINISHED = [PENDING, RUNNING]
+
+# Job fields returned to clients
+JOB_FIELDS = ['job_id', 'user_id', 'delete_account', 'status', 'predictions_total', 'predictions_deleted',
+              'images_released', 'files_deleted', 'chunks_deleted', 'bytes_deleted', 'error',
+              'created_at', 'started_at', 'completed_at']
+
+
+def _image_refs(document):
+    """Return the image references of a history document, once per reference it holds"""
+    # image_path repeats image_paths[0] and holds no reference of its own
+    refs = document.get('image_paths') or [document.get('image_path')]
+    return [ref for ref in refs if ref]
+
+
+def _is_gridfs_ref(ref):
+    """Whether an image reference is a GridFS file ID (not disk:/s3: or a legacy path)"""
+    return ':' not in ref and '/' not in ref and ObjectId.is_valid(ref)
+
+
+class DeletionJobRunner:
+    """Creates and runs resumable deletion jobs for a user's data"""
+
+    def __init__(self, database=None, batch_size=500, lease_seconds=300, poll_interval=60, grace_seconds=3600):
+        """
+        Args:
+            database: Database holding the user's data (defaults to mongo.db)
+            batch_size: Predictions deleted per batch
+            lease_seconds: Seconds a claimed job stays locked without progress
+            poll_interval: Seconds between checks for jobs left by other workers
+            grace_seconds: Images re-referenced this recently are left to the garbage collector
+        """
+        self._database = database
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.grace_seconds = grace_seconds
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def create_job(self, user_id, delete_account=False):
+        """
+        Create a deletion job for a user, or return the user's unfinished one
+
+        Args:
+            user_id (str): User whose data is deleted
+            delete_account (bool): Also delete the user's auth and profile documents
+
+        Returns:
+            dict: The job document
+        """
+        jobs = self._get_database().deletion_jobs
+        existing = jobs.find_one({'user_id': user_id, 'status': {'$in': UNFINISHED}})
+        if existing:
+            if delete_account and not existing.get('delete_account'):
+                existing = jobs.find_one_and_update({'_id': existing['_id']}, {'$set': {'delete_account': True}},
+                                                    return_document=ReturnDocument.AFTER)
+            return existing
+
+        job = {
+            '_id': generate_uuid(),
+            'user_id': user_id,
+            'delete_account': delete_account,
+            'status': PENDING,
+            'predictions_total': self._get_database().prediction_history.count_documents({'user_id': user_id}),
+            'predictions_deleted': 0,
+            'images_released': 0,
+            'files_deleted': 0,
+            'chunks_deleted': 0,
+            'bytes_deleted': 0,
+            'created_at': datetime.utcnow()
+        }
+        jobs.insert_one(job)
+        logger.info(f"Created deletion job {job['_id']} for user {user_id}")
+        return job
+
+    def submit(self, user_id, delete_account=False):
+        """
+        Create a deletion job and run it in the background
+
+        Without a running background thread the job runs synchronously.
+
+        Args:
+            user_id (str): User whose data is deleted
+            delete_account (bool): Also delete the user's auth and profile documents
+
+        Returns:
+            dict: The job document, as returned by get_job
+        """
+        job = self.create_job(user_id, delete_account)
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(job['_id'])
+        else:
+            self.run_job(job['_id'])
+        return self.get_job(job['_id'])
+
+    def get_job(self, job_id):
+        """
+        Get the progress of a deletion job
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            dict: Job fields (see JOB_FIELDS), or None if not found
+        """
+        try:
+            job = self._get_database().deletion_jobs.find_one({'_id': job_id})
+        except Exception as e:
+            logger.error(f"Error retrieving deletion job: {str(e)}")
+            return None
+        if not job:
+            return None
+        job['job_id'] = job['_id']
+        return {key: job.get(key) for key in JOB_FIELDS}
+
+    def run_job(self, job_id):
+        """
+        Run a deletion job to completion, resuming where it stopped
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            bool: True if the job completed, False if it is held by another worker or failed
+        """
+        job = self._claim(job_id)
+        if job is None:
+            return False
+
+        try:
+            self._recover_interrupted_batch(job)
+            while self._delete_batch(job):
+                self._renew(job)
+            self._delete_dead_letters(job)
+            self._delete_unreferenced_images(job)
+            if job.get('delete_account'):
+                self._delete_account(job['user_id'])
+        except Exception as e:
+            logger.error(f"Deletion job {job_id} failed: {str(e)}")
+            self._update(job, {'$set': {'status': FAILED, 'error': str(e)}, '$unset': {'locked_until': ''}})
+            metrics.increment('deletion_jobs.failed')
+            return False
+
+        self._update(job, {'$set': {'status': COMPLETED, 'completed_at': datetime.utcnow()},
+                           '$unset': {'locked_until': '', 'error': ''}})
+        metrics.increment('deletion_jobs.completed')
+        logger.info(f"Deletion job {job_id} completed: {job['predictions_deleted']} predictions, "
+                    f"{job['files_deleted']} files, {job['chunks_deleted']} chunks")
+        return True
+
+    def _claim(self, job_id):
+        """Take the lease of an unfinished job, or return None if another worker holds it"""
+        now = datetime.utcnow()
+        return self._get_database().deletion_jobs.find_one_and_update(
+            {'_id': job_id, 'status': {'$in': UNFINISHED},
+             '$or': [{'locked_until': {'$lt': now}}, {'locked_until': {'$exists': False}}]},
+            {'$set': {'status': RUNNING, 'locked_until': now + timedelta(seconds=self.lease_seconds)},
+             '$min': {'started_at': now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _renew(self, job):
+        """Extend the lease of a job after a batch"""
+        self._update(job, {'$set': {'locked_until': datetime.utcnow() + timedelta(seconds=self.lease_seconds)}})
+
+    def _recover_interrupted_batch(self, job):
+        """
+        Finish a batch whose worker stopped after saving it
+
+        Its predictions are deleted again (idempotent), but its image
+        references are not released a second time.
+        """
+        pending = job.get('pending_predictions')
+        if not pending:
+            return
+        logger.warning(f"Deletion job {job['_id']} resumes an interrupted batch of {len(pending)} predictions, "
+                       f"its images are left to the orphan sweep")
+        self._get_database().prediction_history.delete_many({'_id': {'$in': pending}})
+        self._update(job, {'$unset': {'pending_predictions': ''},
+                           '$inc': {'predictions_deleted': len(pending)}})
+
+    def _delete_batch(self, job):
+        """
+        Delete one batch of the user's predictions and release their images
+
+        Returns:
+            bool: True if a batch was deleted, False when none are left
+        """
+        database = self._get_database()
+        documents = list(database.prediction_history.find(
+            {'user_id': job['user_id']}, {'_id': 1, 'image_path': 1, 'image_paths': 1}).limit(self.batch_size))
+        if not documents:
+            return False
+
+        prediction_ids = [document['_id'] for document in documents]
+        refs = [ref for document in documents for ref in _image_refs(document)]
+
+        self._update(job, {'$set': {'pending_predictions': prediction_ids}})
+        database.prediction_history.delete_many({'_id': {'$in': prediction_ids}})
+        report = self._release_images(refs)
+
+        self._update(job, {'$unset': {'pending_predictions': ''},
+                           '$inc': {'predictions_deleted': len(prediction_ids), 'images_released': len(refs),
+                                    'files_deleted': report['files'], 'chunks_deleted': report['chunks'],
+                                    'bytes_deleted': report['bytes']}})
+        metrics.increment('deletion_jobs.predictions_deleted', len(prediction_ids))
+        return True
+
+    def _release_images(self, refs):
+        """
+        Remove one reference per entry of refs, deleting images that lose their last one
+
+        Args:
+            refs: Image references, repeated once per referencing prediction
+
+        Returns:
+            dict: GridFS files, chunks and bytes deleted
+        """
+        from app.utils.storage import ImageStorage
+
+        report = {'files': 0, 'chunks': 0, 'bytes': 0}
+        counts = Counter(refs)
+        gridfs_counts = {ObjectId(ref): count for ref, count in counts.items() if _is_gridfs_ref(ref)}
+
+        files = self._get_database()['fs.files']
+        stored = set(document['_id'] for document in files.find(
+            {'_id': {'$in': list(gridfs_counts)}}, {'_id': 1})) if gridfs_counts else set()
+
+        # Group files by the number of references the batch holds (almost always 1)
+        groups = defaultdict(list)
+        for file_id in stored:
+            groups[gridfs_counts[file_id]].append(file_id)
+
+        deleted = {}
+        for count, file_ids in groups.items():
+            # Files with no references besides this batch's go first, in one delete
+            lengths = {document['_id']: document.get('length', 0) for document in files.find(
+                {'_id': {'$in': file_ids}}, {'length': 1})}
+            files.delete_many({'_id': {'$in': file_ids},
+                               '$or': [{'ref_count': {'$lte': count}}, {'ref_count': {'$exists': False}}]})
+            survivors = set(document['_id'] for document in files.find({'_id': {'$in': file_ids}}, {'_id': 1}))
+            deleted.update({file_id: lengths.get(file_id, 0) for file_id in file_ids if file_id not in survivors})
+
+            # Shared files only lose the batch's references
+            if survivors:
+                files.bulk_write([UpdateOne({'_id': file_id, 'ref_count': {'$gt': count}},
+                                            {'$inc': {'ref_count': -count}}) for file_id in survivors],
+                                 ordered=False)
+
+        if deleted:
+            self._add(report, self._delete_gridfs_files(list(deleted), deleted))
+            cache = get_image_cache()
+            if cache is not None:
+                for file_id in deleted:
+                    cache.invalidate(str(file_id))
+
+        # Archived GridFS images, disk/s3 objects and legacy files go through ImageStorage
+        for ref, count in counts.items():
+            if _is_gridfs_ref(ref) and ObjectId(ref) in stored:
+                continue
+            for _ in range(count):
+                ImageStorage.delete_image(ref)
+        return report
+
+    def _delete_gridfs_files(self, file_ids, lengths):
+        """
+        Delete the derivatives and chunks of deleted GridFS originals
+
+        Args:
+            file_ids: IDs of originals whose file documents were deleted
+            lengths: Dict mapping those IDs to their length in bytes
+
+        Returns:
+            dict: files, chunks and bytes deleted, originals included
+        """
+        database = self._get_database()
+        derivatives = {document['_id']: document.get('length', 0) for document in database['fs.files'].find(
+            {'parent_id': {'$in': file_ids}}, {'length': 1})}
+        if derivatives:
+            database['fs.files'].delete_many({'_id': {'$in': list(derivatives)}})
+
+        all_ids = list(file_ids) + list(derivatives)
+        chunks = 0
+        for offset in range(0, len(all_ids), self.batch_size):
+            chunks += database['fs.chunks'].delete_many(
+                {'files_id': {'$in': all_ids[offset:offset + self.batch_size]}}).deleted_count
+
+        return {'files': len(all_ids), 'chunks': chunks,
+                'bytes': sum(lengths.values()) + sum(derivatives.values())}
+
+    def _delete_dead_letters(self, job):
+        """
+        Delete the user's predictions saved as dead letters by the write-behind queue
+
+        A later replay would otherwise bring them back. Their images are left
+        unreferenced and go with the final sweep.
+        """
+        result = self._get_database()[DEAD_LETTER_COLLECTION].delete_many({'history.user_id': job['user_id']})
+        if result.deleted_count:
+            logger.info(f"Deletion job {job['_id']} deleted {result.deleted_count} dead-lettered predictions")
+
+    def _delete_unreferenced_images(self, job):
+        """
+        Delete images uploaded by the user that no prediction references any more
+
+        Images re-referenced within the grace period are skipped: an upload
+        still in flight may have deduplicated to them before its history
+        document was written.
+        """
+        from app.utils.storage_backends import get_backend_for_ref
+
+        database = self._get_database()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+        settled = {'referenced_at': {'$not': {'$gte': cutoff}}}
+        report = {'files': 0, 'chunks': 0, 'bytes': 0}
+
+        files = database['fs.files']
+        query = {'user_id': job['user_id'], 'variant': {'$exists': False}}
+        for batch in self._scan(files, query):
+            unreferenced = self._unreferenced([str(file_id) for file_id in batch])
+            candidates = [file_id for file_id in batch if str(file_id) in unreferenced]
+            if not candidates:
+                continue
+            lengths = {document['_id']: document.get('length', 0) for document in files.find(
+                dict(settled, _id={'$in': candidates}), {'length': 1})}
+            files.delete_many(dict(settled, _id={'$in': list(lengths)}))
+            survivors = set(document['_id'] for document in files.find({'_id': {'$in': list(lengths)}}, {'_id': 1}))
+            deleted = {file_id: length for file_id, length in lengths.items() if file_id not in survivors}
+            if deleted:
+                self._add(report, self._delete_gridfs_files(list(deleted), deleted))
+
+        for batch in self._scan(database.image_objects, {'user_id': job['user_id']}):
+            for ref in self._unreferenced(batch):
+                deleted = get_backend_for_ref(ref).purge(ref, settled)
+                if deleted:
+                    report['files'] += 1 + len(deleted.get('derivatives', {}))
+                    report['bytes'] += deleted.get('length', 0) + sum(
+                        derivative.get('length', 0) for derivative in deleted.get('derivatives', {}).values())
+
+        self._update(job, {'$inc': {'files_deleted': report['files'], 'chunks_deleted': report['chunks'],
+                                    'bytes_deleted': report['bytes']}})
+
+    def _delete_account(self, user_id):
+        """Delete the user's auth and profile documents"""
+        database = self._get_database()
+        database.auth.delete_one({'user_id': user_id})
+        database.profile.delete_one({'user_id': user_id})
+        logger.info(f"Deleted account of user {user_id}")
+
+    def _scan(self, collection, query):
+        """Yield the _id values matching a query in _id order, one batch at a time"""
+        last_id = None
+        while True:
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query['_id'] = {'$gt': last_id}
+            batch = [document['_id'] for document in
+                     collection.find(batch_query, {'_id': 1}).sort('_id', 1).limit(self.batch_size)]
+            if not batch:
+                return
+            last_id = batch[-1]
+            yield batch
+
+    def _unreferenced(self, refs):
+        """Return the refs no prediction_history document or dead letter references (indexed lookups)"""
+        database = self._get_database()
+        referenced = set()
+        for document in database.prediction_history.find(
+                {'$or': [{'image_path': {'$in': refs}}, {'image_paths': {'$in': refs}}]},
+                {'_id': 0, 'image_path': 1, 'image_paths': 1}):
+            referenced.update(_image_refs(document))
+        referenced |= dead_letter_refs(database, refs)
+        return [ref for ref in refs if ref not in referenced]
+
+    def _update(self, job, update):
+        """Apply an update to a job document and mirror its counters locally"""
+        self._get_database().deletion_jobs.update_one({'_id': job['_id']}, update)
+        for key, value in update.get('$inc', {}).items():
+            job[key] = job.get(key, 0) + value
+        job.update(update.get('$set', {}))
+        for key in update.get('$unset', {}):
+            job.pop(key, None)
+
+    @staticmethod
+    def _add(report, counts):
+        for key, value in counts.items():
+            report[key] += value
+
+    def start(self, app):
+        """
+        Run submitted jobs, and unfinished jobs left by stopped workers, in a daemon thread
+
+        Args:
+            app: Flask application (for the app context of each job)
+        """
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    job_ids = [self._queue.get(timeout=self.poll_interval)]
+                except queue.Empty:
+                    job_ids = None
+                with app.app_context():
+                    try:
+                        if job_ids is None:
+                            job_ids = [job['_id'] for job in self._get_database().deletion_jobs.find(
+                                {'status': {'$in': UNFINISHED}}, {'_id': 1})]
+                        for job_id in job_ids:
+                            self.run_job(job_id)
+                    except Exception as e:
+                        logger.error(f"Deletion job loop failed: {str(e)}")
+
+        self._thread = threading.Thread(target=loop, name='deletion-jobs', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after its current job"""
+        self._stop.set()
+
+    def _get_database(self):
+        """Return the database holding the user's data"""
+        if self._database is not None:
+            return self._database
+        return mongo.db
+
+
+def init_deletion_jobs(app):
+    """
+    Create the deletion job runner and start its thread if DELETION_JOBS_BACKGROUND is set
+
+    Args:
+        app: Flask application
+    """
+    runner = DeletionJobRunner(
+        batch_size=app.config.get('DELETION_BATCH_SIZE', 500),
+        lease_seconds=app.config.get('DELETION_LEASE_SECONDS', 300),
+        poll_interval=app.config.get('DELETION_POLL_INTERVAL', 60),
+        grace_seconds=app.config.get('IMAGE_GC_GRACE_SECONDS', 3600)
+    )
+    app.extensions[EXTENSION_KEY] = runner
+
+    if app.config.get('DELETION_JOBS_BACKGROUND', True):
+        runner.start(app)
+        atexit.register(runner.stop)
+    return runner
+
+
+def get_deletion_jobs():
+    """Return the current app's deletion job runner"""
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,168 @@
+"""
+In-process cache of hot stored images.
+
+Users open the same recent images over and over (detail, back, detail
+again), and each open is a storage round-trip. ImageStorage.open_image
+keeps small images of storage backend references in a per-worker LRU
+bounded by total bytes (IMAGE_MEMORY_CACHE_SIZE), so the streaming
+endpoint, the base64 and bulk image paths share one copy of each hot
+image. Images larger than IMAGE_MEMORY_CACHE_MAX_ITEM are always streamed
+from storage.
+
+Image references are content addressed, so cached bytes never go stale;
+entries are still dropped when their image is deleted so deleted images
+are not served from memory. Hits, misses, evictions and cached bytes are
+reported through app.utils.metrics.
+"""
+import threading
+from io import BytesIO
+from flask import current_app, has_app_context
+from app.utils.cache import ByteLRUCache
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the cache is stored
+EXTENSION_KEY = 'image_cache'
+
+# Image fields kept with the cached bytes
+CACHED_FIELDS = ('content_type', 'etag', 'last_modified')
+
+
+def _hit_ratio():
+    """Fraction of image opens answered from memory"""
+    hits = metrics.get_counter('image_cache.hits')
+    total = hits + metrics.get_counter('image_cache.misses')
+    return hits / total if total else 0.0
+
+metrics.register_gauge('image_cache.hit_ratio', _hit_ratio)
+
+
+class ImageCache:
+    """Byte-bounded LRU of stored images and their derivatives"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_item_bytes=2 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Maximum total size of the cached images
+            max_item_bytes: Images larger than this are not cached
+        """
+        self._entries = ByteLRUCache(max_bytes, max_item_bytes, on_evict=self._forget)
+        # Variants cached per reference, so a delete drops the derivatives too
+        self._variants = {}
+        self._lock = threading.Lock()
+
+        metrics.register_gauge('image_cache.bytes', self._entries.size_bytes)
+        metrics.register_gauge('image_cache.entries', self._entries.__len__)
+
+    @property
+    def max_item_bytes(self):
+        return self._entries.max_item_bytes
+
+    def open(self, ref, variant=None):
+        """
+        Open a cached image
+
+        Args:
+            ref: Image reference
+            variant: Name of a derivative, None for the original
+
+        Returns:
+            dict: Same fields as ImageStorage.open_image with an in-memory
+                  stream, or None on a miss
+        """
+        entry = self._entries.get((ref, variant))
+        if entry is None:
+            metrics.increment('image_cache.misses')
+            return None
+        metrics.increment('image_cache.hits')
+        return self._as_image(entry)
+
+    def add(self, ref, variant, image):
+        """
+        Read an opened image into the cache
+
+        Args:
+            ref: Image reference
+            variant: Name of a derivative, None for the original
+            image: Dict returned by a backend's open, its stream is consumed and closed
+
+        Returns:
+            dict: The image with an in-memory stream in place of the consumed one
+        """
+        try:
+            data = image['stream'].read()
+        finally:
+            image['stream'].close()
+
+        entry = {key: image.get(key) for key in CACHED_FIELDS}
+        entry['data'] = data
+
+        with self._lock:
+            self._variants.setdefault(ref, set()).add(variant)
+        evicted = self._entries.set((ref, variant), entry, len(data))
+        if evicted > 0:
+            metrics.increment('image_cache.evictions', evicted)
+        elif evicted < 0:
+            self._forget((ref, variant))
+        return self._as_image(entry)
+
+    def invalidate(self, ref):
+        """Drop an image and all its cached derivatives"""
+        with self._lock:
+            variants = self._variants.pop(ref, ())
+        for variant in variants:
+            self._entries.delete((ref, variant))
+
+    def clear(self):
+        """Drop every cached image"""
+        with self._lock:
+            self._variants.clear()
+        self._entries.clear()
+
+    def _forget(self, key):
+        """Remove an evicted entry from the variant index"""
+        ref, variant = key
+        with self._lock:
+            variants = self._variants.get(ref)
+            if variants is not None:
+                variants.discard(variant)
+                if not variants:
+                    del self._variants[ref]
+
+    @staticmethod
+    def _as_image(entry):
+        """Build an open_image result over cached bytes"""
+        image = {key: entry[key] for key in CACHED_FIELDS}
+        image['stream'] = BytesIO(entry['data'])
+        image['length'] = len(entry['data'])
+        return image
+
+
+def init_image_cache(app):
+    """
+    Create the image cache if IMAGE_MEMORY_CACHE_SIZE is set
+
+    Args:
+        app: Flask application
+    """
+    max_bytes = app.config.get('IMAGE_MEMORY_CACHE_SIZE', 0)
+    if max_bytes <= 0:
+        logger.info("Image memory cache disabled")
+        return None
+
+    image_cache = ImageCache(
+        max_bytes=max_bytes,
+        max_item_bytes=app.config.get('IMAGE_MEMORY_CACHE_MAX_ITEM', 2 * 1024 * 1024)
+    )
+    app.extensions[EXTENSION_KEY] = image_cache
+    logger.info(f"Image memory cache enabled ({max_bytes // (1024 * 1024)} MB per worker)")
+    return image_cache
+
+
+def get_image_cache():
+    """Return the current app's image cache, or None when disabled or outside an app"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,418 @@
+"""
+Image expiry and orphan garbage collection.
+
+Two jobs keep stored images bounded:
+
+- expiry: history documents carry image_expires_at, set at /predict from
+  the user's tier (IMAGE_EXPIRY_DAYS). Expired images are deleted (shared
+  images only lose a reference); the prediction stays in the history
+  without its image_path and with image_expired_at.
+- orphans: images no prediction_history document references, left behind
+  by failed writes, interrupted deletes or history removed by hand.
+  fs.files is scanned in _id order, one batch at a time, and each batch is
+  set-differenced against the image_path / image_paths indexes of
+  prediction_history. Derivatives whose original is gone, chunks whose
+  file is gone and disk/s3 image documents are collected the same way.
+
+Images uploaded or re-referenced within the grace period are never
+collected: write-behind persistence writes images before their history
+document, and a deduplicated upload references an existing file before its
+history is written. Deletes are rate limited so a large backlog does not
+saturate MongoDB, and every run reports the bytes it reclaimed.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from pymongo.errors import DuplicateKeyError
+from app.extensions import mongo
+from app.services.persistence import dead_letter_refs
+from app.utils.generators import get_current_timestamp
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the collector is stored
+EXTENSION_KEY = 'image_gc'
+
+# Lock document in job_locks so only one worker process collects at a time
+LOCK_ID = 'image_gc'
+
+
+def _image_refs(document):
+    """Return the image references of a history document, once per reference it holds"""
+    # image_path repeats image_paths[0]; an image uploaded twice holds two references
+    refs = document.get('image_paths') or [document.get('image_path')]
+    return [ref for ref in refs if ref]
+
+
+class ImageGarbageCollector:
+    """Expires images and deletes images no prediction references"""
+
+    def __init__(self, database=None, batch_size=500, grace_seconds=3600, max_deletes_per_second=200,
+                 sleep=time.sleep):
+        """
+        Args:
+            database: Database to collect (defaults to mongo.db)
+            batch_size: Documents scanned per query
+            grace_seconds: Images uploaded or referenced more recently are kept
+            max_deletes_per_second: Files deleted per second (0 for no limit)
+            sleep: Function used to wait between deletes (replaceable in tests)
+        """
+        self._database = database
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+        self.max_deletes_per_second = max_deletes_per_second
+        self._sleep = sleep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self, dry_run=False):
+        """
+        Expire images, then collect orphans
+
+        Args:
+            dry_run: If True, only report what would be deleted
+
+        Returns:
+            dict: Counts of expired images and deleted files, chunks and
+                  objects, and the bytes reclaimed by orphan collection
+        """
+        start = time.monotonic()
+        report = {'expired_images': self.expire_images(dry_run=dry_run)}
+        report.update(self.collect_orphans(dry_run=dry_run))
+        report['duration_seconds'] = round(time.monotonic() - start, 3)
+
+        if not dry_run:
+            metrics.increment('image_gc.runs')
+        logger.info(f"Image GC {'dry run' if dry_run else 'run'}: {report}")
+        return report
+
+    def expire_images(self, now=None, dry_run=False):
+        """
+        Delete the images of history documents past their image_expires_at
+
+        Args:
+            now: ISO timestamp to compare expiry against (defaults to now)
+            dry_run: If True, only count the expired predictions
+
+        Returns:
+            int: Number of predictions whose images expired
+        """
+        from app.utils.storage import ImageStorage
+
+        history = self._get_database().prediction_history
+        now = now or get_current_timestamp()
+        query = {'image_expires_at': {'$lte': now}}
+        if dry_run:
+            return history.count_documents(query)
+
+        expired = 0
+        while True:
+            documents = list(history.find(query, {'image_path': 1, 'image_paths': 1}).limit(self.batch_size))
+            if not documents:
+                break
+
+            for document in documents:
+                for ref in _image_refs(document):
+                    self._throttle(1)
+                    ImageStorage.delete_image(ref)
+
+            # Unsetting image_expires_at also takes the documents out of the query
+            history.update_many(
+                {'_id': {'$in': [document['_id'] for document in documents]}},
+                {'$unset': {'image_path': '', 'image_paths': '', 'image_expires_at': ''},
+                 '$set': {'image_expired_at': now}}
+            )
+            expired += len(documents)
+
+        if expired:
+            metrics.increment('image_gc.expired_images', expired)
+            logger.info(f"Expired the images of {expired} predictions")
+        return expired
+
+    def collect_orphans(self, dry_run=False):
+        """
+        Delete images no prediction_history document references
+
+        Args:
+            dry_run: If True, only report what would be deleted
+
+        Returns:
+            dict: files, chunks and objects deleted and reclaimed_bytes
+        """
+        report = {'files': 0, 'chunks': 0, 'objects': 0, 'reclaimed_bytes': 0}
+        for collect in (self._collect_gridfs_originals, self._collect_gridfs_derivatives,
+                        self._collect_gridfs_chunks, self._collect_objects):
+            try:
+                for key, value in collect(dry_run).items():
+                    report[key] += value
+            except Exception as e:
+                logger.error(f"Image GC step {collect.__name__} failed: {str(e)}")
+
+        if not dry_run:
+            metrics.increment('image_gc.deleted_files', report['files'] + report['objects'])
+            metrics.increment('image_gc.reclaimed_bytes', report['reclaimed_bytes'])
+        return report
+
+    def _collect_gridfs_originals(self, dry_run):
+        """Delete GridFS originals (and their derivatives) without a referencing prediction"""
+        files = self._get_database()['fs.files']
+        report = {'files': 0, 'chunks': 0, 'reclaimed_bytes': 0}
+
+        for batch in self._scan(files, {'variant': {'$exists': False}}, {'_id': 1}):
+            refs = [str(document['_id']) for document in batch]
+            unreferenced = set(refs) - self._referenced(refs)
+            orphan_ids = [document['_id'] for document in batch if str(document['_id']) in unreferenced]
+            if orphan_ids:
+                self._add(report, self._delete_files(orphan_ids, dry_run, with_derivatives=True))
+        return report
+
+    def _collect_gridfs_derivatives(self, dry_run):
+        """Delete GridFS derivatives whose original no longer exists"""
+        files = self._get_database()['fs.files']
+        report = {'files': 0, 'chunks': 0, 'reclaimed_bytes': 0}
+
+        for batch in self._scan(files, {'variant': {'$exists': True}}, {'_id': 1, 'parent_id': 1}):
+            parent_ids = list(set(document['parent_id'] for document in batch))
+            parents = set(document['_id'] for document in files.find({'_id': {'$in': parent_ids}}, {'_id': 1}))
+            orphan_ids = [document['_id'] for document in batch if document['parent_id'] not in parents]
+            if orphan_ids:
+                self._add(report, self._delete_files(orphan_ids, dry_run))
+        return report
+
+    def _collect_gridfs_chunks(self, dry_run):
+        """Delete GridFS chunks whose file document no longer exists"""
+        database = self._get_database()
+        chunks = database['fs.chunks']
+        report = {'files': 0, 'chunks': 0, 'reclaimed_bytes': 0}
+
+        # Chunk 0 of every file, walked along the (files_id, n) index
+        last_id = None
+        while True:
+            query = {'n': 0}
+            if last_id is not None:
+                query['files_id'] = {'$gt': last_id}
+            batch = list(chunks.find(query, {'files_id': 1}).sort('files_id', 1).limit(self.batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]['files_id']
+
+            # Chunks are written before their file document, so young chunks are kept
+            cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+            files_ids = [chunk['files_id'] for chunk in batch if chunk['_id'].generation_time.replace(tzinfo=None) < cutoff]
+            existing = set(document['_id'] for document in database['fs.files'].find(
+                {'_id': {'$in': files_ids}}, {'_id': 1}))
+            orphan_ids = [files_id for files_id in files_ids if files_id not in existing]
+            if not orphan_ids:
+                continue
+
+            query = {'files_id': {'$in': orphan_ids}}
+            sizes = list(chunks.aggregate([
+                {'$match': query},
+                {'$group': {'_id': None, 'chunks': {'$sum': 1}, 'bytes': {'$sum': {'$binarySize': '$data'}}}}
+            ]))
+            if not sizes:
+                continue
+            if not dry_run:
+                self._throttle(len(orphan_ids))
+                chunks.delete_many(query)
+            report['chunks'] += sizes[0]['chunks']
+            report['reclaimed_bytes'] += sizes[0]['bytes']
+        return report
+
+    def _collect_objects(self, dry_run):
+        """Delete disk/s3 images without a referencing prediction"""
+        from app.utils.storage_backends import get_backend_for_ref
+
+        collection = self._get_database().image_objects
+        report = {'objects': 0, 'reclaimed_bytes': 0}
+
+        projection = {'_id': 1, 'length': 1, 'derivatives': 1}
+        for batch in self._scan(collection, {}, projection):
+            refs = [document['_id'] for document in batch]
+            unreferenced = set(refs) - self._referenced(refs)
+            for document in batch:
+                if document['_id'] not in unreferenced:
+                    continue
+
+                if dry_run:
+                    if collection.find_one(dict(self._settled('upload_date'), _id=document['_id']), {'_id': 1}):
+                        report['objects'] += 1
+                        report['reclaimed_bytes'] += self._object_bytes(document)
+                    continue
+
+                self._throttle(1)
+                try:
+                    deleted = get_backend_for_ref(document['_id']).purge(document['_id'], self._settled('upload_date'))
+                except Exception as e:
+                    logger.error(f"Failed to delete orphaned image {document['_id']}: {str(e)}")
+                    continue
+                if deleted:
+                    report['objects'] += 1
+                    report['reclaimed_bytes'] += self._object_bytes(deleted)
+        return report
+
+    def _delete_files(self, file_ids, dry_run, with_derivatives=False):
+        """
+        Delete GridFS files and their chunks in bulk
+
+        Files are deleted with the grace condition re-checked, so a file
+        referenced again since the scan is kept; chunks are only deleted
+        for files that are really gone.
+
+        Returns:
+            dict: files, chunks and reclaimed_bytes
+        """
+        database = self._get_database()
+        files = database['fs.files']
+        query = dict(self._settled('uploadDate'), _id={'$in': file_ids})
+
+        candidates = {document['_id']: document.get('length', 0) for document in files.find(query, {'length': 1})}
+        if not candidates:
+            return {'files': 0, 'chunks': 0, 'reclaimed_bytes': 0}
+
+        if dry_run:
+            deleted = set(candidates)
+        else:
+            self._throttle(len(candidates))
+            files.delete_many(query)
+            survivors = set(document['_id'] for document in files.find(
+                {'_id': {'$in': list(candidates)}}, {'_id': 1}))
+            deleted = set(candidates) - survivors
+
+        lengths = {file_id: candidates[file_id] for file_id in deleted}
+        if with_derivatives and deleted:
+            derivatives = {document['_id']: document.get('length', 0) for document in files.find(
+                {'parent_id': {'$in': list(deleted)}}, {'length': 1})}
+            if derivatives and not dry_run:
+                self._throttle(len(derivatives))
+                files.delete_many({'_id': {'$in': list(derivatives)}})
+            lengths.update(derivatives)
+
+        chunks = 0
+        if lengths:
+            chunk_query = {'files_id': {'$in': list(lengths)}}
+            if dry_run:
+                chunks = database['fs.chunks'].count_documents(chunk_query)
+            else:
+                chunks = database['fs.chunks'].delete_many(chunk_query).deleted_count
+
+        return {'files': len(lengths), 'chunks': chunks, 'reclaimed_bytes': sum(lengths.values())}
+
+    def _scan(self, collection, query, projection):
+        """Yield the documents matching a query in _id order, one batch at a time"""
+        last_id = None
+        while True:
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query['_id'] = {'$gt': last_id}
+            batch = list(collection.find(batch_query, projection).sort('_id', 1).limit(self.batch_size))
+            if not batch:
+                return
+            last_id = batch[-1]['_id']
+            yield batch
+
+    def _referenced(self, refs):
+        """Return the refs referenced by a prediction_history document or a dead letter (indexed lookups)"""
+        database = self._get_database()
+        referenced = set()
+        for document in database.prediction_history.find(
+                {'$or': [{'image_path': {'$in': refs}}, {'image_paths': {'$in': refs}}]},
+                {'_id': 0, 'image_path': 1, 'image_paths': 1}):
+            referenced.update(_image_refs(document))
+        return referenced | dead_letter_refs(database, refs)
+
+    def _settled(self, upload_field):
+        """Query for images neither uploaded nor referenced within the grace period"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+        return {upload_field: {'$lt': cutoff}, 'referenced_at': {'$not': {'$gte': cutoff}}}
+
+    def _throttle(self, deletes):
+        """Sleep long enough to keep deletes under max_deletes_per_second"""
+        if self.max_deletes_per_second and deletes:
+            self._sleep(deletes / float(self.max_deletes_per_second))
+
+    @staticmethod
+    def _object_bytes(document):
+        """Bytes of an image document's object and derivatives"""
+        return document.get('length', 0) + sum(
+            derivative.get('length', 0) for derivative in document.get('derivatives', {}).values())
+
+    @staticmethod
+    def _add(report, counts):
+        for key, value in counts.items():
+            report[key] += value
+
+    def start(self, app, interval):
+        """
+        Run the collector every `interval` seconds in a daemon thread
+
+        Args:
+            app: Flask application (for the app context of each run)
+            interval: Seconds between runs
+        """
+        def loop():
+            while not self._stop.wait(interval):
+                with app.app_context():
+                    try:
+                        if self._acquire_lock(interval):
+                            self.run()
+                    except Exception as e:
+                        logger.error(f"Image GC run failed: {str(e)}")
+
+        self._thread = threading.Thread(target=loop, name='image-gc', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after its current run"""
+        self._stop.set()
+
+    def _acquire_lock(self, interval):
+        """Take the run lease so only one of several worker processes collects per interval"""
+        now = datetime.utcnow()
+        try:
+            # Matches a free or expired lease; a held lease makes the upsert collide on _id
+            self._get_database().job_locks.find_one_and_update(
+                {'_id': LOCK_ID, '$or': [{'locked_until': {'$lt': now}}, {'locked_until': {'$exists': False}}]},
+                {'$set': {'locked_until': now + timedelta(seconds=interval)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _get_database(self):
+        """Return the database to collect"""
+        if self._database is not None:
+            return self._database
+        return mongo.db
+
+
+def init_image_gc(app):
+    """
+    Create the image garbage collector and start it if IMAGE_GC_INTERVAL is set
+
+    Args:
+        app: Flask application
+    """
+    collector = ImageGarbageCollector(
+        batch_size=app.config.get('IMAGE_GC_BATCH_SIZE', 500),
+        grace_seconds=app.config.get('IMAGE_GC_GRACE_SECONDS', 3600),
+        max_deletes_per_second=app.config.get('IMAGE_GC_MAX_DELETES_PER_SECOND', 200)
+    )
+    app.extensions[EXTENSION_KEY] = collector
+
+    interval = app.config.get('IMAGE_GC_INTERVAL', 0)
+    if interval > 0:
+        collector.start(app, interval)
+        atexit.register(collector.stop)
+        logger.info(f"Image GC runs every {interval} seconds")
+    return collector
+
+
+def get_image_gc():
+    """Return the current app's image garbage collector"""
+    return current_app.extensions.get(EXTENSION_KEY)
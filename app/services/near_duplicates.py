@@ -0,0 +1,165 @@
+"""
+Per-user index of perceptual hashes for near-duplicate detection.
+
+Each user's most recent hashes are kept in NumPy ring buffers of packed
+64-bit integers, so a lookup is one vectorised XOR and popcount over the
+whole buffer (well under a millisecond for tens of thousands of hashes).
+Buffers start small and double as a user adds hashes, up to the per-user
+maximum, so the many users with a handful of predictions cost a few KB each.
+The index is per worker process and is not persisted; it only needs to
+cover recent predictions, which is where re-shot photos come from.
+"""
+import threading
+import numpy as np
+from flask import current_app, has_app_context
+from app.utils.cache import LRUCache
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the index is stored
+EXTENSION_KEY = 'near_duplicate_index'
+
+# What to do when a near-duplicate is found
+NEAR_DUPLICATE_ACTIONS = ('off', 'flag', 'reuse')
+
+# Entries allocated for a new user, doubled each time the buffers fill up
+INITIAL_HASHES_PER_USER = 64
+
+
+class _UserHashes:
+    """Ring buffer of one user's recent hashes and the predictions they belong to"""
+
+    def __init__(self, capacity):
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.class_ids = np.zeros(capacity, dtype=np.int32)
+        self.confidences = np.zeros(capacity, dtype=np.float32)
+        self.prediction_ids = [None] * capacity
+        self.size = 0
+        self.next = 0
+
+    def grow(self, capacity):
+        """Enlarge full buffers that have not wrapped around yet, keeping their entries"""
+        extra = capacity - len(self.hashes)
+        self.hashes = np.concatenate([self.hashes, np.zeros(extra, dtype=np.uint64)])
+        self.class_ids = np.concatenate([self.class_ids, np.zeros(extra, dtype=np.int32)])
+        self.confidences = np.concatenate([self.confidences, np.zeros(extra, dtype=np.float32)])
+        self.prediction_ids.extend([None] * extra)
+        self.next = self.size
+
+
+class NearDuplicateIndex:
+    """Hamming-distance lookup over each user's recent perceptual hashes"""
+
+    def __init__(self, max_hashes_per_user=50000, max_users=1000):
+        """
+        Args:
+            max_hashes_per_user: Hashes kept per user, the oldest are overwritten
+                                 (buffers grow up to this size as the user adds hashes)
+            max_users: Users kept in memory, the least recently active are dropped
+        """
+        self._capacity = max_hashes_per_user
+        self._users = LRUCache(max_users)
+        self._lock = threading.Lock()
+
+    def add(self, user_id, perceptual_hash, prediction_id, class_id, confidence):
+        """
+        Record the hash of a prediction
+
+        Args:
+            user_id: Owner of the prediction
+            perceptual_hash: 64-bit hash as an int
+            prediction_id: ID of the prediction
+            class_id: Predicted class index
+            confidence: Confidence of the predicted class
+        """
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = _UserHashes(min(INITIAL_HASHES_PER_USER, self._capacity))
+                self._users.set(user_id, user)
+            elif user.size == len(user.hashes) < self._capacity:
+                user.grow(min(2 * len(user.hashes), self._capacity))
+
+            slot = user.next
+            user.hashes[slot] = perceptual_hash
+            user.class_ids[slot] = class_id
+            user.confidences[slot] = confidence
+            user.prediction_ids[slot] = prediction_id
+            user.next = (slot + 1) % len(user.hashes)
+            user.size = min(user.size + 1, len(user.hashes))
+
+    def find(self, user_id, perceptual_hash, max_distance):
+        """
+        Find the user's closest earlier prediction within a Hamming distance
+
+        Args:
+            user_id: Owner of the predictions searched
+            perceptual_hash: 64-bit hash as an int
+            max_distance: Maximum number of differing bits
+
+        Returns:
+            dict: prediction_id, distance, class_id and confidence of the closest
+                  match (the most recent one on ties), or None
+        """
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or user.size == 0:
+                return None
+
+            distances = np.bitwise_count(user.hashes[:user.size] ^ np.uint64(perceptual_hash))
+
+            # Search from the newest entry backwards so ties resolve to the most recent
+            order = (user.next - 1 - np.arange(user.size)) % user.size
+            best = order[np.argmin(distances[order])]
+            distance = int(distances[best])
+            if distance > max_distance:
+                return None
+
+            return {
+                'prediction_id': user.prediction_ids[best],
+                'distance': distance,
+                'class_id': int(user.class_ids[best]),
+                'confidence': float(user.confidences[best])
+            }
+
+
+def init_near_duplicates(app):
+    """
+    Create the near-duplicate index unless disabled in the app config
+
+    Args:
+        app: Flask application
+    """
+    action = app.config.get('NEAR_DUPLICATE_ACTION', 'flag')
+    if action not in NEAR_DUPLICATE_ACTIONS:
+        logger.error(f"Unknown NEAR_DUPLICATE_ACTION '{action}', near-duplicate detection disabled")
+        return None
+    if action == 'off':
+        logger.info("Near-duplicate detection disabled")
+        return None
+
+    index = NearDuplicateIndex(
+        max_hashes_per_user=app.config.get('NEAR_DUPLICATE_MAX_HASHES', 50000),
+        max_users=app.config.get('NEAR_DUPLICATE_MAX_USERS', 1000)
+    )
+    app.extensions[EXTENSION_KEY] = index
+    logger.info(f"Near-duplicate detection enabled (action: {action})")
+    return index
+
+
+def get_near_duplicate_config():
+    """
+    Return the near-duplicate index and settings of the current app
+
+    Returns:
+        dict: 'index' (None when disabled or outside an app), 'action' and 'max_distance'
+    """
+    if not has_app_context():
+        return {'index': None, 'action': 'off', 'max_distance': 0}
+    return {
+        'index': current_app.extensions.get(EXTENSION_KEY),
+        'action': current_app.config.get('NEAR_DUPLICATE_ACTION', 'flag'),
+        'max_distance': current_app.config.get('NEAR_DUPLICATE_DISTANCE', 8)
+    }
+
@@ -0,0 +1,415 @@
+"""
+Write-behind persistence for prediction images and history.
+
+/predict hands the encoded images and the history document to a bounded
+queue and responds immediately; worker threads drain the queue in batches,
+writing the images of a batch (each distinct image once) and then all
+history documents with one insert_many. When the queue is full the request
+thread writes synchronously instead, which applies backpressure to
+producers. Queued writes are flushed when the process shuts down.
+
+The response has already been sent when a batch is written, so a failed
+write is retried with a growing delay; images already stored are not
+written again, as that would add their references twice. The synchronous
+write of a full queue is not retried, so MongoDB failures do not add retry
+delays to requests. A batch that still fails is saved to the
+persistence_dead_letters collection, and replay_dead_letters (run by
+scripts/replay_dead_letters.py) writes it once MongoDB is healthy again.
+Until then its images count as referenced for the image GC and deletion
+jobs (dead_letter_refs).
+Write-behind is off by default (PERSISTENCE_WRITE_BEHIND).
+"""
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from pymongo.errors import BulkWriteError
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the queue is stored
+EXTENSION_KEY = 'persistence_queue'
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+# Collection holding the predictions of batches that could not be written
+DEAD_LETTER_COLLECTION = 'persistence_dead_letters'
+
+
+def _write_images(prepared_images):
+    """Default image writer: bulk write to GridFS"""
+    from app.utils.storage import ImageStorage
+    ImageStorage.store_prepared_images(prepared_images)
+
+
+def _write_history(documents):
+    """Default history writer: insert_many into prediction_history"""
+    from app.api.prediction.models import PredictionHistory
+    from app.utils.storage_backends import DUPLICATE_KEY_ERROR
+    try:
+        PredictionHistory.save_predictions(documents)
+    except BulkWriteError as e:
+        # Documents inserted by an earlier attempt of a retried batch are already saved
+        if any(error.get('code') != DUPLICATE_KEY_ERROR for error in e.details.get('writeErrors', [])):
+            raise
+
+
+def _write_dead_letters(letters):
+    """Default dead-letter writer: insert_many into the dead-letter collection"""
+    from app.extensions import mongo
+    mongo.db[DEAD_LETTER_COLLECTION].insert_many(letters)
+
+
+class PersistenceQueue:
+    """Bounded queue of pending prediction writes drained by worker threads"""
+
+    def __init__(self, max_size=1000, workers=2, batch_size=50, enqueue_timeout=0.05, retries=3,
+                 retry_delay=0.5, write_images=_write_images, write_history=_write_history,
+                 write_dead_letters=_write_dead_letters):
+        """
+        Args:
+            max_size: Maximum number of pending predictions
+            workers: Number of worker threads
+            batch_size: Maximum predictions written per batch
+            enqueue_timeout: Seconds to wait for queue space before writing synchronously
+            retries: Attempts after the first before a batch goes to the dead-letter collection
+            retry_delay: Seconds before the first retry, doubled for each further one
+            write_images: Callable writing a list of prepared images
+            write_history: Callable writing a list of history documents
+            write_dead_letters: Callable saving a list of dead letters
+        """
+        self._queue = queue.Queue(maxsize=max_size)
+        self._num_workers = workers
+        self._batch_size = batch_size
+        self._enqueue_timeout = enqueue_timeout
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._write_images = write_images
+        self._write_history = write_history
+        self._write_dead_letters = write_dead_letters
+        self._threads = []
+        self._app = None
+        self._lock = threading.Lock()
+        self._running = False
+
+        metrics.register_gauge('persistence.queue_depth', self._queue.qsize)
+
+    def start(self, app=None):
+        """
+        Start the worker threads
+
+        Args:
+            app: Flask application whose context workers run in
+        """
+        with self._lock:
+            if self._running:
+                return
+            self._app = app
+            self._running = True
+            for index in range(self._num_workers):
+                thread = threading.Thread(target=self._worker, name=f"persistence-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Write-behind persistence started with {self._num_workers} workers")
+
+    def submit(self, history_document, prepared_images=None):
+        """
+        Queue a prediction's images and history document for writing
+
+        Args:
+            history_document: Prediction document (already prepared)
+            prepared_images: Images from ImageStorage.prepare_prediction_image
+
+        Returns:
+            bool: True if queued, False if it was written synchronously because
+                  the queue was full or the workers are not running
+        """
+        item = {
+            'history': history_document,
+            'images': list(prepared_images or []),
+            'enqueued_at': time.monotonic()
+        }
+
+        if self._running:
+            try:
+                self._queue.put(item, timeout=self._enqueue_timeout)
+                metrics.increment('persistence.enqueued')
+                return True
+            except queue.Full:
+                metrics.increment('persistence.backpressure')
+                logger.warning("Persistence queue full, writing synchronously")
+                # On the request thread: a failure goes to the dead letters without retry delays
+                self._write_batch([item], retries=0)
+                return False
+
+        self._write_batch([item])
+        return False
+
+    def depth(self):
+        """Number of predictions waiting to be written"""
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued prediction has been written
+
+        Args:
+            timeout: Maximum seconds to wait (None waits forever)
+
+        Returns:
+            bool: True if the queue drained in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=30.0):
+        """
+        Flush pending writes and stop the worker threads
+
+        Args:
+            timeout: Maximum seconds to wait for the flush
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            threads, self._threads = self._threads, []
+
+        pending = self._queue.qsize()
+        if pending:
+            logger.info(f"Flushing {pending} queued prediction writes")
+
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+        # Anything left (e.g. workers timed out) is written here
+        leftovers = self._drain_nowait(self._queue.qsize())
+        if leftovers:
+            self._write_batch(leftovers)
+        logger.info("Write-behind persistence stopped")
+
+    def _drain_nowait(self, limit):
+        """Take up to `limit` queued items without blocking"""
+        items = []
+        while len(items) < limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if item is not _STOP:
+                items.append(item)
+        return items
+
+    def _worker(self):
+        """Worker loop: take a batch from the queue and write it"""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop_after_batch = False
+            while len(batch) < self._batch_size:
+                try:
+                    next_item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if next_item is _STOP:
+                    self._queue.task_done()
+                    stop_after_batch = True
+                    break
+                batch.append(next_item)
+
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop_after_batch:
+                return
+
+    def _write_batch(self, batch, retries=None):
+        """
+        Write the images, then the history documents, of a batch
+
+        Failed writes are retried; a batch that still fails is saved as dead letters.
+
+        Args:
+            batch: Queued items
+            retries: Attempts after the first (defaults to the queue's retries)
+        """
+        start = time.monotonic()
+        retries = self._retries if retries is None else retries
+        documents = [item['history'] for item in batch]
+
+        # Copies of an image are written together; an image leaves pending once
+        # stored, as writing it again would add its references again
+        pending = {}
+        for item in batch:
+            for image in item['images']:
+                pending.setdefault(image['_id'], []).append(image)
+
+        for attempt in range(retries + 1):
+            if attempt:
+                metrics.increment('persistence.retried', len(batch))
+                time.sleep(self._retry_delay * 2 ** (attempt - 1))
+            try:
+                for image_id in list(pending):
+                    self._call(self._write_images, pending[image_id])
+                    del pending[image_id]
+                if documents:
+                    self._call(self._write_history, documents)
+                metrics.increment('persistence.written', len(batch))
+                break
+            except Exception as e:
+                error = e
+                logger.warning(f"Failed to persist batch of {len(batch)} predictions "
+                               f"(attempt {attempt + 1} of {retries + 1}): {str(e)}")
+        else:
+            self._dead_letter(batch, pending, error)
+
+        now = time.monotonic()
+        metrics.observe('persistence.batch_ms', (now - start) * 1000.0)
+        for item in batch:
+            metrics.observe('persistence.lag_ms', (now - item['enqueued_at']) * 1000.0)
+
+    def _dead_letter(self, batch, pending, error):
+        """
+        Save the predictions of a batch that could not be written, for replay_dead_letters
+
+        Args:
+            batch: Queued items
+            pending: Dict of the image IDs not stored yet
+            error: Last write error
+        """
+        failed_at = datetime.utcnow()
+        letters = [{
+            'history': item['history'],
+            'images': [image for image in item['images'] if image['_id'] in pending],
+            'error': str(error),
+            'failed_at': failed_at
+        } for item in batch]
+        try:
+            self._call(self._write_dead_letters, letters)
+            metrics.increment('persistence.dead_lettered', len(batch))
+            logger.error(f"Failed to persist batch of {len(batch)} predictions, saved to "
+                         f"{DEAD_LETTER_COLLECTION}: {str(error)}")
+        except Exception as e:
+            metrics.increment('persistence.failed', len(batch))
+            prediction_ids = [item['history'].get('prediction_id') for item in batch]
+            logger.error(f"Failed to persist batch of {len(batch)} predictions {prediction_ids}: {str(error)}; "
+                         f"saving them to {DEAD_LETTER_COLLECTION} failed too: {str(e)}")
+
+    def _call(self, write, items):
+        """Run a writer in the app context the queue was started with"""
+        if self._app is not None:
+            with self._app.app_context():
+                write(items)
+        else:
+            write(items)
+
+
+def replay_dead_letters(write_images=_write_images, write_history=_write_history):
+    """
+    Write the predictions saved as dead letters, removing each once written
+
+    Must run in an app context.
+
+    Args:
+        write_images: Callable writing a list of prepared images
+        write_history: Callable writing a list of history documents
+
+    Returns:
+        tuple: (predictions written, predictions still failing)
+    """
+    from app.extensions import mongo
+    collection = mongo.db[DEAD_LETTER_COLLECTION]
+
+    written = 0
+    failed = 0
+    for letter in collection.find().sort('failed_at', 1):
+        try:
+            for image_id in dict.fromkeys(image['_id'] for image in letter['images']):
+                write_images([image for image in letter['images'] if image['_id'] == image_id])
+                # Do not add the image's references again if a later write fails
+                collection.update_one({'_id': letter['_id']}, {'$pull': {'images': {'_id': image_id}}})
+            write_history([letter['history']])
+        except Exception as e:
+            failed += 1
+            logger.error(f"Failed to replay prediction {letter['history'].get('prediction_id')}: {str(e)}")
+            continue
+        collection.delete_one({'_id': letter['_id']})
+        written += 1
+
+    metrics.increment('persistence.replayed', written)
+    logger.info(f"Replayed {written} dead-lettered predictions, {failed} still failing")
+    return written, failed
+
+
+def dead_letter_refs(database, refs):
+    """
+    Return the image references held by dead-lettered history documents
+
+    Images of a batch are written before its history, so a dead letter can
+    be the only thing referencing a stored image until it is replayed.
+
+    Args:
+        database: pymongo Database
+        refs: Image references to look up
+
+    Returns:
+        set: The refs a dead letter references
+    """
+    referenced = set()
+    for letter in database[DEAD_LETTER_COLLECTION].find(
+            {'$or': [{'history.image_path': {'$in': refs}}, {'history.image_paths': {'$in': refs}}]},
+            {'_id': 0, 'history.image_path': 1, 'history.image_paths': 1}):
+        history = letter.get('history', {})
+        referenced.update([history.get('image_path')] + list(history.get('image_paths') or []))
+    return referenced & set(refs)
+
+
+def init_persistence(app):
+    """
+    Create and start the write-behind queue if enabled in the app config
+
+    Args:
+        app: Flask application
+    """
+    if not app.config.get('PERSISTENCE_WRITE_BEHIND', False):
+        logger.info("Write-behind persistence disabled, predictions are written synchronously")
+        return None
+
+    persistence_queue = PersistenceQueue(
+        max_size=app.config.get('PERSISTENCE_QUEUE_SIZE', 1000),
+        workers=app.config.get('PERSISTENCE_WORKERS', 2),
+        batch_size=app.config.get('PERSISTENCE_BATCH_SIZE', 50),
+        enqueue_timeout=app.config.get('PERSISTENCE_ENQUEUE_TIMEOUT', 0.05),
+        retries=app.config.get('PERSISTENCE_RETRIES', 3),
+        retry_delay=app.config.get('PERSISTENCE_RETRY_DELAY', 0.5)
+    )
+    persistence_queue.start(app)
+    app.extensions[EXTENSION_KEY] = persistence_queue
+
+    # Flush queued writes on graceful shutdown
+    atexit.register(persistence_queue.stop)
+    return persistence_queue
+
+
+def get_persistence_queue():
+    """Return the current app's write-behind queue, or None when disabled"""
+    return current_app.extensions.get(EXTENSION_KEY)
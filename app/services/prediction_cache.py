@@ -0,0 +1,183 @@
+"""
+Two-level cache of prediction results.
+
+Results are keyed by the hash of the uploaded bytes together with the model
+version and the preprocessing configuration. Lookups go to an in-process LRU
+first and then to the `prediction_cache` MongoDB collection, which is shared
+by every worker and node and expires entries through a TTL index. Concurrent
+identical requests in a worker are coalesced so only one of them runs
+inference; the others wait for its result, and compute their own when that
+result is not cacheable.
+"""
+import copy
+import time
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from app.extensions import mongo
+from app.utils.cache import LRUCache, SingleFlight
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the cache is stored
+EXTENSION_KEY = 'prediction_cache'
+
+# Per-request fields that are never cached
+UNCACHED_FIELDS = ('user_id', 'prediction_id', 'timestamp', 'timings_ms', 'cache', 'near_duplicate')
+
+
+def _hit_ratio():
+    """Fraction of cache lookups answered without running inference"""
+    hits = sum(metrics.get_counter(f'prediction_cache.hits.{level}') for level in ('memory', 'mongo', 'coalesced'))
+    total = hits + metrics.get_counter('prediction_cache.misses')
+    return hits / total if total else 0.0
+
+metrics.register_gauge('prediction_cache.hit_ratio', _hit_ratio)
+
+
+class PredictionCache:
+    """In-process LRU in front of a shared MongoDB collection with a TTL index"""
+
+    def __init__(self, max_entries=1024, ttl=86400, collection=None):
+        """
+        Args:
+            max_entries: Maximum number of results kept in process memory
+            ttl: Seconds a cached result stays valid
+            collection: Collection for the shared level (defaults to mongo.db.prediction_cache)
+        """
+        self._memory = LRUCache(max_entries)
+        self._ttl = ttl
+        self._collection = collection
+        self._flight = SingleFlight()
+
+        metrics.register_gauge('prediction_cache.memory_entries', self._memory.__len__)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached result for key, computing and storing it on a miss
+
+        Args:
+            key: Cache key (see app.utils.cache.make_cache_key)
+            compute: Callable returning the prediction dict
+
+        Returns:
+            tuple: (prediction dict owned by the caller, source) where source is
+                   'memory', 'mongo', 'coalesced' or 'computed'
+        """
+        start = time.perf_counter()
+        entry, level = self._lookup(key)
+        if entry is not None:
+            self._record_hit(level, entry, start)
+            return copy.deepcopy(entry['result']), level
+
+        (entry, result), shared = self._flight.do(key, lambda: self._compute_and_store(key, compute))
+        if shared:
+            if entry is not None:
+                self._record_hit('coalesced', entry, start)
+                return copy.deepcopy(entry['result']), 'coalesced'
+            # The leader's result was not cacheable (an error or a result reused
+            # from the leader's own near-duplicate photo), so it is not shared
+            result = compute()
+
+        metrics.increment('prediction_cache.misses')
+        return result, 'computed'
+
+    def clear(self):
+        """Drop the in-process level (the shared level expires on its own)"""
+        self._memory.clear()
+
+    def _lookup(self, key):
+        """Look a key up in memory, then in MongoDB (promoting hits to memory)"""
+        now = datetime.utcnow()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry['expires_at'] > now:
+                return entry, 'memory'
+            self._memory.delete(key)
+
+        try:
+            # The TTL monitor only runs periodically, so filter expired entries here too
+            entry = self._get_collection().find_one({'_id': key, 'expires_at': {'$gt': now}})
+        except Exception as e:
+            logger.error(f"Prediction cache lookup failed: {str(e)}")
+            return None, None
+
+        if entry is None:
+            return None, None
+
+        self._memory.set(key, entry)
+        return entry, 'mongo'
+
+    def _compute_and_store(self, key, compute):
+        """
+        Run the prediction and store successful results in both levels
+
+        Returns:
+            tuple: (cache entry or None if the result was not cached, result as returned by compute)
+        """
+        start = time.perf_counter()
+        result = compute()
+        compute_ms = (time.perf_counter() - start) * 1000.0
+
+        # Failed predictions and results reused from a user's near-duplicate
+        # photo are returned but never cached
+        if 'error' in result or 'near_duplicate' in result:
+            return None, result
+
+        now = datetime.utcnow()
+        entry = {
+            '_id': key,
+            'result': copy.deepcopy({k: v for k, v in result.items() if k not in UNCACHED_FIELDS}),
+            'compute_ms': round(compute_ms, 3),
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=self._ttl)
+        }
+
+        self._memory.set(key, entry)
+        try:
+            self._get_collection().replace_one({'_id': key}, entry, upsert=True)
+        except Exception as e:
+            logger.error(f"Prediction cache store failed: {str(e)}")
+
+        return entry, result
+
+    def _record_hit(self, level, entry, start):
+        """Count a hit and the inference time it saved"""
+        lookup_ms = (time.perf_counter() - start) * 1000.0
+        metrics.increment(f'prediction_cache.hits.{level}')
+        metrics.observe('prediction_cache.saved_ms', max(0.0, entry.get('compute_ms', 0.0) - lookup_ms))
+
+    def _get_collection(self):
+        """Return the shared cache collection"""
+        if self._collection is not None:
+            return self._collection
+        return mongo.db.prediction_cache
+
+
+def init_prediction_cache(app):
+    """
+    Create the prediction cache if enabled in the app config
+
+    Args:
+        app: Flask application
+    """
+    if not app.config.get('PREDICTION_CACHE_ENABLED', False):
+        logger.info("Prediction cache disabled")
+        return None
+
+    prediction_cache = PredictionCache(
+        max_entries=app.config.get('PREDICTION_CACHE_SIZE', 1024),
+        ttl=app.config.get('PREDICTION_CACHE_TTL', 86400)
+    )
+    app.extensions[EXTENSION_KEY] = prediction_cache
+    logger.info("Prediction cache enabled")
+    return prediction_cache
+
+
+def get_prediction_cache():
+    """Return the current app's prediction cache, or None when disabled or outside an app"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,185 @@
+"""
+Image retention policy.
+
+Decides per prediction whether its image is stored in full ('original'),
+as a thumbnail only ('thumbnail') or not at all ('none'). Rules are checked
+in order and the first one whose conditions all match decides; predictions
+matching no rule get the default. A rule is a dict of optional conditions
+and the decision under 'store':
+
+    {"max_confidence": 0.6, "store": "original"}           low-confidence predictions
+    {"flagged": true, "store": "original"}                 flagged by the user for review
+    {"classes": ["Tomato___Late_blight"], "store": "original"}
+    {"tiers": ["pro"], "store": "original"}                user tier from the auth token
+    {"sample_rate": 0.05, "store": "original"}             5% sample for retraining
+    {"store": "thumbnail"}                                 everything else
+
+Sampling is derived from the prediction ID, so a prediction always gets the
+same decision.
+
+Stored images can also expire per user tier (IMAGE_EXPIRY_DAYS, e.g.
+"default:90,pro:365,enterprise:0" where 0 keeps images forever). The expiry
+is recorded on the history document as image_expires_at and enforced by
+the image garbage collector (app/services/image_gc.py).
+"""
+import json
+import hashlib
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Key under app.extensions where the policy is stored
+EXTENSION_KEY = 'retention_policy'
+
+# What can be stored for a prediction's image
+RETENTION_DECISIONS = ('original', 'thumbnail', 'none')
+
+# Conditions a rule may set
+RULE_CONDITIONS = ('min_confidence', 'max_confidence', 'classes', 'tiers', 'flagged', 'sample_rate')
+
+
+# Expiry entry for users without a tier (or a tier with no entry)
+DEFAULT_TIER = 'default'
+
+
+def parse_expiry_days(spec):
+    """
+    Parse an image expiry spec like "default:90,pro:365,enterprise:0"
+
+    Args:
+        spec: Comma separated tier:days entries, 0 days never expires
+
+    Returns:
+        dict: Days per tier
+
+    Raises:
+        ValueError: If an entry is malformed or negative
+    """
+    expiry_days = {}
+    for entry in filter(None, (item.strip() for item in (spec or '').split(','))):
+        tier, _, days = entry.partition(':')
+        try:
+            expiry_days[tier.strip()] = int(days)
+        except ValueError:
+            raise ValueError(f"Invalid image expiry entry '{entry}', expected tier:days")
+        if expiry_days[tier.strip()] < 0:
+            raise ValueError(f"Invalid image expiry entry '{entry}', days must not be negative")
+    return expiry_days
+
+
+def sample_fraction(prediction_id):
+    """Map a prediction ID to a stable fraction in [0, 1)"""
+    digest = hashlib.sha256(str(prediction_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2.0 ** 64
+
+
+class RetentionPolicy:
+    """Ordered retention rules with a default decision"""
+
+    def __init__(self, rules=None, default='original', expiry_days=None):
+        """
+        Args:
+            rules: List of rule dicts (see module docstring)
+            default: Decision for predictions matching no rule
+            expiry_days: Days stored images are kept per tier (0 or missing keeps them)
+
+        Raises:
+            ValueError: If a rule or the default is invalid
+        """
+        if default not in RETENTION_DECISIONS:
+            raise ValueError(f"Invalid default retention '{default}', expected one of {RETENTION_DECISIONS}")
+
+        self.rules = list(rules or [])
+        self.default = default
+        self.expiry_days = dict(expiry_days or {})
+        for index, rule in enumerate(self.rules):
+            if not isinstance(rule, dict) or rule.get('store') not in RETENTION_DECISIONS:
+                raise ValueError(f"Retention rule {index} must set 'store' to one of {RETENTION_DECISIONS}")
+            unknown = set(rule) - set(RULE_CONDITIONS) - {'store'}
+            if unknown:
+                raise ValueError(f"Retention rule {index} has unknown conditions: {', '.join(sorted(unknown))}")
+
+    def decide(self, prediction, tier=None, flagged=False):
+        """
+        Decide what to store for a prediction's image
+
+        Args:
+            prediction: Prediction result with prediction_id, class_name and confidence
+            tier: Tier of the user who made the prediction
+            flagged: Whether the user flagged the prediction for review
+
+        Returns:
+            dict: 'store' (one of RETENTION_DECISIONS) and 'rule' (index of the
+                  matching rule, or 'default')
+        """
+        for index, rule in enumerate(self.rules):
+            if self._matches(rule, prediction, tier, flagged):
+                return {'store': rule['store'], 'rule': index}
+        return {'store': self.default, 'rule': 'default'}
+
+    def expires_at(self, tier=None, now=None):
+        """
+        Return when an image stored now for a user of a tier expires
+
+        Args:
+            tier: Tier of the user who made the prediction
+            now: Storage time (defaults to now)
+
+        Returns:
+            str: ISO timestamp, in the format of prediction timestamps, or None if it never expires
+        """
+        days = self.expiry_days.get(tier, self.expiry_days.get(DEFAULT_TIER, 0))
+        if not days:
+            return None
+        return ((now or datetime.now()) + timedelta(days=days)).isoformat()
+
+    def _matches(self, rule, prediction, tier, flagged):
+        """Check whether every condition of a rule holds"""
+        confidence = prediction.get('confidence', 0.0)
+        if 'min_confidence' in rule and confidence < rule['min_confidence']:
+            return False
+        if 'max_confidence' in rule and confidence > rule['max_confidence']:
+            return False
+        if 'classes' in rule and prediction.get('class_name') not in rule['classes']:
+            return False
+        if 'tiers' in rule and tier not in rule['tiers']:
+            return False
+        if 'flagged' in rule and bool(flagged) != bool(rule['flagged']):
+            return False
+        if 'sample_rate' in rule and sample_fraction(prediction.get('prediction_id')) >= rule['sample_rate']:
+            return False
+        return True
+
+
+def init_retention_policy(app):
+    """
+    Create the retention policy from the app config
+
+    Invalid rules are logged and replaced by the default decision for every
+    prediction, so a configuration mistake never drops images.
+
+    Args:
+        app: Flask application
+    """
+    rules = app.config.get('IMAGE_RETENTION_RULES') or '[]'
+    default = app.config.get('IMAGE_RETENTION_DEFAULT', 'original')
+    try:
+        policy = RetentionPolicy(json.loads(rules) if isinstance(rules, str) else rules, default,
+                                 parse_expiry_days(app.config.get('IMAGE_EXPIRY_DAYS', '')))
+    except ValueError as e:
+        logger.error(f"Invalid image retention policy, storing every image: {str(e)}")
+        policy = RetentionPolicy()
+
+    app.extensions[EXTENSION_KEY] = policy
+    logger.info(f"Image retention policy: {len(policy.rules)} rules, default '{policy.default}', "
+                f"expiry {policy.expiry_days or 'never'}")
+    return policy
+
+
+def get_retention_policy():
+    """Return the current app's retention policy (store everything outside an app)"""
+    if not has_app_context():
+        return RetentionPolicy()
+    return current_app.extensions.get(EXTENSION_KEY) or RetentionPolicy()
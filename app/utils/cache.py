@@ -0,0 +1,207 @@
+"""
+In-process caching primitives.
+
+LRUCache is a thread-safe, size-bounded least recently used map,
+ByteLRUCache is the same bounded by the total size of its values instead of
+their number, and SingleFlight coalesces concurrent calls for the same key
+so that only one of them does the work while the others wait for its result.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def make_cache_key(parts):
+    """
+    Build a stable cache key from JSON-serialisable parts
+
+    Args:
+        parts: Dict of values identifying the cached computation
+
+    Returns:
+        str: Hex SHA-256 of the canonical JSON encoding
+    """
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe least recently used cache with a maximum number of entries"""
+
+    def __init__(self, max_size=1024):
+        """
+        Args:
+            max_size: Maximum number of entries kept
+        """
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it as recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove an entry if present"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class ByteLRUCache:
+    """Thread-safe least recently used cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes, max_item_bytes=None, on_evict=None):
+        """
+        Args:
+            max_bytes: Maximum total size of the values kept
+            max_item_bytes: Values larger than this are not cached (defaults to max_bytes)
+            on_evict: Callable receiving the key of every entry evicted to make room
+        """
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes if max_item_bytes is None else min(max_item_bytes, max_bytes)
+        self._on_evict = on_evict
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it as recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def set(self, key, value, size):
+        """
+        Store a value, evicting least recently used entries until it fits
+
+        Args:
+            key: Cache key
+            value: Value to store
+            size: Size of the value in bytes
+
+        Returns:
+            int: Number of entries evicted, or -1 if the value is too large to cache
+        """
+        if size > self.max_item_bytes or self.max_bytes <= 0:
+            return -1
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                evicted.append(evicted_key)
+
+        if self._on_evict:
+            for evicted_key in evicted:
+                self._on_evict(evicted_key)
+        return len(evicted)
+
+    def delete(self, key):
+        """Remove an entry if present"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def size_bytes(self):
+        """Return the total size of the cached values"""
+        with self._lock:
+            return self._bytes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class _Call:
+    """A computation in progress, shared by every caller of the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function once per key for all concurrent callers"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Call function, or wait for the call already running for key
+
+        Args:
+            key: Identifies the computation
+            function: Callable without arguments
+
+        Returns:
+            tuple: (result, shared) where shared is True if the result was
+                   computed by another caller
+
+        Raises:
+            Exception: Whatever function raised, re-raised in every waiting caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
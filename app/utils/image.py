@@ -1,7 +1,6 @@
+import hashlib
 import numpy as np
-import io
 from PIL import Image
-import tensorflow as tf
 from app.utils.log import get_logger
 
 logger = get_logger(__name__)
@@ -9,36 +8,175 @@ logger = get_logger(__name__)
 def prep_image(image_file, target_size=(224, 224)):
     """
     Preprocess image for model prediction
-    
+
+    The image is decoded straight from the upload stream (which may be a
+    spooled temporary file) so no extra full-size copy of the encoded bytes
+    is made. JPEG uploads are decoded at a reduced scale when they are much
+    larger than the target size, and images already at the target size are
+    not resized at all.
+
     Args:
         image_file: Image file object from request.files
         target_size: Target dimensions (height, width) for resizing
-        
+
     Returns:
         Preprocessed image ready for model inference
     """
     try:
-        # Read image from file
-        image_bytes = image_file.read()
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB (in case of grayscale or RGBA)
-        image = image.convert("RGB")
-        
-        # Resize to target size
-        image = image.resize(target_size)
-        
-        # Convert to numpy array and normalize
-        img_array = tf.keras.preprocessing.image.img_to_array(image)
-        img_array = img_array / 255.0  # Normalize to [0,1]
-        
-        # Expand dimensions to create batch of size 1
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        return img_array
-    
+        image = decode_image(image_file, target_size)
+        image = resize_image(image, target_size)
+        return normalize_image(image)
+
     except Exception as e:
         logger.error(f"Error preprocessing image: {str(e)}")
         raise ValueError(f"Failed to process image: {str(e)}")
-    
-    return img_array
\ No newline at end of file
+
+def decode_image(image_file, target_size=(224, 224)):
+    """
+    Decode an image file into an RGB PIL image
+
+    Args:
+        image_file: Image file object positioned anywhere in the stream
+        target_size: Size (height, width) the image will be resized to, used to
+                     let the JPEG decoder downscale while decoding
+
+    Returns:
+        PIL.Image.Image: Decoded RGB image
+    """
+    # Decode image directly from the file stream
+    image_file.seek(0)
+    image = Image.open(image_file)
+
+    # Let the JPEG decoder downscale while decoding (no-op for other formats)
+    image.draft("RGB", (target_size[1], target_size[0]))
+
+    # Convert to RGB (in case of grayscale or RGBA)
+    return image.convert("RGB")
+
+def resize_image(image, target_size=(224, 224)):
+    """
+    Resize a decoded image to the model input size
+
+    Args:
+        image: PIL image
+        target_size: Target dimensions (height, width)
+
+    Returns:
+        PIL.Image.Image: Image of the target size (the same object if no resize was needed)
+    """
+    # PIL sizes are (width, height)
+    pil_size = (target_size[1], target_size[0])
+
+    # Resize to target size unless the client already did
+    if image.size != pil_size:
+        image = image.resize(pil_size)
+    return image
+
+def normalize_image(pixels):
+    """
+    Convert RGB pixels into a normalized batch of one
+
+    Args:
+        pixels: PIL image or uint8 array of shape (height, width, 3)
+
+    Returns:
+        numpy.ndarray: float32 array of shape (1, height, width, 3) scaled to [0, 1]
+    """
+    # Convert to numpy array and normalize in place
+    img_array = np.asarray(pixels, dtype=np.float32)
+    img_array /= 255.0  # Normalize to [0,1]
+
+    # Expand dimensions to create batch of size 1
+    return np.expand_dims(img_array, axis=0)
+
+def parse_shape(shape):
+    """
+    Parse a declared tensor shape
+
+    Args:
+        shape: Shape as a string ("224,224,3" or "224x224x3") or a sequence of ints
+
+    Returns:
+        tuple: Shape as a tuple of ints
+    """
+    if isinstance(shape, str):
+        shape = shape.lower().replace('x', ',').split(',')
+    try:
+        return tuple(int(dim) for dim in shape)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid shape: {shape}")
+
+def decode_tensor(tensor_file, shape, checksum, expected_shape=(224, 224, 3)):
+    """
+    Decode a raw uint8 RGB buffer uploaded by a client that already resized the image
+
+    Args:
+        tensor_file: File object containing height*width*3 raw uint8 bytes (row-major, RGB)
+        shape: Declared shape of the buffer
+        checksum: Hex encoded SHA-256 digest of the raw bytes, optionally prefixed with "sha256:"
+        expected_shape: Shape the model expects as (height, width, channels)
+
+    Returns:
+        numpy.ndarray: uint8 array of shape expected_shape
+
+    Raises:
+        ValueError: If the shape, size or checksum do not match
+    """
+    declared_shape = parse_shape(shape)
+    expected_shape = tuple(expected_shape)
+    if declared_shape != expected_shape:
+        raise ValueError(f"Declared shape {declared_shape} does not match model input shape {expected_shape}")
+
+    if not checksum:
+        raise ValueError("Missing checksum for tensor upload")
+
+    expected_size = int(np.prod(expected_shape))
+    tensor_file.seek(0)
+    data = tensor_file.read(expected_size + 1)
+    if len(data) != expected_size:
+        raise ValueError(f"Tensor upload has {len(data)} bytes, expected {expected_size}")
+
+    checksum = checksum.strip().lower()
+    if checksum.startswith('sha256:'):
+        checksum = checksum[len('sha256:'):]
+
+    digest = hashlib.sha256(data).hexdigest()
+    if digest != checksum:
+        raise ValueError("Tensor checksum mismatch")
+
+    return np.frombuffer(data, dtype=np.uint8).reshape(expected_shape)
+
+def _bin_means(values, bins, axis):
+    """Average a 2D array over `bins` roughly equal ranges along an axis"""
+    edges = np.linspace(0, values.shape[axis], bins + 1).astype(np.intp)
+    sums = np.add.reduceat(values, edges[:-1], axis=axis)
+    counts = np.diff(edges).reshape((-1, 1) if axis == 0 else (1, -1))
+    return sums / counts
+
+def perceptual_hash(image, hash_size=8):
+    """
+    Compute a difference hash (dHash) of a decoded image
+
+    The image is reduced to (hash_size, hash_size + 1) gray cells by area
+    averaging and each bit records whether a cell is brighter than its left
+    neighbour, so small shifts, re-compression and lighting changes flip
+    only a few bits.
+
+    Args:
+        image: Array of shape (height, width, 3) or (1, height, width, 3), e.g.
+               the normalized model input, so no extra decode or resize is needed
+        hash_size: Bits per row and number of rows (8 gives a 64-bit hash)
+
+    Returns:
+        int: Hash with hash_size * hash_size bits
+    """
+    pixels = np.asarray(image, dtype=np.float32)
+    if pixels.ndim == 4:
+        pixels = pixels[0]
+
+    # ITU-R 601 luma
+    gray = pixels[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    cells = _bin_means(_bin_means(gray, hash_size, axis=0), hash_size + 1, axis=1)
+
+    bits = (cells[:, 1:] > cells[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
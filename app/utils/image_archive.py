@@ -0,0 +1,393 @@
+"""
+Cold archive for old GridFS images.
+
+Images older than IMAGE_ARCHIVE_AFTER_DAYS are rarely viewed but keep
+their chunks in the primary database. The archive job
+(scripts/archive_images.py) appends them, with their derivatives, to large
+pack files on local disk or in S3. It records the pack, offset and length
+of every image in the `image_archive` collection, and only then deletes
+the GridFS copies.
+
+GridFS references stay valid. GridFSBackend falls back to the archive for
+files no longer in GridFS, and reads an archived image with one seek
+(disk) or one ranged GET (s3) into its pack.
+
+Packs are written once and never modified. Images are stored verbatim:
+JPEG, WebP and AVIF do not compress further, and compressing a pack as a
+whole would rule out seeking into it. A JSON sidecar next to each pack
+lists its entries, so the index can be rebuilt from the packs alone.
+Deleting an archived image removes its index entry; its bytes stay in the
+pack.
+"""
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO
+from gridfs import GridFSBucket
+from flask import current_app, has_app_context
+from app.extensions import mongo
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+from app.utils.storage_backends import insert_ignoring_duplicates
+
+logger = get_logger(__name__)
+
+# Pack size at which a new pack is started
+PACK_SIZE = 256 * 1024 * 1024
+
+# Age after which images are archived
+ARCHIVE_AFTER_DAYS = 90
+
+# File document fields kept in the archive index
+ARCHIVED_FIELDS = ('filename', 'content_hash', 'prediction_id', 'user_id', 'timestamp')
+
+
+class LocalPackStore:
+    """Pack files in a local (or mounted) directory"""
+
+    name = 'disk'
+
+    def __init__(self, root):
+        """
+        Args:
+            root: Directory holding the pack files
+        """
+        self.root = root
+
+    def path_for(self, pack_id):
+        """Return the path of a pack file"""
+        return os.path.join(self.root, f"{pack_id}.pack")
+
+    def write(self, pack_id, source_path, entries):
+        """
+        Move a finished pack into the store, with its entry sidecar
+
+        Args:
+            pack_id: Pack name
+            source_path: Path of the finished pack file
+            entries: Entries of the pack, written as the JSON sidecar
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, f"{pack_id}.json"), 'w') as sidecar:
+            json.dump(entries, sidecar, default=str)
+        shutil.move(source_path, self.path_for(pack_id))
+
+    def read(self, pack_id, offset, length):
+        """Read `length` bytes at `offset` of a pack, or None if the pack is missing"""
+        try:
+            with open(self.path_for(pack_id), 'rb') as pack:
+                pack.seek(offset)
+                return pack.read(length)
+        except FileNotFoundError:
+            return None
+
+
+class S3PackStore:
+    """Pack files in an S3-compatible bucket (requires the optional boto3 package)"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='archive/', endpoint_url=None, client=None):
+        """
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix for pack files
+            endpoint_url: S3 API endpoint (None for AWS)
+            client: Existing boto3 S3 client (created from the environment if None)
+        """
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The s3 image archive requires boto3 (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def write(self, pack_id, source_path, entries):
+        self.client.upload_fileobj(BytesIO(json.dumps(entries, default=str).encode('utf-8')),
+                                   self.bucket, f"{self.prefix}{pack_id}.json",
+                                   ExtraArgs={'ContentType': 'application/json'})
+        # upload_fileobj switches to multipart uploads for large packs
+        with open(source_path, 'rb') as pack:
+            self.client.upload_fileobj(pack, self.bucket, f"{self.prefix}{pack_id}.pack",
+                                       ExtraArgs={'ContentType': 'application/octet-stream'})
+        os.remove(source_path)
+
+    def read(self, pack_id, offset, length):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{pack_id}.pack",
+                                              Range=f"bytes={offset}-{offset + length - 1}")
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+
+class _PackWriter:
+    """Appends images to a pack file being built in a temporary directory"""
+
+    def __init__(self, staging_dir=None):
+        self.pack_id = f"{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        if staging_dir:
+            os.makedirs(staging_dir, exist_ok=True)
+        handle, self.path = tempfile.mkstemp(suffix='.tmp', dir=staging_dir)
+        self._file = os.fdopen(handle, 'wb')
+        self.size = 0
+
+    def append(self, data):
+        """Append bytes and return their (offset, length)"""
+        offset = self.size
+        self._file.write(data)
+        self.size += len(data)
+        return offset, len(data)
+
+    def close(self):
+        """Flush the pack to disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def discard(self):
+        """Remove an unused pack"""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ImageArchive:
+    """Index of archived images and the pack store holding their bytes"""
+
+    def __init__(self, store, database=None):
+        """
+        Args:
+            store: LocalPackStore or S3PackStore
+            database: Database holding GridFS and image_archive (defaults to mongo.db)
+        """
+        self.store = store
+        self._database = database
+
+    def open(self, ref, variant=None):
+        """
+        Open an archived image (see StorageBackend.open)
+
+        Args:
+            ref: GridFS file ID the image had before it was archived
+            variant: Name of a derivative; the original is returned when None or missing
+
+        Returns:
+            dict: 'stream', 'length', 'content_type', 'etag' and 'last_modified', or None if not archived
+        """
+        document = self._get_collection().find_one({'_id': ref})
+        if document is None:
+            return None
+
+        entry = document.get('derivatives', {}).get(variant) if variant else None
+        entry = entry or document
+        data = self.store.read(document['pack'], entry['offset'], entry['length'])
+        if data is None:
+            logger.error(f"Pack {document['pack']} of archived image {ref} is missing")
+            return None
+
+        metrics.increment('image_archive.reads')
+        return {
+            'stream': BytesIO(data),
+            'length': entry['length'],
+            'content_type': entry.get('content_type') or 'image/jpeg',
+            # Archived bytes are those of the immutable GridFS file
+            'etag': ref if entry is document else f"{ref}.{variant}",
+            'last_modified': document.get('upload_date')
+        }
+
+    def get_metadata(self, ref):
+        """Return the index document of an archived image, or None"""
+        return self._get_collection().find_one({'_id': ref})
+
+    def delete(self, ref):
+        """
+        Remove a reference to an archived image, and its index entry with the last one
+
+        Returns:
+            bool: True if the image was archived
+        """
+        collection = self._get_collection()
+        if collection.find_one_and_update({'_id': ref, 'ref_count': {'$gt': 1}}, {'$inc': {'ref_count': -1}}):
+            logger.info(f"Removed a reference to archived image {ref}")
+            return True
+        if collection.delete_one({'_id': ref}).deleted_count:
+            logger.info(f"Archived image removed from the index with ID {ref}")
+            return True
+        return False
+
+    def archive(self, older_than_days=ARCHIVE_AFTER_DAYS, pack_size=PACK_SIZE, batch_size=100, limit=None,
+                dry_run=False):
+        """
+        Move GridFS originals older than a cutoff, with their derivatives, into packs
+
+        For each pack: the pack is written to the store, then its index
+        entries are inserted, and only then are the GridFS copies deleted.
+        A file whose references changed while it was packed stays in GridFS.
+
+        Args:
+            older_than_days: Archive images uploaded more than this many days ago
+            pack_size: Start a new pack once a pack reaches this many bytes
+            batch_size: GridFS files read per query
+            limit: Stop after this many originals (None for all)
+            dry_run: If True, only report what would be archived
+
+        Returns:
+            dict: Originals archived, packs written and bytes moved out of MongoDB
+        """
+        database = self._get_database()
+        files = database['fs.files']
+        bucket = GridFSBucket(database)
+        started_at = datetime.utcnow()
+        cutoff = started_at - timedelta(days=older_than_days)
+
+        report = {'images': 0, 'packs': 0, 'bytes': 0}
+        writer = None
+        pending = []
+        last_id = None
+        while limit is None or report['images'] < limit:
+            query = {'variant': {'$exists': False}, 'uploadDate': {'$lt': cutoff}}
+            if last_id is not None:
+                query['_id'] = {'$gt': last_id}
+            originals = list(files.find(query).sort('_id', 1).limit(batch_size))
+            if not originals:
+                break
+            last_id = originals[-1]['_id']
+            if limit is not None:
+                originals = originals[:limit - report['images']]
+
+            derivatives = {}
+            for derivative in files.find({'parent_id': {'$in': [original['_id'] for original in originals]}}):
+                derivatives.setdefault(derivative['parent_id'], []).append(derivative)
+
+            for original in originals:
+                report['images'] += 1
+                report['bytes'] += original['length'] + sum(
+                    derivative['length'] for derivative in derivatives.get(original['_id'], []))
+                if dry_run:
+                    continue
+
+                writer = writer or _PackWriter(getattr(self.store, 'root', None))
+                pending.append(self._append(writer, bucket, original, derivatives.get(original['_id'], [])))
+                if writer.size >= pack_size:
+                    self._commit(writer, pending, started_at)
+                    report['packs'] += 1
+                    writer, pending = None, []
+
+        if pending:
+            self._commit(writer, pending, started_at)
+            report['packs'] += 1
+        elif writer is not None:
+            writer.discard()
+
+        if not dry_run:
+            metrics.increment('image_archive.archived_images', report['images'])
+        logger.info(f"Archived {report['images']} images ({report['bytes']} bytes) into {report['packs']} packs")
+        return report
+
+    def _append(self, writer, bucket, original, derivatives):
+        """Append an original and its derivatives to a pack and return its index document"""
+        offset, length = writer.append(bucket.open_download_stream(original['_id']).read())
+        document = {
+            '_id': str(original['_id']),
+            'pack': writer.pack_id,
+            'offset': offset,
+            'length': length,
+            'content_type': original.get('contentType'),
+            'upload_date': original.get('uploadDate'),
+            'ref_count': original.get('ref_count', 1),
+            'derivatives': {}
+        }
+        document.update({key: original[key] for key in ARCHIVED_FIELDS if key in original})
+
+        for derivative in derivatives:
+            offset, length = writer.append(bucket.open_download_stream(derivative['_id']).read())
+            document['derivatives'][derivative['variant']] = {
+                'offset': offset,
+                'length': length,
+                'content_type': derivative.get('contentType')
+            }
+        document['file_ids'] = [original['_id']] + [derivative['_id'] for derivative in derivatives]
+        return document
+
+    def _commit(self, writer, documents, started_at):
+        """Store a finished pack, index its images, then delete their GridFS copies"""
+        database = self._get_database()
+        collection = self._get_collection()
+        file_ids = {document['_id']: document.pop('file_ids') for document in documents}
+
+        writer.close()
+        self.store.write(writer.pack_id, writer.path, documents)
+        for document in documents:
+            document['archived_at'] = datetime.utcnow()
+
+        # An image archived before and uploaded again since adds its references
+        duplicates = insert_ignoring_duplicates(collection, documents)
+        for document in duplicates:
+            collection.update_one({'_id': document['_id']}, {'$inc': {'ref_count': document['ref_count']}})
+
+        # Files referenced or dereferenced since the run started keep their GridFS copy
+        originals = [file_ids[document['_id']][0] for document in documents]
+        database['fs.files'].delete_many({'_id': {'$in': originals},
+                                          'referenced_at': {'$not': {'$gte': started_at}}})
+        kept = set(str(file_doc['_id']) for file_doc in database['fs.files'].find(
+            {'_id': {'$in': originals}}, {'_id': 1}))
+        if kept:
+            collection.delete_many({'_id': {'$in': list(kept)}, 'pack': writer.pack_id})
+            # The references stay with the GridFS copy, not with the older archive entry
+            for document in duplicates:
+                if document['_id'] in kept:
+                    collection.update_one({'_id': document['_id']}, {'$inc': {'ref_count': -document['ref_count']}})
+
+        archived = [file_id for ref, ids in file_ids.items() if ref not in kept for file_id in ids]
+        database['fs.files'].delete_many({'_id': {'$in': archived}})
+        database['fs.chunks'].delete_many({'files_id': {'$in': archived}})
+        logger.info(f"Wrote pack {writer.pack_id} ({writer.size} bytes, {len(documents) - len(kept)} images)")
+
+    def _get_collection(self):
+        """Return the archive index collection"""
+        return self._get_database().image_archive
+
+    def _get_database(self):
+        """Return the database holding GridFS and the archive index"""
+        if self._database is not None:
+            return self._database
+        return mongo.db
+
+
+# Archive instance, created on first use
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def _create_pack_store(config):
+    """Create the pack store from the app config"""
+    name = config.get('IMAGE_ARCHIVE_BACKEND', 'disk')
+    if name == 'disk':
+        return LocalPackStore(config.get('IMAGE_ARCHIVE_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads', 'archive'))
+    if name == 's3':
+        if not config.get('IMAGE_ARCHIVE_S3_BUCKET'):
+            raise ValueError("IMAGE_ARCHIVE_S3_BUCKET must be set for the s3 image archive")
+        return S3PackStore(
+            config.get('IMAGE_ARCHIVE_S3_BUCKET'),
+            prefix=config.get('IMAGE_ARCHIVE_S3_PREFIX', 'archive/'),
+            endpoint_url=config.get('IMAGE_STORAGE_S3_ENDPOINT_URL') or None
+        )
+    raise ValueError(f"Unknown image archive backend '{name}'")
+
+
+def get_archive():
+    """Return the image archive configured by IMAGE_ARCHIVE_BACKEND"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = ImageArchive(_create_pack_store(current_app.config if has_app_context() else {}))
+    return _archive
@@ -0,0 +1,96 @@
+"""
+In-process metrics registry.
+
+Counters, gauges and timing summaries are kept per worker process and
+exposed as JSON by the /api/metrics endpoint.
+"""
+import threading
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters, gauges and value summaries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_callbacks = {}
+        self._summaries = {}
+
+    def increment(self, name, value=1):
+        """Increase a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Set a gauge to an absolute value"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def register_gauge(self, name, callback):
+        """
+        Register a gauge whose value is computed when metrics are read
+
+        Args:
+            name: Gauge name
+            callback: Callable returning the current value
+        """
+        with self._lock:
+            self._gauge_callbacks[name] = callback
+
+    def observe(self, name, value):
+        """Record a value (e.g. a duration in milliseconds) in a summary"""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = {'count': 0, 'sum': 0.0, 'min': value, 'max': value}
+                self._summaries[name] = summary
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['min'] = min(summary['min'], value)
+            summary['max'] = max(summary['max'], value)
+
+    def get_counter(self, name):
+        """Return the current value of a counter"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        """
+        Return all metrics as a JSON-serialisable dict
+
+        Returns:
+            dict: counters, gauges and summaries (with averages)
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            callbacks = dict(self._gauge_callbacks)
+            summaries = {
+                name: dict(summary, avg=summary['sum'] / summary['count'] if summary['count'] else 0.0)
+                for name, summary in self._summaries.items()
+            }
+
+        # Evaluate callback gauges outside the lock, they may read other metrics
+        for name, callback in callbacks.items():
+            try:
+                gauges[name] = callback()
+            except Exception as e:
+                logger.error(f"Error reading gauge {name}: {str(e)}")
+                gauges[name] = None
+
+        return {'counters': counters, 'gauges': gauges, 'summaries': summaries}
+
+    def reset(self):
+        """Clear all recorded values (mainly for testing)"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+
+# Default registry shared by the whole process
+metrics = MetricsRegistry()
@@ -0,0 +1,90 @@
+"""
+Keyset (cursor) pagination of prediction history.
+
+Paging with skip(offset) makes MongoDB walk and discard every skipped
+document, so deep pages get linearly slower. A cursor instead records the
+sort value and prediction_id of the last document of a page; the next page
+starts right after it with a range query, which an index on
+(sort field, prediction_id) answers without scanning skipped documents.
+prediction_id breaks ties between documents with the same sort value.
+
+Cursors are opaque to clients: URL-safe base64 of the extended JSON of the
+sort field, order and last key, so datetimes and other BSON values survive
+the round-trip.
+"""
+import base64
+import binascii
+from bson import json_util
+
+
+def encode_cursor(sort_by, sort_order, value, prediction_id):
+    """
+    Build the cursor of the page following a document
+
+    Args:
+        sort_by: Field the page is sorted by
+        sort_order: 'asc' or 'desc'
+        value: Sort field value of the last document (BSON or extended JSON)
+        prediction_id: prediction_id of the last document
+
+    Returns:
+        str: Opaque cursor
+    """
+    encoded = json_util.dumps({'sort_by': sort_by, 'sort_order': sort_order, 'value': value, 'id': prediction_id})
+    return base64.urlsafe_b64encode(encoded.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, sort_order):
+    """
+    Read a cursor made by encode_cursor
+
+    Args:
+        cursor: Cursor sent by the client
+        sort_by: Field the requested page is sorted by
+        sort_order: 'asc' or 'desc'
+
+    Returns:
+        tuple: (sort value, prediction_id) of the last document of the previous page
+
+    Raises:
+        ValueError: If the cursor is malformed or was made for another sort
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        decoded = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        key = (decoded['value'], decoded['id'])
+        cursor_sort = (decoded['sort_by'], decoded['sort_order'])
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != (sort_by, sort_order) or not isinstance(key[1], str):
+        raise ValueError('Cursor does not match the requested sort')
+    return key
+
+
+def keyset_filter(sort_by, direction, value, prediction_id):
+    """
+    Build the query matching the documents after a key in sort order
+
+    Documents are sorted by (sort_by, prediction_id), both in direction.
+    MongoDB sorts missing and null values before all others.
+
+    Args:
+        sort_by: Field the documents are sorted by
+        direction: 1 for ascending, -1 for descending
+        value: Sort value of the last document returned
+        prediction_id: prediction_id of the last document returned
+
+    Returns:
+        dict: Query to combine with the page's filters using $and
+    """
+    after = '$gt' if direction == 1 else '$lt'
+    same_value = {sort_by: value, 'prediction_id': {after: prediction_id}}
+
+    # Range operators never match null, which sorts first ascending and last descending
+    if value is None:
+        if direction == 1:
+            return {'$or': [same_value, {sort_by: {'$ne': None}}]}
+        return same_value
+    if direction == 1:
+        return {'$or': [{sort_by: {after: value}}, same_value]}
+    return {'$or': [{sort_by: {after: value}}, same_value, {sort_by: None}]}
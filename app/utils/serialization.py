@@ -0,0 +1,79 @@
+"""
+JSON-ready conversion of MongoDB documents.
+
+History reads used to turn a cursor into JSON-serializable dicts with
+json.loads(json_util.dumps(list(cursor))): every page was encoded to an
+extended JSON string and parsed back before jsonify encoded it once more.
+to_json_compatible converts each document in place of that round-trip,
+while the cursor is iterated, handling the ObjectIds and datetimes of
+history documents directly and leaving strings, numbers, lists and dicts
+as they are. The result is the same relaxed extended JSON json_util
+produces ({"$oid": ...}, {"$date": ...}), so API responses do not change.
+Other BSON types fall back to json_util.
+"""
+import math
+from datetime import datetime
+from bson import json_util
+from bson.objectid import ObjectId
+
+# Datetimes from this instant on are written as ISO-8601 strings by json_util
+_EPOCH = datetime(1970, 1, 1)
+
+# Values JSON encodes as they are
+_PLAIN_TYPES = (str, int, bool, type(None))
+
+
+def _convert_datetime(value):
+    """Relaxed extended JSON of a datetime, as json_util writes it"""
+    if value.tzinfo is not None or value < _EPOCH:
+        return json_util.default(value)
+    millis = value.microsecond // 1000
+    text = value.replace(microsecond=0).isoformat()
+    return {'$date': f"{text}.{millis:03d}Z" if millis else f"{text}Z"}
+
+
+def to_json_compatible(value):
+    """
+    Convert a MongoDB value to one the json module can encode
+
+    Args:
+        value: Document, list or scalar read from MongoDB
+
+    Returns:
+        The value with BSON types replaced by their relaxed extended JSON
+    """
+    value_type = type(value)
+    if value_type is dict:
+        return {key: to_json_compatible(item) for key, item in value.items()}
+    if value_type is list:
+        return [to_json_compatible(item) for item in value]
+    if value_type in _PLAIN_TYPES:
+        return value
+    if value_type is float:
+        # NaN and infinity are not valid JSON numbers
+        return value if math.isfinite(value) else json_util.default(value)
+    if value_type is ObjectId:
+        return {'$oid': str(value)}
+    if value_type is datetime:
+        return _convert_datetime(value)
+    if isinstance(value, dict):
+        return {key: to_json_compatible(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_compatible(item) for item in value]
+    try:
+        return json_util.default(value)
+    except TypeError:
+        return value
+
+
+def documents_to_json(cursor):
+    """
+    Convert the documents of a cursor while iterating it
+
+    Args:
+        cursor: pymongo cursor or any iterable of documents
+
+    Returns:
+        list: JSON-serializable documents
+    """
+    return [to_json_compatible(document) for document in cursor]
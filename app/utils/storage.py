@@ -1,34 +1,134 @@
 import os
 import uuid
+import mimetypes
 import base64
+import hashlib
 from datetime import datetime
 from PIL import Image
 from io import BytesIO
 from app.utils.log import get_logger
 from app.extensions import fs, mongo
 from bson.objectid import ObjectId
-from flask import current_app
+from flask import current_app, has_app_context
+from app.utils.storage_backends import CHUNK_SIZE, DEFAULT_BACKEND, get_backend, get_backend_for_ref
+from app.utils.image_archive import get_archive
+from app.services.image_cache import get_image_cache
 
 logger = get_logger(__name__)
 
+# Storage encoders: format -> (content type, file extension)
+IMAGE_FORMATS = {
+    'JPEG': ('image/jpeg', 'jpg'),
+    'WEBP': ('image/webp', 'webp'),
+    'AVIF': ('image/avif', 'avif')
+}
+
+# Formats already reported as unsupported by the installed Pillow
+_unsupported_formats = set()
+
+def resolve_image_format(image_format):
+    """
+    Validate a storage format, falling back to JPEG when Pillow cannot encode it
+    
+    AVIF needs Pillow 11.3+ (or the pillow-avif-plugin package); WebP is
+    available in standard Pillow builds.
+    
+    Args:
+        image_format: Key of IMAGE_FORMATS, case insensitive
+        
+    Returns:
+        str: The format to encode with
+        
+    Raises:
+        ValueError: If the format is unknown
+    """
+    image_format = (image_format or 'JPEG').upper()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image storage format '{image_format}', expected one of {', '.join(IMAGE_FORMATS)}")
+    
+    Image.init()
+    if image_format not in Image.SAVE:
+        if image_format not in _unsupported_formats:
+            _unsupported_formats.add(image_format)
+            logger.warning(f"Pillow cannot encode {image_format} images, storing JPEG instead")
+        return 'JPEG'
+    return image_format
+
+def _parse_derivative_entries(spec):
+    """Parse derivative entries into (name, max_side, quality or None) tuples"""
+    entries = []
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, rest = entry.partition(':')
+        size, _, quality = rest.partition(':')
+        name, size, quality = name.strip(), size.strip(), quality.strip()
+        if (not name or name == 'original' or not size.isdigit() or int(size) <= 0
+                or (quality and (not quality.isdigit() or not 1 <= int(quality) <= 100))):
+            raise ValueError(f"Invalid image derivative '{entry}', expected name:max_side[:quality]")
+        entries.append((name, int(size), int(quality) if quality else None))
+    return entries
+
+def parse_derivative_sizes(spec):
+    """
+    Parse a derivative specification such as "thumb:128:70,medium:512"
+    
+    Args:
+        spec: Comma separated name:max_side entries, each with an optional :quality
+        
+    Returns:
+        list: (name, max_side) tuples, largest first
+        
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    sizes = [(name, size) for name, size, _ in _parse_derivative_entries(spec)]
+    return sorted(sizes, key=lambda item: item[1], reverse=True)
+
+def parse_derivative_qualities(spec):
+    """
+    Parse the per-derivative encoder qualities of a derivative specification
+    
+    Args:
+        spec: Comma separated name:max_side[:quality] entries
+        
+    Returns:
+        dict: Derivative name to quality, for entries that set one
+        
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    return {name: quality for name, _, quality in _parse_derivative_entries(spec) if quality is not None}
+
 class ImageStorage:
-    """Utility class for handling image storage operations using GridFS"""
+    """
+    Utility class for handling image storage operations
+    
+    Images are stored through the backend configured by IMAGE_STORAGE_BACKEND
+    (see app.utils.storage_backends) and read back through the backend their
+    reference points to.
+    """
     
     # Legacy base directory for backward compatibility
     BASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads')
     
+    # Streaming buffer size, the GridFS default chunk size (255 KiB)
+    CHUNK_SIZE = CHUNK_SIZE
+    
     @classmethod
-    def save_prediction_image(cls, image_file, prediction_id, user_id='anonymous'):
+    def save_prediction_image(cls, image_file, prediction_id, user_id='anonymous', retention='original'):
         """
-        Save an uploaded image for a prediction to GridFS
+        Save an uploaded image for a prediction
         
         Args:
-            image_file: The uploaded image file object
+            image_file: The uploaded image file object or a decoded PIL image
             prediction_id: ID of the prediction
             user_id: ID of the user who uploaded the image
+            retention: 'original' or 'thumbnail' (see prepare_prediction_image)
             
         Returns:
-            str: GridFS file ID as string
+            str: Image reference (GridFS file ID as string for the GridFS backend)
         """
         try:
             from flask import current_app
@@ -43,64 +143,306 @@ class ImageStorage:
                 logger.error("GridFS instance is not available")
                 raise RuntimeError("GridFS instance is not available")
                 
-            # Validate input parameters
-            if not image_file:
-                logger.error("No image file provided")
-                return None
-                
-            if not prediction_id:
-                logger.error("No prediction ID provided")
+            prepared = cls.prepare_prediction_image(image_file, prediction_id, user_id, retention)
+            if not prepared:
                 return None
-                
-            # Reset file pointer to beginning
-            image_file.seek(0)
             
-            # Open image with PIL to convert it to JPEG
-            img = Image.open(image_file)
+            logger.debug(f"Attempting to save image to {prepared['backend']} with metadata: {prepared['metadata']}")
             
-            # Save image to a BytesIO object
-            output = BytesIO()
-            img.save(output, format="JPEG", quality=85)
-            output.seek(0)
+            # Save the image, or add a reference if the same image is already stored
+            file_id = cls.store_prepared_images([prepared])[0]
             
-            # Prepare metadata
-            metadata = {
-                'content_type': 'image/jpeg',
-                'prediction_id': prediction_id,
-                'user_id': user_id,
-                'timestamp': datetime.utcnow(),
-                'filename': f"{prediction_id}.jpg"
-            }
-            
-            logger.debug(f"Attempting to save image to GridFS with metadata: {metadata}")
+            logger.info(f"Image saved in {prepared['backend']} with reference {file_id}")
             
-            # Save to GridFS
-            image_data = output.read()
-            if not image_data:
-                logger.error("Generated empty image data")
-                return None
-                
-            file_id = fs.put(image_data, **metadata)
-            
-            logger.info(f"Image saved in GridFS with ID {file_id}")
-            
-            return str(file_id)
+            return file_id
             
         except AttributeError as e:
             logger.error(f"GridFS AttributeError: {str(e)}")
             logger.error("This usually indicates that GridFS is not properly initialized")
             return None
         except Exception as e:
-            logger.error(f"Failed to save image to GridFS: {str(e)}")
+            logger.error(f"Failed to save image: {str(e)}")
+            return None
+    
+    @classmethod
+    def prepare_prediction_image(cls, image_file, prediction_id, user_id='anonymous', retention='original'):
+        """
+        Encode an image and its derivatives for storage without writing them
+        
+        The image reference is derived from the content hash of the encoded
+        bytes (see content_hash), so it is known before the write happens (see
+        app.services.persistence) and a photo the same user re-submits maps to
+        the image already stored. The image is
+        decoded once; the original and every derivative are encoded from that
+        decoded image.
+        
+        With retention 'thumbnail' (see app.services.retention) only the
+        smallest derivative is stored, as the image itself, so every size
+        served for the prediction is that thumbnail.
+        
+        Args:
+            image_file: The uploaded image file object or a decoded PIL image
+            prediction_id: ID of the prediction
+            user_id: ID of the user who uploaded the image
+            retention: 'original' (image and derivatives) or 'thumbnail'
+            
+        Returns:
+            dict: '_id' (ObjectId), 'data' (encoded bytes), 'metadata',
+                  'derivatives' (list of prepared derivatives), 'backend' (name of
+                  the storage backend) and 'ref' (image reference), or None on invalid input
+        """
+        # Validate input parameters
+        if not image_file:
+            logger.error("No image file provided")
+            return None
+            
+        if not prediction_id:
+            logger.error("No prediction ID provided")
+            return None
+        
+        # Re-encode the image in the storage format, capped to the archival size
+        config = cls._get_storage_format_config()
+        img = cls._load_image(image_file)
+        max_dimension = config['max_dimension']
+        quality = config['quality']
+        storage_format = config['format']
+        
+        if retention == 'thumbnail':
+            derivative_config = cls._get_derivative_config()
+            if derivative_config['sizes']:
+                name, max_dimension = derivative_config['sizes'][-1]
+                quality = derivative_config['qualities'].get(name, derivative_config['quality'])
+                storage_format = derivative_config['format']
+        
+        if max_dimension and max(img.size) > max_dimension:
+            img = img.copy()
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        
+        image_format = resolve_image_format(storage_format)
+        content_type, extension = IMAGE_FORMATS[image_format]
+        image_data = cls.encode_prediction_image(img, quality=quality, image_format=image_format).getvalue()
+        if not image_data:
+            logger.error("Generated empty image data")
             return None
+        
+        # Prepare metadata
+        metadata = {
+            'content_type': content_type,
+            'prediction_id': prediction_id,
+            'user_id': user_id,
+            'timestamp': datetime.utcnow(),
+            'filename': f"{prediction_id}.{extension}",
+            'content_hash': cls.content_hash(image_data, user_id)
+        }
+        
+        file_id = cls.content_file_id(metadata['content_hash'])
+        prepared = {
+            '_id': file_id,
+            'data': image_data,
+            'metadata': metadata,
+            'derivatives': cls.prepare_derivatives(img, file_id, metadata) if retention != 'thumbnail' else []
+        }
+        
+        backend = get_backend()
+        prepared['backend'] = backend.name
+        prepared['ref'] = backend.make_ref(prepared)
+        return prepared
+    
+    @classmethod
+    def content_hash(cls, data, user_id):
+        """
+        Hash under which an image is deduplicated
+        
+        Images are only shared among the predictions of one user: the hash
+        covers the uploader's ID along with the bytes, so the same photo sent
+        by two users is stored twice and the user_id and prediction_id of
+        every stored image belong to its uploader.
+        
+        Args:
+            data: Stored bytes of the image
+            user_id: ID of the user who uploaded the image
+            
+        Returns:
+            str: Hex SHA-256 of the user ID and the bytes
+        """
+        digest = hashlib.sha256(str(user_id).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+    
+    @classmethod
+    def content_file_id(cls, content_hash):
+        """
+        Derive the GridFS file ID of an image from its content hash
+        
+        Args:
+            content_hash: Hex digest returned by content_hash
+            
+        Returns:
+            ObjectId: The first 12 bytes of the hash
+        """
+        return ObjectId(bytes.fromhex(content_hash[:24]))
+    
+    @classmethod
+    def prepare_derivatives(cls, img, parent_id, parent_metadata, sizes=None, image_format=None, quality=None):
+        """
+        Encode the resized copies of an image configured by IMAGE_DERIVATIVES
+        
+        Sizes are produced largest first and each one is resized from the
+        previous, so only the largest is resampled from the full image.
+        Sizes the image is already smaller than are skipped; reads fall back
+        to the original for them.
+        
+        Args:
+            img: Decoded PIL image
+            parent_id: GridFS ID of the original image
+            parent_metadata: Metadata of the original image
+            sizes: (name, max_side) tuples (defaults to the app config)
+            image_format: Key of IMAGE_FORMATS (defaults to the app config)
+            quality: Encoder quality for every size (defaults to the per-derivative
+                     qualities of IMAGE_DERIVATIVES, then IMAGE_DERIVATIVE_QUALITY)
+            
+        Returns:
+            list: Prepared derivatives with '_id', 'data' and 'metadata'
+        """
+        config = cls._get_derivative_config()
+        sizes = config['sizes'] if sizes is None else sizes
+        image_format = resolve_image_format(image_format or config['format'])
+        content_type, extension = IMAGE_FORMATS[image_format]
+        
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        derivatives = []
+        source = img
+        for name, max_side in sorted(sizes, key=lambda item: item[1], reverse=True):
+            if max(source.size) <= max_side:
+                continue
+            
+            resized = source.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+            source = resized
+            
+            output = BytesIO()
+            resized.save(output, format=image_format,
+                         quality=quality if quality is not None else config['qualities'].get(name, config['quality']))
+            
+            metadata = {
+                'content_type': content_type,
+                'prediction_id': parent_metadata.get('prediction_id'),
+                'user_id': parent_metadata.get('user_id'),
+                'timestamp': parent_metadata.get('timestamp'),
+                'filename': f"{parent_metadata.get('prediction_id')}_{name}.{extension}",
+                'parent_id': parent_id,
+                'variant': name,
+                'width': resized.size[0],
+                'height': resized.size[1]
+            }
+            derivatives.append({'_id': ObjectId(), 'data': output.getvalue(), 'metadata': metadata})
+        
+        return derivatives
+    
+    @classmethod
+    def get_derivative_names(cls):
+        """Return the names of the configured derivatives"""
+        return [name for name, _ in cls._get_derivative_config()['sizes']]
+    
+    @classmethod
+    def _get_derivative_config(cls):
+        """Read derivative settings from the app config, with defaults outside an app"""
+        config = current_app.config if has_app_context() else {}
+        spec = config.get('IMAGE_DERIVATIVES', 'thumb:128,medium:512')
+        return {
+            'sizes': parse_derivative_sizes(spec),
+            'qualities': parse_derivative_qualities(spec),
+            'format': config.get('IMAGE_DERIVATIVE_FORMAT', 'JPEG'),
+            'quality': config.get('IMAGE_DERIVATIVE_QUALITY', 80)
+        }
+    
+    @classmethod
+    def _get_storage_format_config(cls):
+        """Read the encoding settings of stored originals from the app config, with defaults outside an app"""
+        config = current_app.config if has_app_context() else {}
+        return {
+            'format': config.get('IMAGE_STORAGE_FORMAT', 'JPEG'),
+            'quality': config.get('IMAGE_STORAGE_QUALITY', 85),
+            'max_dimension': config.get('IMAGE_STORAGE_MAX_DIMENSION', 0)
+        }
+    
+    @classmethod
+    def store_prepared_images(cls, prepared_images):
+        """
+        Write several prepared images in bulk through their storage backends
+        
+        Images are content addressed: an image that is already stored (or
+        that appears several times in the batch) is not written again, its
+        reference count is increased instead.
+        
+        Args:
+            prepared_images: List of dicts returned by prepare_prediction_image
+                             or prepare_derivatives
+            
+        Returns:
+            list: Image references (saved as image_path) of the given images, in order
+        """
+        # One bulk write per backend, images prepared without one go to GridFS
+        batches = {}
+        for index, prepared in enumerate(prepared_images):
+            batches.setdefault(prepared.get('backend', DEFAULT_BACKEND), []).append(index)
+        
+        refs = [None] * len(prepared_images)
+        for name, indexes in batches.items():
+            stored = get_backend(name).store([prepared_images[index] for index in indexes])
+            for index, ref in zip(indexes, stored):
+                refs[index] = ref
+        return refs
+    
+    @classmethod
+    def encode_prediction_image(cls, image_file, quality=85, image_format='JPEG'):
+        """
+        Re-encode an uploaded image for storage
+        
+        Args:
+            image_file: The uploaded image file object or a decoded PIL image
+            quality: Encoder quality
+            image_format: Key of IMAGE_FORMATS
+            
+        Returns:
+            BytesIO: Encoded image, positioned at the start
+        """
+        img = cls._load_image(image_file)
+        
+        # Stored images are plain RGB (JPEG has no alpha channel or palette)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        # Save image to a BytesIO object
+        output = BytesIO()
+        img.save(output, format=image_format, quality=quality)
+        output.seek(0)
+        return output
+    
+    @classmethod
+    def _load_image(cls, image_file):
+        """Open an uploaded file with PIL, accepting already decoded images (e.g. tensor uploads)"""
+        if isinstance(image_file, Image.Image):
+            return image_file
+        
+        # Reset file pointer to beginning
+        image_file.seek(0)
+        img = Image.open(image_file)
+        img.load()
+        return img
     
     @classmethod
     def get_image_from_gridfs(cls, file_id):
         """
-        Get an image file from GridFS
+        Read a stored image into memory
+        
+        Kept under its original name; references of every storage backend are accepted.
         
         Args:
-            file_id: GridFS file ID as string
+            file_id: Image reference (GridFS file ID as string)
             
         Returns:
             bytes: Image data as bytes
@@ -108,29 +450,72 @@ class ImageStorage:
         try:
             if not file_id:
                 return None
+            if '/' not in file_id and get_image_cache() is not None:
+                # Through open_image, which serves and fills the image cache
+                image = cls.read_image(file_id)
+                return image['data'] if image else None
+            return get_backend_for_ref(file_id).read(file_id)
                 
-            # Convert string ID to ObjectId
-            obj_id = ObjectId(file_id)
+        except Exception as e:
+            logger.error(f"Failed to get image: {str(e)}")
+            return None
             
-            # Get file from GridFS
-            if not fs.exists(obj_id):
-                logger.warning(f"Image not found in GridFS with ID {file_id}")
+    @classmethod
+    def open_image(cls, image_path, variant=None):
+        """
+        Open a stored image for streaming without reading it into memory
+        
+        Args:
+            image_path: Image reference, or a legacy filesystem path
+            variant: Name of a derivative (e.g. 'thumb'); the original is
+                     returned when None or when the derivative does not exist
+            
+        Returns:
+            dict: 'stream' (file object, caller must close it), 'length',
+                  'content_type', 'etag' and 'last_modified', or None if not found
+        """
+        try:
+            if not image_path:
                 return None
-                
-            grid_out = fs.get(obj_id)
-            return grid_out.read()
-                
+            
+            # For backward compatibility with file paths
+            if '/' in image_path:
+                legacy_path = os.path.join(cls.BASE_DIR, image_path)
+                if not os.path.exists(legacy_path):
+                    logger.warning(f"Legacy image not found at {legacy_path}")
+                    return None
+                stat = os.stat(legacy_path)
+                content_type = mimetypes.guess_type(legacy_path)[0] or 'application/octet-stream'
+                return {
+                    'stream': open(legacy_path, 'rb'),
+                    'length': stat.st_size,
+                    'content_type': content_type,
+                    'etag': f"{int(stat.st_mtime)}-{stat.st_size}",
+                    'last_modified': datetime.utcfromtimestamp(stat.st_mtime)
+                }
+            
+            # Small hot images are served from the per-worker memory cache
+            cache = get_image_cache()
+            if cache is not None:
+                image = cache.open(image_path, variant)
+                if image is not None:
+                    return image
+            
+            image = get_backend_for_ref(image_path).open(image_path, variant)
+            if cache is not None and image is not None and image['length'] <= cache.max_item_bytes:
+                image = cache.add(image_path, variant, image)
+            return image
         except Exception as e:
-            logger.error(f"Failed to get image from GridFS: {str(e)}")
+            logger.error(f"Failed to open image: {str(e)}")
             return None
-            
+    
     @classmethod
     def get_image_metadata(cls, file_id):
         """
-        Get metadata for an image stored in GridFS
+        Get metadata for a stored image
         
         Args:
-            file_id: GridFS file ID as string
+            file_id: Image reference (GridFS file ID as string)
             
         Returns:
             dict: Image metadata
@@ -138,30 +523,39 @@ class ImageStorage:
         try:
             if not file_id:
                 return None
-                
-            # Convert string ID to ObjectId
-            obj_id = ObjectId(file_id)
             
-            # Get the GridFS file directly - this also returns metadata
-            if not fs.exists(obj_id):
+            # Object store backends keep their metadata in image_objects
+            if get_backend_for_ref(file_id).name != DEFAULT_BACKEND:
+                document = mongo.db.image_objects.find_one({'_id': file_id})
+                if not document:
+                    logger.warning(f"Image not found with reference {file_id}")
+                    return None
+                return {key: document.get(key) for key in
+                        ['content_type', 'filename', 'upload_date', 'length', 'prediction_id', 'user_id', 'timestamp']}
+                
+            # One query for the file document, without opening the file
+            file_doc = mongo.db['fs.files'].find_one({'_id': ObjectId(file_id)})
+            if not file_doc:
+                # Old images are moved to the cold archive
+                document = get_archive().get_metadata(file_id)
+                if document:
+                    return {key: document.get(key) for key in
+                            ['content_type', 'filename', 'upload_date', 'length', 'prediction_id', 'user_id', 'timestamp']}
                 logger.warning(f"Image not found in GridFS with ID {file_id}")
                 return None
-                
-            # Get the file from GridFS
-            grid_out = fs.get(obj_id)
             
-            # Extract metadata from GridOut object
+            # Extract metadata from the file document
             metadata = {
-                'content_type': grid_out.content_type,
-                'filename': grid_out.filename,
-                'upload_date': grid_out.upload_date,
-                'length': grid_out.length
+                'content_type': file_doc.get('contentType'),
+                'filename': file_doc.get('filename'),
+                'upload_date': file_doc.get('uploadDate'),
+                'length': file_doc.get('length')
             }
             
             # Add any custom metadata
             for key in ['prediction_id', 'user_id', 'timestamp']:
-                if hasattr(grid_out, key):
-                    metadata[key] = getattr(grid_out, key)
+                if key in file_doc:
+                    metadata[key] = file_doc[key]
                     
             return metadata
                 
@@ -169,36 +563,47 @@ class ImageStorage:
             logger.error(f"Failed to get image metadata: {str(e)}")
             return None
     
+    @classmethod
+    def read_image(cls, file_id, variant=None):
+        """
+        Read a stored image into memory together with its content type
+        
+        Args:
+            file_id: Image reference, or a legacy filesystem path
+            variant: Name of a derivative (see open_image)
+            
+        Returns:
+            dict: 'data' (bytes) and 'content_type', or None if not found
+        """
+        image = cls.open_image(file_id, variant)
+        if image is None:
+            return None
+        try:
+            return {'data': image['stream'].read(), 'content_type': image['content_type']}
+        except Exception as e:
+            logger.error(f"Failed to read image: {str(e)}")
+            return None
+        finally:
+            image['stream'].close()
+    
     @classmethod
     def get_image_as_base64(cls, file_id):
         """
-        Get an image as base64 encoded string from GridFS
+        Get a stored image as base64 encoded string
         
         Args:
-            file_id: GridFS file ID as string
+            file_id: Image reference (GridFS file ID as string), or a legacy filesystem path
             
         Returns:
             str: Base64 encoded image or None if not found
         """
         try:
-            # For backward compatibility with file paths
-            if file_id and '/' in file_id:
-                # This is a path from the old storage system
-                # Try to open from filesystem first
-                legacy_path = os.path.join(cls.BASE_DIR, file_id)
-                if os.path.exists(legacy_path):
-                    with open(legacy_path, "rb") as img_file:
-                        encoded_string = base64.b64encode(img_file.read()).decode('utf-8')
-                        return encoded_string
-            
-            # Get from GridFS
-            image_data = cls.get_image_from_gridfs(file_id)
-            
-            if not image_data:
+            image = cls.read_image(file_id)
+            if not image or not image['data']:
                 return None
                 
             # Encode as base64
-            encoded_string = base64.b64encode(image_data).decode('utf-8')
+            encoded_string = base64.b64encode(image['data']).decode('utf-8')
             return encoded_string
                 
         except Exception as e:
@@ -208,10 +613,13 @@ class ImageStorage:
     @classmethod
     def delete_image(cls, file_id):
         """
-        Delete an image from GridFS
+        Delete a stored image
+        
+        Images shared by several predictions only lose a reference; the image
+        and its derivatives are removed with the last reference.
         
         Args:
-            file_id: GridFS file ID as string
+            file_id: Image reference (GridFS file ID as string)
             
         Returns:
             bool: True if deletion was successful, False otherwise
@@ -230,16 +638,13 @@ class ImageStorage:
                     return True
                 return False
             
-            # Convert string ID to ObjectId and delete from GridFS
-            obj_id = ObjectId(file_id)
+            deleted = get_backend_for_ref(file_id).delete(file_id)
             
-            if not fs.exists(obj_id):
-                logger.warning(f"Image not found in GridFS with ID {file_id}")
-                return False
-                
-            fs.delete(obj_id)
-            logger.info(f"Image deleted from GridFS with ID {file_id}")
-            return True
+            # Deleted images are no longer served from memory
+            cache = get_image_cache()
+            if cache is not None:
+                cache.invalidate(file_id)
+            return deleted
                 
         except Exception as e:
             logger.error(f"Failed to delete image: {str(e)}")
@@ -250,15 +655,27 @@ class ImageStorage:
         """
         Get all images associated with a prediction ID
         
+        A deduplicated image keeps the prediction_id of the prediction that
+        first stored it, so the references saved on the prediction's history
+        document are returned along with the images stored under its ID.
+        
         Args:
             prediction_id: ID of the prediction
             
         Returns:
-            list: List of file IDs for images associated with the prediction
+            list: References of the images associated with the prediction (derivatives excluded)
         """
         try:
-            files = mongo.db.fs.files.find({"prediction_id": prediction_id})
-            return [str(file["_id"]) for file in files]
+            prediction = mongo.db.prediction_history.find_one(
+                {"prediction_id": prediction_id}, {"image_path": 1, "image_paths": 1}) or {}
+            files = mongo.db['fs.files'].find({"prediction_id": prediction_id, "variant": {"$exists": False}}, {"_id": 1})
+            objects = mongo.db.image_objects.find({"prediction_id": prediction_id}, {"_id": 1})
+            archived = mongo.db.image_archive.find({"prediction_id": prediction_id}, {"_id": 1})
+            
+            refs = [prediction.get("image_path")] + list(prediction.get("image_paths") or [])
+            refs += [str(file["_id"]) for file in files] + [obj["_id"] for obj in objects] + [doc["_id"] for doc in archived]
+            # Drop duplicates, keeping the history order
+            return [ref for ref in dict.fromkeys(refs) if ref]
         except Exception as e:
             logger.error(f"Failed to get images for prediction: {str(e)}")
             return []
@@ -272,11 +689,13 @@ class ImageStorage:
             user_id: ID of the user
             
         Returns:
-            list: List of file IDs for images uploaded by the user
+            list: References of the images uploaded by the user (derivatives excluded)
         """
         try:
-            files = mongo.db.fs.files.find({"user_id": user_id})
-            return [str(file["_id"]) for file in files]
+            files = mongo.db['fs.files'].find({"user_id": user_id, "variant": {"$exists": False}})
+            objects = mongo.db.image_objects.find({"user_id": user_id}, {"_id": 1})
+            archived = mongo.db.image_archive.find({"user_id": user_id}, {"_id": 1})
+            return [str(file["_id"]) for file in files] + [obj["_id"] for obj in objects] + [doc["_id"] for doc in archived]
         except Exception as e:
             logger.error(f"Failed to get images for user: {str(e)}")
             return []
@@ -306,13 +725,9 @@ class ImageStorage:
                 filename = os.path.basename(relative_path)
                 prediction_id = os.path.splitext(filename)[0]
             
-            # Read file
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
             # Prepare metadata
             metadata = {
-                'content_type': 'image/jpeg',
+                'content_type': mimetypes.guess_type(relative_path)[0] or 'image/jpeg',
                 'prediction_id': prediction_id,
                 'user_id': user_id,
                 'timestamp': datetime.utcnow(),
@@ -320,8 +735,9 @@ class ImageStorage:
                 'migrated_from': relative_path
             }
             
-            # Save to GridFS
-            file_id = fs.put(file_data, **metadata)
+            # Stream the file into GridFS one chunk at a time
+            with open(file_path, 'rb') as f:
+                file_id = fs.put(f, chunk_size=cls.CHUNK_SIZE, **metadata)
             
             logger.info(f"File migrated to GridFS with ID {file_id}")
             
@@ -0,0 +1,763 @@
+"""
+Image storage backends.
+
+ImageStorage prepares images (encoding, derivatives, content hash) and
+hands them to a backend, which stores the bytes and hands back a reference
+that is saved as the prediction's image_path:
+
+- gridfs: MongoDB GridFS, referenced by a 24 character ObjectId string
+- disk:   content-addressed files on a local (or mounted) disk, "disk:<sha256>"
+- s3:     content-addressed objects in an S3-compatible bucket, "s3:<sha256>"
+
+References carry their backend, so images written by any backend stay
+readable after the configured backend changes, which is how images are
+migrated without downtime (see scripts/migrate_image_storage.py). Legacy
+filesystem paths (containing '/') are handled by ImageStorage itself.
+
+Every backend deduplicates by content hash (per user, see
+ImageStorage.content_hash) and reference counts its originals; derivatives
+are stored and deleted together with their original.
+GridFS files moved to the cold archive (app/utils/image_archive.py) keep
+their references and are read and deleted through GridFSBackend.
+"""
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from io import BytesIO
+from bson.objectid import ObjectId
+from gridfs import GridFSBucket
+from gridfs.errors import FileExists, NoFile
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from flask import current_app, has_app_context
+from app.extensions import mongo
+from app.utils.log import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+# GridFS default chunk size (255 KiB), also used as the streaming buffer size
+CHUNK_SIZE = 255 * 1024
+
+# Attempts at referencing or uploading an image before giving up, and the
+# first delay between them (doubled each time), for files caught mid-delete
+STORE_ATTEMPTS = 4
+STORE_RETRY_DELAY = 0.05
+
+# Age after which chunks without a file document are left by a failed upload,
+# not written by one still in progress
+STALE_UPLOAD_SECONDS = 60
+
+# Query matching image documents a delete removes instead of decrementing
+LAST_REFERENCE = {'ref_count': {'$not': {'$gt': 1}}}
+
+# MongoDB duplicate key error code
+DUPLICATE_KEY_ERROR = 11000
+
+# Backend used for references without a prefix
+DEFAULT_BACKEND = 'gridfs'
+
+
+def insert_ignoring_duplicates(collection, documents):
+    """
+    insert_many that tolerates documents inserted concurrently by another writer
+
+    Args:
+        collection: Target collection
+        documents: Documents to insert
+
+    Returns:
+        list: Documents rejected as duplicates
+
+    Raises:
+        BulkWriteError: For errors other than duplicate keys
+    """
+    if not documents:
+        return []
+    try:
+        collection.insert_many(documents, ordered=False)
+        return []
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        return [documents[error['index']] for error in errors]
+
+
+def _count_references(prepared_images, key):
+    """Count references per stored object and keep the first prepared image of each"""
+    references = Counter(key(prepared) for prepared in prepared_images)
+    unique_images = {}
+    for prepared in prepared_images:
+        unique_images.setdefault(key(prepared), prepared)
+    return references, unique_images
+
+
+class StorageBackend:
+    """Interface implemented by every image storage backend"""
+
+    # Backend name, also the reference prefix for backends other than GridFS
+    name = None
+
+    def make_ref(self, prepared):
+        """
+        Return the reference a prepared image will be stored under
+
+        Args:
+            prepared: Dict returned by ImageStorage.prepare_prediction_image
+
+        Returns:
+            str: Reference to save as image_path
+        """
+        raise NotImplementedError
+
+    def store(self, prepared_images):
+        """
+        Store prepared images and their derivatives
+
+        Images already stored (or repeated in the batch) only gain references.
+
+        Args:
+            prepared_images: List of dicts returned by ImageStorage.prepare_prediction_image
+
+        Returns:
+            list: References of the given images, in order
+        """
+        raise NotImplementedError
+
+    def open(self, ref, variant=None):
+        """
+        Open a stored image for streaming
+
+        Args:
+            ref: Reference returned by store
+            variant: Name of a derivative; the original is returned when None
+                     or when the derivative does not exist
+
+        Returns:
+            dict: 'stream' (file object, caller must close it), 'length',
+                  'content_type', 'etag' and 'last_modified', or None if not found
+        """
+        raise NotImplementedError
+
+    def delete(self, ref):
+        """
+        Drop one reference to an image, removing it with the last one
+
+        Args:
+            ref: Reference returned by store
+
+        Returns:
+            bool: True if a reference was dropped, False if the image was not found
+        """
+        raise NotImplementedError
+
+    def read(self, ref, variant=None):
+        """Read a stored image into memory, or None if not found"""
+        image = self.open(ref, variant)
+        if image is None:
+            return None
+        try:
+            return image['stream'].read()
+        finally:
+            image['stream'].close()
+
+
+class GridFSBackend(StorageBackend):
+    """
+    Images stored as GridFS files in the application database
+
+    Reads go through GridFSBucket download streams, which fetch the file
+    document in one query and then chunks in cursor batches as the stream is
+    consumed, so memory per read does not grow with the image size. Writes
+    go through upload streams with the content-derived file ID.
+    """
+
+    name = 'gridfs'
+
+    def __init__(self, database=None, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            database: Database holding the fs.files and fs.chunks collections (defaults to mongo.db)
+            chunk_size: Chunk size of new files in bytes
+        """
+        self._database = database
+        self.chunk_size = chunk_size
+        # Whether the GridFS indexes used by writes have been created
+        self._indexes_ready = False
+
+    def make_ref(self, prepared):
+        return str(prepared['_id'])
+
+    def store(self, prepared_images):
+        """
+        Stream prepared images into GridFS under their content-derived IDs
+
+        Each new original goes through a GridFSBucket upload stream opened
+        with its file ID, followed by its derivatives. Upload streams write
+        the chunks (batched into insert_many calls by pymongo) before the
+        file document, so readers never see a file without its chunks. The
+        file ID is derived from the content hash, so duplicates map to the
+        file already stored and only increase its ref_count; a file written
+        concurrently by another upload makes the stream raise FileExists.
+
+        Raises:
+            RuntimeError: If an image can neither be referenced nor uploaded
+        """
+        if not prepared_images:
+            return []
+
+        self._ensure_indexes()
+        bucket = self._get_bucket()
+
+        # Count references per file, duplicates within the batch share one write
+        references, unique_images = _count_references(prepared_images, lambda prepared: prepared['_id'])
+
+        written = 0
+        for file_id, prepared in unique_images.items():
+            if self._store_file(bucket, prepared, references[file_id]):
+                written += 1
+
+        deduplicated = len(prepared_images) - written
+        if deduplicated:
+            metrics.increment('storage.deduplicated_images', deduplicated)
+
+        logger.info(f"Stored {written} images in GridFS, {deduplicated} deduplicated")
+        return [str(prepared['_id']) for prepared in prepared_images]
+
+    def store_derivatives(self, derivatives):
+        """
+        Upload derivatives of originals already stored in GridFS
+
+        Derivatives have no ref_count of their own: they are found through
+        their parent_id and deleted with their original.
+
+        Args:
+            derivatives: Dicts returned by ImageStorage.prepare_derivatives
+
+        Returns:
+            int: Number of derivatives written
+        """
+        if not derivatives:
+            return 0
+
+        self._ensure_indexes()
+        bucket = self._get_bucket()
+        written = sum(1 for derivative in derivatives if self._upload(bucket, derivative))
+        logger.info(f"Stored {written} derivatives in GridFS")
+        return written
+
+    def open(self, ref, variant=None):
+        bucket = self._get_bucket()
+        try:
+            grid_out = None
+            if variant:
+                grid_out = next(iter(bucket.find({'parent_id': ObjectId(ref), 'variant': variant}, limit=1)), None)
+
+            # A single query: the download stream raises NoFile when the file is missing
+            if grid_out is None:
+                grid_out = bucket.open_download_stream(ObjectId(ref))
+            return {
+                'stream': grid_out,
+                'length': grid_out.length,
+                'content_type': grid_out.content_type or 'image/jpeg',
+                # GridFS files are immutable, so the ID (or stored md5) is a strong validator
+                'etag': getattr(grid_out, 'md5', None) or str(grid_out._id),
+                'last_modified': grid_out.upload_date
+            }
+        except NoFile:
+            # Old images are moved to the cold archive
+            from app.utils.image_archive import get_archive
+            archived = get_archive().open(ref, variant)
+            if archived is None:
+                logger.warning(f"Image not found in GridFS with ID {ref}")
+            return archived
+
+    def delete(self, ref):
+        obj_id = ObjectId(ref)
+        database = self._get_database()
+        files = database['fs.files']
+
+        # The file document is only removed while it holds the last reference,
+        # so a reference added concurrently by store is never lost
+        while True:
+            # Shared images only lose a reference
+            if files.find_one_and_update(
+                    {'_id': obj_id, 'ref_count': {'$gt': 1}},
+                    {'$inc': {'ref_count': -1}, '$set': {'referenced_at': datetime.utcnow()}},
+                    projection={'_id': 1}):
+                logger.info(f"Removed a reference to shared image {ref}")
+                return True
+
+            if files.find_one_and_delete(dict(LAST_REFERENCE, _id=obj_id), projection={'_id': 1}):
+                break
+
+            if files.find_one({'_id': obj_id}, {'_id': 1}) is None:
+                from app.utils.image_archive import get_archive
+                if get_archive().delete(ref):
+                    return True
+                logger.warning(f"Image not found in GridFS with ID {ref}")
+                return False
+            # Referenced again between the two updates, decrement instead
+
+        database['fs.chunks'].delete_many({'files_id': obj_id})
+
+        # All derivatives go in two deletes, however many there are
+        derivative_ids = [doc['_id'] for doc in files.find({'parent_id': obj_id}, {'_id': 1})]
+        if derivative_ids:
+            files.delete_many({'_id': {'$in': derivative_ids}})
+            database['fs.chunks'].delete_many({'files_id': {'$in': derivative_ids}})
+        logger.info(f"Image deleted from GridFS with ID {ref}")
+        return True
+
+    def _store_file(self, bucket, prepared, count):
+        """
+        Add references to a stored original, or upload it with its derivatives
+
+        The reference is added with a single find_one_and_update, which only
+        matches if the file exists at that moment, so a racing delete either
+        removed it first (and the file is uploaded again) or sees the new
+        ref_count. An upload failing with FileExists means another writer
+        stored the file meanwhile, a delete is still removing its chunks, or
+        a failed upload left chunks behind (removed once stale), so both steps
+        are retried with a short backoff.
+
+        Args:
+            bucket: GridFSBucket to write to
+            prepared: Dict returned by ImageStorage.prepare_prediction_image
+            count: Number of references to add
+
+        Returns:
+            bool: True if the file was uploaded, False if it only gained references
+
+        Raises:
+            RuntimeError: If the file can neither be referenced nor uploaded
+        """
+        for attempt in range(STORE_ATTEMPTS):
+            if attempt:
+                time.sleep(STORE_RETRY_DELAY * 2 ** (attempt - 1))
+            if self._add_reference(prepared['_id'], count):
+                return False
+            if self._upload(bucket, prepared, count):
+                for derivative in prepared.get('derivatives', []):
+                    self._upload(bucket, derivative)
+                return True
+
+        logger.error(f"Image {prepared['_id']} could neither be referenced nor uploaded to GridFS")
+        raise RuntimeError(f"Could not store image {prepared['_id']} in GridFS")
+
+    def _upload(self, bucket, prepared, ref_count=None):
+        """
+        Write one prepared image through an upload stream with its own file ID
+
+        Metadata fields become top-level fields of the file document, as
+        GridFS.put(data, **metadata) would store them.
+
+        Args:
+            bucket: GridFSBucket to write to
+            prepared: Dict with '_id', 'data' and 'metadata'
+            ref_count: Initial reference count of an original, None for derivatives
+
+        Returns:
+            bool: True if written, False if a file with that ID already exists
+        """
+        metadata = dict(prepared['metadata'])
+        filename = metadata.pop('filename', None) or str(prepared['_id'])
+        grid_in = bucket.open_upload_stream_with_id(prepared['_id'], filename)
+        try:
+            grid_in.content_type = metadata.pop('content_type', None)
+            for key, value in metadata.items():
+                setattr(grid_in, key, value)
+            if ref_count is not None:
+                grid_in.ref_count = ref_count
+            grid_in.write(BytesIO(prepared['data']))
+            grid_in.close()
+        except FileExists:
+            # Not aborted: that would delete the chunks of the file another writer stored
+            self._remove_stale_chunks(prepared['_id'])
+            return False
+        except Exception:
+            # Chunks left without a file document would make every later upload
+            # of this content fail with FileExists
+            try:
+                grid_in.abort()
+            except Exception as e:
+                logger.error(f"Error aborting the upload of image {prepared['_id']}: {str(e)}")
+            raise
+        return True
+
+    def _remove_stale_chunks(self, file_id):
+        """
+        Delete the chunks a failed upload left without a file document
+
+        Chunks younger than STALE_UPLOAD_SECONDS may belong to an upload still
+        in progress and are kept; the caller retries after a backoff.
+
+        Args:
+            file_id: ObjectId of the file whose upload hit FileExists
+        """
+        database = self._get_database()
+        if database['fs.files'].find_one({'_id': file_id}, {'_id': 1}) is not None:
+            return
+        cutoff = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=STALE_UPLOAD_SECONDS))
+        deleted = database['fs.chunks'].delete_many({'files_id': file_id, '_id': {'$lt': cutoff}}).deleted_count
+        if deleted:
+            logger.warning(f"Removed {deleted} chunks left by a failed upload of image {file_id}")
+
+    def _add_reference(self, file_id, count):
+        """
+        Increase the ref_count of a stored file
+
+        Args:
+            file_id: ObjectId of the file
+            count: Number of references to add
+
+        Returns:
+            bool: True if the file exists and gained the references
+        """
+        # referenced_at keeps the garbage collector off files re-referenced
+        # by an upload whose history document is not written yet
+        return self._get_database()['fs.files'].find_one_and_update(
+            {'_id': file_id},
+            {'$inc': {'ref_count': count}, '$set': {'referenced_at': datetime.utcnow()}},
+            projection={'_id': 1}
+        ) is not None
+
+    def _ensure_indexes(self):
+        """Create the GridFS indexes and the deduplication and derivative indexes once"""
+        if self._indexes_ready:
+            return
+        database = self._get_database()
+        database['fs.chunks'].create_index([('files_id', 1), ('n', 1)], unique=True)
+        database['fs.files'].create_index([('filename', 1), ('uploadDate', 1)])
+        database['fs.files'].create_index([('parent_id', 1), ('variant', 1)], sparse=True)
+        database['fs.files'].create_index('content_hash', unique=True,
+                                          partialFilterExpression={'content_hash': {'$exists': True}})
+        self._indexes_ready = True
+
+    def _get_database(self):
+        """Return the database holding the GridFS collections"""
+        if self._database is not None:
+            return self._database
+        return mongo.db
+
+    def _get_bucket(self):
+        """Return a GridFSBucket on the GridFS collections (cheap, no round-trip)"""
+        return GridFSBucket(self._get_database(), chunk_size_bytes=self.chunk_size)
+
+
+class ObjectStoreBackend(StorageBackend):
+    """
+    Base class for content-addressed object stores
+
+    Image bytes live in the object store under their SHA-256. A small
+    document per original in the `image_objects` collection records the
+    reference count, content type and derivatives, so MongoDB no longer
+    holds any image bytes. Objects are written before their document, so
+    readers never see a document without its object.
+    """
+
+    def __init__(self, collection=None):
+        """
+        Args:
+            collection: Collection for image documents (defaults to mongo.db.image_objects)
+        """
+        self._collection = collection
+
+    def make_ref(self, prepared):
+        return f"{self.name}:{prepared['metadata']['content_hash']}"
+
+    def store(self, prepared_images):
+        if not prepared_images:
+            return []
+
+        collection = self._get_collection()
+        references, unique_images = _count_references(prepared_images, self.make_ref)
+
+        written = 0
+        for ref, prepared in unique_images.items():
+            # Images already stored only gain references, in one update that
+            # fails if a delete removed the image meanwhile
+            if self._add_reference(collection, ref, references[ref]):
+                continue
+
+            content_hash = prepared['metadata']['content_hash']
+            document = {
+                '_id': ref,
+                'ref_count': references[ref],
+                'length': len(prepared['data']),
+                'content_type': prepared['metadata'].get('content_type'),
+                'upload_date': datetime.utcnow(),
+                'derivatives': {}
+            }
+            document.update({k: v for k, v in prepared['metadata'].items() if k != 'content_type'})
+
+            self._write_object(content_hash, prepared['data'], document['content_type'])
+            for derivative in prepared.get('derivatives', []):
+                variant = derivative['metadata']['variant']
+                key = f"{content_hash}.{variant}"
+                self._write_object(key, derivative['data'], derivative['metadata']['content_type'])
+                document['derivatives'][variant] = {
+                    'key': key,
+                    'length': len(derivative['data']),
+                    'content_type': derivative['metadata']['content_type']
+                }
+
+            try:
+                collection.insert_one(document)
+                written += 1
+            except DuplicateKeyError:
+                # Stored concurrently by another writer
+                if not self._add_reference(collection, ref, references[ref]):
+                    logger.error(f"Image {ref} could neither be referenced nor stored in {self.name}")
+                    raise RuntimeError(f"Could not store image {ref} in {self.name}")
+
+        deduplicated = len(prepared_images) - written
+        if deduplicated:
+            metrics.increment('storage.deduplicated_images', deduplicated)
+
+        logger.info(f"Stored {written} images in {self.name}, {deduplicated} deduplicated")
+        return [self.make_ref(prepared) for prepared in prepared_images]
+
+    def open(self, ref, variant=None):
+        document = self._get_collection().find_one({'_id': ref})
+        if document is None:
+            logger.warning(f"Image not found in {self.name} with reference {ref}")
+            return None
+
+        derivative = document.get('derivatives', {}).get(variant) if variant else None
+        key = derivative['key'] if derivative else document['content_hash']
+        content_type = derivative['content_type'] if derivative else document.get('content_type')
+
+        stream = self._open_object(key)
+        if stream is None:
+            logger.warning(f"Object {key} missing from {self.name}")
+            return None
+
+        return {
+            'stream': stream,
+            'length': derivative['length'] if derivative else document['length'],
+            'content_type': content_type or 'image/jpeg',
+            # Objects are immutable and named by their content
+            'etag': key,
+            'last_modified': document.get('upload_date')
+        }
+
+    def delete(self, ref):
+        collection = self._get_collection()
+
+        # As in GridFSBackend.delete, only the last reference removes the image
+        while True:
+            # Shared images only lose a reference
+            if collection.find_one_and_update({'_id': ref, 'ref_count': {'$gt': 1}}, {'$inc': {'ref_count': -1}}):
+                logger.info(f"Removed a reference to shared image {ref}")
+                return True
+
+            if self.purge(ref, condition=LAST_REFERENCE) is not None:
+                logger.info(f"Image deleted from {self.name} with reference {ref}")
+                return True
+
+            if collection.find_one({'_id': ref}) is None:
+                logger.warning(f"Image not found in {self.name} with reference {ref}")
+                return False
+
+    def purge(self, ref, condition=None):
+        """
+        Delete an image and its derivatives whatever its ref_count
+
+        Args:
+            ref: Image reference
+            condition: Extra query the image document must match to be deleted
+
+        Returns:
+            dict: The deleted image document, or None if nothing was deleted
+        """
+        query = dict(condition or {})
+        query['_id'] = ref
+        document = self._get_collection().find_one_and_delete(query)
+        if document is None:
+            return None
+
+        for derivative in document.get('derivatives', {}).values():
+            self._delete_object(derivative['key'])
+        self._delete_object(document['content_hash'])
+        return document
+
+    def _add_reference(self, collection, ref, count):
+        """Add references to a stored image, True if it exists (see GridFSBackend._add_reference)"""
+        result = collection.update_one({'_id': ref},
+                                       {'$inc': {'ref_count': count}, '$set': {'referenced_at': datetime.utcnow()}})
+        return result.matched_count > 0
+
+    def _get_collection(self):
+        """Return the image document collection"""
+        if self._collection is not None:
+            return self._collection
+        return mongo.db.image_objects
+
+    def _write_object(self, key, data, content_type):
+        """Write an object (idempotent, objects are named by their content)"""
+        raise NotImplementedError
+
+    def _open_object(self, key):
+        """Return a readable file object for an object, or None if missing"""
+        raise NotImplementedError
+
+    def _delete_object(self, key):
+        """Delete an object if it exists"""
+        raise NotImplementedError
+
+
+class LocalDiskBackend(ObjectStoreBackend):
+    """
+    Content-addressed files on a local or mounted disk
+
+    Files are sharded into two levels of directories named after the first
+    hex digits of their hash (ab/cd/abcd...) to keep directories small, and
+    written to a temporary file that is renamed into place so readers never
+    see a partial file.
+    """
+
+    name = 'disk'
+
+    def __init__(self, root, collection=None):
+        """
+        Args:
+            root: Directory holding the object tree
+            collection: Collection for image documents (defaults to mongo.db.image_objects)
+        """
+        super().__init__(collection)
+        self.root = root
+
+    def path_for(self, key):
+        """Return the sharded file path of an object"""
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _write_object(self, key, data, content_type):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            return
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix='.tmp-', delete=False) as temp_file:
+            try:
+                source = BytesIO(data)
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    temp_file.write(chunk)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            except Exception:
+                os.unlink(temp_file.name)
+                raise
+        os.replace(temp_file.name, path)
+
+    def _open_object(self, key):
+        try:
+            return open(self.path_for(key), 'rb')
+        except FileNotFoundError:
+            return None
+
+    def _delete_object(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Backend(ObjectStoreBackend):
+    """
+    Content-addressed objects in an S3-compatible bucket
+
+    Works with AWS S3 and with self-hosted or local stand-ins such as MinIO
+    through endpoint_url. Requires the optional boto3 package.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='images/', endpoint_url=None, client=None, collection=None):
+        """
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix for image objects
+            endpoint_url: S3 API endpoint (None for AWS)
+            client: Existing boto3 S3 client (created from the environment if None)
+            collection: Collection for image documents (defaults to mongo.db.image_objects)
+        """
+        super().__init__(collection)
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The s3 image storage backend requires boto3 (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _write_object(self, key, data, content_type):
+        # upload_fileobj streams the body and switches to multipart uploads for large objects
+        self.client.upload_fileobj(
+            BytesIO(data), self.bucket, self.prefix + key,
+            ExtraArgs={'ContentType': content_type or 'application/octet-stream'}
+        )
+
+    def _open_object(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def _delete_object(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+
+# Backend instances by name, created on first use
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def _create_backend(name, config):
+    """Create a backend from the app config"""
+    if name == 'gridfs':
+        return GridFSBackend(chunk_size=config.get('IMAGE_STORAGE_CHUNK_SIZE', CHUNK_SIZE))
+    if name == 'disk':
+        return LocalDiskBackend(config.get('IMAGE_STORAGE_DISK_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads', 'objects'))
+    if name == 's3':
+        if not config.get('IMAGE_STORAGE_S3_BUCKET'):
+            raise ValueError("IMAGE_STORAGE_S3_BUCKET must be set for the s3 image storage backend")
+        return S3Backend(
+            config.get('IMAGE_STORAGE_S3_BUCKET'),
+            prefix=config.get('IMAGE_STORAGE_S3_PREFIX', 'images/'),
+            endpoint_url=config.get('IMAGE_STORAGE_S3_ENDPOINT_URL') or None
+        )
+    raise ValueError(f"Unknown image storage backend '{name}'")
+
+
+def get_backend(name=None):
+    """
+    Return a storage backend by name
+
+    Args:
+        name: 'gridfs', 'disk' or 's3' (defaults to IMAGE_STORAGE_BACKEND)
+
+    Returns:
+        StorageBackend: Shared backend instance
+    """
+    config = current_app.config if has_app_context() else {}
+    name = name or config.get('IMAGE_STORAGE_BACKEND', DEFAULT_BACKEND)
+
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = _create_backend(name, config)
+    return backend
+
+
+def get_backend_for_ref(ref):
+    """Return the backend an image reference was stored with"""
+    prefix, separator, _ = ref.partition(':')
+    return get_backend(prefix if separator else DEFAULT_BACKEND)
@@ -0,0 +1,83 @@
+"""
+Upload handling utilities.
+
+Multipart file parts are written to a spooled temporary file while the
+request body is parsed, so an upload only stays in memory up to the
+configured threshold and is rolled over to disk beyond it.
+"""
+import hashlib
+from tempfile import SpooledTemporaryFile
+from flask import Request, current_app, jsonify
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Werkzeug's own default threshold, used when no app config is available
+DEFAULT_SPOOL_THRESHOLD = 500 * 1024
+
+
+class SpooledUploadRequest(Request):
+    """Request class that spools uploaded files using a configurable threshold"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        """
+        Return the stream an uploaded file part is written to
+
+        Args:
+            total_content_length: Length of the whole request body
+            content_type: MIME type of the file part
+            filename: Original filename of the file part
+            content_length: Length of the file part, if the client sent it
+
+        Returns:
+            SpooledTemporaryFile: Stream that rolls over to disk above the threshold
+        """
+        threshold = DEFAULT_SPOOL_THRESHOLD
+        if current_app:
+            threshold = current_app.config.get('UPLOAD_SPOOL_THRESHOLD', DEFAULT_SPOOL_THRESHOLD)
+
+        return SpooledTemporaryFile(max_size=threshold, mode='rb+')
+
+
+def hash_stream(stream, chunk_size=64 * 1024):
+    """
+    Compute the SHA-256 of an uploaded file without loading it into memory
+
+    Args:
+        stream: Seekable file object (e.g. a FileStorage)
+        chunk_size: Bytes read at a time
+
+    Returns:
+        str: Hex digest; the stream is left at its start
+    """
+    stream.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def init_upload_handling(app):
+    """
+    Configure streaming upload handling for the application
+
+    Args:
+        app: Flask application
+    """
+    app.request_class = SpooledUploadRequest
+
+    @app.errorhandler(413)
+    def request_entity_too_large(error):
+        """Return a JSON error when an upload exceeds MAX_CONTENT_LENGTH"""
+        max_length = app.config.get('MAX_CONTENT_LENGTH')
+        logger.warning(f"Rejected upload larger than {max_length} bytes")
+        return jsonify({
+            'error': 'Uploaded file is too large',
+            'max_content_length': max_length
+        }), 413
+
+    logger.info(
+        f"Upload handling configured (max content length: {app.config.get('MAX_CONTENT_LENGTH')}, "
+        f"spool threshold: {app.config.get('UPLOAD_SPOOL_THRESHOLD')})"
+    )
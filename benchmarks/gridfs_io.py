@@ -0,0 +1,177 @@
+"""
+Benchmark GridFS image I/O: round-trips and peak memory per operation
+
+Compares the legacy whole-buffer path (fs.put of a bytes copy, fs.exists
+plus fs.get().read(), fs.exists plus fs.delete) with the streaming
+GridFSBackend (upload streams with content-derived IDs, download streams
+read one chunk at a time, single round-trip existence checks). Round-trips are counted with a pymongo
+CommandListener and peak memory is measured with tracemalloc.
+
+Unlike the other benchmarks this one needs a MongoDB server. It works in a
+scratch database that is dropped afterwards.
+
+Usage:
+    python benchmarks/gridfs_io.py --mongo-uri mongodb://localhost:27017
+    python benchmarks/gridfs_io.py --sizes 100000,2000000,16000000 --json
+"""
+
+import os
+import sys
+import json
+import argparse
+import tracemalloc
+from io import BytesIO
+from collections import Counter
+
+from gridfs import GridFS
+from pymongo import MongoClient, monitoring
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import CHUNK_SIZE, GridFSBackend
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count the commands sent to the server, i.e. the round-trips"""
+
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        self.commands.clear()
+
+    def total(self):
+        return sum(self.commands.values())
+
+
+def _measure(counter, operation):
+    """Run an operation and return (round-trips, peak traced memory in bytes)"""
+    counter.reset()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return counter.total(), peak
+
+
+def _prepared(size, seed):
+    """A prepared image of the given size, as ImageStorage.prepare_prediction_image returns"""
+    data = os.urandom(size - 8) + seed.to_bytes(8, 'big')
+    content_hash = ImageStorage.content_hash(data, 'bench')
+    return {
+        '_id': ImageStorage.content_file_id(content_hash),
+        'data': data,
+        'metadata': {
+            'content_type': 'image/jpeg',
+            'prediction_id': f"bench-{seed}",
+            'user_id': 'bench',
+            'filename': f"bench-{seed}.jpg",
+            'content_hash': content_hash
+        }
+    }
+
+
+def _read_streaming(backend, ref):
+    """Read an image the way the download endpoint does, one buffer at a time"""
+    image = backend.open(ref)
+    with image['stream'] as stream:
+        for _ in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            pass
+
+
+def run_benchmark(uri, sizes, database_name='plant_bench_gridfs'):
+    """
+    Measure write, read and delete of one image per size on both paths
+
+    Returns:
+        list: One result dict per (path, size, operation)
+    """
+    counter = CommandCounter()
+    client = MongoClient(uri, event_listeners=[counter])
+    client.drop_database(database_name)
+    database = client[database_name]
+    fs = GridFS(database)
+    backend = GridFSBackend(database=database)
+
+    # Create indexes and warm up connections outside the measurements
+    backend.store([_prepared(1024, 0)])
+    fs.put(b'warmup', filename='warmup')
+
+    results = []
+    try:
+        for index, size in enumerate(sizes, start=1):
+            legacy = _prepared(size, index)
+            streaming = _prepared(size, index + len(sizes))
+
+            def legacy_write():
+                metadata = dict(legacy['metadata'])
+                # The legacy save copied the encoded BytesIO into bytes before fs.put
+                data = BytesIO(legacy['data']).read()
+                fs.put(data, _id=legacy['_id'], contentType=metadata.pop('content_type'), **metadata)
+
+            def legacy_read():
+                if fs.exists(legacy['_id']):
+                    fs.get(legacy['_id']).read()
+
+            def legacy_delete():
+                if fs.exists(legacy['_id']):
+                    fs.delete(legacy['_id'])
+                for derivative in fs.find({'parent_id': legacy['_id']}):
+                    fs.delete(derivative._id)
+
+            ref = backend.make_ref(streaming)
+            operations = [
+                ('legacy', 'write', legacy_write),
+                ('legacy', 'read', legacy_read),
+                ('legacy', 'delete', legacy_delete),
+                ('streaming', 'write', lambda: backend.store([streaming])),
+                ('streaming', 'read', lambda: _read_streaming(backend, ref)),
+                ('streaming', 'delete', lambda: backend.delete(ref))
+            ]
+            for path, operation, function in operations:
+                round_trips, peak = _measure(counter, function)
+                results.append({
+                    'path': path,
+                    'operation': operation,
+                    'bytes': size,
+                    'round_trips': round_trips,
+                    'peak_memory_mb': round(peak / (1024 * 1024), 2)
+                })
+    finally:
+        client.drop_database(database_name)
+        client.close()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure GridFS round-trips and peak memory per image operation")
+    parser.add_argument("--mongo-uri", default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'),
+                        help="MongoDB server to benchmark against")
+    parser.add_argument("--sizes", default="100000,1000000,16000000",
+                        help="Comma separated image sizes in bytes")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    args = parser.parse_args()
+    results = run_benchmark(args.mongo_uri, [int(size) for size in args.sizes.split(',')])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'path':<10} {'operation':<9} {'image MB':>9} {'round-trips':>12} {'peak memory MB':>15}")
+        for result in results:
+            print(f"{result['path']:<10} {result['operation']:<9} {result['bytes'] / (1024 * 1024):>9.2f} "
+                  f"{result['round_trips']:>12} {result['peak_memory_mb']:>15.2f}")
@@ -0,0 +1,144 @@
+"""
+Compare the conversion of prediction history pages to JSON
+
+The legacy path turned a cursor into JSON-serializable dicts with
+json.loads(json_util.dumps(list(cursor))) before jsonify encoded them
+again; the current path converts each document with
+app.utils.serialization while iterating. For each page size this times
+the conversion alone and the conversion plus the final json.dumps done by
+jsonify, on synthetic history documents decoded from BSON so they carry
+the same types a pymongo cursor returns.
+
+Usage:
+    python benchmarks/history_serialization.py
+    python benchmarks/history_serialization.py --pages 100,500,2000 --repeats 50 --json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+import bson
+from bson import json_util
+from bson.objectid import ObjectId
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.serialization import documents_to_json
+
+CLASSES = ['Tomato___healthy', 'Tomato___Late_blight', 'Potato___Early_blight', 'Corn___Common_rust']
+
+
+def make_history_documents(count, seed=0):
+    """
+    Build history documents shaped like the ones /predict stores
+
+    Returns:
+        list: Documents as a pymongo cursor would return them
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    documents = []
+    for index in range(count):
+        class_name = rng.choice(CLASSES)
+        plant_type, _, condition = class_name.partition('___')
+        created_at = start + timedelta(seconds=rng.randint(0, 180 * 86400), microseconds=rng.randint(0, 999999))
+        documents.append({
+            '_id': ObjectId(),
+            'prediction_id': f"{rng.getrandbits(128):032x}",
+            'user_id': 'bench-user',
+            'class_name': class_name,
+            'confidence': rng.random(),
+            'timestamp': created_at.isoformat(),
+            'plant_type': plant_type,
+            'condition': condition,
+            'advice': ' '.join(['Remove infected leaves and apply a copper based fungicide.'] * rng.randint(20, 40)),
+            'top_predictions': [{'class_name': name, 'confidence': rng.random()} for name in rng.sample(CLASSES, 3)],
+            'timings_ms': {'preprocess_ms': rng.random() * 20, 'inference_ms': rng.random() * 80},
+            'image_path': str(ObjectId()),
+            'storage_type': 'gridfs',
+            'created_at': created_at,
+            'image_expires_at': created_at + timedelta(days=90)
+        })
+    # Round-trip through BSON so values have the types a cursor yields
+    return bson.decode_all(b''.join(bson.encode(document) for document in documents))
+
+
+def legacy_convert(documents):
+    return json.loads(json_util.dumps(list(documents)))
+
+
+def _median_ms(function, repeats):
+    """Run a function several times and return (last result, median milliseconds)"""
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return result, statistics.median(timings)
+
+
+def run_benchmark(page_sizes, repeats=20, seed=0):
+    """
+    Time both conversions on pages of each size
+
+    Args:
+        page_sizes: Documents per page
+        repeats: Timed runs per measurement
+        seed: Seed of the synthetic documents
+
+    Returns:
+        list: One result dict per page size
+    """
+    results = []
+    for page_size in page_sizes:
+        documents = make_history_documents(page_size, seed)
+
+        legacy, legacy_ms = _median_ms(lambda: legacy_convert(documents), repeats)
+        current, current_ms = _median_ms(lambda: documents_to_json(documents), repeats)
+        if current != legacy:
+            raise AssertionError("documents_to_json output differs from json_util")
+
+        _, legacy_response_ms = _median_ms(lambda: json.dumps(legacy_convert(documents)), repeats)
+        _, current_response_ms = _median_ms(lambda: json.dumps(documents_to_json(documents)), repeats)
+
+        results.append({
+            'page_size': page_size,
+            'response_bytes': len(json.dumps(current)),
+            'legacy_convert_ms': round(legacy_ms, 3),
+            'convert_ms': round(current_ms, 3),
+            'convert_speedup': round(legacy_ms / current_ms, 2),
+            'legacy_response_ms': round(legacy_response_ms, 3),
+            'response_ms': round(current_response_ms, 3),
+            'response_speedup': round(legacy_response_ms / current_response_ms, 2)
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare history page conversion to JSON, legacy vs. direct")
+    parser.add_argument("--pages", default="100,500", help="Comma separated page sizes")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed runs per measurement")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic documents")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    args = parser.parse_args()
+    results = run_benchmark([int(size) for size in args.pages.split(',')], repeats=args.repeats, seed=args.seed)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'page':>6} {'KB':>8} {'legacy ms':>10} {'direct ms':>10} {'speedup':>8} "
+              f"{'legacy+dumps':>13} {'direct+dumps':>13} {'speedup':>8}")
+        for result in results:
+            print(f"{result['page_size']:>6} {result['response_bytes'] / 1024:>8.1f} "
+                  f"{result['legacy_convert_ms']:>10.2f} {result['convert_ms']:>10.2f} "
+                  f"{result['convert_speedup']:>7.2f}x {result['legacy_response_ms']:>13.2f} "
+                  f"{result['response_ms']:>13.2f} {result['response_speedup']:>7.2f}x")
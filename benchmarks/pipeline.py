@@ -0,0 +1,292 @@
+"""
+Deterministic benchmark and regression check for the image prediction pipeline
+
+Times each stage of a prediction in isolation - decode, resize, normalise,
+infer, post-process and the JPEG re-encode done by ImageStorage - on
+synthetic leaf images of several sizes and formats. No MongoDB or network
+access is needed: when the real model file is missing a small stand-in
+Keras model with the same input shape and class count is used.
+
+Results are written as JSON so a run can be compared against a saved
+baseline; the script exits with status 1 when any stage regresses beyond
+the threshold.
+
+Usage:
+    python benchmarks/pipeline.py --output bench_results.json
+    python benchmarks/pipeline.py --baseline bench_baseline.json --threshold 0.25
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = ('decode', 'resize', 'normalise', 'infer', 'postprocess', 'jpeg_encode')
+
+DEFAULT_SIZES = ((224, 224), (1024, 768), (4032, 3024))
+DEFAULT_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+# Regressions smaller than this many milliseconds are treated as noise
+DEFAULT_MIN_DELTA_MS = 0.5
+
+
+def make_leaf_image(width, height, seed=0):
+    """
+    Create a synthetic diseased-leaf image, as create_test_image.py does
+
+    A brownish background with yellow blight spots and a green border,
+    drawn deterministically from the seed and scaled to the requested size.
+    """
+    rng = np.random.default_rng(seed)
+    image_array = np.zeros((height, width, 3), dtype=np.uint8)
+    image_array[:, :] = [139, 69, 19]  # Brownish color
+
+    # Add yellowish spots (early blight characteristics)
+    yy, xx = np.ogrid[:height, :width]
+    scale = min(width, height) / 224.0
+    for _ in range(20):
+        x = rng.integers(int(10 * scale), width - int(10 * scale))
+        y = rng.integers(int(10 * scale), height - int(10 * scale))
+        spot_size = rng.integers(5, 20) * scale
+        mask = (xx - x) ** 2 + (yy - y) ** 2 <= spot_size ** 2
+        image_array[mask] = [218, 165, 32]  # Gold/yellow color
+
+    # Green edge to simulate the healthy part of the leaf
+    edge_width = max(1, int(20 * scale))
+    image_array[:edge_width, :] = [34, 139, 34]
+    image_array[-edge_width:, :] = [34, 139, 34]
+    image_array[:, :edge_width] = [34, 139, 34]
+    image_array[:, -edge_width:] = [34, 139, 34]
+
+    # Mild sensor noise so encoders see realistic entropy
+    noise = rng.integers(-6, 7, size=image_array.shape)
+    return np.clip(image_array.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def encode_image(pixels, format):
+    """Encode a pixel array in the given format and return the bytes"""
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format=format)
+    return output.getvalue()
+
+
+def load_model_loader():
+    """
+    Return a ModelLoader with the real model, or a stand-in with the same shapes
+
+    Returns:
+        tuple: (ModelLoader, bool) where the bool tells whether the real model was used
+    """
+    from app.core.models.model_loader import ModelLoader
+    from app.core.resources import ResourceManager
+
+    model_loader = ModelLoader()
+    model_path = ResourceManager.get_model_path()
+    if model_path and model_loader.load_model(model_path):
+        return model_loader, True
+
+    import tensorflow as tf
+    model_loader._load_class_names()
+    num_classes = max(len(model_loader.class_names), 1)
+    height, width, channels = model_loader.get_input_shape()
+
+    inputs = tf.keras.Input((height, width, channels))
+    x = tf.keras.layers.Conv2D(16, 3, strides=2, activation='relu')(inputs)
+    x = tf.keras.layers.Conv2D(32, 3, strides=2, activation='relu')(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    model_loader.model.model = tf.keras.Model(inputs, outputs)
+    return model_loader, False
+
+
+def _time_ms(func, *args):
+    """Call func and return (result, elapsed milliseconds)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000.0
+
+
+def benchmark_case(encoded, model_loader, repeats):
+    """
+    Time every pipeline stage for one encoded image
+
+    Returns:
+        dict: Stage name to {'median_ms', 'p95_ms'}
+    """
+    from app.utils.image import decode_image, resize_image, normalize_image
+    from app.utils.storage import ImageStorage
+
+    target_size = model_loader.get_input_size()
+    timings = {stage: [] for stage in STAGES}
+
+    # Silence Keras progress bars
+    predict = model_loader.model.model.predict
+
+    # Warm up the model so graph tracing is not measured
+    predict(np.zeros((1,) + model_loader.get_input_shape(), dtype=np.float32), verbose=0)
+
+    for _ in range(repeats):
+        image, elapsed = _time_ms(decode_image, io.BytesIO(encoded), target_size)
+        timings['decode'].append(elapsed)
+
+        image, elapsed = _time_ms(resize_image, image, target_size)
+        timings['resize'].append(elapsed)
+
+        batch, elapsed = _time_ms(normalize_image, image)
+        timings['normalise'].append(elapsed)
+
+        scores, elapsed = _time_ms(lambda b: np.asarray(predict(b, verbose=0)), batch)
+        timings['infer'].append(elapsed)
+
+        _, elapsed = _time_ms(model_loader.format_prediction, scores[0])
+        timings['postprocess'].append(elapsed)
+
+        _, elapsed = _time_ms(ImageStorage.encode_prediction_image, io.BytesIO(encoded))
+        timings['jpeg_encode'].append(elapsed)
+
+    return {
+        stage: {
+            'median_ms': round(float(np.median(values)), 4),
+            'p95_ms': round(float(np.percentile(values, 95)), 4)
+        }
+        for stage, values in timings.items()
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, formats=DEFAULT_FORMATS, repeats=10, seed=0):
+    """
+    Run the benchmark over every (size, format) combination
+
+    Returns:
+        dict: JSON-serialisable results
+    """
+    model_loader, real_model = load_model_loader()
+
+    cases = {}
+    for width, height in sizes:
+        pixels = make_leaf_image(width, height, seed=seed)
+        for format in formats:
+            encoded = encode_image(pixels, format)
+            name = f"{format.lower()}_{width}x{height}"
+            cases[name] = {
+                'bytes': len(encoded),
+                'stages': benchmark_case(encoded, model_loader, repeats)
+            }
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'real_model': real_model,
+            'repeats': repeats,
+            'seed': seed
+        },
+        'cases': cases
+    }
+
+
+def compare_results(current, baseline, threshold=0.25, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """
+    Compare a run against a baseline
+
+    A stage regresses when its median is more than `threshold` (relative)
+    and more than `min_delta_ms` (absolute) slower than the baseline.
+
+    Returns:
+        list: One dict per regressed (case, stage)
+    """
+    regressions = []
+    for case_name, case in current['cases'].items():
+        baseline_case = baseline.get('cases', {}).get(case_name)
+        if not baseline_case:
+            continue
+
+        for stage, stats in case['stages'].items():
+            baseline_stats = baseline_case['stages'].get(stage)
+            if not baseline_stats:
+                continue
+
+            before = baseline_stats['median_ms']
+            after = stats['median_ms']
+            if after - before > min_delta_ms and after > before * (1.0 + threshold):
+                regressions.append({
+                    'case': case_name,
+                    'stage': stage,
+                    'baseline_ms': before,
+                    'current_ms': after,
+                    'change': round(after / before - 1.0, 4) if before else None
+                })
+    return regressions
+
+
+def _print_results(results):
+    """Print a table of median stage timings"""
+    header = f"{'case':<20} {'bytes':>10} " + " ".join(f"{stage:>12}" for stage in STAGES)
+    print(header)
+    for case_name, case in results['cases'].items():
+        row = f"{case_name:<20} {case['bytes']:>10} "
+        row += " ".join(f"{case['stages'][stage]['median_ms']:>12.3f}" for stage in STAGES)
+        print(row)
+
+
+def _parse_sizes(value):
+    """Parse '224x224,1024x768' into [(224, 224), (1024, 768)]"""
+    sizes = []
+    for item in value.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the image prediction pipeline stage by stage")
+    parser.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SIZES),
+                        help="Comma separated WIDTHxHEIGHT image sizes")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS),
+                        help="Comma separated Pillow formats")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed iterations per case")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic images")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--baseline", help="Compare against this results JSON and fail on regression")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed relative slowdown of a stage median before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help="Ignore slowdowns smaller than this many milliseconds")
+
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        sizes=_parse_sizes(args.sizes),
+        formats=[f.strip().upper() for f in args.formats.split(',')],
+        repeats=args.repeats,
+        seed=args.seed
+    )
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare_results(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"- {regression['case']} / {regression['stage']}: "
+                      f"{regression['baseline_ms']:.3f} ms -> {regression['current_ms']:.3f} ms")
+            sys.exit(1)
+
+        print("\nNo regressions against baseline")
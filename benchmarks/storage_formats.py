@@ -0,0 +1,184 @@
+"""
+Compare storage formats for prediction images: size and encode/decode time
+
+Encodes every image in test_data/ (and optional synthetic leaf images at
+larger sizes) in each storage format with ImageStorage, the same encoder
+used at upload, and reports the stored size of the original and of its
+derivatives together with encode and decode times. Sizes are also given
+relative to the first format, the baseline.
+
+Usage:
+    python benchmarks/storage_formats.py
+    python benchmarks/storage_formats.py --formats JPEG:85,WEBP:80,AVIF:60 --max-dimension 2048 --json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from io import BytesIO
+
+from PIL import Image, UnidentifiedImageError
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.storage import ImageStorage, IMAGE_FORMATS
+from benchmarks.pipeline import make_leaf_image
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_data')
+
+
+def load_images(data_dir, synthetic_sizes, seed=0):
+    """
+    Load the images of a directory and generate synthetic ones
+
+    Files Pillow cannot open are skipped with a note.
+
+    Returns:
+        list: (name, PIL image) tuples
+    """
+    images = []
+    for filename in sorted(os.listdir(data_dir)) if os.path.isdir(data_dir) else []:
+        path = os.path.join(data_dir, filename)
+        try:
+            with Image.open(path) as img:
+                img.load()
+                images.append((filename, img.convert('RGB')))
+        except (UnidentifiedImageError, OSError):
+            print(f"Skipping {filename}: not an image Pillow can open", file=sys.stderr)
+
+    for width, height in synthetic_sizes:
+        images.append((f"synthetic_{width}x{height}", Image.fromarray(make_leaf_image(width, height, seed))))
+    return images
+
+
+def _median_ms(function, repeats):
+    """Run a function several times and return (last result, median milliseconds)"""
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return result, statistics.median(timings)
+
+
+def _decode(data):
+    img = Image.open(BytesIO(data))
+    img.load()
+    return img
+
+
+def benchmark_image(img, image_format, quality, max_dimension, repeats):
+    """
+    Encode one image as it would be stored and time it
+
+    Returns:
+        dict: Stored bytes of the original and derivatives, encode and decode medians
+    """
+    if max_dimension and max(img.size) > max_dimension:
+        img = img.copy()
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    output, encode_ms = _median_ms(
+        lambda: ImageStorage.encode_prediction_image(img, quality=quality, image_format=image_format), repeats)
+    data = output.getvalue()
+    _, decode_ms = _median_ms(lambda: _decode(data), repeats)
+
+    derivatives = ImageStorage.prepare_derivatives(img, 'bench', {'prediction_id': 'bench'}, image_format=image_format)
+    return {
+        'stored_size': f"{img.size[0]}x{img.size[1]}",
+        'original_bytes': len(data),
+        'derivative_bytes': sum(len(derivative['data']) for derivative in derivatives),
+        'encode_ms': round(encode_ms, 2),
+        'decode_ms': round(decode_ms, 2)
+    }
+
+
+def run_benchmark(images, formats, max_dimension=0, repeats=3):
+    """
+    Benchmark every image in every supported format
+
+    Args:
+        images: (name, PIL image) tuples
+        formats: (format, quality) tuples, the first is the size baseline
+        max_dimension: Cap on the stored original's longest side (0 for none)
+        repeats: Timed runs per measurement
+
+    Returns:
+        list: One result dict per (image, format)
+    """
+    Image.init()
+    supported = []
+    for image_format, quality in formats:
+        if image_format in Image.SAVE:
+            supported.append((image_format, quality))
+        else:
+            print(f"Skipping {image_format}: the installed Pillow cannot encode it", file=sys.stderr)
+
+    results = []
+    for name, img in images:
+        baseline = None
+        for image_format, quality in supported:
+            result = benchmark_image(img, image_format, quality, max_dimension, repeats)
+            total = result['original_bytes'] + result['derivative_bytes']
+            baseline = baseline or total
+            result.update({
+                'image': name,
+                'format': image_format,
+                'quality': quality,
+                'relative_size': round(total / baseline, 3)
+            })
+            results.append(result)
+    return results
+
+
+def _parse_formats(value):
+    """Parse 'JPEG:85,WEBP:80' into [('JPEG', 85), ('WEBP', 80)]"""
+    formats = []
+    for item in value.split(','):
+        image_format, _, quality = item.partition(':')
+        image_format = image_format.strip().upper()
+        if image_format not in IMAGE_FORMATS:
+            raise argparse.ArgumentTypeError(f"Unknown format '{image_format}'")
+        formats.append((image_format, int(quality or 80)))
+    return formats
+
+
+def _parse_sizes(value):
+    """Parse '1024x768,4000x3000' into [(1024, 768), (4000, 3000)]"""
+    sizes = []
+    for item in filter(None, value.split(',')):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare stored image size and encode/decode time across formats")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Directory of sample images")
+    parser.add_argument("--formats", type=_parse_formats, default=_parse_formats("JPEG:85,WEBP:80,AVIF:60"),
+                        help="Comma separated FORMAT:quality pairs, the first is the size baseline")
+    parser.add_argument("--synthetic", type=_parse_sizes, default=_parse_sizes("1024x768,4000x3000"),
+                        help="Comma separated WIDTHxHEIGHT synthetic leaf images to add (empty for none)")
+    parser.add_argument("--max-dimension", type=int, default=0, help="IMAGE_STORAGE_MAX_DIMENSION to apply")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per measurement")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    args = parser.parse_args()
+    results = run_benchmark(load_images(args.data_dir, args.synthetic), args.formats,
+                            max_dimension=args.max_dimension, repeats=args.repeats)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'image':<26} {'format':<8} {'stored':>10} {'original KB':>12} {'derivs KB':>10} "
+              f"{'relative':>9} {'encode ms':>10} {'decode ms':>10}")
+        for result in results:
+            print(f"{result['image']:<26} {result['format'] + ':' + str(result['quality']):<8} "
+                  f"{result['stored_size']:>10} {result['original_bytes'] / 1024:>12.1f} "
+                  f"{result['derivative_bytes'] / 1024:>10.1f} {result['relative_size']:>9.3f} "
+                  f"{result['encode_ms']:>10.2f} {result['decode_ms']:>10.2f}")
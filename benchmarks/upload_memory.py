@@ -0,0 +1,171 @@
+"""
+Benchmark peak RSS per in-flight /predict upload
+
+Compares the legacy ingestion path (read the whole upload into bytes, wrap it
+in BytesIO and decode at full resolution) with the streaming path (spooled
+upload stream decoded directly by prep_image). Each case runs in a fresh
+process so peak RSS measurements do not leak between cases.
+
+Usage:
+    python benchmarks/upload_memory.py
+    python benchmarks/upload_memory.py --sizes 1024x768,4000x3000 --spool-threshold 524288
+"""
+
+import os
+import sys
+import gc
+import io
+import json
+import argparse
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _read_status_kb(field):
+    """Read a memory field (in kB) from /proc/self/status"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS watermark (VmHWM) for this process"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _make_jpeg(width, height, quality=90):
+    """Create a synthetic JPEG that compresses like a real photo (gradient plus noise)"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(x, (height, width)),
+                     np.broadcast_to(y, (height, width)),
+                     np.full((height, width), 96, dtype=np.float32)], axis=-1)
+    noise = rng.normal(0, 24, size=(height, width, 3)).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def _legacy_prep(image_file, target_size=(224, 224)):
+    """The pre-streaming prep_image: full read, BytesIO wrap, full-resolution decode"""
+    image_bytes = image_file.read()
+    image = Image.open(io.BytesIO(image_bytes))
+    image = image.convert("RGB")
+    image = image.resize(target_size)
+    img_array = np.asarray(image, dtype=np.float32)
+    img_array = img_array / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def _run_case(mode, width, height, spool_threshold, queue):
+    """Run a single upload through a minimal Flask app and report peak RSS"""
+    from flask import Flask, request, jsonify
+    from app.utils.image import prep_image
+    from app.utils.upload import SpooledUploadRequest
+
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024
+    app.config['UPLOAD_SPOOL_THRESHOLD'] = spool_threshold
+    if mode == 'streaming':
+        app.request_class = SpooledUploadRequest
+
+    measurement = {}
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        file = request.files['file']
+        if mode == 'streaming':
+            prep_image(file)
+        else:
+            _legacy_prep(file)
+        measurement['peak_kb'] = _read_status_kb('VmHWM')
+        return jsonify({'ok': True})
+
+    client = app.test_client()
+    payload = _make_jpeg(width, height)
+
+    # Warm up imports and allocator pools with a tiny upload
+    client.post('/predict', data={'file': (io.BytesIO(_make_jpeg(32, 32)), 'warmup.jpg')},
+                content_type='multipart/form-data')
+
+    gc.collect()
+    baseline_kb = _read_status_kb('VmRSS')
+    peak_reset = _reset_peak_rss()
+
+    client.post('/predict', data={'file': (io.BytesIO(payload), 'upload.jpg')},
+                content_type='multipart/form-data')
+
+    queue.put({
+        'mode': mode,
+        'image': f"{width}x{height}",
+        'upload_bytes': len(payload),
+        'peak_rss_delta_mb': round((measurement['peak_kb'] - baseline_kb) / 1024.0, 2),
+        'peak_reset': peak_reset
+    })
+
+
+def run_benchmark(sizes, spool_threshold):
+    """
+    Run every (mode, size) combination in its own process
+
+    Returns:
+        list: One result dict per case
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for width, height in sizes:
+        for mode in ('legacy', 'streaming'):
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_case, args=(mode, width, height, spool_threshold, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+    return results
+
+
+def _parse_sizes(value):
+    """Parse '1024x768,4000x3000' into [(1024, 768), (4000, 3000)]"""
+    sizes = []
+    for item in value.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure peak RSS per in-flight upload")
+    parser.add_argument("--sizes", default="1024x768,2048x1536,4000x3000",
+                        help="Comma separated WIDTHxHEIGHT image sizes")
+    parser.add_argument("--spool-threshold", type=int, default=512 * 1024,
+                        help="UPLOAD_SPOOL_THRESHOLD used for the streaming path")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    args = parser.parse_args()
+    results = run_benchmark(_parse_sizes(args.sizes), args.spool_threshold)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'mode':<10} {'image':<11} {'upload MB':>10} {'peak RSS delta MB':>18}")
+        for result in results:
+            print(f"{result['mode']:<10} {result['image']:<11} "
+                  f"{result['upload_bytes'] / (1024 * 1024):>10.2f} {result['peak_rss_delta_mb']:>18.2f}")
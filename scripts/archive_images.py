@@ -0,0 +1,51 @@
+"""
+Archive script to move old GridFS images into pack files on disk or S3
+(see app/utils/image_archive.py)
+
+Archived images stay readable through their existing image_path. Run it
+periodically, e.g. nightly from cron.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.image_archive import get_archive
+
+# Create Flask app context
+app = create_app()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old GridFS images into archive pack files")
+    parser.add_argument("--older-than-days", type=int, default=app.config['IMAGE_ARCHIVE_AFTER_DAYS'],
+                        help="Archive images uploaded more than this many days ago")
+    parser.add_argument("--pack-size-mb", type=int, default=app.config['IMAGE_ARCHIVE_PACK_SIZE'] // (1024 * 1024),
+                        help="Start a new pack file once a pack reaches this size")
+    parser.add_argument("--batch-size", type=int, default=100, help="GridFS files read per query")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of images to archive")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would be archived without doing it")
+
+    args = parser.parse_args()
+
+    start_time = time.time()
+
+    with app.app_context():
+        report = get_archive().archive(
+            older_than_days=args.older_than_days,
+            pack_size=args.pack_size_mb * 1024 * 1024,
+            batch_size=args.batch_size,
+            limit=args.limit,
+            dry_run=args.dry_run
+        )
+
+    elapsed = time.time() - start_time
+    print(f"\nArchive summary{' (dry run)' if args.dry_run else ''}:")
+    print(f"- Images archived: {report['images']}")
+    print(f"- Pack files written: {report['packs']}")
+    print(f"- Moved out of MongoDB: {report['bytes'] / (1024 * 1024):.2f} MB")
+    print(f"- Completed in {elapsed:.2f} seconds")
@@ -0,0 +1,129 @@
+"""
+Backfill script to generate thumbnail/medium derivatives for images stored
+before derivatives were produced at upload time
+"""
+
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+from PIL import Image
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.extensions import fs, mongo
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import get_backend
+
+# Create Flask app context
+app = create_app()
+
+def find_missing(batch_size, after_id=None):
+    """
+    Find original images without derivatives
+
+    Originals checked by an earlier run are skipped, including those too
+    small for any configured size, which have no derivatives.
+
+    Args:
+        batch_size: Maximum number of originals to return
+        after_id: Only consider files with a greater _id (resume point)
+
+    Returns:
+        tuple: (list of file documents missing derivatives, last _id scanned)
+    """
+    query = {'variant': {'$exists': False}, 'derivatives_checked': {'$exists': False},
+             'contentType': {'$regex': '^image/'}}
+    if after_id is not None:
+        query['_id'] = {'$gt': after_id}
+
+    originals = list(mongo.db['fs.files'].find(query).sort('_id', 1).limit(batch_size))
+    if not originals:
+        return [], None
+
+    # One query per batch to skip originals that already have derivatives
+    ids = [original['_id'] for original in originals]
+    done = set(mongo.db['fs.files'].distinct('parent_id', {'parent_id': {'$in': ids}}))
+
+    return [original for original in originals if original['_id'] not in done], ids[-1]
+
+def backfill(batch_size=100, limit=None, pause=0.0, dry_run=False):
+    """
+    Generate and store derivatives for every original image missing them
+
+    Args:
+        batch_size: Originals processed per batch (one bulk GridFS write each)
+        limit: Stop after this many originals (None for all)
+        pause: Seconds to sleep between batches to limit load on MongoDB
+        dry_run: If True, only report what would be generated
+
+    Returns:
+        tuple: (number of originals processed, number of errors)
+    """
+    processed = 0
+    errors = 0
+    after_id = None
+
+    while limit is None or processed < limit:
+        missing, after_id = find_missing(batch_size, after_id)
+        if after_id is None:
+            break
+        if limit is not None:
+            missing = missing[:limit - processed]
+
+        prepared = []
+        checked = []
+        for original in missing:
+            if dry_run:
+                print(f"[DRY RUN] Would generate derivatives for {original['_id']}")
+                processed += 1
+                continue
+            try:
+                img = Image.open(BytesIO(fs.get(original['_id']).read()))
+                prepared.extend(ImageStorage.prepare_derivatives(img, original['_id'], original))
+                checked.append(original['_id'])
+                processed += 1
+            except Exception as e:
+                print(f"Error generating derivatives for {original['_id']}: {str(e)}")
+                errors += 1
+
+        if prepared:
+            # Derivatives only: going through store() would add references to the originals
+            get_backend('gridfs').store_derivatives(prepared)
+            print(f"Stored {len(prepared)} derivatives (processed {processed} originals)")
+        if checked:
+            # Marked after the derivatives are written, so an interrupted run checks them again
+            mongo.db['fs.files'].update_many({'_id': {'$in': checked}}, {'$set': {'derivatives_checked': True}})
+
+        if pause:
+            time.sleep(pause)
+
+    return processed, errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate image derivatives for existing GridFS images")
+    parser.add_argument("--batch-size", type=int, default=100, help="Originals processed per batch")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of originals to process")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would be generated without doing it")
+
+    args = parser.parse_args()
+
+    start_time = time.time()
+
+    with app.app_context():
+        processed, errors = backfill(
+            batch_size=args.batch_size,
+            limit=args.limit,
+            pause=args.pause,
+            dry_run=args.dry_run
+        )
+
+    elapsed = time.time() - start_time
+    print(f"\nBackfill summary:")
+    print(f"- Originals processed: {processed}")
+    print(f"- Errors: {errors}")
+    print(f"- Completed in {elapsed:.2f} seconds")
@@ -0,0 +1,54 @@
+"""
+Garbage collection script for prediction images: deletes expired images
+and images no prediction_history document references, and reports the
+bytes reclaimed
+
+The web app runs the same job every IMAGE_GC_INTERVAL seconds; this script
+runs it once, e.g. from cron or after a large cleanup.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.image_gc import ImageGarbageCollector
+
+# Create Flask app context
+app = create_app()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete expired and orphaned prediction images")
+    parser.add_argument("--batch-size", type=int, default=app.config['IMAGE_GC_BATCH_SIZE'],
+                        help="Documents scanned per query")
+    parser.add_argument("--grace", type=int, default=app.config['IMAGE_GC_GRACE_SECONDS'],
+                        help="Keep images stored or referenced within this many seconds")
+    parser.add_argument("--rate", type=int, default=app.config['IMAGE_GC_MAX_DELETES_PER_SECOND'],
+                        help="Maximum files deleted per second (0 for no limit)")
+    parser.add_argument("--skip-expiry", action="store_true", help="Only collect orphaned images")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without doing it")
+
+    args = parser.parse_args()
+
+    start_time = time.time()
+    collector = ImageGarbageCollector(batch_size=args.batch_size, grace_seconds=args.grace,
+                                      max_deletes_per_second=args.rate)
+
+    with app.app_context():
+        if args.skip_expiry:
+            report = collector.collect_orphans(dry_run=args.dry_run)
+        else:
+            report = collector.run(dry_run=args.dry_run)
+
+    elapsed = time.time() - start_time
+    print(f"\nImage GC summary{' (dry run)' if args.dry_run else ''}:")
+    if 'expired_images' in report:
+        print(f"- Predictions with expired images: {report['expired_images']}")
+    print(f"- Orphaned GridFS files: {report['files']} ({report['chunks']} chunks)")
+    print(f"- Orphaned disk/s3 images: {report['objects']}")
+    print(f"- Reclaimed: {report['reclaimed_bytes'] / (1024 * 1024):.2f} MB")
+    print(f"- Completed in {elapsed:.2f} seconds")
@@ -0,0 +1,245 @@
+"""
+Migration script to move stored images between storage backends
+(gridfs, disk, s3) without downtime
+
+Every image reference names its backend, so the application keeps reading
+images from the old backend until their prediction is repointed. Set
+IMAGE_STORAGE_BACKEND to the target first so new images are written there,
+then run this script. Each image is copied, every prediction referencing it
+(in image_path or image_paths) is repointed, and only then is it removed
+from the source backend.
+"""
+
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+from PIL import Image
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.extensions import mongo
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import get_backend
+
+# Create Flask app context
+app = create_app()
+
+# image_path patterns of the images stored by each backend
+SOURCE_PATTERNS = {
+    'gridfs': '^[0-9a-f]{24}$',
+    'disk': '^disk:',
+    's3': '^s3:'
+}
+
+def find_refs(source, batch_size, after_ref=None):
+    """
+    Find image references of the source backend still used by predictions
+
+    Both image_path and the image_paths of multi-image predictions are
+    searched.
+
+    Args:
+        source: Name of the source backend
+        batch_size: Maximum number of references to return
+        after_ref: Only consider greater references (resume point)
+
+    Returns:
+        list: Distinct references, in ascending order
+    """
+    pattern = {'$regex': SOURCE_PATTERNS[source]}
+    ref_match = dict(pattern)
+    if after_ref is not None:
+        ref_match['$gt'] = after_ref
+
+    pipeline = [
+        {'$match': {'$or': [{'image_path': pattern}, {'image_paths': pattern}]}},
+        {'$project': {'refs': {'$concatArrays': [['$image_path'], {'$ifNull': ['$image_paths', []]}]}}},
+        {'$unwind': '$refs'},
+        {'$match': {'refs': ref_match}},
+        {'$group': {'_id': '$refs'}},
+        {'$sort': {'_id': 1}},
+        {'$limit': batch_size}
+    ]
+    return [doc['_id'] for doc in mongo.db.prediction_history.aggregate(pipeline)]
+
+def count_references(document, ref):
+    """
+    Count the stored references a prediction holds to an image
+
+    A multi-image prediction stored one reference per entry of image_paths
+    and repeats the first one in image_path; other predictions stored one
+    for image_path.
+
+    Args:
+        document: prediction_history document
+        ref: Image reference
+
+    Returns:
+        int: Number of references
+    """
+    if document.get('image_paths'):
+        return document['image_paths'].count(ref)
+    return int(document.get('image_path') == ref)
+
+def repoint(document, ref, new_ref, target_name):
+    """
+    Replace an image reference in a prediction
+
+    Returns:
+        bool: True if the prediction was updated, False if it no longer references the image
+    """
+    update = {}
+    array_filters = None
+    if document.get('image_path') == ref:
+        update.update({'image_path': new_ref, 'storage_type': target_name})
+    if ref in (document.get('image_paths') or []):
+        update['image_paths.$[r]'] = new_ref
+        array_filters = [{'r': ref}]
+
+    result = mongo.db.prediction_history.update_one(
+        {'_id': document['_id'], '$or': [{'image_path': ref}, {'image_paths': ref}]},
+        {'$set': update},
+        array_filters=array_filters
+    )
+    return result.modified_count > 0
+
+def copy_image(ref, target, references):
+    """
+    Copy an image and freshly generated derivatives to the target backend
+
+    Args:
+        ref: Reference of the image in its current backend
+        target: Target StorageBackend
+        references: Number of predictions referencing the image
+
+    Returns:
+        str: Reference of the image in the target backend, or None if it is missing
+    """
+    data = ImageStorage.get_image_from_gridfs(ref)
+    if data is None:
+        return None
+
+    source_metadata = ImageStorage.get_image_metadata(ref) or {}
+    metadata = {
+        'content_type': source_metadata.get('content_type') or 'image/jpeg',
+        'prediction_id': source_metadata.get('prediction_id'),
+        'user_id': source_metadata.get('user_id'),
+        'timestamp': source_metadata.get('timestamp'),
+        'filename': source_metadata.get('filename'),
+        'content_hash': ImageStorage.content_hash(data, source_metadata.get('user_id')),
+        'migrated_from': ref
+    }
+
+    file_id = ImageStorage.content_file_id(metadata['content_hash'])
+    prepared = {
+        '_id': file_id,
+        'data': data,
+        'metadata': metadata,
+        'derivatives': ImageStorage.prepare_derivatives(Image.open(BytesIO(data)), file_id, metadata)
+    }
+
+    # One reference per prediction pointing at the image
+    return target.store([prepared] * references)[0]
+
+def migrate(source, target_name, batch_size=100, limit=None, pause=0.0, dry_run=False):
+    """
+    Move every image of the source backend to the target backend
+
+    Args:
+        source: Name of the source backend
+        target_name: Name of the target backend
+        batch_size: References processed per batch
+        limit: Stop after this many images (None for all)
+        pause: Seconds to sleep between batches to limit load
+        dry_run: If True, only report what would be migrated
+
+    Returns:
+        tuple: (number of images migrated, number of errors)
+    """
+    target = get_backend(target_name)
+    source_backend = get_backend(source)
+    migrated = 0
+    errors = 0
+    after_ref = None
+
+    while limit is None or migrated < limit:
+        refs = find_refs(source, batch_size, after_ref)
+        if not refs:
+            break
+        after_ref = refs[-1]
+        if limit is not None:
+            refs = refs[:limit - migrated]
+
+        for ref in refs:
+            documents = list(mongo.db.prediction_history.find(
+                {'$or': [{'image_path': ref}, {'image_paths': ref}]}, {'image_path': 1, 'image_paths': 1}))
+            references = sum(count_references(document, ref) for document in documents)
+            if dry_run:
+                print(f"[DRY RUN] Would migrate {ref} ({references} references) to {target_name}")
+                migrated += 1
+                continue
+            try:
+                new_ref = copy_image(ref, target, references)
+                if new_ref is None:
+                    print(f"Image {ref} not found in {source}, skipping")
+                    errors += 1
+                    continue
+
+                # Repoint predictions before removing the source, readers never see a missing image
+                moved = sum(count_references(document, ref) for document in documents
+                            if repoint(document, ref, new_ref, target_name))
+
+                # The target holds exactly the references moved; drop them from the source
+                for _ in range(references - moved):
+                    target.delete(new_ref)
+                for _ in range(moved):
+                    if not source_backend.delete(ref):
+                        break
+
+                migrated += 1
+            except Exception as e:
+                print(f"Error migrating {ref}: {str(e)}")
+                errors += 1
+
+        print(f"Migrated {migrated} images so far ({errors} errors)")
+        if pause:
+            time.sleep(pause)
+
+    return migrated, errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move stored images between storage backends")
+    parser.add_argument("--from", dest="source", choices=sorted(SOURCE_PATTERNS), default="gridfs",
+                        help="Backend to move images out of")
+    parser.add_argument("--to", dest="target", choices=sorted(SOURCE_PATTERNS), required=True,
+                        help="Backend to move images into")
+    parser.add_argument("--batch-size", type=int, default=100, help="References processed per batch")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of images to migrate")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would be migrated without doing it")
+
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--from and --to must be different backends")
+
+    start_time = time.time()
+
+    with app.app_context():
+        migrated, errors = migrate(
+            args.source,
+            args.target,
+            batch_size=args.batch_size,
+            limit=args.limit,
+            pause=args.pause,
+            dry_run=args.dry_run
+        )
+
+    elapsed = time.time() - start_time
+    print(f"\nMigration summary:")
+    print(f"- Images migrated: {migrated}")
+    print(f"- Errors: {errors}")
+    print(f"- Completed in {elapsed:.2f} seconds")
@@ -1,170 +1,302 @@
 """
 Migration script to transfer existing images from the filesystem to GridFS
+
+Files are read and written to GridFS by a pool of worker threads, one batch
+at a time. The predictions of a whole batch are then repointed with one
+bulk_write. After each batch the last migrated path is saved to a
+checkpoint file, so an interrupted migration resumes where it stopped.
+Files are stored content addressed: a file migrated before is not written
+again, and identical files share one GridFS file. Each file gets one
+reference per prediction pointing at it; files no prediction references
+are skipped, as the image GC would only delete them again.
 """
 
 import os
 import sys
+import json
 import time
-from tqdm import tqdm
+import mimetypes
 import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from pymongo import UpdateMany
 
 # Add parent directory to path to import app modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app
+from app.extensions import mongo
 from app.utils.storage import ImageStorage
-from app.api.prediction.models import PredictionHistory
+from app.utils.storage_backends import GridFSBackend
 
 # Create Flask app context
 app = create_app()
 
+# Extensions of the images saved by the filesystem storage
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
 def get_prediction_id_from_filename(filename):
     """Extract prediction ID from filename (remove extension)"""
     return os.path.splitext(filename)[0]
 
-def migrate_files(uploads_dir, dry_run=False, update_db=True):
+def find_images(uploads_dir, after_path=None):
     """
-    Migrate all image files from filesystem to GridFS
-    
+    List the images of the uploads directory in a stable order
+
     Args:
         uploads_dir: Directory containing upload files
-        dry_run: If True, don't actually perform migration
-        update_db: If True, update prediction records in database
+        after_path: Only return paths sorting after this one (resume point)
+
+    Returns:
+        list: Paths relative to the uploads directory, sorted
     """
-    count = 0
-    errors = 0
-    migration_map = {}  # Map of old paths to new GridFS IDs
-    
-    print(f"Scanning directory: {uploads_dir}")
-    
-    # Walk through all files in the uploads directory
+    paths = []
     for root, dirs, files in os.walk(uploads_dir):
-        for filename in tqdm(files, desc=f"Migrating files in {os.path.basename(root)}"):
-            if filename.endswith(('.jpg', '.jpeg', '.png')):
-                # Get full path and relative path
-                full_path = os.path.join(root, filename)
-                rel_path = os.path.relpath(full_path, uploads_dir)
-                prediction_id = get_prediction_id_from_filename(filename)
-                
-                print(f"Processing: {rel_path} (Prediction ID: {prediction_id})")
-                
-                if dry_run:
-                    print(f"[DRY RUN] Would migrate: {rel_path}")
-                    count += 1
-                    continue
-                
-                # Migrate file to GridFS
-                gridfs_id = ImageStorage.migrate_file_to_gridfs(rel_path, prediction_id)
-                
-                if gridfs_id:
-                    print(f"Migrated: {rel_path} -> {gridfs_id}")
-                    migration_map[rel_path] = gridfs_id
-                    count += 1
-                else:
-                    print(f"Error migrating: {rel_path}")
-                    errors += 1
-    
-    print(f"\nMigration summary:")
-    print(f"- Total files processed: {count}")
-    print(f"- Migration errors: {errors}")
-    
-    # Update database records if requested
-    if update_db and not dry_run and count > 0:
-        update_database_records(migration_map)
-    
-    return count, errors
+        # Content-addressed objects and archive packs are not legacy uploads
+        dirs[:] = [name for name in dirs if name not in ('objects', 'archive')]
+        for filename in files:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, filename), uploads_dir))
+    paths.sort()
+    if after_path is not None:
+        paths = [path for path in paths if path > after_path]
+    return paths
+
+def load_checkpoint(checkpoint_path):
+    """Return the saved progress, or an empty one"""
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint:
+            return json.load(checkpoint)
+    return {'last_path': None, 'migrated': 0, 'skipped': 0, 'errors': 0, 'bytes': 0, 'updated': 0}
+
+def save_checkpoint(checkpoint_path, progress):
+    """Atomically save the progress after a batch"""
+    progress['saved_at'] = datetime.utcnow().isoformat()
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, 'w') as checkpoint:
+        json.dump(progress, checkpoint, indent=2)
+    os.replace(temp_path, checkpoint_path)
+
+def migrate_file(backend, uploads_dir, rel_path, prediction):
+    """
+    Write one file to GridFS (runs in a worker thread)
+
+    Args:
+        backend: GridFSBackend to write to
+        uploads_dir: Directory containing upload files
+        rel_path: Path of the file relative to the uploads directory
+        prediction: First prediction referencing the file, with the number of
+                    predictions referencing it in 'references'
+
+    Returns:
+        tuple: (relative path, GridFS file ID as string or None, bytes read)
+    """
+    try:
+        with open(os.path.join(uploads_dir, rel_path), 'rb') as f:
+            data = f.read()
+
+        user_id = prediction.get('user_id') or 'anonymous'
+        content_hash = ImageStorage.content_hash(data, user_id)
+        file_id = ImageStorage.content_file_id(content_hash)
+
+        # Written from this path by an earlier run that stopped before repointing
+        # its predictions, which the references were already added for
+        existing = mongo.db['fs.files'].find_one({'_id': file_id}, {'migrated_from': 1})
+        if existing and existing.get('migrated_from') == rel_path:
+            return rel_path, str(file_id), len(data)
+
+        filename = os.path.basename(rel_path)
+        prepared = {
+            '_id': file_id,
+            'data': data,
+            'metadata': {
+                'content_type': mimetypes.guess_type(rel_path)[0] or 'image/jpeg',
+                'content_hash': content_hash,
+                'prediction_id': prediction.get('prediction_id') or get_prediction_id_from_filename(filename),
+                'user_id': user_id,
+                'timestamp': datetime.utcnow(),
+                'filename': filename,
+                'migrated_from': rel_path
+            }
+        }
+        # One reference per prediction repointed to the file
+        return rel_path, backend.store([prepared] * prediction['references'])[0], len(data)
+    except Exception as e:
+        print(f"Error migrating {rel_path}: {str(e)}")
+        return rel_path, None, 0
 
 def update_database_records(migration_map):
     """
-    Update prediction records in the database to use new GridFS IDs
-    
+    Repoint the predictions of migrated files with one bulk write
+
     Args:
         migration_map: Dictionary mapping old file paths to new GridFS IDs
+
+    Returns:
+        int: Number of prediction records updated
     """
-    with app.app_context():
-        # Update database records
-        print("\nUpdating database records...")
-        updated = 0
-        errors = 0
-        
-        for old_path, new_id in tqdm(migration_map.items(), desc="Updating DB records"):
-            try:
-                # Find prediction records with this image path
-                result = app.mongo.db.prediction_history.update_many(
-                    {"image_path": old_path},
-                    {"$set": {"image_path": new_id, "storage_type": "gridfs"}}
-                )
-                
-                if result.modified_count > 0:
-                    updated += result.modified_count
-                    print(f"Updated {result.modified_count} records for {old_path}")
-            except Exception as e:
-                print(f"Error updating records for {old_path}: {str(e)}")
-                errors += 1
-        
-        print(f"\nDatabase update summary:")
-        print(f"- Records updated: {updated}")
-        print(f"- Update errors: {errors}")
+    if not migration_map:
+        return 0
+    result = mongo.db.prediction_history.bulk_write(
+        [UpdateMany({"image_path": old_path}, {"$set": {"image_path": new_id, "storage_type": "gridfs"}})
+         for old_path, new_id in migration_map.items()],
+        ordered=False
+    )
+    return result.modified_count
+
+def migrate_files(uploads_dir, workers=8, batch_size=200, checkpoint_path=None, dry_run=False, update_db=True):
+    """
+    Migrate all image files from filesystem to GridFS
+
+    Args:
+        uploads_dir: Directory containing upload files
+        workers: Threads reading files and writing them to GridFS
+        batch_size: Files per batch (one bulk database update and checkpoint each)
+        checkpoint_path: File recording progress, resumed from if it exists (None to disable)
+        dry_run: If True, don't actually perform migration
+        update_db: If True, update prediction records in database
+
+    Returns:
+        dict: Files migrated, errors, bytes and records updated over all runs
+    """
+    progress = load_checkpoint(checkpoint_path)
+    progress.setdefault('skipped', 0)
+    if progress['last_path']:
+        print(f"Resuming after {progress['last_path']} ({progress['migrated']} files migrated before)")
+
+    print(f"Scanning directory: {uploads_dir}")
+    paths = find_images(uploads_dir, progress['last_path'])
+    print(f"Found {len(paths)} files to migrate")
+
+    if dry_run:
+        total_bytes = sum(os.path.getsize(os.path.join(uploads_dir, path)) for path in paths)
+        print(f"[DRY RUN] Would migrate {len(paths)} files ({total_bytes / (1024 * 1024):.1f} MB)")
+        return {'migrated': len(paths), 'errors': 0, 'bytes': total_bytes, 'updated': 0}
+
+    # Worker threads use the database directly, without an app context
+    backend = GridFSBackend(database=mongo.db,
+                            chunk_size=app.config.get('IMAGE_STORAGE_CHUNK_SIZE', ImageStorage.CHUNK_SIZE))
+    start = time.monotonic()
+    run_files = 0
+    run_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=len(paths), desc="Migrating files") as bar:
+        for offset in range(0, len(paths), batch_size):
+            batch = paths[offset:offset + batch_size]
+
+            # One query counting the predictions of each path of the whole batch
+            predictions = {doc['_id']: doc for doc in mongo.db.prediction_history.aggregate([
+                {'$match': {'image_path': {'$in': batch}}},
+                {'$group': {'_id': '$image_path', 'references': {'$sum': 1},
+                            'prediction_id': {'$first': '$prediction_id'}, 'user_id': {'$first': '$user_id'}}}
+            ])}
+            referenced = [path for path in batch if path in predictions]
+
+            results = list(executor.map(
+                lambda path: migrate_file(backend, uploads_dir, path, predictions[path]), referenced))
+            migration_map = {path: file_id for path, file_id, _ in results if file_id}
+
+            if update_db:
+                progress['updated'] += update_database_records(migration_map)
+
+            batch_bytes = sum(size for _, _, size in results)
+            progress['migrated'] += len(migration_map)
+            progress['skipped'] += len(batch) - len(referenced)
+            progress['errors'] += len(referenced) - len(migration_map)
+            progress['bytes'] += batch_bytes
+            progress['last_path'] = batch[-1]
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, progress)
+
+            run_files += len(batch)
+            run_bytes += batch_bytes
+            elapsed = max(time.monotonic() - start, 1e-6)
+            bar.update(len(batch))
+            bar.set_postfix(files_per_s=f"{run_files / elapsed:.1f}",
+                            mb_per_s=f"{run_bytes / elapsed / (1024 * 1024):.2f}")
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"\nMigration summary:")
+    print(f"- Files migrated: {progress['migrated']}")
+    print(f"- Files skipped (no prediction references them): {progress['skipped']}")
+    print(f"- Migration errors: {progress['errors']}")
+    print(f"- Records updated: {progress['updated']}")
+    print(f"- Data migrated: {progress['bytes'] / (1024 * 1024):.1f} MB")
+    print(f"- Throughput this run: {run_files / elapsed:.1f} files/s, {run_bytes / elapsed / (1024 * 1024):.2f} MB/s")
+    return progress
 
 def verify_migration():
     """Verify that files were correctly migrated to GridFS"""
-    with app.app_context():
-        print("\nVerifying migration...")
-        
-        # Count GridFS files
-        grid_count = app.mongo.db.fs.files.count_documents({})
-        print(f"Total files in GridFS: {grid_count}")
-        
-        # Check for records still using filesystem paths
-        legacy_count = app.mongo.db.prediction_history.count_documents({
-            "image_path": {"$regex": "^[^0-9a-f]"}  # Non-ObjectId paths
-        })
-        
-        gridfs_count = app.mongo.db.prediction_history.count_documents({
-            "image_path": {"$regex": "^[0-9a-f]{24}$"}  # ObjectId strings
-        })
-        
-        print(f"Records using filesystem paths: {legacy_count}")
-        print(f"Records using GridFS: {gridfs_count}")
-        
-        # Sample some records
-        if gridfs_count > 0:
-            print("\nSample GridFS records:")
-            for record in app.mongo.db.prediction_history.find(
-                {"image_path": {"$regex": "^[0-9a-f]{24}$"}},
-                {"prediction_id": 1, "image_path": 1}
-            ).limit(5):
-                print(f"- Prediction: {record.get('prediction_id')}, Image: {record.get('image_path')}")
+    print("\nVerifying migration...")
+
+    # Count GridFS files
+    grid_count = mongo.db.fs.files.count_documents({})
+    print(f"Total files in GridFS: {grid_count}")
+
+    # Check for records still using filesystem paths
+    legacy_count = mongo.db.prediction_history.count_documents({
+        "image_path": {"$regex": "/"}  # Paths relative to the uploads directory
+    })
+
+    gridfs_count = mongo.db.prediction_history.count_documents({
+        "image_path": {"$regex": "^[0-9a-f]{24}$"}  # ObjectId strings
+    })
+
+    print(f"Records using filesystem paths: {legacy_count}")
+    print(f"Records using GridFS: {gridfs_count}")
+
+    # Sample some records
+    if gridfs_count > 0:
+        print("\nSample GridFS records:")
+        for record in mongo.db.prediction_history.find(
+            {"image_path": {"$regex": "^[0-9a-f]{24}$"}},
+            {"prediction_id": 1, "image_path": 1}
+        ).limit(5):
+            print(f"- Prediction: {record.get('prediction_id')}, Image: {record.get('image_path')}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Migrate image files from filesystem to GridFS")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be migrated without doing it")
     parser.add_argument("--no-db-update", action="store_true", help="Skip updating database records")
     parser.add_argument("--verify", action="store_true", help="Verify migration status")
-    
+    parser.add_argument("--workers", type=int, default=8, help="Threads reading files and writing to GridFS")
+    parser.add_argument("--batch-size", type=int, default=200, help="Files per batch, bulk update and checkpoint")
+    parser.add_argument("--checkpoint", default=os.path.join(ImageStorage.BASE_DIR, '.migrate_to_gridfs.json'),
+                        help="Progress file used to resume an interrupted migration")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and scan every file again")
+
     args = parser.parse_args()
-    
+
     if args.verify:
         with app.app_context():
             verify_migration()
         sys.exit(0)
-    
+
     # Get uploads directory from app config
     uploads_dir = ImageStorage.BASE_DIR
     print(f"Using uploads directory: {uploads_dir}")
-    
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
     start_time = time.time()
-    
+
     with app.app_context():
-        count, errors = migrate_files(
-            uploads_dir, 
-            dry_run=args.dry_run, 
+        progress = migrate_files(
+            uploads_dir,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            checkpoint_path=args.checkpoint,
+            dry_run=args.dry_run,
             update_db=not args.no_db_update
         )
-    
+
     elapsed = time.time() - start_time
     print(f"\nMigration completed in {elapsed:.2f} seconds")
-    
-    if not args.dry_run and errors == 0:
+
+    if not args.dry_run and progress['errors'] == 0:
         print("\nMigration successful. You may want to run with --verify to check the results.")
         print("Once verified, you can safely delete the original files if desired.")
+    elif progress['errors']:
+        print("\nSome files failed. Fix them and run again with --restart: migrated files are not written twice.")
@@ -0,0 +1,33 @@
+"""
+Replay script for write-behind persistence: writes the predictions of
+batches that failed every retry and were saved to the
+persistence_dead_letters collection
+
+Run it once MongoDB is healthy again; predictions still failing stay in
+the collection for the next run.
+"""
+
+import os
+import sys
+import time
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.persistence import replay_dead_letters
+
+# Create Flask app context
+app = create_app()
+
+if __name__ == "__main__":
+    start_time = time.time()
+
+    with app.app_context():
+        written, failed = replay_dead_letters()
+
+    elapsed = time.time() - start_time
+    print(f"\nDead-letter replay summary:")
+    print(f"- Predictions written: {written}")
+    print(f"- Predictions still failing: {failed}")
+    print(f"- Completed in {elapsed:.2f} seconds")
@@ -0,0 +1,65 @@
+"""
+Unit tests for the pipeline benchmark helpers
+"""
+
+import unittest
+import os
+import sys
+import io
+import numpy as np
+
+# Add parent directory to path so we can import the benchmarks
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.pipeline import make_leaf_image, encode_image, compare_results
+from app.utils.image import prep_image, decode_image, resize_image, normalize_image
+
+class TestPipelineBenchmark(unittest.TestCase):
+
+    def _results(self, **medians):
+        """Build a results document with one case"""
+        return {
+            'cases': {
+                'jpeg_224x224': {
+                    'bytes': 1000,
+                    'stages': {stage: {'median_ms': value, 'p95_ms': value} for stage, value in medians.items()}
+                }
+            }
+        }
+
+    def test_synthetic_images_are_deterministic(self):
+        """Test that the same seed produces the same image"""
+        first = make_leaf_image(320, 240, seed=3)
+        second = make_leaf_image(320, 240, seed=3)
+        self.assertEqual(first.shape, (240, 320, 3))
+        np.testing.assert_array_equal(first, second)
+
+    def test_stages_match_prep_image(self):
+        """Test that the separately timed stages compose to prep_image"""
+        encoded = encode_image(make_leaf_image(640, 480), 'PNG')
+
+        staged = normalize_image(resize_image(decode_image(io.BytesIO(encoded))))
+        np.testing.assert_array_equal(staged, prep_image(io.BytesIO(encoded)))
+
+    def test_compare_detects_regression(self):
+        """Test that a stage slower than the threshold is reported"""
+        baseline = self._results(decode=10.0, infer=50.0)
+        current = self._results(decode=14.0, infer=52.0)
+
+        regressions = compare_results(current, baseline, threshold=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]['stage'], 'decode')
+
+    def test_compare_ignores_small_absolute_changes(self):
+        """Test that sub-millisecond noise on fast stages is not a regression"""
+        baseline = self._results(resize=0.01)
+        current = self._results(resize=0.05)
+
+        self.assertEqual(compare_results(current, baseline, threshold=0.25), [])
+
+    def test_compare_ignores_unknown_cases(self):
+        """Test that cases missing from the baseline are skipped"""
+        self.assertEqual(compare_results(self._results(decode=5.0), {'cases': {}}), [])
+
+if __name__ == '__main__':
+    unittest.main()
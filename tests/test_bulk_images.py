@@ -0,0 +1,112 @@
+"""
+Unit tests for the bulk prediction image endpoint
+"""
+
+import json
+import os
+import unittest
+from unittest.mock import patch
+import jwt
+from flask import Flask
+
+from app.config import config
+from app.api.prediction import prediction_bp
+from app.api.prediction.models import PredictionHistory
+from app.utils.storage import ImageStorage
+
+RECORDS = [
+    {'prediction_id': 'p1', 'user_id': 'u1', 'image_path': '0123456789abcdef01234567'},
+    {'prediction_id': 'p2', 'user_id': 'u1', 'image_path': 'disk:' + 'a' * 64},
+    {'prediction_id': 'p3', 'user_id': 'u1'},
+    {'prediction_id': 'p4', 'user_id': 'u2', 'image_path': 'fedcba9876543210fedcba98'}
+]
+
+def _get_image_paths(prediction_ids):
+    return [record for record in RECORDS if record['prediction_id'] in prediction_ids]
+
+def _read_image(image_path, variant=None):
+    return {'data': f"{image_path}:{variant}".encode(), 'content_type': 'image/jpeg'}
+
+def _parse_multipart(response):
+    """Split a multipart/mixed response into (headers, body) tuples"""
+    boundary = response.mimetype_params['boundary'].encode()
+    parts = response.data.split(b'--' + boundary)
+    assert parts[-1] == b'--\r\n'
+    parsed = []
+    for part in parts[1:-1]:
+        head, body = part[2:-2].split(b'\r\n\r\n', 1)
+        headers = dict(line.split(': ', 1) for line in head.decode().split('\r\n'))
+        parsed.append((headers, body))
+    return parsed
+
+class TestBulkPredictionImages(unittest.TestCase):
+
+    def setUp(self):
+        """Set up the prediction blueprint with storage and history patched"""
+        app = Flask(__name__)
+        app.config.from_object(config['testing'])
+        app.config['PREDICTION_IMAGES_MAX_BATCH'] = 3
+        app.register_blueprint(prediction_bp)
+        self.client = app.test_client()
+
+        token = jwt.encode({'sub': 'u1'}, os.getenv('SECRET_KEY', 'default_secret_key'), algorithm='HS256')
+        self.headers = {'Authorization': f"Bearer {token}"}
+
+        patchers = [
+            patch.object(PredictionHistory, 'get_image_paths', side_effect=_get_image_paths),
+            patch.object(ImageStorage, 'read_image', side_effect=_read_image),
+            patch.object(ImageStorage, 'get_derivative_names', return_value=['medium', 'thumb'])
+        ]
+        self.mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def _post(self, body):
+        return self.client.post('/api/prediction/history/images', json=body, headers=self.headers)
+
+    def test_images_are_returned_in_request_order(self):
+        """Test that the manifest and image parts follow the requested order"""
+        response = self._post({'prediction_ids': ['p2', 'p3', 'p1', 'p2']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'multipart/mixed')
+        parts = _parse_multipart(response)
+
+        manifest = json.loads(parts[0][1])
+        self.assertEqual([image['prediction_id'] for image in manifest['images']], ['p2', 'p1'])
+        self.assertEqual(manifest['missing'], ['p3'])
+
+        self.assertEqual([headers['Content-ID'] for headers, _ in parts[1:]], ['<p2>', '<p1>'])
+        self.assertEqual(parts[2][1], b'0123456789abcdef01234567:thumb')
+        self.assertEqual(int(parts[2][0]['Content-Length']), len(parts[2][1]))
+
+        # One lookup for the whole batch, duplicates removed
+        self.mocks[0].assert_called_once_with(['p2', 'p3', 'p1'])
+
+    def test_derivative_sizes_only(self):
+        """Test that any derivative can be requested but originals cannot"""
+        response = self._post({'prediction_ids': ['p1'], 'size': 'medium'})
+        self.assertEqual(_parse_multipart(response)[1][1], b'0123456789abcdef01234567:medium')
+
+        self.assertEqual(self._post({'prediction_ids': ['p1'], 'size': 'original'}).status_code, 400)
+        self.mocks[2].return_value = []
+        self.assertEqual(self._post({'prediction_ids': ['p1']}).status_code, 400)
+        self.mocks[1].assert_called_once()
+
+    def test_foreign_predictions_are_rejected(self):
+        """Test that a batch including another user's prediction is refused"""
+        response = self._post({'prediction_ids': ['p1', 'p4']})
+
+        self.assertEqual(response.status_code, 403)
+        self.mocks[1].assert_not_called()
+
+    def test_invalid_requests(self):
+        """Test the batch cap and the validation of ids and size"""
+        self.assertEqual(self._post({'prediction_ids': ['a', 'b', 'c', 'd']}).status_code, 400)
+        self.assertEqual(self._post({'prediction_ids': []}).status_code, 400)
+        self.assertEqual(self._post({'prediction_ids': 'p1'}).status_code, 400)
+        self.assertEqual(self._post({'prediction_ids': ['p1'], 'size': 'huge'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/prediction/history/images', json={}).status_code, 401)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+Unit tests for background deletion of a user's history and account
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from PIL import Image
+from bson.objectid import ObjectId
+
+from app import create_app
+from app.extensions import mongo
+from app.services.data_deletion import DeletionJobRunner
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import GridFSBackend
+
+COLLECTIONS = ('fs.files', 'fs.chunks', 'image_objects', 'prediction_history', 'deletion_jobs', 'auth', 'profile',
+               'persistence_dead_letters')
+
+class TestDeletionJobs(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an empty database and a runner deleting two predictions per batch"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.db = mongo.db
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+
+        self.runner = DeletionJobRunner(database=self.db, batch_size=2, grace_seconds=60)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+        self.app_context.pop()
+
+    def _predict(self, color, prediction_id, user_id):
+        """Store an image with its derivatives and a prediction referencing it"""
+        image = Image.new('RGB', (600, 400), color=color)
+        prepared = ImageStorage.prepare_prediction_image(image, prediction_id, user_id)
+        ref = GridFSBackend(database=self.db).store([prepared])[0]
+        self.db.prediction_history.insert_one({'prediction_id': prediction_id, 'user_id': user_id, 'image_path': ref})
+        return ref
+
+    def _files(self, ref):
+        """Count the file documents and chunks of an image and its derivatives"""
+        file_ids = [document['_id'] for document in self.db['fs.files'].find(
+            {'$or': [{'_id': ObjectId(ref)}, {'parent_id': ObjectId(ref)}]}, {'_id': 1})]
+        return len(file_ids), self.db['fs.chunks'].count_documents({'files_id': {'$in': file_ids}})
+
+    def test_history_is_deleted_and_shared_images_kept(self):
+        """Test that the user's images go with the history and other users' copies are kept"""
+        own = [self._predict((200, 30 * index, 30), f"own-{index}", 'leaving-user') for index in range(3)]
+        shared = self._predict((30, 30, 200), 'shared-1', 'leaving-user')
+        self._predict((30, 30, 200), 'shared-2', 'leaving-user')
+        theirs = self._predict((30, 30, 200), 'theirs', 'other-user')
+        self.assertNotEqual(shared, theirs)
+        self.db.prediction_history.insert_one({'prediction_id': 'no-image', 'user_id': 'leaving-user'})
+
+        job = self.runner.create_job('leaving-user')
+        self.assertEqual(job['predictions_total'], 6)
+        self.assertTrue(self.runner.run_job(job['_id']))
+
+        self.assertEqual(self.db.prediction_history.count_documents({'user_id': 'leaving-user'}), 0)
+        for ref in own + [shared]:
+            self.assertEqual(self._files(ref), (0, 0))
+        other_file = self.db['fs.files'].find_one({'_id': ObjectId(theirs)})
+        self.assertEqual((other_file['ref_count'], other_file['user_id']), (1, 'other-user'))
+        self.assertGreater(self._files(theirs)[1], 0)
+        self.assertEqual(self.db.prediction_history.count_documents({'user_id': 'other-user'}), 1)
+
+        job = self.runner.get_job(job['_id'])
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual((job['predictions_deleted'], job['images_released']), (6, 5))
+        self.assertEqual(job['files_deleted'], 4 * len(ImageStorage.get_derivative_names()) + 4)
+        self.assertGreater(job['bytes_deleted'], 0)
+
+    def test_interrupted_batch_is_not_released_twice(self):
+        """Test that resuming a job does not release the references of an interrupted batch again"""
+        shared = self._predict((30, 200, 30), 'shared-1', 'leaving-user')
+        self._predict((30, 200, 30), 'shared-2', 'leaving-user')
+        own = self._predict((200, 200, 30), 'own', 'leaving-user')
+
+        # A worker saved a batch and stopped before releasing its images
+        job = self.runner.create_job('leaving-user')
+        interrupted = [self.db.prediction_history.find_one({'prediction_id': 'shared-1'})['_id']]
+        self.db.deletion_jobs.update_one({'_id': job['_id']}, {'$set': {
+            'status': 'running', 'pending_predictions': interrupted,
+            'locked_until': datetime.utcnow() - timedelta(seconds=1)}})
+        self.db.prediction_history.delete_many({'_id': {'$in': interrupted}})
+
+        self.assertTrue(self.runner.run_job(job['_id']))
+
+        # The shared image kept its leftover reference (re-referenced within the
+        # grace period, so the orphan sweep skips it), the own image was deleted
+        self.assertEqual(self.db['fs.files'].find_one({'_id': ObjectId(shared)})['ref_count'], 1)
+        self.assertEqual(self._files(own), (0, 0))
+        self.assertEqual(self.runner.get_job(job['_id'])['predictions_deleted'], 3)
+
+    def test_multi_image_predictions_release_each_reference_once(self):
+        """Test that the first image of a multi-image prediction is released once, not for image_path too"""
+        first = self._predict((200, 30, 200), 'single', 'leaving-user')
+        prepared = [ImageStorage.prepare_prediction_image(Image.new('RGB', (600, 400), color=color),
+                                                          'multi', 'leaving-user')
+                    for color in ((200, 30, 200), (30, 200, 200))]
+        self.assertEqual(GridFSBackend(database=self.db).store(prepared)[0], first)
+        second = str(prepared[1]['_id'])
+        self.db.prediction_history.insert_one({'prediction_id': 'multi', 'user_id': 'leaving-user',
+                                               'image_path': first, 'image_paths': [first, second]})
+
+        job = self.runner.create_job('leaving-user')
+        self.assertTrue(self.runner.run_job(job['_id']))
+
+        self.assertEqual(self.runner.get_job(job['_id'])['images_released'], 3)
+        self.assertEqual(self._files(first), (0, 0))
+        self.assertEqual(self._files(second), (0, 0))
+
+    def test_dead_letters_are_deleted(self):
+        """Test that the user's dead-lettered predictions go, and their images once nothing references them"""
+        image = Image.new('RGB', (600, 400), color=(120, 60, 200))
+        prepared = ImageStorage.prepare_prediction_image(image, 'dead-letter', 'leaving-user')
+        ref = GridFSBackend(database=self.db).store([prepared])[0]
+        self.db.persistence_dead_letters.insert_many([
+            {'history': {'prediction_id': 'dead-letter', 'user_id': 'leaving-user', 'image_path': ref}, 'images': []},
+            {'history': {'prediction_id': 'other-letter', 'user_id': 'other-user'}, 'images': []}])
+        # Uploaded before the grace period
+        self.runner.grace_seconds = 0
+
+        job = self.runner.create_job('leaving-user')
+        self.assertTrue(self.runner.run_job(job['_id']))
+
+        self.assertEqual(self.db.persistence_dead_letters.count_documents({'history.user_id': 'leaving-user'}), 0)
+        self.assertEqual(self.db.persistence_dead_letters.count_documents({'history.user_id': 'other-user'}), 1)
+        self.assertEqual(self._files(ref), (0, 0))
+
+    def test_account_deletion_and_leases(self):
+        """Test that account jobs remove the account, and that held jobs are not run twice"""
+        self._predict((90, 90, 90), 'account-prediction', 'leaving-user')
+        self.db.auth.insert_one({'user_id': 'leaving-user', 'username': 'leaving'})
+        self.db.profile.insert_one({'user_id': 'leaving-user'})
+
+        job = self.runner.create_job('leaving-user')
+        self.assertEqual(self.runner.create_job('leaving-user', delete_account=True)['_id'], job['_id'])
+
+        self.db.deletion_jobs.update_one({'_id': job['_id']}, {'$set': {
+            'status': 'running', 'locked_until': datetime.utcnow() + timedelta(minutes=5)}})
+        self.assertFalse(self.runner.run_job(job['_id']))
+        self.assertEqual(self.db.prediction_history.count_documents({'user_id': 'leaving-user'}), 1)
+
+        self.db.deletion_jobs.update_one({'_id': job['_id']}, {'$unset': {'locked_until': ''}})
+        self.assertTrue(self.runner.run_job(job['_id']))
+        self.assertIsNone(self.db.auth.find_one({'user_id': 'leaving-user'}))
+        self.assertIsNone(self.db.profile.find_one({'user_id': 'leaving-user'}))
+        self.assertFalse(self.runner.run_job(job['_id']))
+
+if __name__ == '__main__':
+    unittest.main()
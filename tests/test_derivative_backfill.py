@@ -0,0 +1,65 @@
+"""
+Unit tests for backfilling derivatives of images stored without them
+"""
+
+import os
+import sys
+import unittest
+from PIL import Image
+
+# Add parent directory to path so we can import the scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.extensions import mongo
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import get_backend
+from scripts.backfill_derivatives import backfill, find_missing
+
+COLLECTIONS = ('fs.files', 'fs.chunks')
+
+class TestDerivativeBackfill(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an empty GridFS"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.db = mongo.db
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+
+    def tearDown(self):
+        """Clean up after tests"""
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+        self.app_context.pop()
+
+    def _store_original(self, size, prediction_id):
+        """Store an original the way uploads did before derivatives existed"""
+        prepared = ImageStorage.prepare_prediction_image(Image.new('RGB', size, color=(200, 30, 30)),
+                                                         prediction_id, 'backfill-user')
+        prepared['derivatives'] = []
+        return get_backend('gridfs').store([prepared])[0]
+
+    def test_originals_are_checked_once_and_keep_their_references(self):
+        """Test that derivatives are added without references and small originals are not read again"""
+        large = self._store_original((600, 400), 'large')
+        small = self._store_original((64, 64), 'small')
+
+        self.assertEqual(backfill(batch_size=10), (2, 0))
+
+        derivatives = self.db['fs.files'].find({'parent_id': {'$exists': True}})
+        self.assertEqual(sorted((str(d['parent_id']), d['variant']) for d in derivatives),
+                         [(large, 'medium'), (large, 'thumb')])
+        originals = list(self.db['fs.files'].find({'parent_id': {'$exists': False}}))
+        self.assertEqual([original['ref_count'] for original in originals], [1, 1])
+        self.assertTrue(all(original['derivatives_checked'] for original in originals))
+        self.assertIsNotNone(ImageStorage.read_image(small))
+
+        self.assertEqual(find_missing(10), ([], None))
+        self.assertEqual(backfill(batch_size=10), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
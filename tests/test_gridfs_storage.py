@@ -17,7 +17,7 @@ class TestGridFSStorage(unittest.TestCase):
     
     def setUp(self):
         """Set up test environment"""
-        self.app = create_app(testing=True)
+        self.app = create_app('testing')
         self.client = self.app.test_client()
         self.app_context = self.app.app_context()
         self.app_context.push()
@@ -145,17 +145,19 @@ class TestGridFSStorage(unittest.TestCase):
     
     def test_get_images_by_prediction_id(self):
         """Test retrieving images by prediction ID"""
-        # Save multiple images with same prediction ID
+        # Save multiple distinct images with same prediction ID
+        # (identical images are deduplicated into one file)
         file_ids = []
-        for i in range(3):
-            with open(self.temp_file.name, 'rb') as f:
-                file_obj = io.BytesIO(f.read())
-                file_id = ImageStorage.save_prediction_image(
-                    file_obj, 
-                    self.test_prediction_id,
-                    self.test_user_id
-                )
-                file_ids.append(file_id)
+        for color in ['red', 'green', 'blue']:
+            file_obj = io.BytesIO()
+            Image.new('RGB', (100, 100), color=color).save(file_obj, format='JPEG')
+            file_obj.seek(0)
+            file_id = ImageStorage.save_prediction_image(
+                file_obj, 
+                self.test_prediction_id,
+                self.test_user_id
+            )
+            file_ids.append(file_id)
         
         # Retrieve images by prediction ID
         result_ids = ImageStorage.get_images_by_prediction_id(self.test_prediction_id)
@@ -167,5 +169,68 @@ class TestGridFSStorage(unittest.TestCase):
         for file_id in file_ids:
             self.assertIn(file_id, result_ids)
 
+    def test_duplicate_images_are_shared(self):
+        """Test that re-submitted images share one reference-counted file"""
+        file_ids = []
+        for _ in range(2):
+            with open(self.temp_file.name, 'rb') as f:
+                file_ids.append(ImageStorage.save_prediction_image(
+                    io.BytesIO(f.read()),
+                    self.test_prediction_id,
+                    self.test_user_id
+                ))
+        
+        # Both predictions reference the same file
+        self.assertEqual(file_ids[0], file_ids[1])
+        
+        # The first delete only drops a reference
+        self.assertTrue(ImageStorage.delete_image(file_ids[0]))
+        self.assertIsNotNone(ImageStorage.get_image_from_gridfs(file_ids[0]))
+        
+        # The last delete removes the file
+        self.assertTrue(ImageStorage.delete_image(file_ids[1]))
+        self.assertIsNone(ImageStorage.get_image_from_gridfs(file_ids[1]))
+
+    def test_duplicate_images_are_scoped_per_user(self):
+        """Test that the same image uploaded by another user is stored separately"""
+        file_ids = []
+        for user_id in [self.test_user_id, 'test-user-456']:
+            with open(self.temp_file.name, 'rb') as f:
+                file_ids.append(ImageStorage.save_prediction_image(
+                    io.BytesIO(f.read()),
+                    self.test_prediction_id,
+                    user_id
+                ))
+        
+        # Each user's file carries their own ID
+        self.assertNotEqual(file_ids[0], file_ids[1])
+        self.assertEqual(ImageStorage.get_image_metadata(file_ids[0])['user_id'], self.test_user_id)
+        self.assertEqual(ImageStorage.get_image_metadata(file_ids[1])['user_id'], 'test-user-456')
+        self.assertNotIn(file_ids[1], ImageStorage.get_images_by_user_id(self.test_user_id))
+    
+    def test_get_images_by_prediction_id_follows_history(self):
+        """Test that a prediction sharing an earlier prediction's image finds it"""
+        from app.extensions import mongo
+        second_prediction_id = self.test_prediction_id + "-2"
+        file_ids = []
+        for prediction_id in [self.test_prediction_id, second_prediction_id]:
+            with open(self.temp_file.name, 'rb') as f:
+                file_ids.append(ImageStorage.save_prediction_image(
+                    io.BytesIO(f.read()),
+                    prediction_id,
+                    self.test_user_id
+                ))
+        self.assertEqual(file_ids[0], file_ids[1])
+        
+        mongo.db.prediction_history.insert_one({
+            'prediction_id': second_prediction_id,
+            'user_id': self.test_user_id,
+            'image_path': file_ids[1]
+        })
+        try:
+            self.assertEqual(ImageStorage.get_images_by_prediction_id(second_prediction_id), [file_ids[1]])
+        finally:
+            mongo.db.prediction_history.delete_one({'prediction_id': second_prediction_id})
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,194 @@
+"""
+Unit tests for the cold image archive
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from io import BytesIO
+from PIL import Image
+from bson.objectid import ObjectId
+
+from app import create_app
+from app.extensions import mongo
+from app.utils import image_archive
+from app.utils.image_archive import ImageArchive, LocalPackStore, S3PackStore
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import GridFSBackend
+
+class _Collection:
+    """Minimal stand-in for the image_archive collection"""
+
+    class _Result:
+        def __init__(self, deleted_count):
+            self.deleted_count = deleted_count
+
+    def __init__(self, documents):
+        self.documents = {document['_id']: document for document in documents}
+
+    def find_one(self, query):
+        return self.documents.get(query['_id'])
+
+    def find_one_and_update(self, query, update):
+        document = self.documents.get(query['_id'])
+        if document is None or document['ref_count'] <= query['ref_count']['$gt']:
+            return None
+        document['ref_count'] += update['$inc']['ref_count']
+        return document
+
+    def delete_one(self, query):
+        return self._Result(1 if self.documents.pop(query['_id'], None) else 0)
+
+class _Database:
+    def __init__(self, documents):
+        self.image_archive = _Collection(documents)
+
+class _S3Client:
+    """Minimal stand-in for a boto3 S3 client supporting ranged reads"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def get_object(self, Bucket, Key, Range):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+        return {'Body': BytesIO(self.objects[(Bucket, Key)][start:end + 1])}
+
+class TestPackStores(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a pack holding an original and its thumbnail"""
+        self.root = tempfile.mkdtemp()
+        self.pack_path = f"{self.root}/staged.tmp"
+        with open(self.pack_path, 'wb') as pack:
+            pack.write(b'ORIGINAL-BYTES' + b'THUMB')
+        self.document = {
+            '_id': '0123456789abcdef01234567', 'pack': 'pack-1', 'offset': 0, 'length': 14,
+            'content_type': 'image/webp', 'ref_count': 2,
+            'derivatives': {'thumb': {'offset': 14, 'length': 5, 'content_type': 'image/jpeg'}}
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_local_pack_reads_seek_into_the_pack(self):
+        """Test that originals and derivatives are read from their offsets"""
+        store = LocalPackStore(f"{self.root}/packs")
+        store.write('pack-1', self.pack_path, [self.document])
+        archive = ImageArchive(store, database=_Database([self.document]))
+
+        original = archive.open(self.document['_id'])
+        self.assertEqual(original['stream'].read(), b'ORIGINAL-BYTES')
+        self.assertEqual((original['length'], original['content_type']), (14, 'image/webp'))
+
+        thumb = archive.open(self.document['_id'], variant='thumb')
+        self.assertEqual(thumb['stream'].read(), b'THUMB')
+        self.assertEqual(thumb['etag'], f"{self.document['_id']}.thumb")
+
+        self.assertEqual(archive.open(self.document['_id'], variant='medium')['length'], 14)
+        self.assertIsNone(archive.open('fedcba9876543210fedcba98'))
+
+    def test_s3_pack_reads_are_ranged(self):
+        """Test that the s3 pack store fetches only the requested byte range"""
+        client = _S3Client()
+        store = S3PackStore('archive-bucket', prefix='cold/', client=client)
+        store.write('pack-1', self.pack_path, [self.document])
+
+        self.assertIn(('archive-bucket', 'cold/pack-1.json'), client.objects)
+        self.assertEqual(store.read('pack-1', 14, 5), b'THUMB')
+        self.assertIsNone(store.read('pack-2', 0, 5))
+
+    def test_archived_images_are_reference_counted(self):
+        """Test that deleting an archived image removes its index entry with the last reference"""
+        archive = ImageArchive(LocalPackStore(self.root), database=_Database([self.document]))
+
+        self.assertTrue(archive.delete(self.document['_id']))
+        self.assertIsNotNone(archive.get_metadata(self.document['_id']))
+        self.assertTrue(archive.delete(self.document['_id']))
+        self.assertIsNone(archive.get_metadata(self.document['_id']))
+        self.assertFalse(archive.delete(self.document['_id']))
+
+class TestImageArchiveJob(unittest.TestCase):
+
+    def setUp(self):
+        """Set up GridFS images and an archive in a temporary directory"""
+        self.app = create_app('testing')
+        self.root = tempfile.mkdtemp()
+        self.app.config['IMAGE_ARCHIVE_PATH'] = self.root
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        image_archive._archive = None
+
+        self.db = mongo.db
+        for name in ('fs.files', 'fs.chunks', 'image_archive'):
+            self.db[name].delete_many({})
+
+    def tearDown(self):
+        """Clean up after tests"""
+        for name in ('fs.files', 'fs.chunks', 'image_archive'):
+            self.db[name].delete_many({})
+        image_archive._archive = None
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.app_context.pop()
+
+    def _store(self, color, days_old):
+        """Store an image with its derivatives, uploaded days_old days ago"""
+        image = Image.new('RGB', (600, 400), color=color)
+        prepared = ImageStorage.prepare_prediction_image(image, f"archive-{days_old}", 'archive-user')
+        ref = GridFSBackend(database=self.db).store([prepared])[0]
+        uploaded = datetime.utcnow() - timedelta(days=days_old)
+        self.db['fs.files'].update_many({'$or': [{'_id': ObjectId(ref)}, {'parent_id': ObjectId(ref)}]},
+                                        {'$set': {'uploadDate': uploaded}})
+        return ref, prepared
+
+    def test_old_images_move_to_packs_and_stay_readable(self):
+        """Test that old images leave GridFS and are served from their pack"""
+        old_ref, old_prepared = self._store((200, 30, 30), 200)
+        older_ref, _ = self._store((30, 200, 30), 300)
+        recent_ref, _ = self._store((30, 30, 200), 5)
+
+        report = image_archive.get_archive().archive(older_than_days=90, pack_size=1)
+        self.assertEqual((report['images'], report['packs']), (2, 2))
+
+        self.assertEqual(self.db['fs.files'].count_documents({'_id': ObjectId(old_ref)}), 0)
+        self.assertEqual(self.db['fs.chunks'].count_documents({'files_id': ObjectId(old_ref)}), 0)
+        self.assertIsNotNone(self.db['fs.files'].find_one({'_id': ObjectId(recent_ref)}))
+
+        self.assertEqual(ImageStorage.get_image_from_gridfs(old_ref), old_prepared['data'])
+        thumb = ImageStorage.open_image(old_ref, variant='thumb')
+        with thumb['stream'] as stream:
+            self.assertEqual(max(Image.open(stream).size), 128)
+        self.assertEqual(ImageStorage.get_image_metadata(older_ref)['user_id'], 'archive-user')
+
+        self.assertTrue(ImageStorage.delete_image(old_ref))
+        self.assertIsNone(ImageStorage.get_image_from_gridfs(old_ref))
+
+    def test_kept_reuploads_leave_archived_references_unchanged(self):
+        """Test that a re-uploaded image kept in GridFS does not add references to its archive entry"""
+        ref, _ = self._store((200, 30, 30), 200)
+        image_archive.get_archive().archive(older_than_days=90)
+
+        # Uploaded again, then referenced while the next run packs it
+        self.assertEqual(self._store((200, 30, 30), 200)[0], ref)
+        self.db['fs.files'].update_one({'_id': ObjectId(ref)},
+                                       {'$set': {'referenced_at': datetime.utcnow() + timedelta(days=1)}})
+        image_archive.get_archive().archive(older_than_days=90)
+
+        self.assertIsNotNone(self.db['fs.files'].find_one({'_id': ObjectId(ref)}))
+        self.assertEqual(self.db.image_archive.find_one({'_id': ref})['ref_count'], 1)
+
+        self.assertTrue(ImageStorage.delete_image(ref))
+        self.assertTrue(ImageStorage.delete_image(ref))
+        self.assertIsNone(self.db.image_archive.find_one({'_id': ref}))
+
+if __name__ == '__main__':
+    unittest.main()
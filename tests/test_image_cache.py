@@ -0,0 +1,114 @@
+"""
+Unit tests for the in-process image cache
+"""
+
+import base64
+import unittest
+from datetime import datetime
+from io import BytesIO
+from unittest.mock import patch
+from flask import Flask
+
+from app.config import config
+from app.utils.cache import ByteLRUCache
+from app.utils.metrics import metrics
+from app.utils.storage import ImageStorage
+from app.services.image_cache import init_image_cache, get_image_cache
+
+class _Backend:
+    """Storage backend stand-in counting the images it opens"""
+
+    def __init__(self, images):
+        self.images = images
+        self.opens = []
+
+    def open(self, ref, variant=None):
+        self.opens.append((ref, variant))
+        data = self.images.get((ref, variant))
+        if data is None:
+            return None
+        return {'stream': BytesIO(data), 'length': len(data), 'content_type': 'image/jpeg',
+                'etag': f"{ref}.{variant}", 'last_modified': datetime(2025, 5, 1)}
+
+    def delete(self, ref):
+        return self.images.pop((ref, None), None) is not None
+
+class TestByteLRUCache(unittest.TestCase):
+
+    def test_evicts_by_total_bytes(self):
+        """Test that least recently used entries are evicted until the new value fits"""
+        evicted = []
+        cache = ByteLRUCache(max_bytes=10, max_item_bytes=6, on_evict=evicted.append)
+        cache.set('a', b'aaaa', 4)
+        cache.set('b', b'bbbb', 4)
+        cache.get('a')
+
+        self.assertEqual(cache.set('c', b'cccccc', 6), 1)
+        self.assertEqual(evicted, ['b'])
+        self.assertEqual((cache.get('a'), cache.get('c')), (b'aaaa', b'cccccc'))
+        self.assertEqual(cache.size_bytes(), 10)
+
+        self.assertEqual(cache.set('d', b'd' * 7, 7), -1)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(len(cache), 2)
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an app with a 1 KB image cache in front of a stand-in backend"""
+        self.app = Flask(__name__)
+        self.app.config.from_object(config['testing'])
+        self.app.config['IMAGE_MEMORY_CACHE_SIZE'] = 1024
+        self.app.config['IMAGE_MEMORY_CACHE_MAX_ITEM'] = 512
+        init_image_cache(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.ref = '0123456789abcdef01234567'
+        self.backend = _Backend({(self.ref, None): b'o' * 400, (self.ref, 'thumb'): b't' * 100,
+                                 ('fedcba9876543210fedcba98', None): b'L' * 600})
+        patcher = patch('app.utils.storage.get_backend_for_ref', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def _read(self, ref, variant=None):
+        image = ImageStorage.open_image(ref, variant)
+        with image['stream'] as stream:
+            return stream.read()
+
+    def test_repeated_opens_are_served_from_memory(self):
+        """Test that an image is read from storage once and shared by every read path"""
+        hits = metrics.get_counter('image_cache.hits')
+
+        self.assertEqual(self._read(self.ref), b'o' * 400)
+        image = ImageStorage.open_image(self.ref)
+        self.assertEqual((image['length'], image['etag']), (400, f"{self.ref}.None"))
+        self.assertEqual(ImageStorage.get_image_from_gridfs(self.ref), b'o' * 400)
+        self.assertEqual(ImageStorage.get_image_as_base64(self.ref), base64.b64encode(b'o' * 400).decode('utf-8'))
+
+        self.assertEqual(self.backend.opens, [(self.ref, None)])
+        self.assertGreaterEqual(metrics.get_counter('image_cache.hits') - hits, 3)
+
+    def test_large_images_are_not_cached(self):
+        """Test that images over the item limit are streamed from storage every time"""
+        self._read('fedcba9876543210fedcba98')
+        self._read('fedcba9876543210fedcba98')
+
+        self.assertEqual(len(self.backend.opens), 2)
+        self.assertIsNone(get_image_cache().open('fedcba9876543210fedcba98'))
+
+    def test_delete_invalidates_every_variant(self):
+        """Test that deleting an image drops the original and its derivatives from memory"""
+        self._read(self.ref)
+        self.assertEqual(self._read(self.ref, 'thumb'), b't' * 100)
+
+        self.assertTrue(ImageStorage.delete_image(self.ref))
+        self.assertIsNone(get_image_cache().open(self.ref))
+        self.assertIsNone(get_image_cache().open(self.ref, 'thumb'))
+        self.assertIsNone(ImageStorage.open_image(self.ref))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+Unit tests for image derivatives generated at upload
+"""
+
+import unittest
+import io
+import numpy as np
+from unittest.mock import patch
+from flask import Flask
+from PIL import Image
+
+from app.utils.storage import ImageStorage, parse_derivative_sizes, parse_derivative_qualities, resolve_image_format
+
+class TestImageDerivatives(unittest.TestCase):
+
+    def _upload(self, width, height):
+        """Encode a random RGB image as an uploaded JPEG file"""
+        pixels = np.random.RandomState(0).randint(0, 255, (height, width, 3), dtype=np.uint8)
+        output = io.BytesIO()
+        Image.fromarray(pixels).save(output, format='JPEG')
+        output.seek(0)
+        return output
+
+    def test_parse_derivative_sizes(self):
+        """Test that derivative specs are parsed largest first"""
+        self.assertEqual(parse_derivative_sizes('thumb:128, medium:512'), [('medium', 512), ('thumb', 128)])
+        self.assertEqual(parse_derivative_sizes(''), [])
+
+        for spec in ['thumb', 'thumb:abc', 'original:128', 'thumb:0', 'thumb:128:0', 'thumb:128:abc']:
+            with self.assertRaises(ValueError):
+                parse_derivative_sizes(spec)
+
+    def test_per_derivative_quality(self):
+        """Test that an optional quality per derivative is parsed and used"""
+        spec = 'thumb:128:20,medium:512'
+        self.assertEqual(parse_derivative_sizes(spec), [('medium', 512), ('thumb', 128)])
+        self.assertEqual(parse_derivative_qualities(spec), {'thumb': 20})
+
+        app = Flask(__name__)
+        img = Image.open(self._upload(400, 400))
+        sizes = {}
+        for spec in ['thumb:128:20', 'thumb:128:95']:
+            app.config['IMAGE_DERIVATIVES'] = spec
+            with app.app_context():
+                sizes[spec] = len(ImageStorage.prepare_derivatives(img, 'parent', {'prediction_id': 'p'})[0]['data'])
+        self.assertLess(sizes['thumb:128:20'], sizes['thumb:128:95'])
+
+    def test_prepare_prediction_image_includes_derivatives(self):
+        """Test that derivatives are linked to the original and fit their size"""
+        prepared = ImageStorage.prepare_prediction_image(self._upload(1024, 768), 'pred-1', 'user-1')
+
+        derivatives = {d['metadata']['variant']: d for d in prepared['derivatives']}
+        self.assertEqual(set(derivatives), {'thumb', 'medium'})
+
+        for name, max_side in [('thumb', 128), ('medium', 512)]:
+            metadata = derivatives[name]['metadata']
+            self.assertEqual(metadata['parent_id'], prepared['_id'])
+            self.assertEqual(metadata['prediction_id'], 'pred-1')
+            self.assertEqual(max(metadata['width'], metadata['height']), max_side)
+
+            img = Image.open(io.BytesIO(derivatives[name]['data']))
+            self.assertEqual(img.size, (metadata['width'], metadata['height']))
+
+    def test_identical_images_share_file_id(self):
+        """Test that the file ID is derived from the stored bytes and the uploader"""
+        first = ImageStorage.prepare_prediction_image(self._upload(200, 200), 'pred-1', 'user-1')
+        second = ImageStorage.prepare_prediction_image(self._upload(200, 200), 'pred-2', 'user-1')
+        other_user = ImageStorage.prepare_prediction_image(self._upload(200, 200), 'pred-3', 'user-2')
+
+        self.assertEqual(first['_id'], second['_id'])
+        self.assertEqual(first['metadata']['content_hash'], second['metadata']['content_hash'])
+        self.assertEqual(str(first['_id']), first['metadata']['content_hash'][:24])
+        self.assertEqual(first['data'], other_user['data'])
+        self.assertNotEqual(first['_id'], other_user['_id'])
+
+    def test_small_images_skip_larger_derivatives(self):
+        """Test that no derivative is produced at or above the original size"""
+        img = Image.open(self._upload(300, 200))
+        derivatives = ImageStorage.prepare_derivatives(img, 'parent', {'prediction_id': 'p'})
+
+        self.assertEqual([d['metadata']['variant'] for d in derivatives], ['thumb'])
+
+    def test_webp_derivatives(self):
+        """Test that derivatives can be encoded as WebP"""
+        img = Image.open(self._upload(400, 400))
+        derivatives = ImageStorage.prepare_derivatives(img, 'parent', {'prediction_id': 'p'},
+                                                       sizes=[('thumb', 128)], image_format='webp')
+
+        self.assertEqual(derivatives[0]['metadata']['content_type'], 'image/webp')
+        self.assertEqual(Image.open(io.BytesIO(derivatives[0]['data'])).format, 'WEBP')
+
+    def test_storage_format_and_max_dimension(self):
+        """Test that the original is stored in the configured format and capped in size"""
+        app = Flask(__name__)
+        app.config.update(IMAGE_STORAGE_FORMAT='webp', IMAGE_STORAGE_MAX_DIMENSION=600)
+        with app.app_context():
+            prepared = ImageStorage.prepare_prediction_image(self._upload(1200, 900), 'pred-1', 'user-1')
+
+        img = Image.open(io.BytesIO(prepared['data']))
+        self.assertEqual((img.format, img.size), ('WEBP', (600, 450)))
+        self.assertEqual(prepared['metadata']['content_type'], 'image/webp')
+        self.assertEqual(prepared['metadata']['filename'], 'pred-1.webp')
+
+    def test_thumbnail_retention_stores_only_the_thumbnail(self):
+        """Test that thumbnail retention stores the smallest derivative as the image"""
+        prepared = ImageStorage.prepare_prediction_image(self._upload(1024, 768), 'pred-1', 'user-1', 'thumbnail')
+
+        self.assertEqual(prepared['derivatives'], [])
+        self.assertEqual(Image.open(io.BytesIO(prepared['data'])).size, (128, 96))
+
+    def test_unsupported_format_falls_back_to_jpeg(self):
+        """Test that formats the installed Pillow cannot encode are stored as JPEG"""
+        Image.init()
+        with patch.dict(Image.SAVE):
+            Image.SAVE.pop('AVIF', None)
+            self.assertEqual(resolve_image_format('avif'), 'JPEG')
+        self.assertEqual(resolve_image_format('webp'), 'WEBP')
+
+        with self.assertRaises(ValueError):
+            resolve_image_format('gif')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Unit tests for image expiry and orphan garbage collection
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from PIL import Image
+from bson.binary import Binary
+from bson.objectid import ObjectId
+
+from app import create_app
+from app.extensions import mongo
+from app.services.image_gc import ImageGarbageCollector
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import GridFSBackend
+
+class TestImageGarbageCollector(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an empty image store and a collector with a one minute grace period"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.db = mongo.db
+        for name in ('fs.files', 'fs.chunks', 'image_objects', 'prediction_history'):
+            self.db[name].delete_many({})
+
+        self.sleeps = []
+        self.collector = ImageGarbageCollector(database=self.db, batch_size=2, grace_seconds=60,
+                                               max_deletes_per_second=10, sleep=self.sleeps.append)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        for name in ('fs.files', 'fs.chunks', 'image_objects', 'prediction_history'):
+            self.db[name].delete_many({})
+        self.app_context.pop()
+
+    def _store(self, color, prediction_id):
+        """Store an image with its derivatives and return its reference"""
+        image = Image.new('RGB', (600, 400), color=color)
+        prepared = ImageStorage.prepare_prediction_image(image, prediction_id, 'gc-user')
+        return GridFSBackend(database=self.db).store([prepared])[0]
+
+    def _age_everything(self, seconds=3600):
+        """Move every stored file and chunk past the grace period"""
+        old = datetime.utcnow() - timedelta(seconds=seconds)
+        self.db['fs.files'].update_many({}, {'$set': {'uploadDate': old}})
+        # Chunk age comes from its ObjectId
+        for index, chunk in enumerate(list(self.db['fs.chunks'].find())):
+            self.db['fs.chunks'].delete_one({'_id': chunk['_id']})
+            chunk['_id'] = ObjectId.from_datetime(old - timedelta(seconds=index))
+            self.db['fs.chunks'].insert_one(chunk)
+
+    def _history(self, prediction_id, image_path, **fields):
+        document = {'prediction_id': prediction_id, 'user_id': 'gc-user', 'image_path': image_path}
+        document.update(fields)
+        self.db.prediction_history.insert_one(document)
+
+    def test_orphans_are_deleted_with_derivatives_and_chunks(self):
+        """Test that only unreferenced files go, and that their bytes are reported"""
+        kept = self._store((200, 30, 30), 'gc-kept')
+        orphan = self._store((30, 200, 30), 'gc-orphan')
+        self._history('gc-kept', kept)
+        self._age_everything()
+
+        orphan_files = list(self.db['fs.files'].find(
+            {'$or': [{'_id': ObjectId(orphan)}, {'parent_id': ObjectId(orphan)}]}))
+        orphan_bytes = sum(file_doc['length'] for file_doc in orphan_files)
+
+        report = self.collector.collect_orphans(dry_run=True)
+        self.assertEqual((report['files'], report['reclaimed_bytes']), (len(orphan_files), orphan_bytes))
+        self.assertIsNotNone(self.db['fs.files'].find_one({'_id': ObjectId(orphan)}))
+
+        report = self.collector.collect_orphans()
+        self.assertEqual((report['files'], report['reclaimed_bytes']), (len(orphan_files), orphan_bytes))
+        self.assertEqual(report['chunks'], len(orphan_files))
+        self.assertEqual(self.db['fs.files'].count_documents(
+            {'$or': [{'_id': ObjectId(orphan)}, {'parent_id': ObjectId(orphan)}]}), 0)
+        self.assertEqual(self.db['fs.chunks'].count_documents(
+            {'files_id': {'$in': [file_doc['_id'] for file_doc in orphan_files]}}), 0)
+        self.assertEqual(ImageStorage.read_image(kept)['content_type'], 'image/jpeg')
+
+        # Deletes were throttled to max_deletes_per_second
+        self.assertAlmostEqual(sum(self.sleeps), len(orphan_files) / 10.0)
+
+    def test_recent_and_rereferenced_images_are_kept(self):
+        """Test that images inside the grace period survive even without history"""
+        fresh = self._store((30, 30, 200), 'gc-fresh')
+        self.assertEqual(self.collector.collect_orphans()['files'], 0)
+
+        # A deduplicated upload re-references an old file before its history is written
+        self._age_everything()
+        self._store((30, 30, 200), 'gc-fresh-again')
+        self.assertEqual(self.collector.collect_orphans()['files'], 0)
+        self.assertIsNotNone(self.db['fs.files'].find_one({'_id': ObjectId(fresh)}))
+
+    def test_dead_lettered_images_are_kept(self):
+        """Test that an image only a dead-lettered prediction references is not collected"""
+        pending = self._store((200, 200, 30), 'gc-dead-letter')
+        self.db.persistence_dead_letters.insert_one({
+            'history': {'prediction_id': 'gc-dead-letter', 'user_id': 'gc-user', 'image_path': pending},
+            'images': [], 'error': 'write failed', 'failed_at': datetime.utcnow()})
+        self._age_everything()
+
+        try:
+            self.assertEqual(self.collector.collect_orphans()['files'], 0)
+            self.assertIsNotNone(self.db['fs.files'].find_one({'_id': ObjectId(pending)}))
+        finally:
+            self.db.persistence_dead_letters.delete_many({})
+
+    def test_chunks_without_file_are_deleted(self):
+        """Test that chunks left by an interrupted write are collected"""
+        files_id = ObjectId()
+        old = datetime.utcnow() - timedelta(hours=2)
+        self.db['fs.chunks'].insert_many([
+            {'_id': ObjectId.from_datetime(old), 'files_id': files_id, 'n': 0, 'data': Binary(b'x' * 100)},
+            {'_id': ObjectId.from_datetime(old + timedelta(seconds=1)), 'files_id': files_id, 'n': 1,
+             'data': Binary(b'x' * 20)}
+        ])
+
+        report = self.collector.collect_orphans()
+        self.assertEqual((report['chunks'], report['reclaimed_bytes']), (2, 120))
+        self.assertEqual(self.db['fs.chunks'].count_documents({'files_id': files_id}), 0)
+
+    def test_expired_images_are_deleted(self):
+        """Test that expired images are deleted and their predictions kept without image"""
+        expired = self._store((120, 120, 30), 'gc-expired')
+        current = self._store((30, 120, 120), 'gc-current')
+        self._history('gc-expired', expired, image_expires_at='2020-01-01T00:00:00')
+        self._history('gc-current', current, image_expires_at='2999-01-01T00:00:00')
+
+        self.assertEqual(self.collector.expire_images(dry_run=True), 1)
+        self.assertEqual(self.collector.expire_images(), 1)
+
+        self.assertIsNone(self.db['fs.files'].find_one({'_id': ObjectId(expired)}))
+        self.assertIsNotNone(self.db['fs.files'].find_one({'_id': ObjectId(current)}))
+        prediction = self.db.prediction_history.find_one({'prediction_id': 'gc-expired'})
+        self.assertNotIn('image_path', prediction)
+        self.assertIn('image_expired_at', prediction)
+
+    def test_expiry_releases_every_reference_of_a_prediction(self):
+        """Test that an image sent twice in one prediction loses both references when it expires"""
+        image = Image.new('RGB', (600, 400), color=(200, 120, 30))
+        prepared = ImageStorage.prepare_prediction_image(image, 'gc-twice', 'gc-user')
+        ref = GridFSBackend(database=self.db).store([prepared, prepared])[0]
+        self._history('gc-twice', ref, image_paths=[ref, ref], image_expires_at='2020-01-01T00:00:00')
+
+        self.assertEqual(self.collector.expire_images(), 1)
+
+        self.assertIsNone(self.db['fs.files'].find_one({'_id': ObjectId(ref)}))
+
+if __name__ == '__main__':
+    unittest.main()
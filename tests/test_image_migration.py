@@ -0,0 +1,124 @@
+"""
+Unit tests for moving stored images between storage backends
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from PIL import Image
+from bson.objectid import ObjectId
+
+# Add parent directory to path so we can import the scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.extensions import mongo
+from app.utils import storage_backends
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import GridFSBackend, LocalDiskBackend
+from scripts.migrate_image_storage import find_refs, migrate
+from scripts.migrate_to_gridfs import migrate_files
+
+COLLECTIONS = ('fs.files', 'fs.chunks', 'image_objects', 'prediction_history')
+
+class TestImageMigration(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an empty database and a disk backend in a temporary directory"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.db = mongo.db
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+
+        self.root = tempfile.mkdtemp()
+        self.gridfs = GridFSBackend(database=self.db)
+        self.backends = patch.dict(storage_backends._backends, {
+            'gridfs': self.gridfs,
+            'disk': LocalDiskBackend(self.root, collection=self.db.image_objects)
+        })
+        self.backends.start()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        self.backends.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+        self.app_context.pop()
+
+    def _prepare(self, color, prediction_id):
+        image = Image.new('RGB', (600, 400), color=color)
+        return ImageStorage.prepare_prediction_image(image, prediction_id, 'migration-user')
+
+    def test_multi_image_predictions_are_migrated(self):
+        """Test that every image of a multi-image prediction moves, with one reference per use"""
+        first, second = self.gridfs.store(
+            [self._prepare((200, 30, 30), 'multi'), self._prepare((30, 200, 30), 'multi')])
+        self.db.prediction_history.insert_one({'prediction_id': 'multi', 'user_id': 'migration-user',
+                                               'image_path': first, 'image_paths': [first, second]})
+        self.assertEqual(self.gridfs.store([self._prepare((200, 30, 30), 'single')]), [first])
+        self.db.prediction_history.insert_one({'prediction_id': 'single', 'user_id': 'migration-user',
+                                               'image_path': first})
+        self.assertEqual(find_refs('gridfs', 10), sorted([first, second]))
+
+        self.assertEqual(migrate('gridfs', 'disk'), (2, 0))
+
+        multi = self.db.prediction_history.find_one({'prediction_id': 'multi'})
+        single = self.db.prediction_history.find_one({'prediction_id': 'single'})
+        self.assertTrue(all(ref.startswith('disk:') for ref in multi['image_paths']))
+        self.assertEqual(multi['image_path'], multi['image_paths'][0])
+        self.assertEqual(single['image_path'], multi['image_path'])
+
+        self.assertEqual(self.db.image_objects.find_one({'_id': multi['image_paths'][0]})['ref_count'], 2)
+        self.assertEqual(self.db.image_objects.find_one({'_id': multi['image_paths'][1]})['ref_count'], 1)
+        self.assertEqual(self.db['fs.files'].count_documents({'_id': {'$in': [ObjectId(first), ObjectId(second)]}}), 0)
+        self.assertEqual(find_refs('gridfs', 10), [])
+        self.assertIsNotNone(ImageStorage.read_image(multi['image_paths'][1]))
+
+class TestFilesystemMigration(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an empty database and an uploads directory with two legacy files"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.db = mongo.db
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+
+        self.uploads = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.uploads, 'legacy-user'))
+        for name, color in (('shared.jpg', (200, 30, 30)), ('unused.jpg', (30, 200, 30))):
+            Image.new('RGB', (64, 64), color=color).save(os.path.join(self.uploads, 'legacy-user', name))
+
+    def tearDown(self):
+        """Clean up after tests"""
+        shutil.rmtree(self.uploads, ignore_errors=True)
+        for name in COLLECTIONS:
+            self.db[name].delete_many({})
+        self.app_context.pop()
+
+    def test_files_get_one_reference_per_prediction(self):
+        """Test that a path shared by predictions gets their references and unreferenced files are skipped"""
+        path = os.path.join('legacy-user', 'shared.jpg')
+        self.db.prediction_history.insert_many([
+            {'prediction_id': f'legacy-{index}', 'user_id': 'legacy-user', 'image_path': path} for index in range(3)])
+
+        progress = migrate_files(self.uploads, workers=2, batch_size=10)
+        self.assertEqual((progress['migrated'], progress['skipped'], progress['errors']), (1, 1, 0))
+
+        refs = set(document['image_path'] for document in self.db.prediction_history.find())
+        self.assertEqual(len(refs), 1)
+        file_doc = self.db['fs.files'].find_one({'_id': ObjectId(refs.pop())})
+        self.assertEqual((file_doc['ref_count'], file_doc['migrated_from']), (3, path))
+        self.assertEqual(self.db['fs.files'].count_documents({'parent_id': {'$exists': False}}), 1)
+
+if __name__ == '__main__':
+    unittest.main()
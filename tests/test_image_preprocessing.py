@@ -0,0 +1,154 @@
+"""
+Unit tests for image preprocessing and streaming upload handling
+"""
+
+import unittest
+import io
+import hashlib
+from PIL import Image
+import numpy as np
+from flask import Flask, request, jsonify
+
+from app.utils.image import prep_image, normalize_image, decode_tensor
+from app.core.models.model_loader import ModelLoader, DEFAULT_INPUT_SHAPE
+from app.utils.upload import SpooledUploadRequest, init_upload_handling
+
+class TestPrepImage(unittest.TestCase):
+
+    def _create_test_image(self, size=(640, 480), format='JPEG'):
+        """Create a simple test image"""
+        img = Image.new('RGB', size, color=(34, 139, 34))
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format=format)
+        img_byte_arr.seek(0)
+        return img_byte_arr
+
+    def test_prep_image_shape_and_range(self):
+        """Test that prep_image returns a normalized batch of one"""
+        img_array = prep_image(self._create_test_image())
+
+        self.assertEqual(img_array.shape, (1, 224, 224, 3))
+        self.assertEqual(img_array.dtype, np.float32)
+        self.assertGreaterEqual(img_array.min(), 0.0)
+        self.assertLessEqual(img_array.max(), 1.0)
+
+    def test_prep_image_rewinds_stream(self):
+        """Test that a partially consumed stream is decoded from the start"""
+        image_file = self._create_test_image(format='PNG')
+        image_file.read(10)
+
+        img_array = prep_image(image_file)
+        self.assertEqual(img_array.shape, (1, 224, 224, 3))
+
+    def test_prep_image_invalid_data(self):
+        """Test that undecodable data raises ValueError"""
+        with self.assertRaises(ValueError):
+            prep_image(io.BytesIO(b'not an image'))
+
+    def test_prep_image_at_model_resolution(self):
+        """Test that an image already at model resolution keeps its exact pixels"""
+        pixels = np.random.default_rng(0).integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+        image_file = io.BytesIO()
+        Image.fromarray(pixels).save(image_file, format='PNG')
+
+        img_array = prep_image(image_file)
+        np.testing.assert_allclose(img_array[0], pixels / 255.0, rtol=1e-6)
+
+class TestTensorUpload(unittest.TestCase):
+
+    def setUp(self):
+        """Create a raw 224x224x3 uint8 buffer and its checksum"""
+        self.pixels = np.random.default_rng(1).integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+        self.raw = self.pixels.tobytes()
+        self.checksum = hashlib.sha256(self.raw).hexdigest()
+
+    def test_decode_tensor(self):
+        """Test decoding a valid tensor upload"""
+        pixels = decode_tensor(io.BytesIO(self.raw), '224,224,3', self.checksum)
+        np.testing.assert_array_equal(pixels, self.pixels)
+
+        batch = normalize_image(pixels)
+        self.assertEqual(batch.shape, (1, 224, 224, 3))
+        self.assertEqual(batch.dtype, np.float32)
+
+    def test_decode_tensor_prefixed_checksum(self):
+        """Test that a 'sha256:' prefixed checksum is accepted"""
+        pixels = decode_tensor(io.BytesIO(self.raw), '224x224x3', 'sha256:' + self.checksum.upper())
+        self.assertEqual(pixels.shape, (224, 224, 3))
+
+    def test_decode_tensor_checksum_mismatch(self):
+        """Test that a corrupted buffer is rejected"""
+        corrupted = b'\x00' + self.raw[1:]
+        with self.assertRaises(ValueError):
+            decode_tensor(io.BytesIO(corrupted), '224,224,3', self.checksum)
+
+    def test_decode_tensor_wrong_shape(self):
+        """Test that a shape other than the model input shape is rejected"""
+        with self.assertRaises(ValueError):
+            decode_tensor(io.BytesIO(self.raw), '256,256,3', self.checksum)
+
+    def test_decode_tensor_wrong_size(self):
+        """Test that a truncated or oversized buffer is rejected"""
+        with self.assertRaises(ValueError):
+            decode_tensor(io.BytesIO(self.raw[:-1]), '224,224,3', self.checksum)
+        with self.assertRaises(ValueError):
+            decode_tensor(io.BytesIO(self.raw + b'\x00'), '224,224,3', self.checksum)
+
+    def test_default_model_metadata(self):
+        """Test that an unloaded model publishes the default input shape"""
+        model_loader = ModelLoader()
+        self.assertEqual(model_loader.get_input_shape(), DEFAULT_INPUT_SHAPE)
+        self.assertEqual(model_loader.get_model_metadata()['input_shape'], list(DEFAULT_INPUT_SHAPE))
+
+class TestSpooledUpload(unittest.TestCase):
+
+    def setUp(self):
+        """Create a minimal app using the streaming upload request class"""
+        self.app = Flask(__name__)
+        self.app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
+        self.app.config['UPLOAD_SPOOL_THRESHOLD'] = 1024
+        init_upload_handling(self.app)
+
+        @self.app.route('/upload', methods=['POST'])
+        def upload():
+            stream = request.files['file'].stream
+            return jsonify({'rolled_to_disk': bool(getattr(stream, '_rolled', False))})
+
+        self.client = self.app.test_client()
+
+    def test_request_class(self):
+        """Test that the app uses the spooled upload request class"""
+        self.assertIs(self.app.request_class, SpooledUploadRequest)
+
+    def test_large_upload_spooled_to_disk(self):
+        """Test that uploads above the threshold are rolled over to disk"""
+        response = self.client.post(
+            '/upload',
+            data={'file': (io.BytesIO(b'x' * 8192), 'upload.bin')},
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['rolled_to_disk'])
+
+    def test_small_upload_kept_in_memory(self):
+        """Test that uploads below the threshold stay in memory"""
+        response = self.client.post(
+            '/upload',
+            data={'file': (io.BytesIO(b'x' * 100), 'upload.bin')},
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.get_json()['rolled_to_disk'])
+
+    def test_oversized_upload_rejected(self):
+        """Test that uploads above MAX_CONTENT_LENGTH get a JSON 413"""
+        response = self.client.post(
+            '/upload',
+            data={'file': (io.BytesIO(b'x' * 128 * 1024), 'upload.bin')},
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('error', response.get_json())
+
+if __name__ == '__main__':
+    unittest.main()
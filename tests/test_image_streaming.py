@@ -0,0 +1,51 @@
+"""
+Unit tests for opening stored images for streaming
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from app.utils.storage import ImageStorage
+
+class TestOpenImage(unittest.TestCase):
+
+    def setUp(self):
+        """Point the legacy uploads directory at a temporary directory"""
+        self.original_base_dir = ImageStorage.BASE_DIR
+        self.temp_dir = tempfile.mkdtemp()
+        ImageStorage.BASE_DIR = self.temp_dir
+
+        os.makedirs(os.path.join(self.temp_dir, '2025-05'))
+        self.data = bytes(range(256)) * 4
+        with open(os.path.join(self.temp_dir, '2025-05', 'legacy.jpg'), 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        """Restore the uploads directory"""
+        ImageStorage.BASE_DIR = self.original_base_dir
+        shutil.rmtree(self.temp_dir)
+
+    def test_open_legacy_image(self):
+        """Test that legacy filesystem images open as seekable streams"""
+        image = ImageStorage.open_image('2025-05/legacy.jpg')
+
+        self.assertIsNotNone(image)
+        try:
+            self.assertEqual(image['length'], len(self.data))
+            self.assertEqual(image['content_type'], 'image/jpeg')
+            self.assertTrue(image['etag'])
+
+            image['stream'].seek(100)
+            self.assertEqual(image['stream'].read(10), self.data[100:110])
+        finally:
+            image['stream'].close()
+
+    def test_open_missing_image(self):
+        """Test that missing images return None"""
+        self.assertIsNone(ImageStorage.open_image('2025-05/missing.jpg'))
+        self.assertIsNone(ImageStorage.open_image(None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Unit tests for perceptual hashing and the near-duplicate index
+"""
+
+import unittest
+import os
+import sys
+import numpy as np
+
+# Add parent directory to path so we can import the benchmarks
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.pipeline import make_leaf_image
+from app.utils.image import perceptual_hash
+from app.services.near_duplicates import NearDuplicateIndex
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class TestPerceptualHash(unittest.TestCase):
+
+    def _leaf(self, seed, noise=0.0, shift=0):
+        """Normalized leaf image with optional sensor noise and a horizontal shift"""
+        image = make_leaf_image(224, 224, seed=seed).astype(np.float32) / 255.0
+        if noise:
+            image = np.clip(image + noise * np.random.RandomState(seed).randn(*image.shape), 0.0, 1.0)
+        return np.roll(image, shift, axis=1)
+
+    def test_hash_is_64_bits_and_accepts_batches(self):
+        """Test that batched and unbatched inputs hash the same"""
+        image = self._leaf(1)
+        value = perceptual_hash(image)
+
+        self.assertLess(value, 2 ** 64)
+        self.assertEqual(perceptual_hash(image[None]), value)
+
+    def test_reshot_photo_is_close(self):
+        """Test that noise and small shifts change only a few bits"""
+        original = perceptual_hash(self._leaf(1))
+
+        self.assertLessEqual(hamming(original, perceptual_hash(self._leaf(1, noise=0.03))), 8)
+        self.assertLessEqual(hamming(original, perceptual_hash(self._leaf(1, shift=3))), 8)
+
+    def test_different_photo_is_far(self):
+        """Test that unrelated images are well beyond the default distance"""
+        self.assertGreater(hamming(perceptual_hash(self._leaf(1)), perceptual_hash(self._leaf(2))), 16)
+
+class TestNearDuplicateIndex(unittest.TestCase):
+
+    def test_find_within_distance(self):
+        """Test that only hashes within the distance are matched"""
+        index = NearDuplicateIndex()
+        index.add('user-1', 0b1111, 'p1', 3, 0.9)
+
+        match = index.find('user-1', 0b0111, max_distance=1)
+        self.assertEqual(match['prediction_id'], 'p1')
+        self.assertEqual(match['distance'], 1)
+        self.assertEqual(match['class_id'], 3)
+        self.assertAlmostEqual(match['confidence'], 0.9, places=5)
+        self.assertIsNone(index.find('user-1', 0b0000, max_distance=3))
+
+    def test_users_are_isolated(self):
+        """Test that one user's hashes never match another user's photos"""
+        index = NearDuplicateIndex()
+        index.add('user-1', 42, 'p1', 0, 0.5)
+
+        self.assertIsNone(index.find('user-2', 42, max_distance=8))
+
+    def test_ties_resolve_to_most_recent(self):
+        """Test that the newest of equally close predictions is returned"""
+        index = NearDuplicateIndex(max_hashes_per_user=3)
+        for i in range(5):
+            index.add('user-1', 7, f'p{i}', 0, 0.5)
+
+        self.assertEqual(index.find('user-1', 7, max_distance=0)['prediction_id'], 'p4')
+
+    def test_oldest_hashes_are_overwritten(self):
+        """Test that the ring buffer forgets the oldest predictions"""
+        index = NearDuplicateIndex(max_hashes_per_user=2)
+        index.add('user-1', 2 ** 63 + 1, 'old', 0, 0.5)
+        index.add('user-1', 0, 'p1', 0, 0.5)
+        index.add('user-1', 0, 'p2', 0, 0.5)
+
+        self.assertIsNone(index.find('user-1', 2 ** 63 + 1, max_distance=0))
+
+    def test_buffers_grow_with_the_user(self):
+        """Test that users with a few hashes stay small and buffers grow up to the maximum"""
+        index = NearDuplicateIndex(max_hashes_per_user=50000, max_users=1000)
+        for user in range(1000):
+            for i in range(3):
+                index.add(f'user-{user}', user * 8 + i, f'p{user}-{i}', 0, 0.5)
+
+        users = [index._users.get(f'user-{user}') for user in range(1000)]
+        memory = sum(user.hashes.nbytes + user.class_ids.nbytes + user.confidences.nbytes for user in users)
+        self.assertLess(memory, 1024 * 1024)
+        self.assertEqual(index.find('user-999', 999 * 8 + 2, max_distance=0)['prediction_id'], 'p999-2')
+
+        # Growth keeps every entry, then the ring wraps at the maximum
+        index = NearDuplicateIndex(max_hashes_per_user=100)
+        for i in range(250):
+            index.add('user-1', i, f'p{i}', 0, 0.5)
+        self.assertEqual(len(index._users.get('user-1').hashes), 100)
+        self.assertIsNone(index.find('user-1', 149, max_distance=0))
+        for i in range(150, 250):
+            self.assertEqual(index.find('user-1', i, max_distance=0)['prediction_id'], f'p{i}')
+
+    def test_large_index(self):
+        """Test lookups over tens of thousands of hashes"""
+        index = NearDuplicateIndex(max_hashes_per_user=50000)
+        hashes = np.random.RandomState(0).randint(0, 2 ** 62, size=50000, dtype=np.int64)
+        for i, value in enumerate(hashes):
+            index.add('user-1', int(value), f'p{i}', 0, 0.5)
+
+        match = index.find('user-1', int(hashes[1234]) ^ 0b101, max_distance=2)
+        self.assertEqual(match['prediction_id'], 'p1234')
+        self.assertEqual(match['distance'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
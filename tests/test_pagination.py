@@ -0,0 +1,46 @@
+"""
+Unit tests for keyset pagination cursors
+"""
+
+import unittest
+from datetime import datetime
+
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_filter
+
+class TestCursors(unittest.TestCase):
+
+    def test_cursor_round_trip(self):
+        """Test that cursors are opaque URL-safe strings keeping the key's type"""
+        cursor = encode_cursor('timestamp', 'desc', '2025-05-11T10:30:45', 'p-1')
+        self.assertRegex(cursor, r'^[A-Za-z0-9_-]+$')
+        self.assertEqual(decode_cursor(cursor, 'timestamp', 'desc'), ('2025-05-11T10:30:45', 'p-1'))
+
+        created = datetime(2025, 5, 11, 10, 30, 45)
+        cursor = encode_cursor('created_at', 'asc', created, 'p-2')
+        self.assertEqual(decode_cursor(cursor, 'created_at', 'asc')[0].replace(tzinfo=None), created)
+
+    def test_invalid_cursors_are_rejected(self):
+        """Test that malformed cursors and cursors of another sort raise ValueError"""
+        cursor = encode_cursor('timestamp', 'desc', '2025-05-11T10:30:45', 'p-1')
+        for bad in ('not a cursor', cursor[:-4], 'e30'):
+            with self.assertRaises(ValueError):
+                decode_cursor(bad, 'timestamp', 'desc')
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, 'timestamp', 'asc')
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, 'confidence', 'desc')
+
+    def test_keyset_filter(self):
+        """Test the range query following a key in each direction"""
+        self.assertEqual(keyset_filter('timestamp', -1, 't', 'p'), {'$or': [
+            {'timestamp': {'$lt': 't'}}, {'timestamp': 't', 'prediction_id': {'$lt': 'p'}}, {'timestamp': None}]})
+        self.assertEqual(keyset_filter('confidence', 1, 0.5, 'p'), {'$or': [
+            {'confidence': {'$gt': 0.5}}, {'confidence': 0.5, 'prediction_id': {'$gt': 'p'}}]})
+
+        # Missing values sort first: ascending continues into non-null values, descending ends with them
+        self.assertEqual(keyset_filter('condition', 1, None, 'p'), {'$or': [
+            {'condition': None, 'prediction_id': {'$gt': 'p'}}, {'condition': {'$ne': None}}]})
+        self.assertEqual(keyset_filter('condition', -1, None, 'p'), {'condition': None, 'prediction_id': {'$lt': 'p'}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Unit tests for write-behind prediction persistence
+"""
+
+import unittest
+import threading
+import time
+
+from app.services.persistence import PersistenceQueue
+from app.utils.metrics import metrics
+
+class TestPersistenceQueue(unittest.TestCase):
+
+    def setUp(self):
+        """Record writes in memory instead of MongoDB"""
+        self.calls = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.release.set()
+
+    def _write_images(self, images):
+        self.release.wait(5)
+        with self.lock:
+            self.calls.append(('images', [image['_id'] for image in images]))
+
+    def _write_history(self, documents):
+        with self.lock:
+            self.calls.append(('history', [document['prediction_id'] for document in documents]))
+
+    def _queue(self, **kwargs):
+        return PersistenceQueue(write_images=self._write_images, write_history=self._write_history, **kwargs)
+
+    def _written_ids(self, kind):
+        return [item for call_kind, items in self.calls if call_kind == kind for item in items]
+
+    def test_writes_are_batched_and_flushed_on_stop(self):
+        """Test that queued predictions are written in batches and flushed on stop"""
+        persistence_queue = self._queue(workers=1, batch_size=10)
+
+        # Hold the worker so everything queues up behind the first batch
+        self.release.clear()
+        persistence_queue.start()
+        for i in range(5):
+            self.assertTrue(persistence_queue.submit({'prediction_id': f'p{i}'}, [{'_id': f'img{i}'}]))
+        self.release.set()
+        persistence_queue.stop()
+
+        self.assertEqual(sorted(self._written_ids('history')), [f'p{i}' for i in range(5)])
+        self.assertEqual(sorted(self._written_ids('images')), [f'img{i}' for i in range(5)])
+        self.assertLess(len([c for c in self.calls if c[0] == 'history']), 5)
+        self.assertEqual(persistence_queue.depth(), 0)
+
+    def test_images_written_before_history(self):
+        """Test that each batch writes images before the history documents"""
+        persistence_queue = self._queue(workers=1)
+        persistence_queue.start()
+        persistence_queue.submit({'prediction_id': 'p1'}, [{'_id': 'img1'}])
+        self.assertTrue(persistence_queue.flush(timeout=5))
+        persistence_queue.stop()
+
+        self.assertEqual([kind for kind, _ in self.calls], ['images', 'history'])
+
+    def test_backpressure_writes_synchronously(self):
+        """Test that a full queue makes the caller write synchronously"""
+        persistence_queue = self._queue(workers=1, max_size=1, batch_size=1, enqueue_timeout=0.01)
+        before = metrics.get_counter('persistence.backpressure')
+
+        self.release.clear()
+        persistence_queue.start()
+        persistence_queue.submit({'prediction_id': 'p0'}, [{'_id': 'img0'}])  # taken by the blocked worker
+        while persistence_queue.depth():
+            time.sleep(0.01)
+        persistence_queue.submit({'prediction_id': 'p1'})  # fills the queue
+        queued = persistence_queue.submit({'prediction_id': 'p2'})  # no room left
+
+        self.assertFalse(queued)
+        self.assertIn('p2', self._written_ids('history'))
+        self.assertEqual(metrics.get_counter('persistence.backpressure'), before + 1)
+
+        self.release.set()
+        persistence_queue.stop()
+        self.assertEqual(sorted(self._written_ids('history')), ['p0', 'p1', 'p2'])
+
+    def test_not_started_writes_synchronously(self):
+        """Test that submit writes inline when workers are not running"""
+        persistence_queue = self._queue()
+        self.assertFalse(persistence_queue.submit({'prediction_id': 'p1'}))
+        self.assertEqual(self._written_ids('history'), ['p1'])
+
+    def test_failed_writes_are_retried(self):
+        """Test that a failed history write is retried without writing the images again"""
+        failures = [RuntimeError('not primary'), RuntimeError('not primary')]
+        def write_history(documents):
+            if failures:
+                raise failures.pop()
+            self._write_history(documents)
+        persistence_queue = PersistenceQueue(write_images=self._write_images, write_history=write_history,
+                                             retry_delay=0)
+
+        self.assertFalse(persistence_queue.submit({'prediction_id': 'p1'}, [{'_id': 'img1'}]))
+        self.assertEqual(self.calls, [('images', ['img1']), ('history', ['p1'])])
+
+    def test_stored_images_are_not_written_again(self):
+        """Test that a retry after a partial image write only writes the images not stored yet"""
+        failures = [RuntimeError('not primary')]
+        def write_images(images):
+            if images[0]['_id'] == 'img2' and failures:
+                raise failures.pop()
+            self._write_images(images)
+        persistence_queue = PersistenceQueue(write_images=write_images, write_history=self._write_history,
+                                             retry_delay=0)
+
+        persistence_queue._write_batch([
+            {'history': {'prediction_id': 'p1'}, 'images': [{'_id': 'img1'}], 'enqueued_at': time.monotonic()},
+            {'history': {'prediction_id': 'p2'}, 'images': [{'_id': 'img2'}], 'enqueued_at': time.monotonic()},
+            {'history': {'prediction_id': 'p3'}, 'images': [{'_id': 'img1'}], 'enqueued_at': time.monotonic()}
+        ])
+
+        self.assertEqual(self.calls, [('images', ['img1', 'img1']), ('images', ['img2']),
+                                      ('history', ['p1', 'p2', 'p3'])])
+
+    def test_backpressure_writes_are_not_retried(self):
+        """Test that a failed synchronous write of a full queue is dead-lettered without retry delays"""
+        letters = []
+        def write_history(documents):
+            if 'p2' in [document['prediction_id'] for document in documents]:
+                raise RuntimeError('connection refused')
+            self._write_history(documents)
+        persistence_queue = PersistenceQueue(write_images=self._write_images, write_history=write_history,
+                                             write_dead_letters=letters.extend, workers=1, max_size=1,
+                                             batch_size=1, enqueue_timeout=0.01, retry_delay=10)
+
+        self.release.clear()
+        persistence_queue.start()
+        persistence_queue.submit({'prediction_id': 'p0'}, [{'_id': 'img0'}])  # taken by the blocked worker
+        while persistence_queue.depth():
+            time.sleep(0.01)
+        persistence_queue.submit({'prediction_id': 'p1'})  # fills the queue
+
+        start = time.monotonic()
+        self.assertFalse(persistence_queue.submit({'prediction_id': 'p2'}))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([letter['history']['prediction_id'] for letter in letters], ['p2'])
+
+        self.release.set()
+        persistence_queue.stop()
+
+    def test_failed_batches_are_dead_lettered(self):
+        """Test that a batch failing every retry is saved as dead letters"""
+        letters = []
+        def write_history(documents):
+            raise RuntimeError('connection refused')
+        persistence_queue = PersistenceQueue(write_images=self._write_images, write_history=write_history,
+                                             write_dead_letters=letters.extend, retries=2, retry_delay=0)
+        before = metrics.get_counter('persistence.dead_lettered')
+
+        persistence_queue.submit({'prediction_id': 'p1'}, [{'_id': 'img1'}])
+
+        self.assertEqual(self._written_ids('images'), ['img1'])
+        self.assertEqual(len(letters), 1)
+        self.assertEqual((letters[0]['history'], letters[0]['images']), ({'prediction_id': 'p1'}, []))
+        self.assertEqual(letters[0]['error'], 'connection refused')
+        self.assertEqual(metrics.get_counter('persistence.dead_lettered'), before + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Unit tests for the prediction result cache
+"""
+
+import unittest
+import threading
+import time
+from datetime import datetime
+
+from app.utils.cache import LRUCache, SingleFlight, make_cache_key
+from app.services.prediction_cache import PredictionCache
+
+class _Collection:
+    """Minimal stand-in for the prediction_cache collection"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def find_one(self, query):
+        document = self.documents.get(query['_id'])
+        if document and document['expires_at'] > query['expires_at']['$gt']:
+            return document
+        return None
+
+    def replace_one(self, query, document, upsert=False):
+        self.documents[query['_id']] = document
+
+class TestCachePrimitives(unittest.TestCase):
+
+    def test_lru_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry is evicted first"""
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_cache_key_is_order_independent(self):
+        """Test that keys only depend on the values of their parts"""
+        self.assertEqual(make_cache_key({'a': 1, 'b': [2, 3]}), make_cache_key({'b': [2, 3], 'a': 1}))
+        self.assertNotEqual(make_cache_key({'a': 1}), make_cache_key({'a': 2}))
+
+    def test_single_flight_coalesces_concurrent_calls(self):
+        """Test that concurrent calls for one key run the function once"""
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True])
+        self.assertTrue(all(result == 'result' for result, _ in results))
+
+class TestPredictionCache(unittest.TestCase):
+
+    def setUp(self):
+        """Create a cache backed by an in-memory collection"""
+        self.collection = _Collection()
+        self.cache = PredictionCache(max_entries=10, ttl=60, collection=self.collection)
+        self.calls = 0
+
+    def _compute(self, result=None):
+        def compute():
+            self.calls += 1
+            return dict(result or {'class_name': 'Tomato___healthy', 'confidence': 0.9}, timings_ms={'inference_ms': 5.0})
+        return compute
+
+    def test_hits_skip_compute(self):
+        """Test that a repeated key is served from memory without computing"""
+        first, source = self.cache.get_or_compute('key', self._compute())
+        self.assertEqual(source, 'computed')
+        self.assertIn('timings_ms', first)
+
+        second, source = self.cache.get_or_compute('key', self._compute())
+        self.assertEqual(source, 'memory')
+        self.assertEqual(second['class_name'], 'Tomato___healthy')
+        self.assertNotIn('timings_ms', second)
+        self.assertEqual(self.calls, 1)
+
+    def test_shared_level_serves_other_workers(self):
+        """Test that results stored by one worker are found by another"""
+        self.cache.get_or_compute('key', self._compute())
+
+        other_worker = PredictionCache(collection=self.collection)
+        _, source = other_worker.get_or_compute('key', self._compute())
+        self.assertEqual(source, 'mongo')
+        self.assertEqual(self.calls, 1)
+
+    def test_hits_return_independent_copies(self):
+        """Test that callers can modify results without changing the cache"""
+        self.cache.get_or_compute('key', self._compute())
+        hit, _ = self.cache.get_or_compute('key', self._compute())
+        hit['class_name'] = 'changed'
+
+        again, _ = self.cache.get_or_compute('key', self._compute())
+        self.assertEqual(again['class_name'], 'Tomato___healthy')
+
+    def test_errors_are_not_cached(self):
+        """Test that failed predictions are computed again"""
+        failed = {'error': 'bad image', 'class_name': 'Unknown', 'confidence': 0.0}
+        self.cache.get_or_compute('key', self._compute(failed))
+        _, source = self.cache.get_or_compute('key', self._compute(failed))
+
+        self.assertEqual(source, 'computed')
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.collection.documents, {})
+
+    def test_uncacheable_results_are_not_shared(self):
+        """Test that callers waiting on a near-duplicate reuse compute their own result"""
+        started = threading.Event()
+        results = {}
+
+        def leader_compute():
+            started.set()
+            time.sleep(0.2)
+            return {'class_name': 'Potato___Early_blight', 'confidence': 0.8,
+                    'near_duplicate': {'prediction_id': 'user-a-photo', 'distance': 2, 'reused': True}}
+
+        def follower_compute():
+            self.calls += 1
+            return {'class_name': 'Tomato___healthy', 'confidence': 0.9}
+
+        leader = threading.Thread(target=lambda: results.update(
+            leader=self.cache.get_or_compute('key', leader_compute)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.update(
+            follower=self.cache.get_or_compute('key', follower_compute)))
+        follower.start()
+        leader.join()
+        follower.join()
+
+        self.assertIn('near_duplicate', results['leader'][0])
+        self.assertEqual(results['follower'], ({'class_name': 'Tomato___healthy', 'confidence': 0.9}, 'computed'))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.collection.documents, {})
+
+    def test_expired_entries_are_ignored(self):
+        """Test that entries past their expiry are recomputed"""
+        self.cache.get_or_compute('key', self._compute())
+        self.cache._memory.get('key')['expires_at'] = datetime(2000, 1, 1)
+
+        _, source = self.cache.get_or_compute('key', self._compute())
+        self.assertEqual(source, 'computed')
+
+if __name__ == '__main__':
+    unittest.main()
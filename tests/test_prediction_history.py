@@ -4,6 +4,7 @@ import unittest
 import os
 import sys
 import json
+import jwt
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -14,6 +15,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app
 from app.api.prediction.models import PredictionHistory
+from app.api.prediction.services import PredictionService
+from app.utils.pagination import decode_cursor
 from app.utils.generators import generate_uuid, get_current_timestamp
 
 class TestPredictionHistory(unittest.TestCase):
@@ -105,6 +108,72 @@ class TestPredictionHistory(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(len(data['predictions']), 2)
         
+    def test_cursor_pagination(self):
+        """Test that cursor pages cover the history once, including timestamp ties"""
+        timestamps = ['2025-05-11T10:00:00'] * 3 + ['2025-05-10T09:00:00', '2025-05-12T08:00:00']
+        with self.app.app_context():
+            for i, timestamp in enumerate(timestamps):
+                PredictionHistory.save_prediction({
+                    'prediction_id': f'{self.test_user_id}-{i}',
+                    'user_id': self.test_user_id,
+                    'class_name': f'test_class_{i}',
+                    'confidence': 0.9,
+                    'timestamp': timestamp,
+                    'plant_type': 'Test Plant',
+                    'condition': 'Test Disease'
+                })
+            
+            seen = []
+            after = None
+            while True:
+                page, next_cursor = PredictionService.get_user_prediction_page(self.test_user_id, limit=2, after=after)
+                seen.extend(prediction['prediction_id'] for prediction in page)
+                if next_cursor is None:
+                    break
+                after = decode_cursor(next_cursor, 'timestamp', 'desc')
+            
+            expected = [prediction['prediction_id'] for prediction in
+                        PredictionHistory.get_user_predictions(self.test_user_id, limit=10)]
+            self.assertEqual(seen, expected)
+            self.assertEqual(len(set(seen)), 5)
+            self.assertEqual(seen[0], f'{self.test_user_id}-4')
+        
+    def test_list_fields(self):
+        """Test that list views return the summary or the requested fields, and details everything"""
+        prediction_id = f'{self.test_user_id}-fields'
+        with self.app.app_context():
+            PredictionHistory.save_prediction({
+                'prediction_id': prediction_id,
+                'user_id': self.test_user_id,
+                'class_name': 'Tomato___Late_blight',
+                'confidence': 0.8,
+                'timestamp': get_current_timestamp(),
+                'plant_type': 'Tomato',
+                'condition': 'Late_blight',
+                'advice': 'Remove infected leaves. ' * 200,
+                'perceptual_hash': '00ff00ff00ff00ff'
+            })
+        
+        token = jwt.encode({'sub': self.test_user_id}, os.getenv('SECRET_KEY', 'default_secret_key'), algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        summary = json.loads(self.client.get('/api/prediction/history', headers=headers).data)['predictions'][0]
+        self.assertEqual(summary['class_name'], 'Tomato___Late_blight')
+        self.assertNotIn('advice', summary)
+        self.assertNotIn('_id', summary)
+        
+        response = self.client.get('/api/prediction/my-predictions?fields=advice,confidence', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        selected = json.loads(response.data)['predictions'][0]
+        self.assertEqual(set(selected), {'prediction_id', 'timestamp', 'advice', 'confidence'})
+        
+        response = self.client.get('/api/prediction/my-predictions?fields=perceptual_hash', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        
+        detail = json.loads(self.client.get(f'/api/prediction/history/{prediction_id}', headers=headers).data)
+        self.assertIn('advice', detail)
+        self.assertIn('perceptual_hash', detail)
+
     def test_image_storage(self):
         """Test saving and retrieving images with predictions"""
         # Make a prediction with image storage
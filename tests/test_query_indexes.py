@@ -0,0 +1,93 @@
+"""
+Query plan tests of the prediction history indexes
+"""
+
+import itertools
+import os
+import unittest
+from datetime import datetime, timedelta
+import jwt
+
+from app import create_app
+from app.extensions import mongo
+from app.api.prediction.models import PredictionHistory
+from app.db.indexes import INDEXES, HISTORY_SORT_FIELDS
+
+PLANTS = [('Tomato', 'healthy'), ('Tomato', 'late_blight'), ('Potato', 'early_blight'), ('Corn', 'common_rust')]
+
+def _stages(plan):
+    """Collect the stage names of an explain() plan tree"""
+    if isinstance(plan, list):
+        return [stage for child in plan for stage in _stages(child)]
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan['stage']] if 'stage' in plan else []
+    return stages + [stage for value in plan.values() for stage in _stages(value)]
+
+class TestIndexRegistry(unittest.TestCase):
+
+    def test_every_sort_field_is_indexed(self):
+        """Test that each sortable field has a (user_id, field, prediction_id) index"""
+        keys = [list(index.document['key'].items()) for index in INDEXES['prediction_history']]
+        for field in HISTORY_SORT_FIELDS:
+            self.assertIn([('user_id', 1), (field, -1), ('prediction_id', -1)], keys)
+
+class TestHistoryQueryPlans(unittest.TestCase):
+
+    def setUp(self):
+        """Set up two users' histories with every index built"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.collection = mongo.db.prediction_history
+        self.collection.delete_many({'user_id': {'$in': ['plan-user', 'plan-other']}})
+
+        start = datetime(2025, 1, 1)
+        self.collection.insert_many([{
+            'prediction_id': f'{user_id}-{index:04d}',
+            'user_id': user_id,
+            'plant_type': PLANTS[index % len(PLANTS)][0],
+            'condition': PLANTS[index % len(PLANTS)][1],
+            'class_name': '___'.join(PLANTS[index % len(PLANTS)]),
+            'confidence': (index * 37 % 100) / 100,
+            # Every third prediction shares the timestamp of the previous one
+            'timestamp': (start + timedelta(minutes=index - index // 3)).isoformat()
+        } for user_id in ('plan-user', 'plan-other') for index in range(300)])
+
+    def tearDown(self):
+        """Clean up after tests"""
+        self.collection.delete_many({'user_id': {'$in': ['plan-user', 'plan-other']}})
+        self.app_context.pop()
+
+    def _assert_indexed(self, filters, sort_by, sort_order, after=None):
+        query, sort = PredictionHistory.history_query(filters, sort_by, sort_order, after)
+        explain = self.collection.find(query).sort(sort).limit(21).explain()
+        stages = _stages(explain['queryPlanner']['winningPlan'])
+        context = f"{filters} sorted by {sort_by} {sort_order} after {after}: {stages}"
+        self.assertIn('IXSCAN', stages, context)
+        self.assertNotIn('COLLSCAN', stages, context)
+        self.assertNotIn('SORT', stages, context)
+
+    def test_history_pages_use_indexes_without_sorting(self):
+        """Test that every history query shape is answered in index order"""
+        filter_sets = [{}, {'plant_type': 'Tomato'}, {'condition': 'healthy'},
+                       {'plant_type': 'Tomato', 'condition': 'late_blight'}]
+        for extra, sort_by, sort_order in itertools.product(filter_sets, HISTORY_SORT_FIELDS, ('desc', 'asc')):
+            filters = dict(extra, user_id='plan-user')
+            self._assert_indexed(filters, sort_by, sort_order)
+
+            # A cursor page starts after a record in the middle of the history
+            last = self.collection.find_one({'prediction_id': 'plan-user-0150'})
+            self._assert_indexed(filters, sort_by, sort_order, (last[sort_by], last['prediction_id']))
+
+    def test_unindexed_sort_is_rejected(self):
+        """Test that sorting by a field without an index returns no records"""
+        self.assertEqual(PredictionHistory.get_filtered_predictions({'user_id': 'plan-user'}, sort_by='advice'), [])
+
+        token = jwt.encode({'sub': 'plan-user'}, os.getenv('SECRET_KEY', 'default_secret_key'), algorithm='HS256')
+        response = self.app.test_client().get('/api/prediction/my-predictions?sort_by=advice',
+                                              headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
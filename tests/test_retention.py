@@ -0,0 +1,77 @@
+"""
+Unit tests for the image retention policy
+"""
+
+import unittest
+from datetime import datetime
+from flask import Flask
+
+from app.services.retention import RetentionPolicy, init_retention_policy, parse_expiry_days, sample_fraction
+
+class TestRetentionPolicy(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a policy keeping uncertain, flagged and sampled images"""
+        self.policy = RetentionPolicy([
+            {'max_confidence': 0.6, 'store': 'original'},
+            {'flagged': True, 'store': 'original'},
+            {'classes': ['Tomato___Late_blight'], 'tiers': ['pro'], 'store': 'original'},
+            {'sample_rate': 0.1, 'store': 'original'},
+            {'classes': ['Corn_(maize)___healthy'], 'store': 'none'}
+        ], default='thumbnail')
+
+    def _prediction(self, confidence=0.95, class_name='Tomato___Late_blight', prediction_id='p-1'):
+        return {'prediction_id': prediction_id, 'class_name': class_name, 'confidence': confidence}
+
+    def test_first_matching_rule_decides(self):
+        """Test that rules are checked in order and the default applies otherwise"""
+        sampled = next(f"p-{i}" for i in range(1000) if sample_fraction(f"p-{i}") < 0.1)
+        unsampled = next(f"p-{i}" for i in range(1000) if sample_fraction(f"p-{i}") >= 0.1)
+
+        self.assertEqual(self.policy.decide(self._prediction(confidence=0.4)), {'store': 'original', 'rule': 0})
+        self.assertEqual(self.policy.decide(self._prediction(prediction_id=unsampled), flagged=True)['rule'], 1)
+        self.assertEqual(self.policy.decide(self._prediction(prediction_id=unsampled), tier='pro')['rule'], 2)
+        self.assertEqual(self.policy.decide(self._prediction(prediction_id=sampled))['rule'], 3)
+        self.assertEqual(
+            self.policy.decide(self._prediction(class_name='Corn_(maize)___healthy', prediction_id=unsampled)),
+            {'store': 'none', 'rule': 4})
+        self.assertEqual(self.policy.decide(self._prediction(prediction_id=unsampled)),
+                         {'store': 'thumbnail', 'rule': 'default'})
+
+    def test_sampling_is_stable_and_proportional(self):
+        """Test that a prediction is always sampled the same way, at roughly the configured rate"""
+        self.assertEqual(sample_fraction('abc'), sample_fraction('abc'))
+
+        sampled = sum(sample_fraction(f"prediction-{i}") < 0.1 for i in range(10000))
+        self.assertTrue(800 < sampled < 1200)
+
+    def test_invalid_rules_are_rejected(self):
+        """Test that malformed rules raise and fall back to storing every image at startup"""
+        for rules, default in [([{'store': 'everything'}], 'original'),
+                               ([{'confidence': 0.5, 'store': 'none'}], 'original'),
+                               ([], 'sometimes')]:
+            with self.assertRaises(ValueError):
+                RetentionPolicy(rules, default)
+
+        app = Flask(__name__)
+        app.config.update(IMAGE_RETENTION_RULES='[{"store": ', IMAGE_RETENTION_DEFAULT='none')
+        policy = init_retention_policy(app)
+        self.assertEqual(policy.decide(self._prediction()), {'store': 'original', 'rule': 'default'})
+
+    def test_images_expire_per_tier(self):
+        """Test that image expiry follows the user's tier, falling back to the default entry"""
+        policy = RetentionPolicy(expiry_days=parse_expiry_days('default:90, pro:365, enterprise:0'))
+        now = datetime(2025, 1, 1, 12, 0, 0)
+
+        self.assertEqual(policy.expires_at(None, now), '2025-04-01T12:00:00')
+        self.assertEqual(policy.expires_at('free', now), '2025-04-01T12:00:00')
+        self.assertEqual(policy.expires_at('pro', now), '2026-01-01T12:00:00')
+        self.assertIsNone(policy.expires_at('enterprise', now))
+        self.assertIsNone(self.policy.expires_at('pro', now))
+
+        for spec in ('default', 'pro:soon', 'default:-1'):
+            with self.assertRaises(ValueError):
+                parse_expiry_days(spec)
+
+if __name__ == '__main__':
+    unittest.main()
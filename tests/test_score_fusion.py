@@ -0,0 +1,67 @@
+"""
+Unit tests for multi-image score fusion
+"""
+
+import unittest
+import numpy as np
+
+from app.core.models.fusion import fuse_scores
+from app.core.models.model_loader import ModelLoader
+
+class TestScoreFusion(unittest.TestCase):
+
+    def setUp(self):
+        """Per-image class scores for three photos of one plant"""
+        self.scores = np.array([
+            [0.70, 0.20, 0.10],
+            [0.40, 0.50, 0.10],
+            [0.60, 0.30, 0.10],
+        ])
+
+    def test_mean_fusion(self):
+        """Test that mean fusion averages log-probabilities and renormalizes"""
+        fused = fuse_scores(self.scores, 'mean')
+
+        expected = np.exp(np.log(self.scores).mean(axis=0))
+        expected /= expected.sum()
+        np.testing.assert_allclose(fused, expected)
+        self.assertAlmostEqual(fused.sum(), 1.0)
+        self.assertEqual(int(np.argmax(fused)), 0)
+
+    def test_mean_fusion_penalises_disagreement(self):
+        """Test that a class one photo rules out is not chosen by mean fusion"""
+        scores = np.array([
+            [0.55, 0.45],
+            [0.00, 1.00],
+        ])
+        self.assertEqual(int(np.argmax(fuse_scores(scores, 'mean'))), 1)
+
+    def test_max_fusion(self):
+        """Test that max fusion keeps the highest score per class"""
+        fused = fuse_scores(self.scores, 'max')
+        np.testing.assert_allclose(fused, [0.70, 0.50, 0.10])
+
+    def test_single_image(self):
+        """Test that fusing one image keeps its top class and confidence"""
+        fused = fuse_scores(self.scores[:1], 'mean')
+        np.testing.assert_allclose(fused, self.scores[0])
+
+    def test_invalid_input(self):
+        """Test that unknown methods and malformed scores are rejected"""
+        with self.assertRaises(ValueError):
+            fuse_scores(self.scores, 'median')
+        with self.assertRaises(ValueError):
+            fuse_scores(np.array([0.1, 0.9]), 'mean')
+
+    def test_format_fused_prediction(self):
+        """Test that a fused score vector is mapped to a class name"""
+        model_loader = ModelLoader()
+        model_loader.class_names = ['Tomato___healthy', 'Tomato___Early_blight', 'Tomato___Late_blight']
+
+        prediction = model_loader.format_prediction(fuse_scores(self.scores, 'max'))
+        self.assertEqual(prediction['class_id'], 0)
+        self.assertEqual(prediction['class_name'], 'Tomato___healthy')
+        self.assertAlmostEqual(prediction['confidence'], 0.70)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Unit tests for the conversion of MongoDB documents to JSON
+"""
+
+import json
+import unittest
+from datetime import datetime, timezone, timedelta
+from bson import json_util, Int64, Decimal128, Binary
+from bson.objectid import ObjectId
+
+from app.utils.serialization import documents_to_json, to_json_compatible
+
+class TestSerialization(unittest.TestCase):
+
+    def test_matches_json_util(self):
+        """Test that documents convert exactly as the json_util round-trip did"""
+        documents = [{
+            '_id': ObjectId(),
+            'created_at': datetime(2025, 5, 11, 10, 30, 45, 123456),
+            'image_expires_at': datetime(2025, 8, 9),
+            'confidence': 0.89,
+            'top_predictions': [{'class_name': 'Tomato___healthy', 'confidence': 0.89, 'seen': [datetime(2025, 5, 1)]}],
+            'image_paths': [str(ObjectId()), None],
+            'flags': {'near_duplicate': True, 'count': Int64(3)},
+            'before_epoch': datetime(1960, 1, 1),
+            'aware': datetime(2025, 1, 1, tzinfo=timezone(timedelta(hours=7))),
+            'score': float('nan'),
+            'price': Decimal128('1.50'),
+            'hash': Binary(b'\x00\x01')
+        }]
+
+        converted = documents_to_json(iter(documents))
+        self.assertEqual(converted, json.loads(json_util.dumps(documents)))
+        self.assertEqual(json.dumps(converted), json.dumps(json.loads(json_util.dumps(documents))))
+
+    def test_common_values(self):
+        """Test the ObjectId and datetime shapes returned by the API"""
+        object_id = ObjectId('6650c0ffee0000000000beef')
+        self.assertEqual(to_json_compatible(object_id), {'$oid': '6650c0ffee0000000000beef'})
+        self.assertEqual(to_json_compatible(datetime(2025, 5, 11, 10, 30, 45)), {'$date': '2025-05-11T10:30:45Z'})
+        self.assertEqual(to_json_compatible(datetime(2025, 5, 11, 10, 30, 45, 7000)), {'$date': '2025-05-11T10:30:45.007Z'})
+        self.assertEqual(to_json_compatible(('a', 1)), ['a', 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+"""
+Unit tests for the image storage backends
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from io import BytesIO
+from PIL import Image
+from gridfs.errors import FileExists
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+from pymongo.results import DeleteResult, UpdateResult
+
+from app.utils.storage import ImageStorage
+from app.utils.storage_backends import GridFSBackend, LocalDiskBackend, S3Backend, get_backend_for_ref
+
+class _Collection:
+    """Minimal stand-in for the image_objects collection"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def find(self, query, projection=None):
+        return [self.documents[ref] for ref in query['_id']['$in'] if ref in self.documents]
+
+    def find_one(self, query, projection=None):
+        return self.documents.get(query['_id'])
+
+    def insert_one(self, document):
+        if document['_id'] in self.documents:
+            raise DuplicateKeyError('duplicate')
+        self.documents[document['_id']] = document
+
+    def update_one(self, query, update):
+        document = self.documents.get(query['_id'])
+        if document is not None:
+            document['ref_count'] += update['$inc']['ref_count']
+        return UpdateResult({'n': int(document is not None)}, acknowledged=True)
+
+    def find_one_and_update(self, query, update):
+        document = self.documents.get(query['_id'])
+        if document is None or document['ref_count'] <= query['ref_count']['$gt']:
+            return None
+        document['ref_count'] += update['$inc']['ref_count']
+        return document
+
+    def find_one_and_delete(self, query):
+        document = self.documents.get(query['_id'])
+        if document is None or document['ref_count'] > query.get('ref_count', {}).get('$not', {}).get('$gt', float('inf')):
+            return None
+        return self.documents.pop(query['_id'])
+
+class _GridFSCollection:
+    """Minimal stand-in for fs.files holding the ref_count of the files a bucket stores"""
+
+    def __init__(self, bucket=None):
+        self.bucket = bucket
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def find_one(self, query, projection=None):
+        return self.bucket.files.get(query['_id'])
+
+    def find_one_and_update(self, query, update, projection=None):
+        document = self.bucket.files.get(query['_id'])
+        if document is not None:
+            document['ref_count'] += update['$inc']['ref_count']
+        return document
+
+class _GridFSChunks:
+    """Minimal stand-in for fs.chunks holding the chunk IDs of each file"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def delete_many(self, query):
+        chunks = self.bucket.chunks.get(query['files_id'], [])
+        kept = [chunk_id for chunk_id in chunks if chunk_id >= query['_id']['$lt']]
+        self.bucket.chunks[query['files_id']] = kept
+        return DeleteResult({'n': len(chunks) - len(kept)}, acknowledged=True)
+
+class _GridIn:
+    """Minimal stand-in for a GridFS upload stream"""
+
+    def __init__(self, bucket, file_id, filename):
+        self._bucket = bucket
+        self._fields = {'_id': file_id, 'filename': filename}
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            self._fields[name] = value
+
+    def write(self, data):
+        if self._bucket.fail_writes:
+            self._bucket.fail_writes -= 1
+            self._bucket.chunks[self._fields['_id']] = [ObjectId()]
+            raise AutoReconnect('connection reset')
+        if self._bucket.chunks.get(self._fields['_id']):
+            raise FileExists('chunk exists')
+        self._fields['data'] = data.read()
+
+    def close(self):
+        if self._fields['_id'] in self._bucket.files:
+            raise FileExists('file exists')
+        self._bucket.files[self._fields['_id']] = self._fields
+
+    def abort(self):
+        self._bucket.chunks.pop(self._fields['_id'], None)
+        self._bucket.aborted.append(self._fields['_id'])
+
+class _GridFSBucket:
+    """Minimal stand-in for a GridFSBucket"""
+
+    def __init__(self):
+        self.files = {}
+        # Chunk IDs written for files without a file document
+        self.chunks = {}
+        self.aborted = []
+        # Number of uploads failing after writing a chunk
+        self.fail_writes = 0
+
+    def open_upload_stream_with_id(self, file_id, filename):
+        return _GridIn(self, file_id, filename)
+
+class _S3Client:
+    """Minimal stand-in for a boto3 S3 client"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        return {'Body': BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+class TestStorageBackends(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a temporary disk backend and a prepared image"""
+        self.root = tempfile.mkdtemp()
+        self.disk = LocalDiskBackend(self.root, collection=_Collection())
+        self.prepared = self._prepare(self.disk, (200, 30, 30))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _prepare(self, backend, color):
+        image = Image.new('RGB', (600, 400), color=color)
+        prepared = ImageStorage.prepare_prediction_image(image, 'pred-1', 'user-1')
+        prepared['backend'] = backend.name
+        prepared['ref'] = backend.make_ref(prepared)
+        return prepared
+
+    def test_disk_roundtrip(self):
+        """Test that images are stored sharded by hash and read back with their derivatives"""
+        ref = self.disk.store([self.prepared])[0]
+        content_hash = self.prepared['metadata']['content_hash']
+
+        self.assertEqual(ref, f"disk:{content_hash}")
+        self.assertTrue(os.path.exists(os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)))
+        self.assertEqual(self.disk.read(ref), self.prepared['data'])
+
+        image = self.disk.open(ref, variant='thumb')
+        with image['stream'] as stream:
+            self.assertEqual(max(Image.open(stream).size), 128)
+        self.assertEqual(image['etag'], f"{content_hash}.thumb")
+
+    def test_disk_deduplicates_and_counts_references(self):
+        """Test that a duplicate only adds a reference and the last delete removes the files"""
+        ref = self.disk.store([self.prepared, self.prepared])[0]
+        self.disk.store([self.prepared])
+
+        self.assertEqual(self.disk._get_collection().find_one({'_id': ref})['ref_count'], 3)
+        for _ in range(2):
+            self.assertTrue(self.disk.delete(ref))
+        self.assertIsNotNone(self.disk.read(ref))
+
+        self.assertTrue(self.disk.delete(ref))
+        self.assertIsNone(self.disk.read(ref))
+        self.assertFalse(self.disk.delete(ref))
+        leftover = [name for _, _, names in os.walk(self.root) for name in names]
+        self.assertEqual(leftover, [])
+
+    def test_s3_roundtrip(self):
+        """Test that the S3 backend stores objects under its prefix and deletes them with the image"""
+        client = _S3Client()
+        s3 = S3Backend('images-bucket', prefix='test/', client=client, collection=_Collection())
+        prepared = self._prepare(s3, (30, 200, 30))
+
+        ref = s3.store([prepared])[0]
+        content_hash = prepared['metadata']['content_hash']
+        self.assertEqual(ref, f"s3:{content_hash}")
+        self.assertIn(('images-bucket', f"test/{content_hash}"), client.objects)
+        self.assertEqual(s3.read(ref), prepared['data'])
+        self.assertEqual(s3.open(ref, variant='medium')['content_type'], 'image/jpeg')
+
+        self.assertTrue(s3.delete(ref))
+        self.assertEqual(client.objects, {})
+
+    def test_gridfs_uploads_with_content_ids(self):
+        """Test that GridFS files are uploaded under their content ID and a concurrent duplicate adds references"""
+        bucket = _GridFSBucket()
+        gridfs = GridFSBackend(database={'fs.files': _GridFSCollection(bucket), 'fs.chunks': _GridFSChunks(bucket)})
+        gridfs._get_bucket = lambda: bucket
+        prepared = self._prepare(gridfs, (30, 30, 200))
+
+        self.assertEqual(gridfs.store([prepared, prepared]), [prepared['ref']] * 2)
+        file_doc = bucket.files[prepared['_id']]
+        self.assertEqual(file_doc['data'], prepared['data'])
+        self.assertEqual((file_doc['content_type'], file_doc['content_hash'], file_doc['ref_count']),
+                         ('image/jpeg', prepared['metadata']['content_hash'], 2))
+        derivatives = [doc for doc in bucket.files.values() if doc.get('parent_id') == prepared['_id']]
+        self.assertEqual(len(derivatives), len(prepared['derivatives']))
+        self.assertNotIn('ref_count', derivatives[0])
+
+        # Stored images only gain references
+        self.assertEqual(gridfs.store([prepared]), [prepared['ref']])
+        self.assertEqual(len(bucket.files), 1 + len(prepared['derivatives']))
+        self.assertEqual(file_doc['ref_count'], 3)
+
+    def test_gridfs_upload_race_adds_references(self):
+        """Test that a file written by another upload since the reference check only gains references"""
+        bucket = _GridFSBucket()
+        files = _GridFSCollection(bucket)
+        gridfs = GridFSBackend(database={'fs.files': files, 'fs.chunks': _GridFSChunks(bucket)})
+        gridfs._get_bucket = lambda: bucket
+        prepared = self._prepare(gridfs, (30, 30, 200))
+
+        # The first reference check misses, then another writer stores the file
+        add_reference = files.find_one_and_update
+        def find_one_and_update(query, update, projection=None):
+            files.find_one_and_update = add_reference
+            bucket.files[query['_id']] = {'_id': query['_id'], 'ref_count': 1}
+            return None
+        files.find_one_and_update = find_one_and_update
+
+        self.assertEqual(gridfs.store([prepared]), [prepared['ref']])
+        self.assertEqual(bucket.files[prepared['_id']]['ref_count'], 2)
+        self.assertEqual(len(bucket.files), 1)
+
+    def test_gridfs_failed_upload_is_aborted(self):
+        """Test that an upload failing midway removes its chunks, so the image can be stored later"""
+        bucket = _GridFSBucket()
+        gridfs = GridFSBackend(database={'fs.files': _GridFSCollection(bucket), 'fs.chunks': _GridFSChunks(bucket)})
+        gridfs._get_bucket = lambda: bucket
+        prepared = self._prepare(gridfs, (200, 200, 30))
+
+        bucket.fail_writes = 1
+        with self.assertRaises(AutoReconnect):
+            gridfs.store([prepared])
+        self.assertEqual((bucket.aborted, bucket.chunks), ([prepared['_id']], {}))
+
+        self.assertEqual(gridfs.store([prepared]), [prepared['ref']])
+        self.assertEqual(bucket.files[prepared['_id']]['ref_count'], 1)
+
+    def test_gridfs_stale_chunks_are_removed(self):
+        """Test that chunks left without a file document by a crashed upload are replaced"""
+        bucket = _GridFSBucket()
+        gridfs = GridFSBackend(database={'fs.files': _GridFSCollection(bucket), 'fs.chunks': _GridFSChunks(bucket)})
+        gridfs._get_bucket = lambda: bucket
+        prepared = self._prepare(gridfs, (200, 30, 200))
+
+        # Chunks of an upload still in progress are left alone
+        bucket.chunks[prepared['_id']] = [ObjectId()]
+        with self.assertRaises(RuntimeError):
+            gridfs.store([prepared])
+        self.assertEqual(len(bucket.chunks[prepared['_id']]), 1)
+
+        bucket.chunks[prepared['_id']] = [ObjectId.from_datetime(datetime.utcnow() - timedelta(hours=1))]
+        self.assertEqual(gridfs.store([prepared]), [prepared['ref']])
+        self.assertEqual(bucket.files[prepared['_id']]['data'], prepared['data'])
+        self.assertEqual(bucket.aborted, [])
+
+    def test_disk_delete_keeps_concurrent_references(self):
+        """Test that a reference added between the decrement and the delete keeps the image"""
+        ref = self.disk.store([self.prepared])[0]
+        collection = self.disk._get_collection()
+
+        # A store adds a reference after the decrement found a single one
+        decrement = collection.find_one_and_update
+        def find_one_and_update(query, update):
+            collection.find_one_and_update = decrement
+            collection.documents[ref]['ref_count'] += 1
+            return None
+        collection.find_one_and_update = find_one_and_update
+
+        self.assertTrue(self.disk.delete(ref))
+        self.assertEqual(collection.documents[ref]['ref_count'], 1)
+        self.assertEqual(self.disk.read(ref), self.prepared['data'])
+
+    def test_refs_dispatch_to_their_backend(self):
+        """Test that references select the backend they were stored with"""
+        self.assertEqual(get_backend_for_ref('0123456789abcdef01234567').name, 'gridfs')
+        self.assertEqual(get_backend_for_ref('disk:abcd').name, 'disk')
+
+if __name__ == '__main__':
+    unittest.main()
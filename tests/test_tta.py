@@ -0,0 +1,73 @@
+"""
+Unit tests for test-time augmentation and the metrics registry
+"""
+
+import unittest
+import numpy as np
+
+from app.core.models.tta import build_tta_batch, average_tta_scores
+from app.utils.metrics import MetricsRegistry
+
+class TestTTA(unittest.TestCase):
+
+    def setUp(self):
+        """Create a normalized 8x8 test image with distinct pixel values"""
+        self.image = np.arange(8 * 8 * 3, dtype=np.float32).reshape(8, 8, 3) / (8 * 8 * 3)
+
+    def test_flips(self):
+        """Test that flip views mirror the original image"""
+        batch, views = build_tta_batch(self.image, max_views=3)
+
+        self.assertEqual(views, ['hflip', 'vflip'])
+        self.assertEqual(batch.shape, (2, 8, 8, 3))
+        np.testing.assert_array_equal(batch[0], self.image[:, ::-1])
+        np.testing.assert_array_equal(batch[1], self.image[::-1, :])
+
+    def test_crops_keep_model_resolution(self):
+        """Test that crop views are stretched back to the input size"""
+        batch, views = build_tta_batch(self.image, max_views=8, crop_fraction=0.5)
+
+        self.assertEqual(len(views), 7)
+        self.assertEqual(batch.shape, (7, 8, 8, 3))
+
+        # Top-left crop of a 4x4 region stretched 2x with nearest neighbour
+        top_left = batch[views.index('top_left_crop')]
+        np.testing.assert_array_equal(top_left[::2, ::2], self.image[:4, :4])
+
+        # Bottom-right crop comes from the opposite corner
+        bottom_right = batch[views.index('bottom_right_crop')]
+        np.testing.assert_array_equal(bottom_right[::2, ::2], self.image[4:, 4:])
+
+    def test_max_views_bounds_batch(self):
+        """Test that the batch never exceeds max_views - 1 augmented views"""
+        batch, views = build_tta_batch(self.image, max_views=1)
+        self.assertEqual(len(views), 0)
+        self.assertEqual(batch.shape[0], 0)
+
+    def test_average_scores(self):
+        """Test that scores are averaged over original and augmented views"""
+        averaged = average_tta_scores([0.4, 0.6], [[0.8, 0.2], [0.6, 0.4]])
+        np.testing.assert_allclose(averaged, [0.6, 0.4])
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counters_summaries_and_gauges(self):
+        """Test recording and reading metrics"""
+        registry = MetricsRegistry()
+        registry.increment('requests')
+        registry.increment('requests', 2)
+        registry.observe('latency_ms', 10.0)
+        registry.observe('latency_ms', 30.0)
+        registry.set_gauge('queue_depth', 4)
+        registry.register_gauge('ratio', lambda: registry.get_counter('requests') / 6)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters']['requests'], 3)
+        self.assertEqual(snapshot['gauges']['queue_depth'], 4)
+        self.assertAlmostEqual(snapshot['gauges']['ratio'], 0.5)
+        self.assertEqual(snapshot['summaries']['latency_ms']['count'], 2)
+        self.assertAlmostEqual(snapshot['summaries']['latency_ms']['avg'], 20.0)
+        self.assertEqual(snapshot['summaries']['latency_ms']['max'], 30.0)
+
+if __name__ == '__main__':
+    unittest.main()